@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+#
+# LSST Data Management System
+# Copyright 2008, 2009, 2010 LSST Corporation.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.    See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+"""Converts a local reference catalog (a USNO-A distribution, or the
+astrometry_net_data package) into the memory-mapped format read by
+MappedRefCatalog. Point the REFCATFILE environment variable to the
+output file to have UsnoRead use it. Only local files are read."""
+
+from __future__ import division, absolute_import
+import os
+import math
+import argparse
+import numpy as np
+
+from lsst.meas.simastrom.simastromLib import RefCatalogBuilder
+from lsst.meas.simastrom.photometry import fluxToAbMag
+
+
+def addAstrometryNet(builder, rFilter, bFilter, ra, dec, radius, posError):
+    """Adds the astrometry_net_data stars within radius (degrees) of (ra, dec),
+    or of the whole sky if radius is None. Returns the number of stars added."""
+    import lsst.utils
+    import lsst.afw.geom as afwGeom
+    import lsst.afw.coord as afwCoord
+    from lsst.meas.astrom.loadAstrometryNetObjects import LoadAstrometryNetObjectsTask
+    from lsst.meas.astrom import AstrometryNetDataConfig
+
+    anDir = lsst.utils.getPackageDir('astrometry_net_data')
+    if anDir is None:
+        raise RuntimeError("astrometry_net_data is not setup")
+    andConfig = AstrometryNetDataConfig()
+    andConfigPath = os.path.join(anDir, "andConfig.py")
+    if not os.path.exists(andConfigPath):
+        raise RuntimeError("astrometry_net_data config file \"%s\" required but not found" %andConfigPath)
+    andConfig.load(andConfigPath)
+    if rFilter is None:
+        rFilter = andConfig.magColumnMap.keys()[0]
+    loader = LoadAstrometryNetObjectsTask(LoadAstrometryNetObjectsTask.ConfigClass())
+
+    if radius is not None:
+        circles = [(ra, dec, radius)]
+    else:
+        # cover the sky with overlapping circles; duplicates are removed using ids
+        step = 10.
+        circles = []
+        for iDec in range(int(180/step)+1):
+            cDec = -90.+iDec*step
+            nRa = max(1, int(math.ceil(360.*math.cos(math.radians(cDec))/step)))
+            circles += [(360.*iRa/nRa, cDec, step) for iRa in range(nRa)]
+
+    seen = set()
+    count = 0
+    for cRa, cDec, cRadius in circles:
+        center = afwCoord.IcrsCoord(afwGeom.Angle(cRa, afwGeom.degrees), afwGeom.Angle(cDec, afwGeom.degrees))
+        refCat = loader.loadSkyCircle(center, afwGeom.Angle(cRadius, afwGeom.degrees), rFilter).refCat
+        if len(refCat) == 0:
+            continue
+        ids = refCat.get("id")
+        keep = np.array([i not in seen for i in ids], dtype=bool)
+        seen.update(ids)
+        if not keep.any():
+            continue
+        raDeg = np.degrees(refCat.get("coord_ra")[keep])
+        decDeg = np.degrees(refCat.get("coord_dec")[keep])
+        # reference fluxes are in Jy
+        magR = fluxToAbMag(refCat.get(rFilter + "_flux")[keep])
+        if bFilter is not None:
+            magB = fluxToAbMag(refCat.get(bFilter + "_flux")[keep])
+        else:
+            magB = np.zeros_like(magR) + 99.9
+        sig = np.zeros_like(raDeg) + posError
+        builder.AddArrays(np.ascontiguousarray(raDeg), np.ascontiguousarray(decDeg),
+                          magR, magB, sig, sig)
+        count += keep.sum()
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("output", help="name of the reference catalog file to write")
+    parser.add_argument("--usno", metavar="DIR", help="directory of a USNO-A distribution (zoneNNNN.cat files)")
+    parser.add_argument("--anet", action="store_true", help="read the astrometry_net_data package")
+    parser.add_argument("--rFilter", help="astrometry.net filter stored as the R magnitude (default: first one)")
+    parser.add_argument("--bFilter", help="astrometry.net filter stored as the B magnitude (default: none)")
+    parser.add_argument("--ra", type=float, default=0., help="center of the region to convert with --anet (degrees)")
+    parser.add_argument("--dec", type=float, default=0., help="center of the region to convert with --anet (degrees)")
+    parser.add_argument("--radius", type=float, help="radius of the region to convert with --anet (degrees, default: whole sky)")
+    parser.add_argument("--posError", type=float, default=0.1,
+                        help="position uncertainty assigned to astrometry.net stars (arcsec)")
+    parser.add_argument("--zoneHeight", type=float, default=0.25, help="height of declination zones (degrees)")
+    args = parser.parse_args()
+    if not args.usno and not args.anet:
+        parser.error("provide at least one of --usno and --anet")
+
+    builder = RefCatalogBuilder()
+    if args.usno:
+        print "read %d stars from %s" % (builder.AddUsno(args.usno), args.usno)
+    if args.anet:
+        count = addAstrometryNet(builder, args.rFilter, args.bFilter,
+                                 args.ra, args.dec, args.radius, args.posError)
+        print "read %d stars from astrometry_net_data" % count
+    builder.Write(args.output, args.zoneHeight)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+// -*- C++ -*-
+/* Compares the combinatorial searches behind MatchSearchRotShiftFlip
+   (MatchConditions::Algorithm 2: segment pairs, 3: triangle
+   hashing). L2 is L1 rotated, shifted, slightly rescaled and possibly
+   flipped, with position and flux noise, and with objects missing on
+   both sides. A search succeeds if its transformation maps L1 objects
+   within 1 pixel of their L2 counterparts. Usage:
+   combinatorialMatchBenchmark [number of trials] [NStars] [missing fraction] */
+
+#include <iostream>
+#include <iomanip>
+#include <cstdlib>
+#include <cmath>
+#include <random>
+#include <chrono>
+
+#include "lsst/meas/simastrom/BaseStar.h"
+#include "lsst/meas/simastrom/ListMatch.h"
+#include "lsst/meas/simastrom/StarMatch.h"
+#include "lsst/meas/simastrom/Gtransfo.h"
+
+using namespace lsst::meas::simastrom;
+
+struct Result
+{
+  unsigned successes;
+  double seconds;
+  Result() : successes(0), seconds(0) {}
+};
+
+static bool search(BaseStarList &L1, BaseStarList &L2, const GtransfoLin &Truth,
+		   const MatchConditions &Conditions, Result &R)
+{
+  BaseStarList l1, l2;
+  L1.CopyTo(l1);
+  L2.CopyTo(l2);
+  auto start = std::chrono::steady_clock::now();
+  StarMatchList *match = MatchSearchRotShiftFlip(l1, l2, Conditions);
+  R.seconds += std::chrono::duration<double>(std::chrono::steady_clock::now()-start).count();
+  if (!match) return false;
+  bool ok = (match->Transfo() != NULL);
+  for (BaseStarCIterator si = L1.begin(); ok && si != L1.end(); ++si)
+    ok = (match->Transfo()->apply(**si).Distance(Truth.apply(**si)) < 1.);
+  delete match;
+  if (ok) R.successes++;
+  return ok;
+}
+
+int main(int nargs, char **args)
+{
+  unsigned nTrials = (nargs > 1) ? atoi(args[1]) : 20;
+  int nStars = (nargs > 2) ? atoi(args[2]) : 70;
+  double missing = (nargs > 3) ? atof(args[3]) : 0.1;
+  const unsigned nObjects = 500;
+  const double side = 2000;
+  std::mt19937 rng(4321);
+  std::uniform_real_distribution<double> u(0,1);
+  std::normal_distribution<double> g(0,1);
+
+  MatchConditions segments;
+  segments.NStarsL1 = segments.NStarsL2 = nStars;
+  MatchConditions triangles = segments;
+  triangles.Algorithm = 3;
+  Result rSegments, rTriangles;
+  for (unsigned trial = 0; trial < nTrials; ++trial)
+    {
+      double angle = 2*M_PI*u(rng);
+      double scale = 1+0.1*(u(rng)-0.5);
+      double flip = (u(rng) < 0.5) ? -1 : 1;
+      GtransfoLin truth(side*u(rng), side*u(rng),
+			scale*cos(angle), -flip*scale*sin(angle),
+			scale*sin(angle), flip*scale*cos(angle));
+      BaseStarList l1, l2;
+      for (unsigned k=0; k<nObjects; ++k)
+	{
+	  Point p(side*u(rng), side*u(rng));
+	  double flux = exp(5*u(rng));
+	  if (u(rng) > missing) l1.push_back(new BaseStar(p.x, p.y, flux));
+	  if (u(rng) > missing)
+	    {
+	      Point q = truth.apply(p);
+	      l2.push_back(new BaseStar(q.x+0.1*g(rng), q.y+0.1*g(rng), flux*(1+0.1*g(rng))));
+	    }
+	}
+      bool okS = search(l1, l2, truth, segments, rSegments);
+      bool okT = search(l1, l2, truth, triangles, rTriangles);
+      std::cout << " trial " << trial << " flip " << flip
+		<< " segments " << (okS ? "ok" : "FAILED")
+		<< " triangles " << (okT ? "ok" : "FAILED") << std::endl;
+    }
+  std::cout << std::setw(12) << "algorithm" << std::setw(12) << "success"
+	    << std::setw(14) << "time/trial(s)" << std::endl;
+  std::cout << std::setw(12) << "segments" << std::setw(9) << rSegments.successes << '/' << nTrials
+	    << std::setw(14) << rSegments.seconds/nTrials << std::endl;
+  std::cout << std::setw(12) << "triangles" << std::setw(9) << rTriangles.successes << '/' << nTrials
+	    << std::setw(14) << rTriangles.seconds/nTrials << std::endl;
+  return 0;
+}
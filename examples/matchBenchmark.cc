@@ -0,0 +1,68 @@
+// -*- C++ -*-
+/* Compares the FastFinder and KdTreeFinder engines behind
+   ListMatchCollect, for lists of various sizes and densities. Both
+   lists cover the same square. The "density" is the mean number of
+   L2 objects within the matching distance of a point. Usage:
+   matchBenchmark [max list size] */
+
+#include <iostream>
+#include <iomanip>
+#include <cstdlib>
+#include <random>
+#include <chrono>
+
+#include "lsst/meas/simastrom/BaseStar.h"
+#include "lsst/meas/simastrom/ListMatch.h"
+#include "lsst/meas/simastrom/StarMatch.h"
+
+using namespace lsst::meas::simastrom;
+
+static void fill(BaseStarList &L, const unsigned N, const double Side, std::mt19937 &Rng)
+{
+  std::uniform_real_distribution<double> u(0, Side);
+  for (unsigned k=0; k<N; ++k) L.push_back(new BaseStar(u(Rng), u(Rng), 1.));
+}
+
+// seconds, and the number of matches
+static double time_collect(const BaseStarList &L1, const BaseStarList &L2,
+			   const double MaxDist, const FinderStrategy Strategy,
+			   size_t &NMatches)
+{
+  auto start = std::chrono::steady_clock::now();
+  StarMatchList *matches = ListMatchCollect(L1, L2, MaxDist, Strategy);
+  auto stop = std::chrono::steady_clock::now();
+  NMatches = matches->size();
+  delete matches;
+  return std::chrono::duration<double>(stop-start).count();
+}
+
+int main(int nargs, char **args)
+{
+  unsigned maxSize = (nargs > 1) ? atoi(args[1]) : 1000000;
+  const double side = 10000;
+  std::mt19937 rng(12345);
+  std::cout << std::setw(10) << "N2" << std::setw(10) << "density"
+	    << std::setw(12) << "slices(s)" << std::setw(12) << "kdtree(s)" 
+	    << std::setw(10) << "matches" << std::endl;
+  for (unsigned n2=1000; n2<=maxSize; n2 *= 10)
+    {
+      BaseStarList l1, l2;
+      fill(l2, n2, side, rng);
+      fill(l1, std::min(n2, 100000u), side, rng);
+      double area = side*side;
+      const double densities[] = {0.01, 0.1, 1, 10};
+      for (unsigned i=0; i<4; ++i)
+	{
+	  double maxDist = sqrt(densities[i]*area/(M_PI*n2));
+	  size_t nSlices, nKd;
+	  double tSlices = time_collect(l1, l2, maxDist, FinderSlices, nSlices);
+	  double tKd = time_collect(l1, l2, maxDist, FinderKdTree, nKd);
+	  std::cout << std::setw(10) << n2 << std::setw(10) << densities[i]
+		    << std::setw(12) << tSlices << std::setw(12) << tKd
+		    << std::setw(10) << nKd;
+	  if (nKd != nSlices) std::cout << " MISMATCH (" << nSlices << ")";
+	  std::cout << std::endl;
+	}
+    }
+  return 0;
+}
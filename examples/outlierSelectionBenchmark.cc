@@ -0,0 +1,100 @@
+// -*- C++ -*-
+/* Compares the two ways of finding the chi2 contributions above the
+   outlier cut (average+NSigCut*sigma) of the FindOutliers routines:
+   sorting all contributions (the former implementation), and
+   SelectLargeChi2s (one pass for the statistics, partial selection for
+   the median, sort of the contributions above the cut only). The
+   contributions are chi2(1) variables, a fraction of them being
+   outliers, and both searches should return the same entries in the
+   same order. Usage:
+   outlierSelectionBenchmark [number of contributions] [NSigCut] [outlier fraction] */
+
+#include <iostream>
+#include <cstdlib>
+#include <cmath>
+#include <vector>
+#include <algorithm>
+#include <random>
+#include <chrono>
+
+#include "lsst/meas/simastrom/Chi2.h"
+
+using namespace lsst::meas::simastrom;
+
+struct Entry
+{
+  double chi2;
+  unsigned index;
+
+  Entry(const double C, const unsigned I) : chi2(C), index(I) {}
+  bool operator < (const Entry &R) const {return (chi2<R.chi2);}
+};
+
+// the former implementation, returning the entries above the cut, strongest first
+static std::vector<Entry> sort_all(std::vector<Entry> &Chi2s, const double NSigCut)
+{
+  std::vector<Entry> above;
+  unsigned nval = Chi2s.size();
+  if (nval == 0) return above;
+  sort(Chi2s.begin(), Chi2s.end());
+  double median = (nval & 1)? Chi2s[nval/2].chi2 :
+    0.5*(Chi2s[nval/2-1].chi2 + Chi2s[nval/2].chi2);
+  double sum=0; double sum2 = 0;
+  for (auto i=Chi2s.begin(); i!=Chi2s.end(); ++i)
+    {sum+= i->chi2;sum2+= i->chi2*i->chi2;}
+  double average = sum/nval;
+  double sigma = sqrt(sum2/nval - average*average);
+  std::cout << "INFO : sort_all chi2 stat: mean/median/sigma "
+	    << average << '/'<< median << '/' << sigma << std::endl;
+  double cut = average+NSigCut*sigma;
+  for (auto i = Chi2s.rbegin(); i != Chi2s.rend(); ++i)
+    {
+      if (i->chi2 < cut) break;
+      above.push_back(*i);
+    }
+  return above;
+}
+
+int main(int nargs, char **args)
+{
+  size_t n = (nargs > 1) ? atol(args[1]) : 10000000;
+  double nSigCut = (nargs > 2) ? atof(args[2]) : 5.;
+  double outlierFraction = (nargs > 3) ? atof(args[3]) : 0.001;
+  std::mt19937 rng(1234);
+  std::normal_distribution<double> g(0,1);
+  std::uniform_real_distribution<double> u(0,1);
+  std::vector<Entry> chi2s;
+  chi2s.reserve(n);
+  for (size_t k=0; k<n; ++k)
+    {
+      double res = g(rng);
+      if (u(rng) < outlierFraction) res *= 30;
+      chi2s.push_back(Entry(res*res, k));
+    }
+  std::vector<Entry> copy(chi2s);
+
+  auto start = std::chrono::steady_clock::now();
+  std::vector<Entry> above = sort_all(copy, nSigCut);
+  double tSort = std::chrono::duration<double>(std::chrono::steady_clock::now()-start).count();
+
+  copy = chi2s;
+  start = std::chrono::steady_clock::now();
+  size_t nAbove = SelectLargeChi2s(copy, nSigCut, "SelectLargeChi2s");
+  double tSelect = std::chrono::duration<double>(std::chrono::steady_clock::now()-start).count();
+
+  /* ties may come in a different order: compare chi2 values, and
+     then the sets of entries */
+  bool same = (nAbove == above.size());
+  for (size_t k=0; same && k<nAbove; ++k) same = (copy[k].chi2 == above[k].chi2);
+  std::vector<unsigned> i1, i2;
+  for (size_t k=0; same && k<nAbove; ++k) { i1.push_back(above[k].index); i2.push_back(copy[k].index);}
+  std::sort(i1.begin(), i1.end());
+  std::sort(i2.begin(), i2.end());
+  same = same && (i1 == i2);
+
+  std::cout << n << " contributions, " << nAbove << " above the cut" << std::endl;
+  std::cout << "full sort        : " << tSort << " s" << std::endl;
+  std::cout << "SelectLargeChi2s : " << tSelect << " s" << std::endl;
+  std::cout << "same entries     : " << (same ? "yes" : "NO") << std::endl;
+  return same ? 0 : 1;
+}
@@ -0,0 +1,56 @@
+// -*- C++ -*-
+#ifndef ASSOCIATIONGROUPS__H
+#define ASSOCIATIONGROUPS__H
+
+#include <vector>
+
+namespace lsst {
+namespace meas {
+namespace simastrom {
+
+//! Groups positions coming from several catalogs into "same object" sets.
+/*! This is the engine of Associations::AssociateCatalogsParallel. All
+  positions (e.g. all measurements of all CcdImage's, on the common
+  tangent plane) are handled at once, rather than one catalog after
+  the other:
+  - the plane is cut into cells of the size of the match cut, and
+   pairs of positions from different sources (i.e. catalogs) closer
+   than the cut are collected, cells being spread over threads.
+  - friends-of-friends groups are built from these pairs.
+  - each group is then split into subgroups that contain at most one
+   position per source, all within the cut of the first position of
+   the subgroup, keeping the closest one when a source offers
+   several (the equivalent of StarMatchList::RemoveAmbiguities).
+
+  Positions are identified by their rank in the input arrays. The
+  subgroups list their members in increasing rank, and are sorted by
+  their first member. The result only depends on the input, not on
+  the number of threads. */
+class AssociationGroups
+{
+  std::vector<unsigned> start; // of each group in members, plus the end
+  std::vector<unsigned> members;
+
+ public :
+  AssociationGroups() {}
+
+  //! Groups the positions (X[k],Y[k]) from catalog Source[k], closer than MatchCut.
+  void Build(const std::vector<double> &X, const std::vector<double> &Y,
+	     const std::vector<unsigned> &Source, const double MatchCut,
+	     const unsigned NThreads=1);
+
+  //! number of groups.
+  unsigned size() const { return start.empty() ? 0 : start.size()-1;}
+
+  //! number of positions in group G.
+  unsigned GroupSize(const unsigned G) const { return start[G+1]-start[G];}
+
+  //! the ranks of the positions in group G, in increasing order.
+  const unsigned *Group(const unsigned G) const { return &members[start[G]];}
+
+  void clear() { start.clear(); members.clear();}
+};
+
+}}}
+
+#endif /* ASSOCIATIONGROUPS__H */
@@ -33,6 +33,7 @@ class Associations {
   CcdImageList ccdImageList; // the catalog handlers
   RefStarList refStarList;// the (e.g.) USNO stars
   RefStarList photRefStarList; // the (e.g) Landolt stars
+  RefStarArrays refStarArrays; // all stars read by CollectLSSTRefStars (refStarList only holds the associated ones)
   FittedStarList fittedStarList; //  the std::list of stars that are going to be fitted
 
     // fit cuts and stuff:
@@ -40,7 +41,8 @@ class Associations {
 
 //  const CatalogLoader * load_it;
 
-  void AssignMags();
+  //! accumulates the magnitudes of the measurements of the CcdImage's of rank FirstCcd and beyond into their FittedStar's.
+  void AssignMags(const unsigned FirstCcd = 0);
 
 public:
 
@@ -74,13 +76,57 @@ public:
 			   const bool UseFittedList = false,
 			   const bool EnlargeFittedList = true);
 
+  //! same as AssociateCatalogs, but all CcdImage's are associated at once, using NThreads() threads.
+  /*! The measurements of all CcdImage's are projected on the common
+    tangent plane and grouped with AssociationGroups: every group
+    becomes a FittedStar (located at its first measurement, or the
+    FittedStar of the group when UseFittedList is true). Unlike
+    AssociateCatalogs, the result does not depend on the order of the
+    CcdImage's (but for the ordering of the fittedStarList), and it
+    does not depend on the number of threads. */
+  void AssociateCatalogsParallel(const double MatchCutInArcSec = 0,
+				   const bool UseFittedList = false,
+				   const bool EnlargeFittedList = true);
+
+  //! associates the catalogs of the CcdImage's of rank FirstNew and beyond (e.g. added by AddImage after a fit) with the FittedStar's in place.
+  /*! This is what AssociateCatalogs(MatchCutInArcSec, true, true)
+    does, for the new CcdImage's only: the catalogs of the other
+    CcdImage's, the FittedStar's (and their current positions) and
+    the RefStar's are left untouched, so that the cost scales with the
+    new data. The FittedStar's can either be on the common tangent
+    plane or on the sky (after DeprojectFittedStars). Unmatched
+    measurements make new FittedStar's, in the same coordinates, that
+    are associated with the unused entries of refStarArrays (which are
+    not reloaded) and go through the cuts of SelectFittedStars. Objects
+    that SelectFittedStars discarded before are not recovered. See
+    AstromFit::RestrictToNewCcdImages to fit the new CcdImage's. */
+  void AssociateNewCatalogs(const double MatchCutInArcSec, const unsigned FirstNew);
+
+  //!
+  unsigned NCcdImages() const { return ccdImageList.size();}
+
+  //! number of threads used by AssociateCatalogsParallel (0: as many as available).
+  void SetNThreads(const unsigned NThreads) { nThreads = NThreads;}
+
+  //!
+  unsigned NThreads() const { return nThreads;}
+
 
   //! Collect stars form an external reference catalog (USNO-A by default) that match the FittedStarList. Optionally project these RefStar s on the tangent plane defined by the CommonTangentPoint().
   void CollectRefStars(const bool ProjectOnTP=true);
   
   //! Collect stars from an external reference catalog using the LSST stack mechanism
+  /*! The coordinates and fluxes are copied into refStarArrays, which
+    is projected on the common tangent plane at once and associated
+    with AssociateRefStarArrays: only the associated reference stars
+    become RefStar's (in refStarList). */
   void CollectLSSTRefStars(lsst::afw::table::SortedCatalogT< lsst::afw::table::SimpleRecord > &Ref, std::string filter);
 
+  //! Associates refStarArrays (projected on the CTP) with the fittedStarList, and rebuilds refStarList.
+  /*! A FittedStar gets the closest reference star within the cut,
+    and a reference star goes to its closest FittedStar. */
+  void AssociateRefStarArrays(const double MatchCutInArcSec);
+
 
 
     
@@ -115,6 +161,19 @@ public:
   
   //! apply cuts (mainly number of measurements) on potential FittedStars
   void SelectFittedStars();
+
+  //! Saves the whole state into FileName: CcdImage's and their catalogs, FittedStar's, RefStar's, refStarArrays, and the links between them.
+  /*! A job can then restart from there (ReadCheckpoint) rather than
+    reload the catalogs and redo the associations, e.g. to fit again
+    with other settings. Since a fit updates the FittedStar's and
+    discards outliers, checkpoints taken along a fit allow to resume
+    it, provided the DistortionModel parameters are saved as well
+    (see DistortionModel::WriteParams). The file is binary, readable
+    on machines with the same byte order. */
+  void WriteCheckpoint(const std::string &FileName) const;
+
+  //! Replaces the whole state by the one saved by WriteCheckpoint. The number of threads is not part of the state.
+  void ReadCheckpoint(const std::string &FileName);
   
   const CcdImageList& TheCcdImageList() const {return ccdImageList;}
   
@@ -126,13 +185,17 @@ public:
   // Return the bounding box in (ra, dec) coordinates containing the whole catalog
   const lsst::afw::geom::Box2D GetRaDecBBox();
 
+  //! Same as above, but one box per CcdImage, in the order of the ccdImageList
+  std::vector<lsst::afw::geom::Box2D> GetCcdRaDecBBoxes() const;
+
   
 private:
   void AssociateRefStars(const double &MatchCutInArcSec, const Gtransfo *T);
   unsigned int nshoots_;
   unsigned int nb_photref_associations;
+  unsigned nThreads;
 };
 
-#endif /* ASSOCIATIONS__H */
-
 }}} // end of namespaces
+
+#endif /* ASSOCIATIONS__H */
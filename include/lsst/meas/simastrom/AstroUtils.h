@@ -16,7 +16,9 @@ enum UsnoColor { RColor , BColor};
 /*! The x and y coordinates of the given stars refer to RA and DEC respectively
 expressed in  degrees. The location of the catalog should be set by the user
 in the USNODIR environment variable. The catalog contains both
-R and B magnitude. The Color argument has to be RColor or BColor. 
+R and B magnitude. If REFCATFILE is set instead, stars are read from
+this file, written by RefCatalogBuilder (see bin/makeRefCatalog.py),
+through a MappedRefCatalog. The Color argument has to be RColor or BColor. 
 WARNING : The flux of the returned BaseStar's is in fact a magnitude. */
 
 
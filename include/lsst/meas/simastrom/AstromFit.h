@@ -4,18 +4,25 @@
 #include <string>
 #include <iostream>
 #include <sstream>
+#include <memory>
+#include <vector>
+#include <unordered_set>
 
 #include "lsst/meas/simastrom/CcdImage.h"
 #include "lsst/meas/simastrom/Eigenstuff.h"
 #include "lsst/meas/simastrom/Tripletlist.h"
 #include "lsst/meas/simastrom/DistortionModel.h"
 #include "lsst/meas/simastrom/Chi2.h"
+#include "lsst/meas/simastrom/ResidualTable.h"
+#include "lsst/meas/simastrom/SparseSolver.h"
+#include "lsst/meas/simastrom/SparseHessian.h"
 
 namespace lsst {
 namespace meas {
 namespace simastrom {
 
 class Associations;
+struct Chi2Vect;
 
 
 /*! This is the class that actually computes the quantities required
@@ -78,18 +85,43 @@ class AstromFit {
   unsigned int _nParTot;
   unsigned _nMeasuredStars;
   double _posError;  // constant term on error on position (in pixel unit)
+  unsigned _nThreads; // number of threads used to loop over CcdImage's
+
+  std::string _solverName; // see SetSolver
+  unsigned _solverMaxIterations; // see SetSolver
+  bool _eliminatePositions; // see SetEliminatePositions
+  bool _directAssembly; // see SetDirectAssembly
+  unsigned _firstNewCcd; // see RestrictToNewCcdImages
+  // when restricted: index in the fit of each parameter of the whole layout (-1 : held fixed)
+  std::vector<int> _fitIndex;
+  std::unordered_set<const FittedStar *> _newStars; // the FittedStar's only the new CcdImage's measure
+  // factorization kept from one Minimize call to the next (defined in AstromFit.cc)
+  struct FactorizationCache;
+  std::unique_ptr<FactorizationCache> _factorizationCache;
+  unsigned _nAnalyses; // see NAnalyses
   
  public :
 
   //! this is the only constructor
   AstromFit (Associations &A, DistortionModel *D, double PosError);
+
+  ~AstromFit();
   
   //! Does a 1 step minimization, assuming a linear model.
   /*! It calls AssignIndices, LSDerivatives, solves the linear system
     and calls OffsetParams. No line search. Relies on sparse linear
-    algebra. */
+    algebra. The symbolic analysis of the Hessian (ordering and
+    elimination tree) is kept for the next call, which reuses it if
+    the parameter layout is the same and the Hessian pattern did not
+    grow (e.g. only outliers were removed in between). Returns 0 when
+    no outliers are left, 1 if the chi2 went up, and 2 if the
+    factorization failed or the solver did not converge. In the latter
+    case, the step that failed is not applied. */
   unsigned Minimize(const std::string &WhatToFit, const double NSigRejCut=0);
 
+  //! Number of symbolic analyses of the Hessian done by Minimize so far (the other calls reused the previous one).
+  unsigned NAnalyses() const { return _nAnalyses;}
+
   //! Compute derivatives of measurement terms for this CcdImage
   void LSDerivatives1(const CcdImage &Ccd, 
 		      TripletList &TList, Eigen::VectorXd &Rhs,
@@ -104,9 +136,67 @@ class AstromFit {
       AssignIndices.  */
   void LSDerivatives(TripletList &TList, Eigen::VectorXd &Rhs) const;
 
+  //! Evaluates the Hessian of the chi2 (both triangles) and its gradient, without storing the whole Jacobian.
+  /*! See SparseHessian. Rhs is incremented, as in LSDerivatives. */
+  void AssembleNormalEquations(Eigen::SparseMatrix<double> &Hessian, Eigen::VectorXd &Rhs) const;
+
+  //! Number of threads used when looping over CcdImage's. 1 (the default) means serial, 0 means all available.
+  /*! The results do not depend on the number of threads. */
+  void SetNThreads(const unsigned NThreads) { _nThreads = NThreads;}
+
+  //!
+  unsigned NThreads() const { return _nThreads;}
+
+  //! Linear solver used by Minimize: "simplicial" (the default) or "pcg". See MakeSparseSolver.
+  /*! MaxIterations bounds the iterations of an iterative solver
+    (see SparseSolver::SetMaxIterations); 0 keeps its default. */
+  void SetSolver(const std::string &SolverName, const unsigned MaxIterations=0);
+
+  //!
+  std::string Solver() const { return _solverName;}
+
+  //! When fitting positions, eliminate them before solving (see SchurSolver).
+  /*! Minimize then only factorizes the system in the other parameters
+    (distortions, refraction), with the solver set by SetSolver, and
+    computes the star positions one star at a time (using NThreads
+    threads). Outlier removal refactorizes the reduced system. */
+  void SetEliminatePositions(const bool Eliminate);
+
+  //!
+  bool EliminatePositions() const { return _eliminatePositions;}
+
+  //! Minimize assembles the Hessian with AssembleNormalEquations rather than from the full Jacobian.
+  /*! This roughly halves the memory peak of Minimize. The default is
+    false. */
+  void SetDirectAssembly(const bool Direct) { _directAssembly = Direct;}
+
+  //!
+  bool DirectAssembly() const { return _directAssembly;}
+
+  //! Restricts the fit to the parameters that only the CcdImage's of rank FirstNew and beyond (in the Associations) constrain.
+  /*! This is meant to warm-start a fit when CcdImage's are added to
+    a fitted state (see Associations::AssociateNewCatalogs): the
+    chi2 terms of the other CcdImage's are ignored, and the
+    parameters they constrain (their mappings, the positions of the
+    FittedStar's they measure, the refraction coefficients) are held
+    fixed. What remains are the parameters of the new CcdImage's
+    (e.g. all of them with SimplePolyModel, only the ones of new
+    exposures with ConstrainedPolyModel), and the positions of the
+    FittedStar's only they measure, with their reference terms.
+    Minimize, ComputeChi2 and the outlier removal then only deal with
+    these, so that their cost scales with the new data. FirstNew = 0
+    restores the fit of everything. */
+  void RestrictToNewCcdImages(const unsigned FirstNew);
+
+  //! see RestrictToNewCcdImages.
+  unsigned FirstNewCcdImage() const { return _firstNewCcd;}
+
   //! Set parameter groups fixed or variable and assign indices to each parameter in the big matrix (which will be used by OffsetParams(...).
   void AssignIndices(const std::string &WhatToFit);
 
+  //! Number of fitted parameters set by the last call to AssignIndices (the size of the vectors LSDerivatives and OffsetParams deal with).
+  unsigned NParTot() const { return _nParTot;}
+
   //!The transformations used to propagate errors are freezed to the current state.
   /*! The routine can be called when the mappings are roughly in place.
     After the call, the transformations used to propage errors are no longer
@@ -145,7 +235,7 @@ class AstromFit {
   //! Just removes outliers from the fit. No Refit done.
   void RemoveRefOutliers(FittedStarList &Outliers);
 
-  //! Produces both ntuples (cook up names from the provided string)
+  //! Produces both ntuples (cook up names from the provided string). Binary (NumPy) if the name ends with ".npy".
   void MakeResTuple(const std::string &TupleName) const;
 
   //! Produces a tuple containing residuals of measurement terms.
@@ -154,6 +244,12 @@ class AstromFit {
   //! Produces a tuple containing residuals of reference terms.
   void MakeRefResTuple(const std::string &TupleName) const;
 
+  //! Residuals of measurement terms (same columns as MakeMeasResTuple), in memory.
+  ResidualTable MeasResiduals() const;
+
+  //! Residuals of reference terms (same columns as MakeRefResTuple), in memory.
+  ResidualTable RefResiduals() const;
+
   //! access to the fitted refraction coefficients. Unit depends on scale in the tangentPlane. Degrees for an actual tangent plane.
   std::vector<double> RefractionCoefficients() const 
     { return _refracCoefficient;}
@@ -168,6 +264,11 @@ class AstromFit {
 			    const double &RefractionCoeff,
 			    const double &Jd) const;
 
+  template <class RhsType>
+    void FillLSDerivatives1(const CcdImage &Ccd,
+			    TripletList &TList, RhsType &Rhs,
+			    const MeasuredStarList *M) const;
+
   template <class ListType, class Accum> 
     void AccumulateStatImageList(ListType &L, Accum &A) const;
 
@@ -177,11 +278,48 @@ class AstromFit {
   template <class Accum> 
     void AccumulateStatRefStars(Accum &Accu) const;
 
+  template <class Sink> 
+    void FillMeasResiduals(Sink &S) const;
+
+  template <class Sink> 
+    void FillRefResiduals(Sink &S) const;
+
+  void CollectChi2Contributions(Chi2Vect &Chi2s,
+				const std::string &MeasOrRef) const;
+
+  unsigned SelectOutliers(Chi2Vect &Chi2s, const double &NSigCut,
+			  MeasuredStarList &MSOutliers,
+			  FittedStarList &FSOutliers) const;
+
+  void HessianFromJacobian(Eigen::SparseMatrix<double> &Hessian, Eigen::VectorXd &Grad);
+
+  //! declares the pairs of parameters the chi2 terms couple.
+  void HessianPattern(SparseHessian &H) const;
+
+  //! the parameter blocks of the fitted stars, for SchurSolver.
+  SchurSolver::BlockList PositionBlocks() const;
+
   
   //! only for outlier removal
   void GetMeasuredStarIndices(const MeasuredStar &Ms, 
 			      std::vector<unsigned> &Indices) const;
 
+  //! the CcdImage's whose measurements enter the fit (see RestrictToNewCcdImages).
+  std::vector<const CcdImage *> FittedCcdImages() const;
+
+  //! index in the fit of parameter Index of the layout set by AssignIndices, -1 if it is held fixed.
+  int FitIndex(const unsigned Index) const
+  { 
+    if (_fitIndex.empty()) return Index;
+    return (Index < _fitIndex.size()) ? _fitIndex[Index] : -1;
+  }
+
+  //! replaces layout indices by indices in the fit, and removes the fixed ones.
+  void ToFitIndices(std::vector<unsigned> &Indices) const;
+
+  //! applies offsets (in the whole layout) to the parameters.
+  void OffsetAllParams(const Eigen::VectorXd &Delta);
+
 };
 
 
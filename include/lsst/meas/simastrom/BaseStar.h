@@ -19,6 +19,9 @@ namespace meas {
 namespace simastrom {
 
 
+class CheckpointWriter;
+class CheckpointReader;
+
 #define MEMPIX2DISK 1
 
 
@@ -63,6 +66,11 @@ double flux;
   { s.dump(stream); return stream;}
 #endif
 
+  //! binary output of the position, its uncertainties and the flux (for checkpoints)
+  void Write(CheckpointWriter &W) const;
+  //! reads what Write wrote
+  void Read(CheckpointReader &R);
+
   virtual void dump(std::ostream & stream = std::cout) const { stream << "x "<< x << " y " << y << " flux " << flux << std::endl;}
   virtual void dumpn(std::ostream & stream = std::cout) const { stream << "x "<< x << " y " << y << " flux " << flux << " ";}
 
@@ -4,6 +4,7 @@
 #include <string>
 #include <list>
 #include <vector>
+#include <mutex> // for std::once_flag
 
 #include "lsst/afw/table/Source.h"
 #include "lsst/afw/image/TanWcs.h"
@@ -22,6 +23,9 @@ namespace simastrom {
 
 typedef int ShootIdType;
 
+class CheckpointWriter;
+class CheckpointReader;
+
 
 //void SetZpKey(const std::string &AKey);
 
@@ -42,7 +46,11 @@ class CcdImage : public RefCount
 //  Gtransfo *readWcs; // i.e. from pix to sky
 //  Gtransfo *inverseReadWcs; // i.e. from sky to pix  
   CountedRef<BaseTanWcs> readWcs; // i.e. from pix to sky
-  CountedRef<Gtransfo> inverseReadWcs; // i.e. from sky to pix
+  // i.e. from sky to pix, computed when first needed (see InverseReadWCS)
+  mutable CountedRef<Gtransfo> inverseReadWcs;
+  /* std::once_flag cannot be copied nor assigned : neither can
+     CcdImage (see the private copy constructor below). */
+  mutable std::once_flag inverseReadWcsDone;
 
   // The following ones should probably be mostly removed.
   CountedRef<Gtransfo> CTP2TP; // go from CommonTangentPlane to this tangent plane.
@@ -92,6 +100,9 @@ class CcdImage : public RefCount
 
   void LoadCatalog(const lsst::afw::table::SortedCatalogT<lsst::afw::table::SourceRecord> &Cat, const std::string &fluxField, const std::string& centroid="base_SdssCentroid",const std::string& shape="base_SdssShape");
 
+  // sets the transfos derived from readWcs and commonTangentPoint
+  void InitTransfos();
+
  public:
 
   CcdImage(lsst::afw::table::SortedCatalogT<lsst::afw::table::SourceRecord> &Ri, 
@@ -101,6 +112,14 @@ class CcdImage : public RefCount
 
 
     
+#ifndef SWIG
+  //! Rebuilds a CcdImage from what Write wrote (see Associations::ReadCheckpoint).
+  CcdImage(CheckpointReader &R);
+
+  //! binary output of the image description, the WCS and both catalogs, but for the links of measurements to FittedStar's.
+  void Write(CheckpointWriter &W) const;
+#endif
+
 #ifdef TO_BE_FIXED 
   //!
   CcdImage(const ReducedImage &Ri, const Point &CommonTangentPoint, const CatalogLoader * LoadIt);
@@ -231,8 +250,8 @@ class CcdImage : public RefCount
   //! the wcs read in the header. NOT updated when fitting.
   const Gtransfo *ReadWCS() const {return readWcs.get();}
   
-  //! the inverse of the one above.
-  const Gtransfo *InverseReadWCS() const {return inverseReadWcs.get();}
+  //! the inverse of the one above (computed at the first call).
+  const Gtransfo *InverseReadWCS() const;
   
   //! Frame in pixels
   const Frame& ImageFrame() const { return imageFrame;}
@@ -261,6 +280,7 @@ class CcdImage : public RefCount
   
  private:
   CcdImage(const CcdImage &); // forbid copies
+  void operator=(const CcdImage &); // and assignments
 
 
 };
@@ -0,0 +1,132 @@
+// -*- C++ -*-
+#ifndef CHECKPOINT__H
+#define CHECKPOINT__H
+
+#include <cstdio>
+#include <string>
+#include <vector>
+#include <type_traits>
+
+namespace lsst {
+namespace meas {
+namespace simastrom {
+
+class Gtransfo;
+class GtransfoPoly;
+
+//! Binary output of checkpoints (see Associations::WriteCheckpoint and DistortionModel::WriteParams).
+/*! The file starts with an 8 character magic that tells what it
+  contains, the byte order and the format version, and the values
+  follow in the byte order of the machine (which is checked at
+  reading). It is written under a temporary name, renamed to FileName
+  by Close(): a job interrupted while writing leaves the previous
+  checkpoint untouched. */
+class CheckpointWriter
+{
+  std::string fileName;
+  std::string tmpName;
+  FILE *ofp;
+  bool ok;
+
+ public :
+  //! Magic should be 8 characters long.
+  CheckpointWriter(const std::string &FileName, const char *Magic);
+
+  //!
+  void PutBytes(const void *Data, const size_t Size);
+
+  //! for scalars only.
+  template <class T> void Put(const T &Value)
+  {
+    static_assert(std::is_arithmetic<T>::value, "CheckpointWriter::Put is meant for scalars");
+    PutBytes(&Value, sizeof(T));
+  }
+
+  //! size, then characters.
+  void PutString(const std::string &S);
+
+  //! size, then elements (which should be scalars).
+  template <class T> void PutVector(const std::vector<T> &V)
+  {
+    static_assert(std::is_arithmetic<T>::value, "CheckpointWriter::PutVector is meant for vectors of scalars");
+    Put<unsigned long long>(V.size());
+    if (!V.empty()) PutBytes(&V[0], V.size()*sizeof(T));
+  }
+
+  //! number of parameters, then parameters (see Gtransfo::ParamRef).
+  void PutParams(const Gtransfo &T);
+
+  //! degree, then coefficients.
+  void PutPoly(const GtransfoPoly &P);
+
+  //! closes the file and renames it to FileName. Throws if anything went wrong.
+  void Close();
+
+  //! removes the temporary file if Close() was not called (e.g. because of an exception).
+  ~CheckpointWriter();
+
+ private :
+  CheckpointWriter(const CheckpointWriter &);
+  void operator = (const CheckpointWriter &);
+};
+
+
+//! Reads what CheckpointWriter wrote. Throws if the file is not of the expected kind, or too short.
+class CheckpointReader
+{
+  std::string fileName;
+  FILE *ifp;
+  unsigned long long remaining; // bytes not read yet
+
+ public :
+  //! Magic should be the one used to write the file.
+  CheckpointReader(const std::string &FileName, const char *Magic);
+
+  //!
+  void GetBytes(void *Data, const size_t Size);
+
+  //!
+  template <class T> void Get(T &Value)
+  {
+    static_assert(std::is_arithmetic<T>::value, "CheckpointReader::Get is meant for scalars");
+    GetBytes(&Value, sizeof(T));
+  }
+
+  //!
+  template <class T> T Get() { T value; Get(value); return value;}
+
+  //!
+  std::string GetString();
+
+  //!
+  template <class T> void GetVector(std::vector<T> &V)
+  {
+    static_assert(std::is_arithmetic<T>::value, "CheckpointReader::GetVector is meant for vectors of scalars");
+    unsigned long long n = Get<unsigned long long>();
+    CheckSize(n, sizeof(T));
+    V.resize(n);
+    if (n) GetBytes(&V[0], n*sizeof(T));
+  }
+
+  //! T should have the number of parameters that were written.
+  void GetParams(Gtransfo &T);
+
+  //! P gets the degree that was written.
+  void GetPoly(GtransfoPoly &P);
+
+  //! throws if N objects of ItemSize bytes cannot be in what remains of the file (e.g. because of a corrupted size)
+  void CheckSize(const unsigned long long N, const size_t ItemSize) const;
+
+  //!
+  const std::string &FileName() const { return fileName;}
+
+  ~CheckpointReader();
+
+ private :
+  CheckpointReader(const CheckpointReader &);
+  void operator = (const CheckpointReader &);
+};
+
+}}}
+
+#endif /* CHECKPOINT__H */
@@ -4,6 +4,9 @@
 #include <string>
 #include <iostream>
 #include <sstream>
+#include <vector>
+#include <algorithm>
+#include <cmath>
 
 namespace lsst {
 namespace meas {
@@ -42,6 +45,39 @@ struct Chi2
 }; // end of struct Chi2
 
 
+//! Finds the chi2 contributions above average+NSigCut*sigma, for the outlier searches of the fits.
+/*! Entries is a vector of objects with a chi2 field, ordered by
+  chi2 (operator <). On return, its first N entries (N is the
+  returned value) are the ones above the cut, sorted by decreasing
+  chi2, and the others follow in no particular order. Average and
+  sigma are accumulated in one pass, the median (only printed, after
+  Label) is obtained by partial selection, and only the entries
+  above the cut get sorted, rather than the whole vector. */
+template <class EntryVector>
+size_t SelectLargeChi2s(EntryVector &Entries, const double NSigCut, const std::string &Label)
+{
+  size_t nval = Entries.size();
+  if (nval == 0) return 0;
+  double sum=0; double sum2 = 0;
+  for (auto i=Entries.cbegin(); i!=Entries.cend(); ++i)
+    {sum+= i->chi2;sum2+= i->chi2*i->chi2;}
+  double average = sum/nval;
+  double sigma = sqrt(sum2/nval - average*average);
+  auto mid = Entries.begin()+nval/2;
+  std::nth_element(Entries.begin(), mid, Entries.end());
+  double median = mid->chi2;
+  if ((nval & 1) == 0) median = 0.5*(median+std::max_element(Entries.begin(), mid)->chi2);
+  std::cout << "INFO : " << Label << " chi2 stat: mean/median/sigma " 
+	    << average << '/'<< median << '/' << sigma << std::endl;
+  double cut = average+NSigCut*sigma;
+  typedef typename EntryVector::value_type Entry;
+  auto last = std::partition(Entries.begin(), Entries.end(),
+			     [cut](const Entry &E) { return !(E.chi2 < cut);});
+  std::sort(Entries.begin(), last, [](const Entry &A, const Entry &B) { return B < A;});
+  return last-Entries.begin();
+}
+
+
 
 
 }}}
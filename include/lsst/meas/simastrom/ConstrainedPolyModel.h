@@ -81,6 +81,12 @@ public :
  //! Cook up a SIP WCS.
   PTR(TanSipPix2RaDec) ProduceSipWcs(const CcdImage &Ccd) const;
 
+  //! The mappings are saved along with their chip or shoot.
+  void WriteParams(const std::string &FileName) const;
+
+  //! With AllowNew, the chips and shoots the file does not mention keep their current mappings.
+  void ReadParams(const std::string &FileName, const bool AllowNew=false);
+
   //! Write a transfo file that contains the pixel->tangent plane mappings for each chip.
   /*! These constitute a description of the focal plane
   arrangement. The produced file is used by matchexposure from
@@ -38,6 +38,16 @@ public :
   //! 
   virtual void FreezeErrorScales() = 0;
 
+  //! Saves the current values of the parameters (see Associations::WriteCheckpoint).
+  virtual void WriteParams(const std::string &FileName) const = 0;
+
+  //! Reads parameters saved by WriteParams, for a model set up for the same CcdImage's and degrees.
+  /*! If AllowNew is true, the model may also have parameters that the
+    file does not hold (e.g. for CcdImage's added since, see
+    Associations::AssociateNewCatalogs): they keep their current
+    values. */
+  virtual void ReadParams(const std::string &FileName, const bool AllowNew=false) = 0;
+
   virtual ~DistortionModel() {};
 
 };
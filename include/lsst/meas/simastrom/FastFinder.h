@@ -3,6 +3,7 @@
 
 #include <vector>
 #include "lsst/meas/simastrom/BaseStar.h"
+#include "lsst/meas/simastrom/StarFinder.h"
 
 namespace lsst {
 namespace meas {
@@ -25,11 +26,12 @@ namespace simastrom {
   in ListMatchupShift, to avoid scanning the whole input lists. Timing
   on ListMatchCollect and ListMatchupShift indicates a gain in speed
   by more than one order of magnitude after implementation of this
-  FastFinder.
+  FastFinder. For large lists (say more than 10^4 objects), the fixed
+  number of slices makes KdTreeFinder faster (see MakeStarFinder).
 */
 
 //! Fast locator in starlists.
-class FastFinder
+class FastFinder : public StarFinder
 {
   //  private :
   public :
@@ -47,6 +49,8 @@ class FastFinder
   typedef decltype(stars)::const_iterator pstar;
 
 public :
+  using StarFinder::FindClosest;
+
     //! Constructor
   FastFinder(const BaseStarList &List, const unsigned NXslice = 100);
 
@@ -1,6 +1,8 @@
 #ifndef FATPOINT__H
 #define FATPOINT__H
 
+#include <vector>
+
 #include "lsst/meas/simastrom/Point.h"
 
 namespace lsst {
@@ -28,6 +30,27 @@ class FatPoint : public Point
 
 };  
 
+
+//! A set of FatPoint's, stored as one array per quantity (see Mapping::TransformPosAndErrorsBatch).
+class FatPointArrays
+{
+ public :
+  std::vector<double> x, y, vx, vy, vxy;
+
+  size_t size() const { return x.size();}
+
+  void resize(const size_t N)
+  { x.resize(N); y.resize(N); vx.resize(N); vy.resize(N); vxy.resize(N);}
+
+  //! 
+  FatPoint Get(const size_t K) const 
+  { return FatPoint(x[K], y[K], vx[K], vy[K], vxy[K]);}
+
+  //!
+  void Set(const size_t K, const FatPoint &P)
+  { x[K] = P.x; y[K] = P.y; vx[K] = P.vx; vy[K] = P.vy; vxy[K] = P.vxy;}
+};
+
 }}}
 
 #endif
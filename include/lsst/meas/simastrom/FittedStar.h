@@ -146,6 +146,11 @@ class FittedStar : public BaseStar, public PmBlock {
   double         FluxErr2() const { return fluxErr2; }
   double&        FluxErr2() { return fluxErr2; }
   
+  //! binary output of everything but the link to the RefStar (see Associations::WriteCheckpoint)
+  void Write(CheckpointWriter &W) const;
+  //! reads what Write wrote
+  void Read(CheckpointReader &R);
+
   //! write stuff 
   std::string       WriteHeader_(std::ostream& pr=std::cout, const char* i=NULL) const;
   virtual void      writen(std::ostream& s) const;
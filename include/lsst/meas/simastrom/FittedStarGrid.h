@@ -0,0 +1,63 @@
+// -*- C++ -*-
+#ifndef FITTEDSTARGRID__H
+#define FITTEDSTARGRID__H
+
+#include <vector>
+#include <unordered_map>
+
+#include "lsst/meas/simastrom/FittedStar.h"
+#include "lsst/meas/simastrom/Frame.h"
+
+namespace lsst {
+namespace meas {
+namespace simastrom {
+
+//! Spatial index of FittedStar's, using their current (x,y) coordinates.
+/*! The plane is cut into square cells, and only non-empty cells are
+  stored (in a hash table), so that the extent of the plane does not
+  need to be known in advance, and stars can be inserted one at a time.
+  It is used by Associations::AssociateCatalogs to select the
+  FittedStar's that may match a CcdImage without scanning the whole
+  FittedStarList. The index does not follow changes of coordinates of
+  the stars it contains. */
+class FittedStarGrid
+{
+  struct Entry
+  {
+    unsigned rank; // insertion order
+    FittedStar *fs;
+    Entry(const unsigned R, FittedStar *F) : rank(R), fs(F) {}
+    bool operator < (const Entry &R) const { return rank < R.rank;}
+  };
+
+  double cellSize;
+  unsigned count;
+  std::unordered_map<long long, std::vector<Entry> > cells;
+
+  long long CellKey(const int I, const int J) const
+  { return (((long long) I) << 32) ^ ((long long) (unsigned) J);}
+
+  int CellCoord(const double &X) const;
+
+ public :
+  //! CellSize is in the units of the coordinates of the stars.
+  FittedStarGrid(const double CellSize);
+
+  //! Adds a star at its current position.
+  void Insert(FittedStar *Fs);
+
+  //! Adds all stars of the list, in list order.
+  void Insert(const FittedStarList &L);
+
+  //! Appends to Out the stars inside F (see Frame::InFrame), in insertion order.
+  void ExtractInFrame(const Frame &F, FittedStarList &Out) const;
+
+  //! number of stars in the index.
+  unsigned size() const { return count;}
+
+  void clear() { cells.clear(); count = 0;}
+};
+
+}}}
+
+#endif /* FITTEDSTARGRID__H */
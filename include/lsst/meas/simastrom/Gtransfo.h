@@ -122,6 +122,20 @@ public:
   //! Derivative w.r.t parameters. Derivatives should be al least 2*NPar long. first Npar, for x, last Npar for y.
   virtual void ParamDerivatives(const Point &Where, double *Dx, double *Dy) const;
 
+  //! Transforms N points at once. The output arrays may be the input ones.
+  virtual void ApplyBatch(const double *Xin, const double *Yin,
+			  double *Xout, double *Yout, const size_t N) const;
+
+  //! TransformPosAndErrors for all points of In. Out is resized, and may be In.
+  virtual void TransformPosAndErrorsBatch(const FatPointArrays &In, FatPointArrays &Out) const;
+
+  //! ParamDerivatives for all points of Where.
+  /*! Der should be at least 2*Npar()*Where.size() long : the
+    derivatives of point k go to Der+2*k*Npar() (for x) and
+    Der+(2*k+1)*Npar() (for y), i.e. the columns 2k and 2k+1 of a
+    (column-major) Npar() x 2N matrix. */
+  virtual void ParamDerivativesBatch(const FatPointArrays &Where, double *Der) const;
+
   //! Rough inverse. 
   /*! Stored by the numerical inverter to guess starting point 
      for the trials. Just here to enable overloading. */
@@ -227,6 +241,15 @@ private:
   void compute_monomials(const double &Xin, const double &Yin, 
 			 double *Monom) const;
 
+  /* Same for N points at once, stored term-major (Monom[k*N+p] is
+     monomial k of point p), so that loops over points vectorize. If
+     DerMx is not NULL, DerMx and DerMy receive the derivatives of the
+     monomials w.r.t. x and y, in the same layout. Powers is a work
+     space of 2*(deg+1)*N doubles. */
+  void compute_monomials(const double *Xin, const double *Yin, const unsigned N,
+			 double *Powers, double *Monom,
+			 double *DerMx=NULL, double *DerMy=NULL) const;
+
 public :
   //! Default transfo : identity for all degrees (>=1 ). The degree refers to the highest total power (x+y) of monomials. 
   GtransfoPoly(const unsigned Deg=1) ;
@@ -250,6 +273,16 @@ public :
   //! a mix of apply and Derivative
   virtual void TransformPosAndErrors(const FatPoint &In, FatPoint &Out) const;
 
+  //! Monomials are computed for blocks of points, and shared by both coordinates.
+  void ApplyBatch(const double *Xin, const double *Yin,
+		  double *Xout, double *Yout, const size_t N) const;
+
+  //! The derivatives of the monomials, computed along with them, propagate the errors.
+  void TransformPosAndErrorsBatch(const FatPointArrays &In, FatPointArrays &Out) const;
+
+  //! The derivatives w.r.t. the coefficients are the monomials themselves.
+  void ParamDerivativesBatch(const FatPointArrays &Where, double *Der) const;
+
   //! returns degree
   unsigned Degree() const { return deg;}
 
@@ -322,7 +355,7 @@ private :
 
 };
 
-//! approximates the inverse by a polynomial, up to required precision.
+//! approximates the inverse by a polynomial, up to required precision (over a grid of points in F).
 GtransfoPoly *InversePolyTransfo(const Gtransfo &Direct, const Frame &F, const double Prec);
 
 GtransfoLin NormalizeCoordinatesTransfo(const Frame & F);
@@ -535,7 +568,7 @@ public:
   //! Overload the "generic routine" (available for all Gtransfo types
   Gtransfo* RoughInverse(const Frame &Region) const;
 
-    //! Inverse transfo: returns a TanRaDec2Pix if there are no corrections, or the iterative solver if there are.
+    //! Inverse transfo: returns a TanRaDec2Pix if there are no corrections, or a fitted polynomial inverse if there are (the iterative solver if the fit does not reach Precision).
   Gtransfo* InverseTransfo(const double Precision,
 			   const Frame& Region) const;
 
@@ -570,7 +603,7 @@ public:
   TanSipPix2RaDec();
 
 
-    //! Inverse transfo: returns a TanRaDec2Pix if there are no corrections, or the iterative solver if there are.
+    //! Inverse transfo: returns a TanRaDec2Pix if there are no corrections, or a fitted polynomial inverse if there are (the iterative solver if the fit does not reach Precision).
   Gtransfo* InverseTransfo(const double Precision,
 			   const Frame& Region) const;
 
@@ -621,12 +654,19 @@ class TanRaDec2Pix : public Gtransfo
     //!
     void apply(const double Xin, const double Yin, double &Xout, double &Yout) const;
 
+    //! Projects N points at once, with the linear part applied to all of them in a second pass.
+    void ApplyBatch(const double *Xin, const double *Yin,
+		    double *Xout, double *Yout, const size_t N) const;
+
     //! transform with analytical derivatives
     void TransformPosAndErrors(const FatPoint &In, 
 			       FatPoint &Out) const;
 
 
 
+    //! Reduces the composition with a BaseTanWcs that has the same tangent point.
+    Gtransfo *ReduceCompo(const Gtransfo *Right) const;
+
     //! exact typed inverse:
     TanPix2RaDec invert() const;
 
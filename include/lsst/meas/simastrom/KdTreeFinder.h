@@ -0,0 +1,70 @@
+// -*- C++ -*-
+#ifndef KDTREEFINDER__H
+#define KDTREEFINDER__H
+
+#include <vector>
+
+#include "lsst/meas/simastrom/StarFinder.h"
+
+namespace lsst {
+namespace meas {
+namespace simastrom {
+
+//! Locator of closest stars using a k-d tree.
+/*! The plane is recursively split at the median of the coordinate
+  with the largest spread, until cells hold a few objects. Unlike
+  FastFinder, which uses a fixed number of x slices, the cost of a
+  query grows as log(N) whatever the size and shape of the
+  footprint, which pays off for large lists (e.g. reference
+  catalogs). The objects are copied (position and address) into a
+  contiguous array, so that BaseStarList can go away, but the
+  BaseStar's themselves should not. */
+class KdTreeFinder : public StarFinder
+{
+  struct Entry
+  {
+    double x, y;
+    const BaseStar *star;
+  };
+
+  struct Node
+  {
+    double split;
+    unsigned begin, end; // range in entries
+    int axis; // 0 for x, 1 for y, -1 for leaves
+    unsigned left, right; // children (in nodes)
+  };
+
+  std::vector<Entry> entries;
+  std::vector<Node> nodes;
+
+  unsigned Build(const unsigned Begin, const unsigned End);
+
+  // up to two closest objects below sqrt(Dist2[1]) (in the subtree of INode)
+  void Search(const unsigned INode, const Point &Where, 
+	      const BaseStar *Best[2], double Dist2[2], 
+	      const bool Two, bool (*SkipIt)(const BaseStar *)) const;
+
+ public :
+  using StarFinder::FindClosest;
+
+  //! Constructor
+  KdTreeFinder(const BaseStarList &List);
+
+  //!
+  const BaseStar *FindClosest(const Point &Where, const double MaxDist, 
+			      bool (*SkipIt)(const BaseStar *) = NULL) const;
+
+  //!
+  const BaseStar *SecondClosest(const Point &Where, 
+				const double MaxDist, 
+				const BaseStar* &Closest,
+				bool (*SkipIt)(const BaseStar *)= NULL) const;
+
+  //! number of objects
+  size_t size() const { return entries.size();}
+};
+
+}}}
+
+#endif /* KDTREEFINDER__H */
@@ -5,6 +5,7 @@
 
 #include "lsst/meas/simastrom/BaseStar.h"
 #include "lsst/meas/simastrom/StarMatch.h"
+#include "lsst/meas/simastrom/StarFinder.h"
 
 namespace lsst {
 namespace meas {
@@ -22,7 +23,8 @@ struct MatchConditions
   double MaxShiftX, MaxShiftY;
   double SizeRatio, DeltaSizeRatio, MinMatchRatio;
   int PrintLevel;
-  int Algorithm;
+  int Algorithm; // 1: segment pairs (2d histogram), 2: segment pairs (4d histogram), 3: triangle hashing
+  double TriangleTolerance; // matching distance of triangle shapes (side ratios), for Algorithm 3
 
   MatchConditions(/* const std::string &DatacardsName = ""*/ );
 
@@ -59,13 +61,16 @@ StarMatchList* MatchSearchRotShiftFlip(BaseStarList &L1, BaseStarList &L2, const
 
 //! assembles star matches.
 /*! It picks stars in L1, transforms them through Guess, and collects
-closest star in L2, and builds a match if closer than MaxDist). */
+closest star in L2, and builds a match if closer than MaxDist). 
+Strategy selects how closest stars are located (see MakeStarFinder). */
 
-StarMatchList *ListMatchCollect(const BaseStarList &L1, const BaseStarList &L2,const Gtransfo *Guess, const double MaxDist);
+StarMatchList *ListMatchCollect(const BaseStarList &L1, const BaseStarList &L2,const Gtransfo *Guess, const double MaxDist,
+				const FinderStrategy Strategy = FinderAuto);
 
 //! same as before except that the transfo is the identity
 
-StarMatchList *ListMatchCollect(const BaseStarList &L1, const BaseStarList &L2, const double MaxDist);
+StarMatchList *ListMatchCollect(const BaseStarList &L1, const BaseStarList &L2, const double MaxDist,
+				const FinderStrategy Strategy = FinderAuto);
 
 //! searches for a 2 dimensional shift using a very crude histogram method.
 
@@ -13,6 +13,7 @@ namespace meas {
 namespace simastrom {
 
 class FatPoint;
+class FatPointArrays;
 class Point;
 
 //! virtual class needed in the abstraction of the distortion model
@@ -39,6 +40,21 @@ class Mapping
     virtual void TransformPosAndErrors(const FatPoint &Where,
 				       FatPoint &OutPos) const = 0;
 
+    //! Transforms all points of Where (e.g. the measurements of a CcdImage) into OutPos, which is resized.
+    /*! The default implementation calls TransformPosAndErrors for
+      each point. Implementations can do better by sharing work
+      between points and vectorizing. */
+    virtual void TransformPosAndErrorsBatch(const FatPointArrays &Where,
+					    FatPointArrays &OutPos) const;
+
+    //! Same as TransformPosAndErrorsBatch, with the derivatives w.r.t. the parameters.
+    /*! H is resized to Npar() rows and 2 columns per point : the
+      columns 2k and 2k+1 are the ones ComputeTransformAndDerivatives
+      would provide for point k. */
+    virtual void ComputeTransformAndDerivativesBatch(const FatPointArrays &Where,
+						     FatPointArrays &OutPos,
+						     Eigen::MatrixXd &H) const;
+
     //! Remember the error scale and freeze it
     //  virtual void FreezeErrorScales() = 0;
 
@@ -86,6 +86,11 @@ class MeasuredStar : public BaseStar
   // No longer decrement counter of associated fitted star in destructor (P. El-Hage le 10/04/2012)
   // ~MeasuredStar() { if (fittedStar) fittedStar->MeasurementCount()--;}
 
+  //! binary output of everything but the links to the FittedStar and the CcdImage (see Associations::WriteCheckpoint)
+  void Write(CheckpointWriter &W) const;
+  //! reads what Write wrote
+  void Read(CheckpointReader &R);
+
   std::string WriteHeader_(std::ostream & pr = std::cout, const char* i = NULL) const;
   void writen(std::ostream& s) const;
 static BaseStar*  read(std::istream &s, const char* format);
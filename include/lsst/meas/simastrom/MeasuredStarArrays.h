@@ -0,0 +1,51 @@
+// -*- C++ -*-
+#ifndef MEASUREDSTARARRAYS__H
+#define MEASUREDSTARARRAYS__H
+
+#include <vector>
+
+#include "lsst/meas/simastrom/MeasuredStar.h"
+#include "lsst/meas/simastrom/FatPoint.h"
+
+namespace lsst {
+namespace meas {
+namespace simastrom {
+
+//! Copy (one array per quantity) of the measurements of a MeasuredStarList, for one pass of a fit.
+/*! A MeasuredStarList means one heap object per measurement, reached
+  through a list node, while the fits only use a handful of numbers
+  from each. The fit loops over the measurements of a CcdImage
+  (AstromFit for positions, PhotomFit for fluxes) copy these numbers
+  into arrays, in the order of the list, and then work on the arrays.
+  The list elements can still be reached through the star array
+  (e.g. to discard outliers). The list remains the owner of the
+  measurements, and the arrays do not follow its changes: they are
+  built at each pass and dropped at its end, so that they cannot go
+  stale and take no memory between passes. */
+class MeasuredStarArrays
+{
+ public :
+  std::vector<double> x, y, vx, vy, vxy, flux, eflux;
+  std::vector<const FittedStar *> fittedStar;
+  std::vector<char> valid;
+  std::vector<MeasuredStar *> star;
+
+  MeasuredStarArrays() {}
+
+  explicit MeasuredStarArrays(const MeasuredStarList &L) { Set(L);}
+
+  //! Copies the content of L (replacing the current one).
+  void Set(const MeasuredStarList &L);
+
+  //! the measured position of entry K, with its uncertainties.
+  FatPoint Position(const size_t K) const
+  { return FatPoint(x[K], y[K], vx[K], vy[K], vxy[K]);}
+
+  size_t size() const { return x.size();}
+
+  void clear();
+};
+
+}}}
+
+#endif /* MEASUREDSTARARRAYS__H */
@@ -0,0 +1,64 @@
+#ifndef PARALLELFOR__H
+#define PARALLELFOR__H
+
+#include <exception>
+
+#ifdef _OPENMP
+#include <omp.h>
+#endif
+
+namespace lsst {
+namespace meas {
+namespace simastrom {
+
+//! Actual number of threads to use: 0 means "as many as OpenMP offers".
+inline unsigned EffectiveNThreads(const unsigned NThreads)
+{
+#ifdef _OPENMP
+  if (NThreads == 0) return omp_get_max_threads();
+  return NThreads;
+#else
+  return 1;
+#endif
+}
+
+//! Calls Func(k) for k in [0,N), spreading the calls over NThreads threads.
+/*! The iterations are handed out dynamically (CcdImage's do not all
+  have the same size). Func should only write into data that belongs
+  to iteration k. If compiled without OpenMP or if NThreads==1, this
+  is a plain loop. An exception thrown by one of the calls is rethrown
+  in the calling thread once the loop is over (an exception escaping
+  an OpenMP region would abort the program). */
+template <class Func> void ParallelFor(const unsigned N, const unsigned NThreads,
+				       const Func &F)
+{
+  unsigned nThreads = EffectiveNThreads(NThreads);
+  if (nThreads <= 1 || N <= 1)
+    {
+      for (unsigned k=0; k<N; ++k) F(k);
+      return;
+    }
+  std::exception_ptr error;
+#ifdef _OPENMP
+#pragma omp parallel for schedule(dynamic) num_threads(nThreads)
+#endif
+  for (int k=0; k < int(N); ++k)
+    {
+      try
+	{
+	  F(unsigned(k));
+	}
+      catch (...)
+	{
+#ifdef _OPENMP
+#pragma omp critical (ParallelForError)
+#endif
+	  if (!error) error = std::current_exception();
+	}
+    }
+  if (error) std::rethrow_exception(error);
+}
+
+}}}
+
+#endif /* PARALLELFOR__H */
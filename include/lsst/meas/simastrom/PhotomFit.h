@@ -5,12 +5,15 @@
 #include <iostream>
 #include <sstream>
 #include <map>
+#include <memory>
 
 #include "lsst/meas/simastrom/CcdImage.h"
 #include "lsst/meas/simastrom/Eigenstuff.h"
 #include "lsst/meas/simastrom/Tripletlist.h"
 #include "lsst/meas/simastrom/PhotomModel.h"
 #include "lsst/meas/simastrom/Chi2.h"
+#include "lsst/meas/simastrom/ResidualTable.h"
+#include "lsst/meas/simastrom/SparseSolver.h"
 
 namespace lsst {
 namespace meas {
@@ -36,6 +39,14 @@ class PhotomFit {
   PhotomModel * _photomModel;
   double _fluxError;
   int _LastNTrip; // last triplet count, used to speed up allocation
+  unsigned _nThreads; // number of threads used to loop over CcdImage's
+  std::string _solverName; // see SetSolver
+  unsigned _solverMaxIterations; // see SetSolver
+  // solver kept from one Minimize call to the next, with the pattern and WhatToFit it was analyzed for
+  std::unique_ptr<SparseSolver> _solver;
+  SparsePattern _analyzedPattern;
+  std::string _analyzedWhatToFit;
+  unsigned _nAnalyses; // see NAnalyses
 
 
   
@@ -47,8 +58,34 @@ class PhotomFit {
   //! Does a 1 step minimization, assuming a linear model.
   /*! It calls AssignIndices, LSDerivatives, solves the linear system
     and calls OffsetParams. No line search. Relies on sparse linear
-    algebra. */
-  bool Minimize(const std::string &WhatToFit);
+    algebra. If NSigRejCut is not 0, outliers (see FindOutliers) are
+    then discarded and the fit is redone, as in AstromFit::Minimize :
+    the factorization is downdated by the contributions of the
+    outliers rather than recomputed, until no outliers are found.
+    The symbolic analysis is kept for the next call if the parameter
+    layout and the Hessian pattern allow it. Returns false if the
+    factorization failed or the solver did not converge. See
+    MinimizeWithStatus for the details. */
+  bool Minimize(const std::string &WhatToFit, const double NSigRejCut=0);
+
+  //! Same as Minimize, but returns the same codes as AstromFit::Minimize.
+  /*! Returns 0 when no outliers are left, 1 if the chi2 went up,
+    and 2 if the factorization failed or the solver did not converge
+    (in which case the step that failed is not applied). */
+  unsigned MinimizeWithStatus(const std::string &WhatToFit, const double NSigRejCut=0);
+
+  //! Number of symbolic analyses of the Hessian done by Minimize so far (the other calls reused the previous one).
+  unsigned NAnalyses() const { return _nAnalyses;}
+
+  //! Calls MinimizeWithStatus until the chi2 decreases by less than RelTolerance (relatively) and no outliers are left.
+  /*! Iterating is needed because the model (PhotomFactor times the
+    fitted flux) is not linear when fitting "Model Fluxes". Each
+    iteration costs one factorization, whatever the number of
+    outliers. Stops after MaxIterations calls, or if the
+    factorization fails. Returns the code of the last
+    MinimizeWithStatus call. */
+  unsigned MinimizeToConvergence(const std::string &WhatToFit, const double NSigRejCut=0,
+				 const unsigned MaxIterations=20, const double RelTolerance=1e-5);
 
   //! Derivatives of the Chi2
   void LSDerivatives(TripletList &TList, Eigen::VectorXd &Rhs) const;
@@ -58,6 +95,21 @@ void LSDerivatives(const CcdImage &Ccd,
 		   TripletList &TList, Eigen::VectorXd &Rhs,
 		   const MeasuredStarList *M=NULL) const;
 
+  //! Number of threads used when looping over CcdImage's. 1 (the default) means serial, 0 means all available.
+  /*! The results do not depend on the number of threads. */
+  void SetNThreads(const unsigned NThreads) { _nThreads = NThreads;}
+
+  //!
+  unsigned NThreads() const { return _nThreads;}
+
+  //! Linear solver used by Minimize: "simplicial" (the default) or "pcg". See MakeSparseSolver.
+  /*! MaxIterations bounds the iterations of an iterative solver
+    (see SparseSolver::SetMaxIterations); 0 keeps its default. */
+  void SetSolver(const std::string &SolverName, const unsigned MaxIterations=0);
+
+  //!
+  std::string Solver() const { return _solverName;}
+
   //! Set parameter groups fixed or variable and assign indices to each parameter in the big matrix (which will be used by OffsetParams(...).
   void AssignIndices(const std::string &WhatToFit);
 
@@ -70,11 +122,22 @@ void LSDerivatives(const CcdImage &Ccd,
   //! Returns a chi2 for the current state
   Chi2 ComputeChi2() const;
 
-  //! Produces an ntuple 
+  //! Produces an ntuple. Binary (NumPy) if the name ends with ".npy".
   void MakeResTuple(const std::string &TupleName) const;
 
+  //! Residuals (same columns as MakeResTuple), in memory.
+  ResidualTable Residuals() const;
+
  private:
 
+  template <class Sink> 
+    void FillResiduals(Sink &S) const;
+
+  template <class RhsType>
+    void FillLSDerivatives(const CcdImage &Ccd,
+			   TripletList &TList, RhsType &Rhs,
+			   const MeasuredStarList *M) const;
+
   template <class ListType, class Accum> 
     void AccumulateStat(ListType &L, Accum &A) const;
 
@@ -0,0 +1,93 @@
+// -*- C++ -*-
+#ifndef REFCATALOG__H
+#define REFCATALOG__H
+
+#include <string>
+#include <vector>
+
+#include "lsst/meas/simastrom/BaseStar.h"
+#include "lsst/meas/simastrom/Frame.h"
+#include "lsst/meas/simastrom/AstroUtils.h"
+
+namespace lsst {
+namespace meas {
+namespace simastrom {
+
+//! One reference star, as stored in a reference catalog file.
+struct RefCatRecord
+{
+  double ra, dec; // degrees, 0 <= ra < 360
+  float magR, magB; // 99.9 if not measured
+  float sigRa, sigDec; // position uncertainties, arcsec on the sky
+};
+
+//! Collects reference stars and writes them in the format read by MappedRefCatalog.
+/*! The sky is cut into declination zones of ZoneHeight degrees, and
+  within a zone, stars are sorted by RA. The file holds a header, the
+  offset of each zone, and then the records. It is written in the
+  byte order of the machine (which is checked at reading). */
+class RefCatalogBuilder
+{
+  std::vector<RefCatRecord> records;
+
+ public :
+  RefCatalogBuilder() {}
+
+  //! adds one star. Ra is brought back into [0,360).
+  void Add(const double Ra, const double Dec, const double MagR, const double MagB,
+	   const double SigRa, const double SigDec);
+
+  //! adds all stars of a USNO-A distribution (the zoneNNNN.cat files of UsnoDir). Returns the number of stars added.
+  unsigned AddUsno(const std::string &UsnoDir);
+
+  //! number of stars collected so far.
+  unsigned size() const { return records.size();}
+
+  //! sorts the stars and writes them into FileName.
+  void Write(const std::string &FileName, const double ZoneHeight = 0.25);
+};
+
+
+//! Read-only access to a reference catalog file written by RefCatalogBuilder.
+/*! The file is memory-mapped: a query only touches the pages that
+  contain the zones and RA ranges it covers, and several queries (or
+  several processes) share the same pages. Coordinates of the
+  returned BaseStar's are (RA,Dec) in degrees, and their flux is a
+  magnitude, as for UsnoRead. */
+class MappedRefCatalog
+{
+  const char *mapped;
+  size_t mappedSize;
+  unsigned nZones;
+  double zoneHeight;
+  const unsigned long long *zoneStart; // nZones+1 offsets, in records
+  const RefCatRecord *records;
+
+  // appends the stars of the zones covering [MinDec,MaxDec] with MinRa <= ra <= MaxRa
+  void ReadBox(const double MinRa, const double MaxRa, const double MinDec, const double MaxDec,
+	       const double RaShift, const UsnoColor Color, BaseStarList &Out) const;
+
+ public :
+  //! maps FileName. Throws if it is not a reference catalog.
+  MappedRefCatalog(const std::string &FileName);
+
+  //! Appends the stars within F (x=RA, y=Dec, degrees) to Out. Handles limits across RA=0. Returns the number of appended stars.
+  unsigned Read(const Frame &F, const UsnoColor Color, BaseStarList &Out) const;
+
+  //! Appends the stars within Radius (degrees) of (Ra, Dec) to Out. Returns the number of appended stars.
+  unsigned ReadCone(const double Ra, const double Dec, const double Radius,
+		    const UsnoColor Color, BaseStarList &Out) const;
+
+  //! total number of stars.
+  unsigned long long size() const { return zoneStart[nZones];}
+
+  ~MappedRefCatalog();
+
+ private :
+  MappedRefCatalog(const MappedRefCatalog &);
+  void operator = (const MappedRefCatalog &);
+};
+
+}}}
+
+#endif /* REFCATALOG__H */
@@ -18,6 +18,8 @@ namespace simastrom {
 //! Objects used as position anchors, typically USNO stars. Coordinate system defined by user. The Common Tangent Plane seems a good idea.
 class RefStar : public BaseStar
 {
+  friend class Associations; // for checkpoints
+
 private :
   unsigned int index;
   FittedStarRef fittedStar;
@@ -48,6 +50,11 @@ private :
   //! star index
   unsigned int &  Index() { return index; }
   unsigned int    Index() const { return index; }
+
+  //! binary output of everything but the link to the FittedStar (see Associations::WriteCheckpoint)
+  void Write(CheckpointWriter &W) const;
+  //! reads what Write wrote
+  void Read(CheckpointReader &R);
   
 };
 
@@ -73,6 +80,35 @@ BaseStarList* Ref2Base(RefStarList *This);
 const BaseStarList& Ref2Base(const RefStarList &This);
 const BaseStarList* Ref2Base(const RefStarList *This);
 
+class Gtransfo;
+
+//! Reference stars stored as arrays (one per quantity), for catalogs with many more stars than get associated.
+/*! The positions on the sky (ra, dec, degrees) come with their
+  variances (vx, vy, degrees^2, vx including the 1/cos(dec)
+  factor). (x, y) are the positions projected by Project().
+  RefStar objects are only built (MakeRefStar) for the entries that
+  get associated. */
+class RefStarArrays
+{
+ public :
+  std::vector<double> ra, dec, mag, vx, vy;
+  std::vector<double> x, y;
+
+  RefStarArrays() {}
+
+  size_t size() const { return ra.size();}
+
+  void resize(const size_t N);
+
+  void clear() { resize(0);}
+
+  //! (x, y) = RaDec2TP(ra, dec), for all entries at once, using NThreads threads (0: as many as available).
+  void Project(const Gtransfo &RaDec2TP, const unsigned NThreads = 1);
+
+  //! a RefStar for entry K, located at (ra, dec), as CollectLSSTRefStars used to build them. Its Index() is K.
+  RefStar *MakeRefStar(const size_t K) const;
+};
+
 
 
 
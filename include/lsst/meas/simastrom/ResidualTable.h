@@ -0,0 +1,132 @@
+#ifndef RESIDUALTABLE__H
+#define RESIDUALTABLE__H
+
+#include <string>
+#include <vector>
+#include <fstream>
+#include <boost/shared_ptr.hpp>
+
+#include "ndarray.h"
+
+namespace lsst {
+namespace meas {
+namespace simastrom {
+
+//! Description of a column of residual tuples.
+struct ResidualColumn
+{
+  std::string name;
+  bool isInteger; //!< written as int64 (otherwise float64) in binary files
+  std::string comment;
+
+  ResidualColumn() : isInteger(false) {}
+
+  ResidualColumn(const std::string &Name, const bool IsInteger,
+		 const std::string &Comment) :
+    name(Name), isInteger(IsInteger), comment(Comment) {}
+};
+
+typedef std::vector<ResidualColumn> ResidualColumnList;
+
+//! Whether FileName ends with ".npy", i.e. residuals should be written in binary.
+bool IsNpyFileName(const std::string &FileName);
+
+
+/* The residual routines of the fits (e.g. AstromFit::MakeMeasResTuple)
+  fill rows through an AddRow(const double *Values) routine, with one
+  value per column. The classes below are the possible receivers of these rows.
+  Integer-valued columns are passed as doubles as well (exactly). */
+
+
+//! Writes rows as formatted text lines, preceded by a "#name: comment" header.
+class AsciiRowWriter
+{
+  std::ofstream stream;
+  unsigned nCols;
+  std::vector<char> isInteger; // per column, written without decimals
+
+ public :
+  AsciiRowWriter(const std::string &FileName, const ResidualColumnList &Columns);
+
+  void AddRow(const double *Values);
+};
+
+
+//! Writes rows into a NumPy .npy file holding a structured array, a chunk of rows at a time.
+/*! The file can be read back (or memory-mapped) using
+  numpy.load(FileName, mmap_mode='r'), and the columns accessed by
+  name. The number of rows is only known at the end: it is written
+  into the header when closing the file (in the destructor, or
+  explicitly via Close()). */
+class NpyRowWriter
+{
+  std::string fileName;
+  std::ofstream stream;
+  ResidualColumnList columns;
+  unsigned headerSize; // including magic string and length
+  size_t rowSize; // in bytes
+  size_t chunkRows;
+  size_t nRows;
+  std::vector<char> buffer;
+  size_t bufferedRows;
+
+  std::string Header(const size_t NRows) const;
+  void Flush();
+
+ public :
+  NpyRowWriter(const std::string &FileName, const ResidualColumnList &Columns,
+	       const size_t ChunkRows = 65536);
+
+  void AddRow(const double *Values);
+
+  //! number of rows written so far
+  size_t NRows() const { return nRows;}
+
+  //! Flushes the pending rows and writes the final header. Called by the destructor if needed.
+  void Close();
+
+  ~NpyRowWriter();
+
+ private :
+  NpyRowWriter(const NpyRowWriter &);
+  NpyRowWriter & operator = (const NpyRowWriter &);
+};
+
+
+//! Residuals held in memory, one array per column. Handed to python as numpy arrays, without copy.
+class ResidualTable
+{
+  ResidualColumnList columns;
+  std::vector<boost::shared_ptr<std::vector<double> > > data;
+
+  unsigned ColumnRank(const std::string &Name) const;
+
+ public :
+  ResidualTable(const ResidualColumnList &Columns);
+
+  void AddRow(const double *Values);
+
+  //! number of rows
+  size_t size() const { return data.empty() ? 0 : data[0]->size();}
+
+  //! The names of the columns, in order.
+  std::vector<std::string> ColumnNames() const;
+
+  //! Changes the value of column Name in row Row. Arrays returned by Column see the change.
+  void SetValue(const std::string &Name, const size_t Row, const double Value);
+
+  //! The column called Name.
+  /*! The returned array refers to the table storage (in python, this
+    is a numpy array without copy), and keeps it alive even if the
+    table goes away. AddRow may move the storage: get the columns
+    once the table is filled. */
+  ndarray::Array<double const,1,1> Column(const std::string &Name) const;
+
+  //! Writes the whole table into a .npy file (see NpyRowWriter).
+  void WriteNpy(const std::string &FileName) const;
+};
+
+
+}}}
+
+#endif /* RESIDUALTABLE__H */
@@ -6,6 +6,8 @@
 #include "lsst/meas/simastrom/Mapping.h"
 #include "lsst/meas/simastrom/Gtransfo.h"
 #include "lsst/meas/simastrom/CcdImage.h"
+#include "lsst/meas/simastrom/FatPoint.h"
+#include "lsst/meas/simastrom/Checkpoint.h"
 
 //! Class for a simple mapping implementing a generic Gtransfo
 /*! It uses a template rather than a pointer so that the derived
@@ -27,10 +29,59 @@ class SimpleGtransfoMapping : public Mapping
   std::shared_ptr<Gtransfo> transfo; 
 
   std::shared_ptr<Gtransfo> errorProp;
-  /* to avoid allocation at every call of PosDerivatives. 
-     use a pointer for constness */
-  std::unique_ptr<GtransfoLin> lin; 
 
+  /* to avoid allocation at every call of PosDerivatives. One per
+     thread, because a mapping can be shared by CcdImage's that are
+     processed concurrently (e.g. the shoot mappings of
+     ConstrainedPolyModel) */
+  static GtransfoLin& Lin()
+  {
+    static thread_local GtransfoLin lin;
+    return lin;
+  }
+
+
+  /* transfo for the position, errorProp for the errors. When both
+     are the same (errors not frozen), the work is only done once. */
+  void TransformWithErrorProp(const FatPoint &Where, FatPoint &OutPos) const
+  {
+    transfo->TransformPosAndErrors(Where,OutPos);
+    if (errorProp == transfo) return;
+    FatPoint tmp;
+    errorProp->TransformPosAndErrors(Where,tmp);
+    OutPos.vx = tmp.vx;
+    OutPos.vy = tmp.vy;
+    OutPos.vxy = tmp.vxy;
+  }
+
+  /* batch transform of points already in the input frame of transfo
+     (i.e. after centering and scaling for SimplePolyMapping). If H is
+     not null, it receives the parameter derivatives. This is one call
+     to the batch routines of the Gtransfo's, which are vectorized for
+     GtransfoPoly, and loop over the points for other transfos. */
+  void BatchFromMid(const FatPointArrays &Mid, FatPointArrays &OutPos,
+		    Eigen::MatrixXd *H) const
+  {
+    transfo->TransformPosAndErrorsBatch(Mid, OutPos);
+    if (errorProp != transfo)
+      {
+	FatPointArrays &tmp = ErrorScratch();
+	errorProp->TransformPosAndErrorsBatch(Mid, tmp);
+	OutPos.vx.swap(tmp.vx);
+	OutPos.vy.swap(tmp.vy);
+	OutPos.vxy.swap(tmp.vxy);
+      }
+    if (!H) return;
+    H->resize(Npar(), 2*Mid.size());
+    if (Npar()) transfo->ParamDerivativesBatch(Mid, H->data());
+  }
+
+  // scratch space for BatchFromMid (see Lin() for thread_local)
+  static FatPointArrays& ErrorScratch()
+  {
+    static thread_local FatPointArrays tmp;
+    return tmp;
+  }
 
 #ifdef STORAGE
   //! this is modern compilation-time check:
@@ -41,12 +92,11 @@ class SimpleGtransfoMapping : public Mapping
 
  public :
 
- SimpleGtransfoMapping(const Gtransfo &T, bool ToFit=true) : toFit(ToFit), transfo(T.Clone()), errorProp(transfo), lin(new GtransfoLin)
+ SimpleGtransfoMapping(const Gtransfo &T, bool ToFit=true) : toFit(ToFit), transfo(T.Clone()), errorProp(transfo)
   {
     // in this order:
     // take a copy of the input transfo,
     // assign the transformation used to propagate errors to the transfo itself
-    // reserve some memory space to compute the derivatives (efficiency).
   }
 
   virtual void FreezeErrorScales()
@@ -75,29 +125,40 @@ class SimpleGtransfoMapping : public Mapping
   void TransformPosAndErrors(const FatPoint &Where,
 			     FatPoint &OutPos) const
   {
-    transfo->TransformPosAndErrors(Where,OutPos);
-    FatPoint tmp;
-    errorProp->TransformPosAndErrors(Where,tmp);
-    OutPos.vx = tmp.vx;
-    OutPos.vy = tmp.vy;
-    OutPos.vxy = tmp.vxy;
+    TransformWithErrorProp(Where, OutPos);
+  }
+
+  //!
+  void TransformPosAndErrorsBatch(const FatPointArrays &Where,
+				  FatPointArrays &OutPos) const
+  {
+    BatchFromMid(Where, OutPos, nullptr);
+  }
+
+  //!
+  void ComputeTransformAndDerivativesBatch(const FatPointArrays &Where,
+					   FatPointArrays &OutPos,
+					   Eigen::MatrixXd &H) const
+  {
+    BatchFromMid(Where, OutPos, &H);
   }
 
   //!
   void  PosDerivative(const Point &Where, Eigen::Matrix2d &Der, 
 		      const double & Eps) const
   {
-    errorProp->Derivative(Where, *lin, Eps);
-    Der(0,0) = lin->Coeff(1,0,0);
+    GtransfoLin &lin = Lin();
+    errorProp->Derivative(Where, lin, Eps);
+    Der(0,0) = lin.Coeff(1,0,0);
     // 
     /* This does not work : it was proved by rotating the frame
        see the compilation switch ROTATE_T2 in constrainedpolymodel.cc
     Der(1,0) = lin->Coeff(1,0,1);
     Der(0,1) = lin->Coeff(0,1,0);
     */
-    Der(1,0) = lin->Coeff(0,1,0);
-    Der(0,1) = lin->Coeff(1,0,1);
-    Der(1,1) = lin->Coeff(0,1,1);
+    Der(1,0) = lin.Coeff(0,1,0);
+    Der(0,1) = lin.Coeff(1,0,1);
+    Der(1,1) = lin.Coeff(0,1,1);
   }
 
   //!
@@ -123,6 +184,27 @@ class SimpleGtransfoMapping : public Mapping
   //! Access to the (fitted) transfo
   virtual const Gtransfo&  Transfo() const {return *transfo;}
 
+  //! the parameters of the transfo, and of the one that propagates errors if it was frozen
+  void Write(CheckpointWriter &W) const
+  {
+    W.PutParams(*transfo);
+    bool frozen = (errorProp != transfo);
+    W.Put(frozen);
+    if (frozen) W.PutParams(*errorProp);
+  }
+
+  //! reads what Write wrote. Throws if the transfo does not have the saved number of parameters.
+  void Read(CheckpointReader &R)
+  {
+    R.GetParams(*transfo);
+    errorProp = transfo;
+    if (R.Get<bool>())
+      {
+	FreezeErrorScales();
+	R.GetParams(*errorProp);
+      }
+  }
+
 };
 
 //! Mapping implementation for a polynomial transformation. 
@@ -139,6 +221,36 @@ class SimplePolyMapping : public SimpleGtransfoMapping
   */
   GtransfoPoly* actualResult; 
 
+  // scratch space for the batch routines (see Lin() for thread_local)
+  static FatPointArrays& Mid()
+  {
+    static thread_local FatPointArrays mid;
+    return mid;
+  }
+
+  // _centerAndScale applied to all points (with errors) in one go
+  void CenterAndScale(const FatPointArrays &Where, FatPointArrays &Out) const
+  {
+    const double a11 = _centerAndScale.A11();
+    const double a12 = _centerAndScale.A12();
+    const double a21 = _centerAndScale.A21();
+    const double a22 = _centerAndScale.A22();
+    const double dx = _centerAndScale.Dx();
+    const double dy = _centerAndScale.Dy();
+    size_t n = Where.size();
+    Out.resize(n);
+    for (size_t k=0; k < n; ++k)
+      {
+	double x = Where.x[k]; double y = Where.y[k];
+	double vx = Where.vx[k]; double vy = Where.vy[k]; double vxy = Where.vxy[k];
+	Out.x[k] = dx + a11*x + a12*y;
+	Out.y[k] = dy + a21*x + a22*y;
+	Out.vx[k] = a11*a11*vx + 2*a11*a12*vxy + a12*a12*vy;
+	Out.vy[k] = a21*a21*vx + 2*a21*a22*vxy + a22*a22*vy;
+	Out.vxy[k] = a11*a21*vx + (a11*a22+a12*a21)*vxy + a12*a22*vy;
+      }
+  }
+
  public:
 
   ~SimplePolyMapping() { delete actualResult;}
@@ -176,17 +288,18 @@ class SimplePolyMapping : public SimpleGtransfoMapping
 		      const double & Eps) const
   {
     Point tmp = _centerAndScale.apply(Where);
-    errorProp->Derivative(tmp, *lin, Eps);
-    Der(0,0) = lin->Coeff(1,0,0);
+    GtransfoLin &lin = Lin();
+    errorProp->Derivative(tmp, lin, Eps);
+    Der(0,0) = lin.Coeff(1,0,0);
     // 
     /* This does not work : it was proved by rotating the frame
        see the compilation switch ROTATE_T2 in constrainedpolymodel.cc
     Der(1,0) = lin->Coeff(1,0,1);
     Der(0,1) = lin->Coeff(0,1,0);
     */
-    Der(1,0) = lin->Coeff(0,1,0);
-    Der(0,1) = lin->Coeff(1,0,1);
-    Der(1,1) = lin->Coeff(0,1,1);
+    Der(1,0) = lin.Coeff(0,1,0);
+    Der(0,1) = lin.Coeff(1,0,1);
+    Der(1,1) = lin.Coeff(0,1,1);
     Der = preDer*Der;
   }
 
@@ -202,12 +315,7 @@ class SimplePolyMapping : public SimpleGtransfoMapping
     {
       FatPoint mid;
       _centerAndScale.TransformPosAndErrors(Where,mid);
-      transfo->TransformPosAndErrors(mid,OutPos);
-      FatPoint tmp;
-      errorProp->TransformPosAndErrors(mid,tmp);
-      OutPos.vx = tmp.vx;
-      OutPos.vy = tmp.vy;
-      OutPos.vxy = tmp.vxy;
+      TransformWithErrorProp(mid,OutPos);
       transfo->ParamDerivatives(mid, &H(0,0), &H(0,1));      
     }
 
@@ -217,12 +325,26 @@ class SimplePolyMapping : public SimpleGtransfoMapping
   {
     FatPoint mid;
     _centerAndScale.TransformPosAndErrors(Where,mid);
-    transfo->TransformPosAndErrors(mid,OutPos);
-    FatPoint tmp;
-    errorProp->TransformPosAndErrors(mid,tmp);
-    OutPos.vx = tmp.vx;
-    OutPos.vy = tmp.vy;
-    OutPos.vxy = tmp.vxy;
+    TransformWithErrorProp(mid,OutPos);
+  }
+
+  //! Implements as well the centering and scaling of coordinates
+  void TransformPosAndErrorsBatch(const FatPointArrays &Where,
+				  FatPointArrays &OutPos) const
+  {
+    FatPointArrays &mid = Mid();
+    CenterAndScale(Where, mid);
+    BatchFromMid(mid, OutPos, nullptr);
+  }
+
+  //! Implements as well the centering and scaling of coordinates
+  void ComputeTransformAndDerivativesBatch(const FatPointArrays &Where,
+					   FatPointArrays &OutPos,
+					   Eigen::MatrixXd &H) const
+  {
+    FatPointArrays &mid = Mid();
+    CenterAndScale(Where, mid);
+    BatchFromMid(mid, OutPos, &H);
   }
 
   //! Access to the (fitted) transfo
@@ -70,6 +70,12 @@ public :
   //! Cook up a SIP WCS.
   PTR(TanSipPix2RaDec) ProduceSipWcs(const CcdImage &Ccd) const;
 
+  //! The mappings are saved along with the name of their CcdImage.
+  void WriteParams(const std::string &FileName) const;
+
+  //! With AllowNew, the mappings of CcdImage's the file does not mention keep their current values (e.g. from the WCS).
+  void ReadParams(const std::string &FileName, const bool AllowNew=false);
+
   ~SimplePolyModel() {};
 
 };
@@ -0,0 +1,60 @@
+// -*- C++ -*-
+#ifndef SPARSEHESSIAN__H
+#define SPARSEHESSIAN__H
+
+#include <vector>
+
+#include "Eigen/Sparse"
+#include "lsst/meas/simastrom/Tripletlist.h"
+
+namespace lsst {
+namespace meas {
+namespace simastrom {
+
+//! Assembles H = J*J^T directly into its final sparse storage, one block of Jacobian columns at a time.
+/*! The usual route (filling triplets for the whole Jacobian J, converting
+  them into a sparse matrix and computing J*J^T) holds the triplets, J
+  and H in memory at the same time. Here, the nonzero pattern of H is
+  declared first (AddCoupling), using the parameter indices the
+  derivatives will involve. Then blocks of Jacobian columns (e.g. the
+  ones of a few CcdImage's, as TripletList's with parameter indices as
+  rows) are added to H and can be discarded right away. Both triangles
+  of H are stored, as J*J^T would provide. Adding blocks is
+  multithreaded (threads own disjoint sets of columns of H), and the
+  result does not depend on the number of threads. */
+class SparseHessian
+{
+  typedef Eigen::SparseMatrix<double> Matrix;
+
+  std::vector<std::vector<int> > pattern; // rows, per column, until EndPattern
+  Matrix h;
+  bool patternDone;
+
+  // rank of the first column of H handled by each task
+  std::vector<unsigned> SplitColumns(const unsigned NTasks) const;
+
+ public :
+  //! N is the number of parameters.
+  SparseHessian(const unsigned N);
+
+  //! Declares that all pairs of parameters in Indices may be coupled.
+  void AddCoupling(const std::vector<unsigned> &Indices);
+
+  //! Declares that all pairs (a,b), a in A, b in B, (and (b,a)) may be coupled.
+  void AddCoupling(const std::vector<unsigned> &A, const std::vector<unsigned> &B);
+
+  //! Allocates H with the declared pattern, and zero values.
+  void EndPattern();
+
+  //! H += J*J^T for the Jacobian columns of each block, in block order.
+  /*! Throws a LogicError if a block involves a pair of parameters
+    which was not declared. */
+  void Accumulate(const std::vector<TripletList> &Blocks, const unsigned NThreads);
+
+  //! Hands the assembled (compressed) matrix over. This object is then empty.
+  void Extract(Matrix &H);
+};
+
+}}}
+
+#endif /* SPARSEHESSIAN__H */
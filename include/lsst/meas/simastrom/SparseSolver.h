@@ -0,0 +1,171 @@
+#ifndef SPARSESOLVER__H
+#define SPARSESOLVER__H
+
+#include <string>
+#include <vector>
+#include <memory>
+#include <iostream>
+
+#include "Eigen/Sparse"
+
+namespace lsst {
+namespace meas {
+namespace simastrom {
+
+//! Interface to the solvers of the (symmetric, positive) normal equations of the fits.
+/*! The fits (AstromFit, PhotomFit) compute the Hessian H of the
+  chi2 and call Analyze (symbolic work, that only depends on the
+  nonzero pattern of H), Factorize, and Solve. Outlier removal relies
+  on Update, which modifies the factorization of H into the one of
+  H +/- W*W^T, at a fraction of the cost of a new factorization.
+  Implementations are obtained by name through MakeSparseSolver. Only
+  the lower triangle of H is used. */
+class SparseSolver
+{
+ public :
+  typedef Eigen::SparseMatrix<double> Matrix;
+
+ private :
+  double analysisTime, factorizationTime; // wall clock seconds, for the last calls.
+
+ protected :
+  virtual void DoAnalyze(const Matrix &H) = 0;
+  virtual bool DoFactorize(const Matrix &H) = 0;
+
+ public :
+  SparseSolver() : analysisTime(0), factorizationTime(0) {}
+
+  //! The name used to create this solver
+  virtual std::string Name() const = 0;
+
+  //! Symbolic analysis (e.g. fill-reducing ordering). Valid for any matrix with a nonzero pattern included in the one of H.
+  void Analyze(const Matrix &H);
+
+  //! Numeric factorization. Returns false if it failed.
+  bool Factorize(const Matrix &H);
+
+  //! Solves H*X = B for the last factorized H. Check Converged() before using X.
+  virtual Eigen::VectorXd Solve(const Eigen::VectorXd &B) = 0;
+
+  //! Whether the last Solve succeeded. Direct solvers always do, an iterative one (pcg) may not converge.
+  virtual bool Converged() const { return true;}
+
+  //! Bounds the number of iterations of an iterative solver (0 restores its default). Ignored by direct solvers.
+  virtual void SetMaxIterations(const unsigned MaxIterations) {}
+
+  //! Number of threads (0 means all available). Ignored by the solvers that run on one thread.
+  virtual void SetNThreads(const unsigned NThreads) {}
+
+  //! Changes the factorized H into H+W*W^T (UpOrDown = true) or H-W*W^T. W has as many rows as H. Returns false if it failed.
+  virtual bool Update(const Matrix &W, const bool UpOrDown) = 0;
+
+  //! Number of terms stored in the factor (for an iterative solver, the ones of the matrix and preconditioner).
+  virtual size_t FactorNonZeros() const = 0;
+
+  double AnalysisTime() const { return analysisTime;}
+  double FactorizationTime() const { return factorizationTime;}
+
+  //! Prints timings and fill-in of the last factorization of H.
+  virtual void Report(std::ostream &S, const Matrix &H) const;
+
+  virtual ~SparseSolver() {}
+};
+
+//! Instanciates a solver: "simplicial" (cholmod simplicial LDLt, the default) or "pcg" (preconditioned conjugate gradient).
+/*! LowerOnly tells that the matrices given to the solver only hold
+  their lower triangle (e.g. the reduced matrix of SchurSolver), rather
+  than both, as the fits provide. pcg reads both triangles when they
+  are there, which is what allows Eigen to spread its matrix-vector
+  products over threads (see SetNThreads). There is no supernodal
+  cholmod solver: the embedded cholmod is built without its Supernodal
+  module (NSUPERNODAL). Throws an InvalidParameterError for unknown
+  names. */
+std::unique_ptr<SparseSolver> MakeSparseSolver(const std::string &Name, const bool LowerOnly=false);
+
+//! The names MakeSparseSolver accepts in this build.
+std::vector<std::string> SparseSolverNames();
+
+
+//! Nonzero pattern of a (compressed) sparse matrix.
+/*! Used to decide whether a symbolic analysis can be reused: it
+  remains valid for any matrix whose pattern is included in the
+  analyzed one. */
+class SparsePattern
+{
+  std::vector<int> outer, inner;
+
+ public :
+  //! Records the pattern of H, which should be compressed.
+  void Set(const SparseSolver::Matrix &H);
+
+  //! Whether the pattern of H is included in the recorded one.
+  bool Covers(const SparseSolver::Matrix &H) const;
+
+  void clear() { outer.clear(); inner.clear();}
+};
+
+
+//! Solves systems with a large block-diagonal part by eliminating it first (Schur complement).
+/*! The parameters are split into blocks, along which H is block-diagonal
+  (e.g. the positions of fitted stars, which are not coupled with each
+  other), and the remaining ones (e.g. distortions, refraction). Writing
+  H = [[A, B],[B^T, D]] with D block-diagonal, Factorize inverts the
+  small blocks of D and factorizes the reduced matrix
+  S = A - B D^{-1} B^T with another SparseSolver. Solve computes the
+  remaining parameters from S, and then back-substitutes the
+  eliminated ones, one block at a time. The reduced matrix has
+  the size of the remaining parameters only, but its pattern couples
+  all parameters which share a block, so that elimination pays when
+  the blocks are numerous and only couple a few other parameters
+  each. Unlike the other solvers, H should be stored with both
+  triangles. Update modifies H and redoes the elimination. */
+class SchurSolver : public SparseSolver
+{
+ public :
+  //! (first index, size) of the diagonal blocks to be eliminated, in increasing index order, not overlapping.
+  typedef std::vector<std::pair<unsigned, unsigned> > BlockList;
+
+ private :
+  std::unique_ptr<SparseSolver> reducedSolver;
+  unsigned nThreads;
+  BlockList blocks;
+  Matrix h; // the full matrix, kept for updates
+  Matrix s; // the reduced matrix, lower triangle
+  SparsePattern sPattern; // the pattern reducedSolver was analyzed for
+  std::vector<int> reducedIndex; // -1 for eliminated parameters
+  std::vector<Eigen::MatrixXd> dInv; // inverses of the diagonal blocks
+
+  bool Eliminate();
+
+ protected :
+  void DoAnalyze(const Matrix &H) {}
+  bool DoFactorize(const Matrix &H);
+
+ public :
+  //! ReducedSolver solves the reduced system, which only holds its lower triangle (see MakeSparseSolver). Blocks are eliminated using NThreads threads (0 means all available).
+  SchurSolver(std::unique_ptr<SparseSolver> ReducedSolver, const unsigned NThreads=1);
+
+  //! Sets the blocks to eliminate, before Factorize.
+  void SetBlocks(const BlockList &Blocks) { blocks = Blocks;}
+
+  //! also sets the threads of the reduced solver.
+  void SetNThreads(const unsigned NThreads) { nThreads = NThreads; reducedSolver->SetNThreads(NThreads);}
+
+  std::string Name() const { return "schur+" + reducedSolver->Name();}
+
+  Eigen::VectorXd Solve(const Eigen::VectorXd &B);
+
+  bool Converged() const { return reducedSolver->Converged();}
+
+  void SetMaxIterations(const unsigned MaxIterations) { reducedSolver->SetMaxIterations(MaxIterations);}
+
+  bool Update(const Matrix &W, const bool UpOrDown);
+
+  size_t FactorNonZeros() const;
+
+  void Report(std::ostream &S, const Matrix &H) const;
+};
+
+}}}
+
+#endif /* SPARSESOLVER__H */
@@ -0,0 +1,50 @@
+// -*- C++ -*-
+#ifndef STARFINDER__H
+#define STARFINDER__H
+
+#include <memory>
+#include <vector>
+
+#include "lsst/meas/simastrom/BaseStar.h"
+
+namespace lsst {
+namespace meas {
+namespace simastrom {
+
+//! The ways of locating the closest stars in a BaseStarList (see MakeStarFinder).
+enum FinderStrategy { FinderAuto, FinderSlices, FinderKdTree };
+
+//! Interface of the locators of closest stars in a BaseStarList (FastFinder, KdTreeFinder).
+/*! Distances to the objects returned by the Find routines are
+  strictly smaller than MaxDist. Objects for which SkipIt returns true
+  are ignored. */
+class StarFinder
+{
+ public :
+  //! Find the closest with some rejection capability 
+  virtual const BaseStar *FindClosest(const Point &Where, const double MaxDist, 
+				      bool (*SkipIt)(const BaseStar *) = NULL) const = 0;
+
+  //! returns the second closest, and the closest in Closest
+  virtual const BaseStar *SecondClosest(const Point &Where, 
+					const double MaxDist, 
+					const BaseStar* &Closest,
+					bool (*SkipIt)(const BaseStar *)= NULL) const = 0;
+
+  //! FindClosest for all points of Where. Closest[k] is NULL if nothing is found for Where[k].
+  virtual void FindClosest(const std::vector<Point> &Where, const double MaxDist,
+			   std::vector<const BaseStar *> &Closest) const;
+
+  virtual ~StarFinder() {}
+};
+
+//! Number of objects above which FinderAuto uses a KdTreeFinder rather than a FastFinder.
+const unsigned KdTreeMinCount = 20000;
+
+//! Builds the locator for List. FinderAuto chooses according to the size of List.
+std::unique_ptr<StarFinder> MakeStarFinder(const BaseStarList &List, 
+					   const FinderStrategy Strategy = FinderAuto);
+
+}}}
+
+#endif /* STARFINDER__H */
@@ -4,6 +4,7 @@
 #include "Eigen/Sparse"
 
 #include <vector>
+#include <utility>
 
 namespace lsst {
 namespace meas {
@@ -35,8 +36,43 @@ class TripletList : public std::vector<Trip>
     nextFreeIndex = Index;
   }
 
+  //! Appends a block filled independently (starting at index 0): its Jacobian columns are shifted to follow the ones already here.
+  void AppendBlock(const TripletList &Block)
+  {
+    for (auto i = Block.begin(); i != Block.end(); ++i)
+      push_back(Trip(i->row(), i->col()+nextFreeIndex, i->value()));
+    nextFreeIndex += Block.NextFreeIndex();
+  }
+
+};
+
+//! Record of gradient contributions (index, value), to be added later to the actual gradient.
+/*! This is what allows to compute derivatives of different CcdImage's
+  concurrently: the contributions are added to the gradient in the
+  order they were recorded, so that the result does not depend on the
+  number of threads. */
+class GradientSlice : public std::vector<std::pair<unsigned, double> >
+{
+ public :
+  void AddEntry(const unsigned i, const double val)
+  {
+    push_back(std::make_pair(i,val));
+  }
+
+  //! Rhs(i) += val, in the recording order.
+  void AddTo(Eigen::VectorXd &Rhs) const
+  {
+    for (auto i = begin(); i != end(); ++i) Rhs(i->first) += i->second;
+  }
 };
 
+//! the two following routines allow to write the derivatives code once, whatever receives the gradient.
+inline void AddToGradient(Eigen::VectorXd &Rhs, const unsigned i, const double val)
+{ Rhs(i) += val;}
+
+inline void AddToGradient(GradientSlice &Rhs, const unsigned i, const double val)
+{ Rhs.AddEntry(i,val);}
+
 }}}
 
 
@@ -5,6 +5,7 @@
 
 #include "lsst/meas/simastrom/Mapping.h"
 #include "lsst/meas/simastrom/Eigenstuff.h"
+#include "lsst/meas/simastrom/FatPoint.h"
 #include "lsst/meas/simastrom/SimplePolyMapping.h"
 
 
@@ -21,6 +22,8 @@ class TwoTransfoMapping: public Mapping
   {
     Eigen::MatrixX2d h1,h2;
     Eigen::Matrix2d dt2dx;
+    FatPointArrays mid;
+    Eigen::MatrixXd hb1,hb2; // for the batch routines
   };
 
   std::unique_ptr<tmpVars> tmp;
@@ -49,6 +52,15 @@ class TwoTransfoMapping: public Mapping
   void TransformPosAndErrors(const FatPoint &Where,
 			    FatPoint &OutPos) const;
 
+  //!
+  void TransformPosAndErrorsBatch(const FatPointArrays &Where,
+				  FatPointArrays &OutPos) const;
+
+  //!
+  void ComputeTransformAndDerivativesBatch(const FatPointArrays &Where,
+					   FatPointArrays &OutPos,
+					   Eigen::MatrixXd &H) const;
+
   //! 
   void OffsetParams(const double *Delta)
   {// this routine is not used when fitting. used for debugging
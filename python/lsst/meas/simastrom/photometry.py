@@ -0,0 +1,35 @@
+from __future__ import division, absolute_import
+#
+# LSST Data Management System
+# Copyright 2008, 2009, 2010, 2011, 2012 LSST Corporation.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsstcorp.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.    See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+"""Photometric conversions, without dependencies on the rest of the stack"""
+
+import numpy as np
+
+__all__ = ["fluxToAbMag"]
+
+
+def fluxToAbMag(flux, undefined=99.9):
+    """AB magnitudes of reference fluxes (in Jy, as afwImage.abMagFromFlux), undefined where the
+    flux is not positive"""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mag = -2.5*np.log10(np.asarray(flux, dtype=float)/3631.)
+    return np.where(np.isfinite(mag), mag, undefined)
@@ -0,0 +1,245 @@
+from __future__ import division, absolute_import
+#
+# LSST Data Management System
+# Copyright 2008, 2009, 2010, 2011, 2012 LSST Corporation.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsstcorp.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.    See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+"""Loading of reference catalogs over the sky cells that cover a set of CCDs,
+with an on-disk cache of the loaded cells."""
+
+import os
+import math
+import hashlib
+import tempfile
+import numpy as np
+
+import lsst.afw.table as afwTable
+import lsst.afw.geom as afwGeom
+import lsst.afw.coord as afwCoord
+
+__all__ = ["RefCatCache", "SkyCell", "skyCellsCovering", "loadSkyCells", "catalogVersion"]
+
+
+class RefCatCache(object):
+    """On-disk cache of reference catalogs (FITS files in a directory), keyed by strings
+
+    The least recently used files are removed when the files exceed maxSize (MB).
+    The modification time of a file records its last use, so that the cache can
+    be shared by processes. Files being written carry the tmpSuffix, so that
+    eviction (possibly by another process) leaves them alone.
+    """
+
+    tmpSuffix = ".fits.tmp"
+
+    def __init__(self, directory, maxSize):
+        self.directory = directory
+        self.maxSize = maxSize*1024*1024
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".fits")
+
+    def get(self, key, load):
+        """Returns the catalog stored under key, or the one returned by load(), which is then stored"""
+        path = self._path(key)
+        if os.path.exists(path):
+            try:
+                cat = afwTable.SimpleCatalog.readFits(path)
+                os.utime(path, None)
+                return cat
+            except Exception:
+                # e.g. removed by another process in between: load it again
+                pass
+        cat = load()
+        # write under a temporary name and rename, so that readers never see a partial file
+        fd, tmpPath = tempfile.mkstemp(suffix=self.tmpSuffix, dir=self.directory)
+        os.close(fd)
+        try:
+            cat.writeFits(tmpPath)
+            os.rename(tmpPath, path)
+        except Exception:
+            if os.path.exists(tmpPath):
+                os.remove(tmpPath)
+            raise
+        self.evict()
+        return cat
+
+    def evict(self):
+        """Removes the least recently used files until the cache fits in its size limit
+
+        Files being written are not candidates, and files removed in the meantime (e.g. by
+        another process) are skipped.
+        """
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".fits"):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+        total = sum(e[1] for e in entries)
+        for mtime, size, path in sorted(entries):
+            if total <= self.maxSize:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+
+class SkyCell(object):
+    """A cell of the sky: declination band iDec (of height cellSize) cut into nRa equal RA ranges
+
+    Cells do not overlap, and have roughly the same area whatever their declination.
+    """
+
+    def __init__(self, iDec, iRa, cellSize):
+        self.iDec = iDec
+        self.iRa = iRa
+        self.cellSize = cellSize
+        self.decMin = max(-90., -90. + iDec*cellSize)
+        self.decMax = min(90., -90. + (iDec+1)*cellSize)
+        self.nRa = nRaCells(iDec, cellSize)
+        self.raMin = 360.*iRa/self.nRa
+        self.raMax = 360.*(iRa+1)/self.nRa
+
+    def key(self):
+        return "cell%g_%d_%d" % (self.cellSize, self.iDec, self.iRa)
+
+    def polar(self):
+        """Whether the cell is a cap around a pole"""
+        return self.nRa == 1 and (self.decMin <= -90. or self.decMax >= 90.)
+
+    def center(self):
+        if self.polar():
+            return 0., (90. if self.decMax >= 90. else -90.)
+        return 0.5*(self.raMin+self.raMax), 0.5*(self.decMin+self.decMax)
+
+    def radius(self):
+        """Radius (degrees) of a circle around center() that contains the cell"""
+        ra, dec = self.center()
+        if self.polar():
+            return 90. - min(abs(self.decMin), abs(self.decMax))
+        if self.nRa == 1:
+            return 180.
+        return max(angularDistance(ra, dec, r, d)
+                   for r in (self.raMin, self.raMax) for d in (self.decMin, self.decMax, dec))
+
+    def contains(self, ra, dec):
+        """Mask of the (ra, dec) arrays (degrees, 0 <= ra < 360) that fall in the cell"""
+        decMax = self.decMax if self.decMax < 90. else 90.1
+        return (ra >= self.raMin) & (ra < self.raMax) & (dec >= self.decMin) & (dec < decMax)
+
+
+def nRaCells(iDec, cellSize):
+    """Number of RA cells in declination band iDec"""
+    decMin = -90. + iDec*cellSize
+    decMax = min(90., decMin + cellSize)
+    # the edge of the band closest to the equator
+    dec = 0. if decMin*decMax < 0 else min(abs(decMin), abs(decMax))
+    return max(1, int(math.floor(360.*math.cos(math.radians(dec))/cellSize)))
+
+
+def angularDistance(ra1, dec1, ra2, dec2):
+    """In degrees"""
+    d1, d2 = math.radians(dec1), math.radians(dec2)
+    c = math.sin(d1)*math.sin(d2) + math.cos(d1)*math.cos(d2)*math.cos(math.radians(ra1-ra2))
+    return math.degrees(math.acos(max(-1., min(1., c))))
+
+
+def skyCellsCovering(boxes, cellSize, margin=0.):
+    """The SkyCells that overlap the (RA,Dec) boxes (degrees), each one enlarged by margin (degrees)
+
+    A box that reaches Dec=+-90 (within the margin) contains the pole: all the RA cells of the
+    declination bands it overlaps are taken. Otherwise, a box wider than 180 degrees in RA is
+    taken as crossing RA=0.
+    """
+    cells = set()
+    nDec = int(math.ceil(180./cellSize))
+    for box in boxes:
+        raMin, raMax = box.getMinX(), box.getMaxX()
+        decMin, decMax = box.getMinY() - margin, box.getMaxY() + margin
+        # the RA range of a box around a pole is [0,360]: it does not cross RA=0
+        polar = decMin <= -90. or decMax >= 90.
+        if raMax - raMin > 180. and not polar:
+            raMin, raMax = raMax - 360., raMin
+        iDecMin = max(0, int(math.floor((decMin+90.)/cellSize)))
+        iDecMax = min(nDec-1, int(math.floor((decMax+90.)/cellSize)))
+        for iDec in range(iDecMin, iDecMax+1):
+            nRa = nRaCells(iDec, cellSize)
+            cosDec = max(math.cos(math.radians(max(abs(decMin), abs(decMax)))), 1e-6)
+            raMargin = margin/cosDec
+            if polar or raMax - raMin + 2*raMargin >= 360.:
+                iRas = range(nRa)
+            else:
+                first = int(math.floor((raMin - raMargin)*nRa/360.))
+                last = int(math.floor((raMax + raMargin)*nRa/360.))
+                iRas = set(i % nRa for i in range(first, last+1))
+            for iRa in iRas:
+                cells.add((iDec, iRa))
+    return [SkyCell(iDec, iRa, cellSize) for iDec, iRa in sorted(cells)]
+
+
+def loadSkyCells(loader, filterName, cells, cache=None, version=""):
+    """Loads the reference objects in cells, using loader.loadSkyCircle, and concatenates them
+
+    Each cell is loaded through a circle that contains it, and trimmed to the cell, so
+    that objects are not duplicated. If cache (a RefCatCache) is provided, the cells are
+    stored under keys made of version, filterName and the cell.
+    """
+    def loadCell(cell):
+        ra, dec = cell.center()
+        center = afwCoord.IcrsCoord(afwGeom.Angle(ra, afwGeom.degrees), afwGeom.Angle(dec, afwGeom.degrees))
+        refCat = loader.loadSkyCircle(center, afwGeom.Angle(cell.radius(), afwGeom.degrees),
+                                      filterName).refCat
+        if len(refCat) == 0:
+            return refCat
+        if not refCat.isContiguous():
+            refCat = refCat.copy(deep=True)
+        raCat = np.degrees(refCat.get("coord_ra")) % 360.
+        decCat = np.degrees(refCat.get("coord_dec"))
+        return refCat.subset(cell.contains(raCat, decCat))
+
+    cats = []
+    for cell in cells:
+        if cache is None:
+            cats.append(loadCell(cell))
+        else:
+            key = "%s_%s_%s" % (version, filterName, cell.key())
+            cats.append(cache.get(key, lambda: loadCell(cell)))
+    if not cats:
+        return None
+    refCat = afwTable.SimpleCatalog(cats[0].getSchema())
+    refCat.reserve(sum(len(c) for c in cats))
+    for c in cats:
+        refCat.extend(c, deep=True)
+    return refCat
+
+
+def catalogVersion(anDir, andConfigPath):
+    """A short string that changes when the astrometry_net_data setup changes"""
+    h = hashlib.sha1(os.path.realpath(anDir))
+    with open(andConfigPath) as f:
+        h.update(f.read())
+    return h.hexdigest()[:12]
@@ -22,7 +22,14 @@ from __future__ import division, absolute_import
 #
 
 import os
+import sys
+import time
+import resource
+import traceback
+import collections
+import multiprocessing
 import numpy as np
+from multiprocessing.pool import ThreadPool
 
 import lsst.utils
 import lsst.pex.config as pexConfig
@@ -42,11 +49,18 @@ from lsst.meas.astrom.loadAstrometryNetObjects import LoadAstrometryNetObjectsTa
 from lsst.meas.astrom import AstrometryNetDataConfig
 
 from .dataIds import PerTractCcdDataIdContainer
+from .refCatCache import RefCatCache, skyCellsCovering, loadSkyCells, catalogVersion
 
 from lsst.meas.simastrom.simastromLib import SimAstromControl, simAstrom, Associations, ProjectionHandler , AstromFit, SimplePolyModel, OneTPPerShoot, CcdImage, GtransfoToTanWcs
 
 __all__ = ["SimAstromConfig", "SimAstromTask"]
 
+# reference object loaders, per astrometry_net_data directory (see SimAstromTask.getRefObjLoader)
+_refObjLoaders = {}
+
+# association distance of the catalogs (arcsec)
+_matchCut = 3.0
+
 class SimAstromRunner(pipeBase.TaskRunner):
     """Subclass of TaskRunner for SimAstromTask (copied from the HSC MosaicRunner)
 
@@ -56,8 +70,11 @@ class SimAstromRunner(pipeBase.TaskRunner):
     arguments generated by the ArgumentParser into the arguments expected by
     MosaicTask.run().
 
-    See pipeBase.TaskRunner for more information, but note that the multiprocessing
-    code path does not apply, because MosaicTask.canMultiprocess == False.
+    Tracts are independent: with -j N, N tracts are processed at once, each one in a
+    process of the TaskRunner pool. Each process then limits its virtual address space
+    to config.tractMemoryLimit (if set), and, if config.nThreads is 0, the C++ fit of each tract
+    uses its share of the cores. A tract that fails is reported (with --doraise, the
+    exception is raised) and the other ones go on.
     """
 
     @staticmethod
@@ -71,9 +88,54 @@ class SimAstromRunner(pipeBase.TaskRunner):
                  tract
                  ) for tract in sorted(refListDict.keys())]
 
+    def nThreadsPerTract(self):
+        """Number of threads of the C++ code for each tract (config.nThreads, unless it is 0)"""
+        if self.config.nThreads != 0 or self.numProcesses <= 1 :
+            return self.config.nThreads
+        return max(1, multiprocessing.cpu_count() // self.numProcesses)
+
+    def limitMemory(self):
+        """Limit the address space of this process to config.tractMemoryLimit (when running with -j)
+
+        RLIMIT_AS bounds virtual memory, not the resident set: each thread reserves its stack,
+        and glibc reserves up to 64 MB per malloc arena, so a multithreaded fit reaches the
+        limit well before using that much physical memory.
+        """
+        if self.numProcesses <= 1 or self.config.tractMemoryLimit <= 0 :
+            return
+        limit = int(self.config.tractMemoryLimit*1024*1024)
+        soft, hard = resource.getrlimit(resource.RLIMIT_AS)
+        if hard != resource.RLIM_INFINITY :
+            limit = min(limit, hard)
+        resource.setrlimit(resource.RLIMIT_AS, (limit, hard))
+
     def __call__(self, args):
+        refList, tract = args
+        self.limitMemory()
         task = self.TaskClass(config=self.config, log=self.log)
-        result = task.run(*args)
+        task.nThreads = self.nThreadsPerTract()
+        self.log.info("tract %s: starting with %d CCDs, %d threads (process %d)" %
+                      (tract, len(refList), task.nThreads, os.getpid()))
+        start = time.time()
+        try :
+            task.run(*args)
+        except Exception as e :
+            if self.doRaise :
+                raise
+            self.log.fatal("tract %s: failed after %.1f s: %s" % (tract, time.time()-start, e))
+            traceback.print_exc(file=sys.stderr)
+            return pipeBase.Struct(tract=tract, failed=True, error=str(e))
+        self.log.info("tract %s: done in %.1f s" % (tract, time.time()-start))
+        return pipeBase.Struct(tract=tract, failed=False, error=None)
+
+    def run(self, parsedCmd):
+        """Process all tracts (see TaskRunner.run), and report the ones that failed"""
+        resultList = pipeBase.TaskRunner.run(self, parsedCmd)
+        failed = [r.tract for r in resultList or [] if r is not None and r.failed]
+        if failed :
+            self.log.warn("%d tracts out of %d failed: %s" %
+                          (len(failed), len(resultList), " ".join(str(t) for t in failed)))
+        return resultList
 
 
 class SimAstromConfig(pexConfig.Config):
@@ -121,14 +183,127 @@ class SimAstromConfig(pexConfig.Config):
         dtype = str,
         default = "base_SdssShape", 
     )
+    nThreads = pexConfig.Field(
+        doc = "Number of threads used by the C++ fit when looping over CCDs (1: serial, 0: all available, "
+              "shared among the tracts processed at once with -j)",
+        dtype = int,
+        default = 1,
+    )
+    tractMemoryLimit = pexConfig.Field(
+        doc = "Limit (in MB) of the virtual address space (RLIMIT_AS) of each process running a tract "
+              "with -j (0, the default: no limit). It counts all mapped memory, including thread stacks "
+              "and malloc arenas, which may be much more than the resident memory, so leave a wide "
+              "margin. A tract that exceeds it fails, without stopping the other ones",
+        dtype = float,
+        default = 0.,
+    )
+    parallelAssociation = pexConfig.Field(
+        doc = "Associate the catalogs of all CCDs at once (using nThreads threads) rather than one CCD after the other",
+        dtype = bool,
+        default = False,
+    )
+    solver = pexConfig.ChoiceField(
+        doc = "Linear solver of the fit normal equations. There is no supernodal cholmod option: "
+              "the embedded cholmod (micro_cholmod) is built with NSUPERNODAL",
+        dtype = str,
+        default = "simplicial",
+        allowed = {"simplicial": "cholmod simplicial LDLt factorization (single threaded)",
+                   "pcg": "conjugate gradient preconditioned by the diagonal, using nThreads threads"},
+    )
+    directAssembly = pexConfig.Field(
+        doc = "Assemble the normal equations of the fit without storing the whole Jacobian (lower memory peak)",
+        dtype = bool,
+        default = False,
+    )
+    eliminatePositions = pexConfig.Field(
+        doc = "When fitting positions, eliminate them (Schur complement) and only factorize the system of the other parameters",
+        dtype = bool,
+        default = False,
+    )
+    nLoadThreads = pexConfig.Field(
+        doc = "Number of threads reading and selecting the input catalogs in advance (1: serial loading, no prefetch)",
+        dtype = int,
+        default = 1,
+    )
+    loadMemoryBudget = pexConfig.Field(
+        doc = "Approximate memory (in MB) that the catalogs read in advance may use. "
+              "Only the selected sources are kept (deep copied, the full catalogs are released), "
+              "and their size is estimated from the record size plus the spans and peaks of their footprints",
+        dtype = float,
+        default = 2000.,
+    )
+    refCatRegion = pexConfig.ChoiceField(
+        doc = "Region over which the reference catalog is loaded",
+        dtype = str,
+        default = "circle",
+        allowed = {"circle": "a circle enclosing the (RA,Dec) box of all CCDs",
+                   "ccds": "the sky cells (of refCatCellSize) overlapping the (RA,Dec) box of a CCD"},
+    )
+    refCatCellSize = pexConfig.Field(
+        doc = "Size (degrees) of the sky cells over which the reference catalog is loaded and cached",
+        dtype = float,
+        default = 0.5,
+    )
+    refCatMargin = pexConfig.Field(
+        doc = "Margin (arcsec) added around the box of each CCD when selecting sky cells",
+        dtype = float,
+        default = 10.,
+    )
+    refCatCacheDir = pexConfig.Field(
+        doc = "Directory of the on-disk cache of loaded reference catalogs (no cache if None)",
+        dtype = str,
+        default = None,
+        optional = True,
+    )
+    refCatCacheSize = pexConfig.Field(
+        doc = "Size limit (in MB) of the reference catalog cache (least recently used entries are removed)",
+        dtype = float,
+        default = 2000.,
+    )
+    resTupleFormat = pexConfig.ChoiceField(
+        doc = "Format of the residual tuples",
+        dtype = str,
+        default = "list",
+        allowed = {"list": "text, one line per measurement (as read by notebooks/Check_residuals.ipynb)",
+                   "npy": "binary NumPy structured arrays (numpy.load, mmap_mode='r')"},
+    )
+    checkpointDir = pexConfig.Field(
+        doc = "Directory where the state of each tract is saved after the association and after each "
+              "minimization stage (no checkpoints if None)",
+        dtype = str,
+        default = None,
+        optional = True,
+    )
+    resume = pexConfig.ChoiceField(
+        doc = "How the checkpoints of checkpointDir are used. The association checkpoint of a tract "
+              "is only valid for the same input CCDs, star selection and reference catalog",
+        dtype = str,
+        default = "fit",
+        allowed = {"none": "ignore them (and overwrite them)",
+                   "association": "start from the association, and redo the whole fit",
+                   "fit": "start after the last minimization stage saved with the same polyOrder and "
+                          "posError, or else from the association"},
+    )
+    incremental = pexConfig.Field(
+        doc = "When resuming from a checkpoint, associate the CCDs it does not hold with its fitted stars "
+              "and, if it is a fit checkpoint, fit them alone before refining the whole tract "
+              "(otherwise, these CCDs are ignored)",
+        dtype = bool,
+        default = True,
+    )
 class SimAstromTask(pipeBase.CmdLineTask):
  
     ConfigClass = SimAstromConfig
     RunnerClass = SimAstromRunner
     _DefaultName = "simAstrom"
+    # rough memory sizes of a footprint span and peak, for the loadMemoryBudget estimates
+    _spanBytes = 40
+    _peakBytes = 64
     
     def __init__(self, *args, **kwargs):
         pipeBase.Task.__init__(self, *args, **kwargs)
+        # threads of the C++ code (see SimAstromRunner.nThreadsPerTract)
+        self.nThreads = self.config.nThreads
 #        self.makeSubtask("select")
 
 # We don't need to persist config and metadata at this stage. In this way, we don't need to put a specific entry in the
@@ -149,9 +324,176 @@ class SimAstromTask(pipeBase.CmdLineTask):
                                 ContainerClass=PerTractCcdDataIdContainer)
         return parser
 
-    @pipeBase.timeMethod
-    def run(self, ref, tract):
+    def loadCcd(self, dataRef, selector):
+        """Read the catalog and metadata of a CCD, and select the sources to be associated
+        
+        @return a Struct with dataRef, selected, tanwcs, md, bbox, calib, filt, and nBytes,
+        a rough estimate of the memory used by the selected catalog, footprints included.
+        The selected records are a deep copy, so that the full catalog is released here.
+        """
+        src = dataRef.get("src", immediate=True)
+        md = dataRef.get("calexp_md", immediate=True)
+        tanwcs = afwImage.TanWcs.cast(afwImage.makeWcs(md))
+        lLeft = afwImage.getImageXY0FromMetadata(afwImage.wcsNameForXY0, md)
+        uRight  = afwGeom.Point2I(lLeft.getX() + md.get("NAXIS1")-1, lLeft.getY() + md.get("NAXIS2")-1)
+        bbox = afwGeom.Box2I(lLeft, uRight)
+        calib = afwImage.Calib(md)
+        filt = dataRef.dataId['filter']
+        
+        # a deep copy, so that the queued CCD does not keep the whole catalog alive
+        newSrc = selector.select(src, calib).copy(deep=True)
+        del src
+        # the copied records still share their footprints with the original ones
+        nBytes = len(newSrc)*newSrc.getSchema().getRecordSize()
+        for rec in newSrc :
+            fp = rec.getFootprint()
+            if fp is not None :
+                nBytes += len(fp.getSpans())*self._spanBytes + len(fp.getPeaks())*self._peakBytes
+        return pipeBase.Struct(dataRef=dataRef, selected=newSrc, tanwcs=tanwcs, md=md,
+                               bbox=bbox, calib=calib, filt=filt, nBytes=nBytes)
+
+    def loadCcds(self, refList, selector):
+        """Generator of loadCcd results, in the order of refList
+        
+        The CCDs are loaded by a pool of config.nLoadThreads threads. The number of
+        CCDs loaded in advance is limited by config.loadMemoryBudget, using the
+        largest catalog seen so far as an estimate of the size of the next ones.
+        """
+        refList = list(refList)
+        if self.config.nLoadThreads <= 1 :
+            for dataRef in refList :
+                yield self.loadCcd(dataRef, selector)
+            return
+        
+        budget = self.config.loadMemoryBudget*1024*1024
+        pool = ThreadPool(self.config.nLoadThreads)
+        try :
+            pending = collections.deque()
+            maxPending = self.config.nLoadThreads # until we know how large catalogs are
+            largest = 0
+            nextRef = 0
+            while pending or nextRef < len(refList) :
+                while nextRef < len(refList) and len(pending) < maxPending :
+                    pending.append(pool.apply_async(self.loadCcd, (refList[nextRef], selector)))
+                    nextRef += 1
+                ccd = pending.popleft().get()
+                largest = max(largest, ccd.nBytes)
+                maxPending = max(1, int(budget // max(largest, 1)))
+                yield ccd
+        finally :
+            pool.terminate()
+            pool.join()
+
+    def getRefObjLoader(self):
+        """Return the astrometry_net_data loader, its default filter and a version string
+
+        They are built once per process, and shared by the tracts it processes.
+        """
+        anDir = lsst.utils.getPackageDir('astrometry_net_data')
+        if anDir is None:
+            raise RuntimeError("astrometry_net_data is not setup")
+        if anDir not in _refObjLoaders :
+            andConfig = AstrometryNetDataConfig()
+            andConfigPath = os.path.join(anDir, "andConfig.py")
+            if not os.path.exists(andConfigPath):
+                raise RuntimeError("astrometry_net_data config file \"%s\" required but not found" %andConfigPath)
+            andConfig.load(andConfigPath)
+            
+            task = LoadAstrometryNetObjectsTask.ConfigClass()
+            loader = LoadAstrometryNetObjectsTask(task)
+            
+            # Determine default filter associated to the catalog
+            filt, mfilt = andConfig.magColumnMap.items()[0]
+            _refObjLoaders[anDir] = pipeBase.Struct(loader=loader, filt=filt,
+                                                    version=catalogVersion(anDir, andConfigPath))
+        return _refObjLoaders[anDir]
+
+    def loadRefCat(self, assoc):
+        """Load the reference catalog over the region covered by the CCDs of assoc
+        
+        With config.refCatRegion == "circle", the catalog is loaded over a circle enclosing
+        the (RA,Dec) box of all CCDs; with "ccds", over the sky cells that overlap the box of
+        one of the CCDs. Loaded regions are kept in config.refCatCacheDir if it is set.
+        
+        @return the catalog and the filter of its reference flux
+        """
+        refLoader = self.getRefObjLoader()
+        filt = refLoader.filt
+        print "Using", filt, "band for reference flux"
+        cache = None
+        if self.config.refCatCacheDir :
+            cache = RefCatCache(self.config.refCatCacheDir, self.config.refCatCacheSize)
+        
+        if self.config.refCatRegion == "ccds" :
+            cells = skyCellsCovering(assoc.GetCcdRaDecBBoxes(), self.config.refCatCellSize,
+                                     self.config.refCatMargin/3600.)
+            print "Loading reference objects over %d sky cells" % len(cells)
+            return loadSkyCells(refLoader.loader, filt, cells, cache, refLoader.version), filt
         
+        # Get the bounding box overlapping all associated images
+        bbox = assoc.GetRaDecBBox()
+        center = afwCoord.Coord(bbox.getCenter(), afwGeom.degrees)
+        corner = afwCoord.Coord(bbox.getMax(), afwGeom.degrees)
+        radius = center.angularSeparation(corner).asRadians()
+        
+        def load():
+            return refLoader.loader.loadSkyCircle(center, afwGeom.Angle(radius, afwGeom.radians), filt).refCat
+        if cache is None :
+            return load(), filt
+        key = "%s_%s_circle_%.6f_%.6f_%.8f" % (refLoader.version, filt, bbox.getCenterX(),
+                                                bbox.getCenterY(), radius)
+        return cache.get(key, load), filt
+
+    def checkpointPaths(self, tract):
+        """The association checkpoint of tract, and the prefix of its fit checkpoints (None if disabled)
+
+        Fit checkpoints depend on polyOrder and posError: changing them restarts the fit from the
+        association.
+        """
+        if not self.config.checkpointDir :
+            return None, None
+        try :
+            os.makedirs(self.config.checkpointDir)
+        except OSError :
+            # e.g. created by the process of another tract
+            if not os.path.isdir(self.config.checkpointDir) :
+                raise
+        prefix = os.path.join(self.config.checkpointDir, "tract%s" % tract)
+        return (prefix + ".assoc",
+                "%s_poly%d_pos%g" % (prefix, self.config.polyOrder, self.config.posError))
+
+    def lastFitStage(self, fitPrefix):
+        """The last saved minimization stage (-1 if none) and the code Minimize returned"""
+        try :
+            with open(fitPrefix + ".stage") as f :
+                stage, code = [int(w) for w in f.read().split()]
+        except (IOError, ValueError) :
+            return -1, None
+        if not (os.path.exists("%s.%d.assoc" % (fitPrefix, stage)) and
+                os.path.exists("%s.%d.model" % (fitPrefix, stage))) :
+            return -1, None
+        return stage, code
+
+    def writeFitCheckpoint(self, fitPrefix, stage, code, assoc, model, previous=None):
+        """Save the state after minimization stage number stage, and remove the one of stage previous
+        (stage-1 if None)"""
+        assoc.WriteCheckpoint("%s.%d.assoc" % (fitPrefix, stage))
+        model.WriteParams("%s.%d.model" % (fitPrefix, stage))
+        # the stage file is replaced last, so that it always names complete checkpoints
+        with open(fitPrefix + ".stage.tmp", "w") as f :
+            f.write("%d %d\n" % (stage, code))
+        os.rename(fitPrefix + ".stage.tmp", fitPrefix + ".stage")
+        if previous is None :
+            previous = stage-1
+        if previous == stage :
+            return
+        for ext in ("assoc", "model") :
+            path = "%s.%d.%s" % (fitPrefix, previous, ext)
+            if os.path.exists(path) :
+                os.remove(path)
+
+    def addImages(self, assoc, ref):
+        """Load the catalogs of ref, and add the CCDs that have selected sources to assoc"""
         configSel = StarSelectorConfig()
         ss = StarSelector(configSel, self.config.sourceFluxField, self.config.maxMag,self.config.centroid,self.config.shape)
         
@@ -161,9 +503,6 @@ class SimAstromTask(pipeBase.CmdLineTask):
         astromControl.centroid = self.config.centroid
         astromControl.shape = self.config.shape
         
-
-        assoc = Associations()
-        
 #        for dataRef in ref :
 #            print dataRef.dataId
 #            print dataRef.dataId["tract"]
@@ -172,95 +511,149 @@ class SimAstromTask(pipeBase.CmdLineTask):
             
 #        return    
         
-        for dataRef in ref :
+        # catalogs are read and selected ahead, but added in the order of ref
+        for ccd in self.loadCcds(ref, ss) :
             
+            dataRef = ccd.dataRef
             print dataRef.dataId
             
-            src = dataRef.get("src", immediate=True)
-            md = dataRef.get("calexp_md", immediate=True)
-            tanwcs = afwImage.TanWcs.cast(afwImage.makeWcs(md))
-            lLeft = afwImage.getImageXY0FromMetadata(afwImage.wcsNameForXY0, md)
-            uRight  = afwGeom.Point2I(lLeft.getX() + md.get("NAXIS1")-1, lLeft.getY() + md.get("NAXIS2")-1)
-            bbox = afwGeom.Box2I(lLeft, uRight)
-            calib = afwImage.Calib(md)
-            filt = dataRef.dataId['filter']
-            
-            newSrc = ss.select(src, calib)
+            newSrc = ccd.selected
             if len(newSrc) == 0 :
                 print "no source selected in ", dataRef.dataId["visit"], dataRef.dataId["ccd"]
                 continue
             print "%d sources selected in visit %d - ccd %d"%(len(newSrc), dataRef.dataId["visit"], dataRef.dataId["ccd"])
             
-            assoc.AddImage(newSrc, tanwcs, md, bbox, filt, calib,
+            assoc.AddImage(newSrc, ccd.tanwcs, ccd.md, ccd.bbox, ccd.filt, ccd.calib,
                            dataRef.dataId['visit'], dataRef.dataId['ccd'],
                            dataRef.getButler().mapper.getCameraName(), 
                            astromControl)
-        
-        matchCut = 3.0
-        assoc.AssociateCatalogs(matchCut)
-        
-        # Use external reference catalogs handled by LSST stack mechanism
-        # Get the bounding box overlapping all associated images
-        # ==> This is probably a bad idea to do it this way <== To be improved
-        bbox = assoc.GetRaDecBBox()
-        center = afwCoord.Coord(bbox.getCenter(), afwGeom.degrees)
-        corner = afwCoord.Coord(bbox.getMax(), afwGeom.degrees)
-        radius = center.angularSeparation(corner).asRadians()
-        
-        # Get astrometry_net_data path
-        anDir = lsst.utils.getPackageDir('astrometry_net_data')
-        if anDir is None:
-            raise RuntimeError("astrometry_net_data is not setup")
 
-        andConfig = AstrometryNetDataConfig()
-        andConfigPath = os.path.join(anDir, "andConfig.py")
-        if not os.path.exists(andConfigPath):
-            raise RuntimeError("astrometry_net_data config file \"%s\" required but not found" %andConfigPath)
-        andConfig.load(andConfigPath)
+    def associate(self, ref):
+        """Load the catalogs of ref, associate them, and collect the reference stars
+
+        @return an Associations, with the fitted stars on the sky, ready for AstromFit
+        """
+        assoc = Associations()
+        self.addImages(assoc, ref)
         
-        task = LoadAstrometryNetObjectsTask.ConfigClass()
-        loader = LoadAstrometryNetObjectsTask(task)
+        if self.config.parallelAssociation :
+            assoc.SetNThreads(self.nThreads)
+            assoc.AssociateCatalogsParallel(_matchCut)
+        else :
+            assoc.AssociateCatalogs(_matchCut)
         
-        # Determine default filter associated to the catalog
-        filt, mfilt = andConfig.magColumnMap.items()[0]
-        print "Using", filt, "band for reference flux"
-
-        refCat = loader.loadSkyCircle(center, afwGeom.Angle(radius, afwGeom.radians), filt).refCat
-        #print refCat.getSchema().getOrderedNames()
+        # Use external reference catalogs handled by LSST stack mechanism
+        refCat, filt = self.loadRefCat(assoc)
         
         # assoc.CollectRefStars(False) # To use USNO-A catalog 
 
         assoc.CollectLSSTRefStars(refCat, filt)
         assoc.SelectFittedStars()
         assoc.DeprojectFittedStars() # required for AstromFit
+        return assoc
+
+    def addNewImages(self, assoc, ref):
+        """Add to assoc (restored from a checkpoint) the CCDs of ref it does not hold, and
+        associate them with its fitted stars (see Associations.AssociateNewCatalogs)
+
+        @return the rank of the first new CcdImage in assoc (assoc.NCcdImages() if none was added)
+        """
+        firstNew = assoc.NCcdImages()
+        known = set((im.Shoot(), im.Chip()) for im in assoc.TheCcdImageList())
+        newRef = [dataRef for dataRef in ref
+                  if (dataRef.dataId["visit"], dataRef.dataId["ccd"]) not in known]
+        if not newRef :
+            return firstNew
+        if not self.config.incremental :
+            print "Ignoring %d CCDs that the checkpoint does not hold (incremental is off)" % len(newRef)
+            return firstNew
+        print "Associating %d CCDs that the checkpoint does not hold" % len(newRef)
+        self.addImages(assoc, newRef)
+        if assoc.NCcdImages() > firstNew :
+            assoc.AssociateNewCatalogs(_matchCut, firstNew)
+        return firstNew
+
+    @pipeBase.timeMethod
+    def run(self, ref, tract):
+        
+        assocPath, fitPrefix = self.checkpointPaths(tract)
+        stage, code = -1, None
+        if fitPrefix and self.config.resume == "fit" :
+            stage, code = self.lastFitStage(fitPrefix)
+        restored = True
+        if stage >= 0 :
+            print "Resuming the fit of tract %s after minimization stage %d" % (tract, stage)
+            assoc = Associations()
+            assoc.ReadCheckpoint("%s.%d.assoc" % (fitPrefix, stage))
+        elif assocPath and self.config.resume != "none" and os.path.exists(assocPath) :
+            print "Reading the association of tract %s from %s" % (tract, assocPath)
+            assoc = Associations()
+            assoc.ReadCheckpoint(assocPath)
+        else :
+            restored = False
+            assoc = self.associate(ref)
+            if assocPath :
+                assoc.WriteCheckpoint(assocPath)
+        assoc.SetNThreads(self.nThreads)
+        
+        # CCDs added since the checkpoint was written
+        firstNew = assoc.NCcdImages()
+        if restored :
+            firstNew = self.addNewImages(assoc, ref)
+        warmStart = (stage >= 0 and assoc.NCcdImages() > firstNew)
+        if restored and stage < 0 and assoc.NCcdImages() > firstNew :
+            assoc.WriteCheckpoint(assocPath)
+        
+        # the mappings of new CCDs start from their WCS
         sky2TP = OneTPPerShoot(assoc.TheCcdImageList())
         spm = SimplePolyModel(assoc.TheCcdImageList(), sky2TP, True, 0, self.config.polyOrder)
+        if stage >= 0 :
+            spm.ReadParams("%s.%d.model" % (fitPrefix, stage), warmStart)
 
         fit = AstromFit(assoc, spm, self.config.posError)
-        fit.Minimize("Distortions")
-        chi2 = fit.ComputeChi2()
-        print chi2
-        fit.Minimize("Positions")
-        chi2 = fit.ComputeChi2()
-        print chi2
-        fit.Minimize("Distortions Positions")
-        chi2 = fit.ComputeChi2()
-        print chi2
-
-        for i in range(20) :
-            r = fit.Minimize("Distortions Positions",5) # outliers removal at 5 sigma.
+        fit.SetNThreads(self.nThreads)
+        fit.SetSolver(self.config.solver)
+        fit.SetEliminatePositions(self.config.eliminatePositions)
+        fit.SetDirectAssembly(self.config.directAssembly)
+
+        # the minimization stages (what to fit, outlier cut): then at most 20 rounds of
+        # outliers removal at 5 sigma, until Minimize returns something else than 1 or 2
+        stages = [("Distortions", 0), ("Positions", 0), ("Distortions Positions", 0)]
+        stages += [("Distortions Positions", 5)]*20
+        converged = (stage >= 0 and stages[stage][1] > 0 and code not in (1, 2))
+        previous = None
+        if warmStart :
+            # fit the new CCDs (and the stars only they measure) alone, everything else staying
+            # at the saved solution, and then go on with the outlier rounds over the whole tract
+            print "Warm start: fitting the %d new CCDs" % (assoc.NCcdImages() - firstNew)
+            fit.RestrictToNewCcdImages(firstNew)
+            for whatToFit in ("Distortions", "Distortions Positions") :
+                fit.Minimize(whatToFit, 0)
+            fit.RestrictToNewCcdImages(0)
+            previous = stage
+            stage = min(stage, 2)
+            converged = False
+        for k in range(stage+1, len(stages)) :
+            if converged :
+                break
+            whatToFit, nSigCut = stages[k]
+            r = fit.Minimize(whatToFit, nSigCut)
             chi2 = fit.ComputeChi2()
             print chi2
+            if fitPrefix :
+                self.writeFitCheckpoint(fitPrefix, k, r, assoc, spm, previous)
+                previous = None
+            if nSigCut == 0 :
+                continue
             if r == 0 :
                 print "fit has converged - no more outliers"
-                break
             elif r == 2 :
                 print "minimization failed"
             elif r == 1 :
                 print "still some ouliers but chi2 increases - retry"
             else :
-                break
                 print "unxepected return code from Minimize"
+            converged = r not in (1, 2)
         
 #        for i in range(80): 
 #            nout = fit.RemoveOutliers(5.) # 5 sigma
@@ -271,7 +664,7 @@ class SimAstromTask(pipeBase.CmdLineTask):
 #            if (nout == 0) : break
             
         # Fill reference and measurement n-tuples for each tract
-        tupleName = "res_" + str(dataRef.dataId["tract"]) + ".list"
+        tupleName = "res_" + str(tract) + "." + self.config.resTupleFormat
         fit.MakeResTuple(tupleName)
         
         # Build an updated wcs for each calexp
@@ -326,55 +719,49 @@ class StarSelector(object) :
     
     def select(self, srcCat, calib):
 # Return a catalog containing only reasonnable stars / galaxies
+#
+# The selection works on the catalog columns: a single boolean mask is
+# built, and the catalog is subsetted once. Each cut is written as
+# "not rejected", so that NaN's go through exactly as they did with the
+# per-source loop this replaces (comparisons with NaN are False).
+# One difference: a flux of 0 made calib.getMagnitude raise, while
+# it is now rejected (by the magnitude error and S/N cuts).
 
-        schema = srcCat.getSchema()
-        #print schema.getOrderedNames()
-        newCat = afwTable.SourceCatalog(schema)
-        fluxKey = schema[self.sourceFluxField+"_flux"].asKey()
-        fluxErrKey = schema[self.sourceFluxField+"_fluxSigma"].asKey()
-        parentKey = schema["parent"].asKey()
-        flagKeys = []
-        for f in self.config.badFlags :
-            key = schema[f].asKey()
-            flagKeys.append(key)
-        fluxFlagKey = schema[self.sourceFluxField+"_flag"].asKey()
-        flagKeys.append(fluxFlagKey)
-        
-        for src in srcCat :
-            # Do not consider sources with bad flags
-            for f in flagKeys :
-                rej = 0
-                if src.get(f) :
-                    rej = 1
-                    break
-            if rej == 1 :
-                continue
+        if not srcCat.isContiguous() :
+            srcCat = srcCat.copy(deep=True)
+
+        flux = srcCat.get(self.sourceFluxField+"_flux")
+        fluxErr = srcCat.get(self.sourceFluxField+"_fluxSigma")
+
+        # Do not consider sources with bad flags
+        keep = np.ones(len(srcCat), dtype=bool)
+        for f in list(self.config.badFlags) + [self.sourceFluxField+"_flag"] :
+            keep &= np.logical_not(srcCat.get(f))
+
+        with np.errstate(divide='ignore', invalid='ignore') :
             # Reject negative flux
-            flux = src.get(fluxKey)
-            if flux < 0 :
-                continue
-            # Reject objects with too large magnitude
-            fluxErr = src.get(fluxErrKey)
-            mag, magErr = calib.getMagnitude(flux, fluxErr)
-            if mag > self.maxMag or magErr > 0.1 or flux/fluxErr < 10 :
-                continue
+            keep &= np.logical_not(flux < 0)
+            # Reject objects with too large magnitude (same as calib.getMagnitude)
+            fluxMag0, fluxMag0Err = calib.getFluxMag0()
+            mag = -2.5*np.log10(flux/fluxMag0)
+            magErr = 2.5/np.log(10.)*np.hypot(fluxErr/flux, fluxMag0Err/fluxMag0)
+            keep &= np.logical_not((mag > self.maxMag) | (magErr > 0.1) | (flux/fluxErr < 10))
             # Reject blends
-            if src.get(parentKey) != 0 :
-                continue
-            footprint = src.getFootprint()
+            keep &= (srcCat.get("parent") == 0)
+
+            vx = np.square(srcCat.get(self.centroid + "_xSigma"))
+            vy = np.square(srcCat.get(self.centroid + "_ySigma"))
+            mxx = srcCat.get(self.shape + "_xx")
+            myy = srcCat.get(self.shape + "_yy")
+            mxy = srcCat.get(self.shape + "_xy")
+            vxy = mxy*(vx+vy)/(mxx+myy)
+            keep &= np.logical_not((vx < 0) | (vy < 0) | (vxy*vxy > vx*vy) |
+                                   np.isnan(vx) | np.isnan(vy))
+
+        # footprints are objects: only look at the surviving sources
+        for i in np.flatnonzero(keep) :
+            footprint = srcCat[int(i)].getFootprint()
             if footprint is not None and len(footprint.getPeaks()) > 1 :
-                continue
-            vx = np.square(src.get(self.centroid + "_xSigma"))
-            vy = np.square(src.get(self.centroid + "_ySigma"))
-            mxx = src.get(self.shape + "_xx")  
-            myy = src.get(self.shape + "_yy")
-            mxy = src.get(self.shape + "_xy") 
-            vxy = mxy*(vx+vy)/(mxx+myy);
+                keep[i] = False
 
-            
-            if vx < 0 or vy< 0 or (vxy*vxy)>(vx*vy) or np.isnan(vx) or np.isnan(vy):
-                continue
-            
-            newCat.append(src)
-            
-        return newCat
+        return srcCat.subset(keep)
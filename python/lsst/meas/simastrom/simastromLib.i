@@ -25,6 +25,7 @@ Python interface to lsst::meas::simastrom classes
 #include "lsst/meas/simastrom/test2.h"
 #include "lsst/meas/simastrom/simAstrom.h"
 #include "lsst/meas/simastrom/CcdImage.h"
+#include "lsst/meas/simastrom/ResidualTable.h"
 #include "lsst/meas/simastrom/AstromFit.h"
 #include "lsst/meas/simastrom/Associations.h"
 #include "lsst/meas/simastrom/DistortionModel.h"
@@ -38,10 +39,17 @@ Python interface to lsst::meas::simastrom classes
 #include "lsst/meas/simastrom/ConstrainedPolyModel.h"
 #include "lsst/meas/simastrom/PhotomFit.h"
 #include "lsst/meas/simastrom/SimplePhotomModel.h"
+#include "lsst/meas/simastrom/RefCatalog.h"
 %}
 
 %include "lsst/p_lsstSwig.i"
 %initializeNumPy(meas_simastrom)
+%{
+#include "ndarray/swig.h"
+%}
+%include "ndarray.i"
+%declareNumPyConverters(ndarray::Array<double const,1,1>);
+%declareNumPyConverters(ndarray::Array<double,2,2>);
 
 %import "lsst/afw/table/tableLib.i"
 
@@ -55,6 +63,7 @@ Python interface to lsst::meas::simastrom classes
 %template(PropertySetList) std::vector<boost::shared_ptr<lsst::daf::base::PropertySet> >;
 %template(CalibList) std::vector<boost::shared_ptr< lsst::afw::image::Calib > >;
 %template(BboxList) std::vector<lsst::afw::geom::Box2I>;
+%template(Box2DList) std::vector<lsst::afw::geom::Box2D>;
 %template(StringList) std::vector<std::string>;
 %template(IntList) std::vector<int>;
 
@@ -73,6 +82,23 @@ class FittedStarList;
 class MeasuredStarList;
 }}}
 %include "lsst/meas/simastrom/Chi2.h"
+%include "lsst/meas/simastrom/ResidualTable.h"
+%template(ResidualColumnList) std::vector<lsst::meas::simastrom::ResidualColumn>;
+%extend lsst::meas::simastrom::ResidualTable {
+    //! Appends a row: one value per column, in order.
+    void AddRowArray(ndarray::Array<double const,1,1> const & Values)
+    {
+        if (unsigned(Values.getSize<0>()) != $self->ColumnNames().size())
+            throw LSST_EXCEPT(lsst::pex::exceptions::InvalidParameterError,
+                              "ResidualTable::AddRowArray : one value per column is expected");
+        $self->AddRow(Values.getData());
+    }
+%pythoncode %{
+    def asDict(self):
+        """The columns as a dict of numpy arrays, that share the table storage."""
+        return dict((name, self.Column(name)) for name in self.ColumnNames())
+%}
+}
 %include "lsst/meas/simastrom/AstromFit.h"
 namespace lsst {
 namespace meas {
@@ -114,6 +140,20 @@ namespace simastrom {
 %include "lsst/meas/simastrom/Point.h"
 %include "lsst/meas/simastrom/FatPoint.h"
 %include "lsst/meas/simastrom/Gtransfo.h"
+%extend lsst::meas::simastrom::Gtransfo {
+    //! Transforms all points (X[k],Y[k]) at once. Returns a 2 x N array (x's, then y's).
+    ndarray::Array<double,2,2> ApplyArrays(ndarray::Array<double const,1,1> const & X,
+                                           ndarray::Array<double const,1,1> const & Y) const
+    {
+        if (X.getSize<0>() != Y.getSize<0>())
+            throw LSST_EXCEPT(lsst::pex::exceptions::InvalidParameterError,
+                              "Gtransfo::ApplyArrays : X and Y have different sizes");
+        int n = X.getSize<0>();
+        ndarray::Array<double,2,2> out = ndarray::allocate(ndarray::makeVector(2, n));
+        if (n) $self->ApplyBatch(X.getData(), Y.getData(), out[0].getData(), out[1].getData(), n);
+        return out;
+    }
+}
 
 %include "lsst/meas/simastrom/CcdImage.h"
 %include "lsst/meas/simastrom/SimplePolyModel.h"
@@ -124,3 +164,22 @@ namespace simastrom {
 %include "lsst/meas/simastrom/PhotomFit.h"
 %include "lsst/meas/simastrom/SimplePhotomModel.h"
 
+%include "lsst/meas/simastrom/RefCatalog.h"
+%extend lsst::meas::simastrom::RefCatalogBuilder {
+    //! Adds all stars of the arrays (degrees, magnitudes, arcsec). Use 99.9 for a missing magnitude.
+    void AddArrays(ndarray::Array<double const,1,1> const & Ra,
+                   ndarray::Array<double const,1,1> const & Dec,
+                   ndarray::Array<double const,1,1> const & MagR,
+                   ndarray::Array<double const,1,1> const & MagB,
+                   ndarray::Array<double const,1,1> const & SigRa,
+                   ndarray::Array<double const,1,1> const & SigDec)
+    {
+        int n = Ra.getSize<0>();
+        if (Dec.getSize<0>() != n || MagR.getSize<0>() != n || MagB.getSize<0>() != n
+            || SigRa.getSize<0>() != n || SigDec.getSize<0>() != n)
+            throw LSST_EXCEPT(lsst::pex::exceptions::InvalidParameterError,
+                              "RefCatalogBuilder::AddArrays : arrays have different sizes");
+        for (int k=0; k<n; ++k) $self->Add(Ra[k], Dec[k], MagR[k], MagB[k], SigRa[k], SigDec[k]);
+    }
+}
+
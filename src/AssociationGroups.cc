@@ -0,0 +1,250 @@
+#include <cmath>
+#include <algorithm>
+
+#include "lsst/meas/simastrom/AssociationGroups.h"
+#include "lsst/meas/simastrom/ParallelFor.h"
+#include "lsst/pex/exceptions.h"
+
+namespace lsst {
+namespace meas {
+namespace simastrom {
+
+typedef std::pair<long long, unsigned> KeyRank; // (cell, position)
+typedef std::pair<unsigned, unsigned> Link;
+
+static const unsigned cells_per_task = 1024;
+static const unsigned groups_per_task = 4096;
+
+static long long cell_key(const int I, const int J)
+{
+  return (((long long) I) << 32) + ((long long) (unsigned) J);
+}
+
+struct Cell
+{
+  long long key;
+  unsigned begin, end; // in the sorted positions
+  int i,j;
+  bool operator < (const long long &Key) const { return key < Key;}
+};
+
+/* Sorts V, pieces being sorted in parallel and then merged. Elements
+   are all different, so the result does not depend on the split. */
+static void parallel_sort(std::vector<KeyRank> &V, const unsigned NThreads)
+{
+  unsigned nPieces = 1;
+  while (nPieces < EffectiveNThreads(NThreads)) nPieces *= 2;
+  std::vector<size_t> bound(nPieces+1);
+  for (unsigned k=0; k <= nPieces; ++k) bound[k] = (V.size()*k)/nPieces;
+  ParallelFor(nPieces, NThreads, [&](unsigned k)
+	      { std::sort(V.begin()+bound[k], V.begin()+bound[k+1]);});
+  for (unsigned width = 1; width < nPieces; width *= 2)
+    ParallelFor(nPieces/(2*width), NThreads, [&](unsigned k)
+		{
+		  unsigned first = 2*width*k;
+		  std::inplace_merge(V.begin()+bound[first],
+				     V.begin()+bound[first+width],
+				     V.begin()+bound[first+2*width]);
+		});
+}
+
+/* Splits the (sorted) members M[0..Size) of a friends-of-friends
+   group into subgroups, appended to Start/Members (see
+   AssociationGroups). */
+static void split_group(const unsigned *M, const unsigned Size,
+			const std::vector<double> &X, const std::vector<double> &Y,
+			const std::vector<unsigned> &Source, const double Cut2,
+			std::vector<unsigned> &Start, std::vector<unsigned> &Members)
+{
+  if (Size == 1)
+    {
+      Start.push_back(Members.size());
+      Members.push_back(M[0]);
+      return;
+    }
+  std::vector<char> used(Size, 0);
+  // (source, position in M) and distance of the closest candidate per source
+  std::vector<Link> chosen;
+  std::vector<double> chosenD2;
+  for (unsigned first=0; first < Size; ++first)
+    {
+      if (used[first]) continue;
+      used[first] = 1;
+      const unsigned ref = M[first];
+      chosen.clear();
+      chosenD2.clear();
+      for (unsigned p = first+1; p < Size; ++p)
+	{
+	  if (used[p]) continue;
+	  const unsigned k = M[p];
+	  const unsigned src = Source[k];
+	  if (src == Source[ref]) continue;
+	  double dx = X[k]-X[ref];
+	  double dy = Y[k]-Y[ref];
+	  double d2 = dx*dx+dy*dy;
+	  if (d2 >= Cut2) continue;
+	  unsigned c = 0;
+	  for ( ; c < chosen.size(); ++c) if (chosen[c].first == src) break;
+	  if (c == chosen.size())
+	    {
+	      chosen.push_back(Link(src, p));
+	      chosenD2.push_back(d2);
+	    }
+	  else if (d2 < chosenD2[c]) // ties go to the lowest rank
+	    {
+	      chosen[c].second = p;
+	      chosenD2[c] = d2;
+	    }
+	}
+      std::vector<unsigned> sub(1, first);
+      for (auto c = chosen.cbegin(); c != chosen.end(); ++c)
+	{
+	  sub.push_back(c->second);
+	  used[c->second] = 1;
+	}
+      std::sort(sub.begin(), sub.end());
+      Start.push_back(Members.size());
+      for (auto p = sub.cbegin(); p != sub.end(); ++p) Members.push_back(M[*p]);
+    }
+}
+
+
+void AssociationGroups::Build(const std::vector<double> &X, const std::vector<double> &Y,
+			      const std::vector<unsigned> &Source, const double MatchCut,
+			      const unsigned NThreads)
+{
+  clear();
+  const unsigned n = X.size();
+  if (Y.size() != n || Source.size() != n)
+    throw LSST_EXCEPT(pex::exceptions::InvalidParameterError, "AssociationGroups::Build : X, Y and Source should have the same size");
+  if (!(MatchCut > 0))
+    throw LSST_EXCEPT(pex::exceptions::InvalidParameterError, "AssociationGroups::Build : the match cut should be positive");
+  start.push_back(0);
+  if (n == 0) return;
+  const double cut2 = MatchCut*MatchCut;
+
+  /* sort the positions by cell, cells being as large as the cut, so
+     that pairs can only involve neighbouring cells */
+  std::vector<KeyRank> sorted(n);
+  ParallelFor(n, NThreads, [&](unsigned k)
+	      {
+		int i = int(std::floor(X[k]/MatchCut));
+		int j = int(std::floor(Y[k]/MatchCut));
+		sorted[k] = KeyRank(cell_key(i,j), k);
+	      });
+  parallel_sort(sorted, NThreads);
+  std::vector<Cell> cells;
+  for (unsigned p=0; p < n; )
+    {
+      Cell c;
+      c.key = sorted[p].first;
+      c.begin = p;
+      while (p < n && sorted[p].first == c.key) ++p;
+      c.end = p;
+      unsigned k = sorted[c.begin].second;
+      c.i = int(std::floor(X[k]/MatchCut));
+      c.j = int(std::floor(Y[k]/MatchCut));
+      cells.push_back(c);
+    }
+
+  // collect the pairs (a,b), a<b, from different sources, closer than the cut
+  const unsigned nTasks = (cells.size()+cells_per_task-1)/cells_per_task;
+  std::vector<std::vector<Link> > links(nTasks);
+  ParallelFor(nTasks, NThreads, [&](unsigned task)
+    {
+      std::vector<Link> &out = links[task];
+      unsigned cellEnd = std::min<unsigned>(cells.size(), (task+1)*cells_per_task);
+      for (unsigned ic = task*cells_per_task; ic < cellEnd; ++ic)
+	{
+	  const Cell &c = cells[ic];
+	  for (int di = -1; di <= 1; ++di)
+	    for (int dj = -1; dj <= 1; ++dj)
+	      {
+		long long key = cell_key(c.i+di, c.j+dj);
+		auto nb = std::lower_bound(cells.cbegin(), cells.cend(), key);
+		if (nb == cells.end() || nb->key != key) continue;
+		for (unsigned pa = c.begin; pa < c.end; ++pa)
+		  {
+		    const unsigned a = sorted[pa].second;
+		    for (unsigned pb = nb->begin; pb < nb->end; ++pb)
+		      {
+			const unsigned b = sorted[pb].second;
+			if (b <= a || Source[a] == Source[b]) continue;
+			double dx = X[a]-X[b];
+			double dy = Y[a]-Y[b];
+			if (dx*dx+dy*dy < cut2) out.push_back(Link(a,b));
+		      }
+		  }
+	      }
+	}
+    });
+  std::vector<KeyRank>().swap(sorted);
+  std::vector<Cell>().swap(cells);
+
+  /* friends-of-friends: union-find where the root of a set is its
+     lowest rank, so parent[k] <= k, and the sets do not depend on the
+     order of the links. */
+  std::vector<unsigned> parent(n);
+  for (unsigned k=0; k < n; ++k) parent[k] = k;
+  for (auto t = links.cbegin(); t != links.end(); ++t)
+    for (auto l = t->cbegin(); l != t->end(); ++l)
+      {
+	unsigned ra = l->first;
+	while (parent[ra] != ra) ra = parent[ra] = parent[parent[ra]];
+	unsigned rb = l->second;
+	while (parent[rb] != rb) rb = parent[rb] = parent[parent[rb]];
+	if (ra < rb) parent[rb] = ra;
+	else if (rb < ra) parent[ra] = rb;
+      }
+  std::vector<std::vector<Link> >().swap(links);
+
+  // groups, ordered by their root, with members in increasing rank
+  std::vector<unsigned> groupOf(n);
+  unsigned nGroups = 0;
+  for (unsigned k=0; k < n; ++k)
+    {
+      parent[k] = parent[parent[k]];
+      groupOf[k] = (parent[k] == k) ? nGroups++ : groupOf[parent[k]];
+    }
+  std::vector<unsigned> gStart(nGroups+1, 0);
+  for (unsigned k=0; k < n; ++k) gStart[groupOf[k]+1]++;
+  for (unsigned g=0; g < nGroups; ++g) gStart[g+1] += gStart[g];
+  std::vector<unsigned> gMembers(n);
+  {
+    std::vector<unsigned> next(gStart.begin(), gStart.end()-1);
+    for (unsigned k=0; k < n; ++k) gMembers[next[groupOf[k]]++] = k;
+  }
+  std::vector<unsigned>().swap(groupOf);
+  std::vector<unsigned>().swap(parent);
+
+  // split groups with ambiguities
+  const unsigned nGroupTasks = (nGroups+groups_per_task-1)/groups_per_task;
+  std::vector<std::vector<unsigned> > subStart(nGroupTasks), subMembers(nGroupTasks);
+  ParallelFor(nGroupTasks, NThreads, [&](unsigned task)
+    {
+      unsigned gEnd = std::min(nGroups, (task+1)*groups_per_task);
+      for (unsigned g = task*groups_per_task; g < gEnd; ++g)
+	split_group(&gMembers[gStart[g]], gStart[g+1]-gStart[g], X, Y, Source, cut2,
+		    subStart[task], subMembers[task]);
+      subStart[task].push_back(subMembers[task].size());
+    });
+
+  // order subgroups by their first member
+  std::vector<std::pair<unsigned, Link> > order; // (first member, (task, subgroup))
+  for (unsigned task=0; task < nGroupTasks; ++task)
+    for (unsigned s=0; s+1 < subStart[task].size(); ++s)
+      order.push_back(std::make_pair(subMembers[task][subStart[task][s]], Link(task,s)));
+  std::sort(order.begin(), order.end());
+  members.reserve(n);
+  start.reserve(order.size()+1);
+  for (auto o = order.cbegin(); o != order.end(); ++o)
+    {
+      const std::vector<unsigned> &ss = subStart[o->second.first];
+      const std::vector<unsigned> &sm = subMembers[o->second.first];
+      unsigned s = o->second.second;
+      members.insert(members.end(), sm.begin()+ss[s], sm.begin()+ss[s+1]);
+      start.push_back(members.size());
+    }
+}
+
+}}}
@@ -2,6 +2,9 @@
 // 
 #include <iostream>
 #include <sstream>
+#include <vector>
+#include <algorithm>
+#include <unordered_map>
 
 #include "lsst/meas/simastrom/Associations.h"
 #include "lsst/meas/simastrom/CcdImage.h"
@@ -9,8 +12,13 @@
 #include "lsst/meas/simastrom/StarMatch.h"
 #include "lsst/meas/simastrom/ListMatch.h"
 #include "lsst/meas/simastrom/Frame.h"
+#include "lsst/meas/simastrom/FittedStarGrid.h"
 #include "lsst/meas/simastrom/AstroUtils.h"
 #include "lsst/meas/simastrom/FatPoint.h"
+#include "lsst/meas/simastrom/AssociationGroups.h"
+#include "lsst/meas/simastrom/ParallelFor.h"
+#include "lsst/meas/simastrom/StarFinder.h"
+#include "lsst/meas/simastrom/Checkpoint.h"
 #include "lsst/afw/image/Image.h"
 #include "lsst/daf/base/PropertySet.h"
 
@@ -32,10 +40,188 @@ static double sqr(const double &x) {return x*x;}
 namespace lsst {
 namespace meas {
 namespace simastrom {
+
+/* The FittedStar's within reach of a CcdImage, on the common tangent
+   plane, with a margin. */
+static Frame ccd_frame_ctp(const CcdImage &Ccd)
+{
+  Frame frameCTP = ApplyTransfo(Ccd.ImageFrame(), *Ccd.Pix2CommonTangentPlane(), LargeFrame);
+  return frameCTP.Rescale(1.10); // add 10 % margin.
+}
+
+/* A few cells per CCD side */
+static double grid_cell_size(const std::vector<Frame> &FramesCTP)
+{
+  if (FramesCTP.empty()) return 1.;
+  const Frame &firstFrame = FramesCTP.front();
+  double cellSize = 0.25*std::max(firstFrame.Width(), firstFrame.Height());
+  return (cellSize > 0) ? cellSize : 1.;
+}
+
+/* Associates the catalog of Ccd with the FittedStar's of Grid (on the
+   common tangent plane) that lie in FrameCTP. Unmatched measurements
+   become FittedStar's, which are added to NewStars and Grid if
+   EnlargeFittedList is true. If Originals is provided, the matched
+   FittedStar's that it holds are replaced by the ones they map to. */
+static void associate_ccd_image(CcdImage &ccdImage, const Frame &FrameCTP,
+				FittedStarGrid &Grid, const double MatchCutInArcSec,
+				const bool EnlargeFittedList, FittedStarList &NewStars,
+				const std::unordered_map<const FittedStar *, FittedStar *> *Originals = NULL)
+{
+  const Gtransfo *toCommonTangentPlane = 
+    ccdImage.Pix2CommonTangentPlane(); 
+
+  /* clear the catalog to fit and copy the whole catalog into it.
+     this enables to reassociate from scratch after a fit
+  */
+      
+  ccdImage.CatalogForFit().clear();
+  ccdImage.WholeCatalog().CopyTo(ccdImage.CatalogForFit());
+  MeasuredStarList &catalog = ccdImage.CatalogForFit();
+
+  // associate with previous lists
+  /* to speed up the match (more precisely the contruction of the
+     FastFinder), select in the fittedStarList the objects that
+     are within reach of the current ccdImage
+  */
+  /* we cannot use FittedStarList::ExtractInFrame, because it does an 
+     actual copy, which we don't want here: we want the pointers in 
+     the StarMatch to refer to fittedStarList elements. The grid
+     returns them in the fittedStarList order. */
+  FittedStarList toMatch;
+  Grid.ExtractInFrame(FrameCTP, toMatch);
+
+
+  // divide by 3600 because coordinates in CTP are in degrees.
+  StarMatchList *smList = ListMatchCollect(Measured2Base(catalog),
+					   Fitted2Base(toMatch),
+					   toCommonTangentPlane,
+					   MatchCutInArcSec/3600.);
+
+  /* should check what this RemoveAmbiguities does... */
+//  if (Preferences().cleanMatches)
+    smList->RemoveAmbiguities(*toCommonTangentPlane);
+
+  /* associate MeasuredStar -> FittedStar using the 
+     surviving matches */
+
+  int matchedCount = 0;
+  for (StarMatchIterator i= smList->begin(); i != smList->end(); ++i)
+    {
+      StarMatch &starMatch = *i;
+      const BaseStar &bs = *starMatch.s1;
+      const MeasuredStar &ms_const = dynamic_cast<const MeasuredStar &>(bs);
+      MeasuredStar &ms= const_cast<MeasuredStar &>(ms_const);
+      const BaseStar &bs2 = *starMatch.s2;
+      const FittedStar &fs_const = dynamic_cast<const FittedStar &>(bs2);
+      FittedStar *fs = const_cast<FittedStar *>(&fs_const);
+      if (Originals)
+	{
+	  auto o = Originals->find(fs);
+	  if (o != Originals->end()) fs = o->second;
+	}
+      ms.SetFittedStar(fs);
+      matchedCount++;
+    }
+  std::cout << " matched " << matchedCount << " objects" 
+	    << " in " << ccdImage.Name() << std::endl;
+  // delete the matches
+  delete smList;
+
+  // add unmatched objets to FittedStarList
+  int unMatchedCount = 0;
+  for (MeasuredStarIterator i = catalog.begin(); i!= catalog.end(); ++i)
+    {
+      MeasuredStar &mstar = **i;
+      // to check if it was matched, just check if it has 
+      // a fittedStar Pointer assigned
+      if (mstar.GetFittedStar()) continue;
+      if (EnlargeFittedList)
+	{
+	  FittedStar *fs = new FittedStar(mstar);
+	  // transform coordinates to CommonTangentPlane
+	  toCommonTangentPlane->TransformPosAndErrors(*fs, *fs);
+	  NewStars.push_back(fs);
+	  Grid.Insert(fs);
+	  mstar.SetFittedStar(fs);
+	}
+      unMatchedCount++;
+    }
+  std::cout << " unmatched objects :" << unMatchedCount << std::endl;
+  std::cout << " ************" << std::endl;
+}
+
+/* For each entry of Refs (projected on the CTP) that is not Taken,
+   the closest FittedStar of Fitted (on the CTP) within MaxDist. A
+   FittedStar keeps the closest reference star (the first one for
+   ties), as RemoveAmbiguities would do. Returns (entry, FittedStar)
+   pairs, in the order of Refs. */
+static std::vector<std::pair<size_t, const BaseStar *> > 
+match_ref_star_arrays(const RefStarArrays &Refs, const FittedStarList &Fitted,
+		      const double MaxDist, const unsigned NThreads,
+		      const std::vector<bool> *Taken = NULL)
+{
+  std::vector<std::pair<size_t, const BaseStar *> > kept;
+  const size_t nRefs = Refs.size();
+  if (Fitted.size() == 0) return kept;
+  std::vector<const BaseStar *> closest(nRefs, NULL);
+  std::unique_ptr<StarFinder> finder = MakeStarFinder(Fitted2Base(Fitted));
+  // reference catalogs usually extend beyond the FittedStar's: skip those
+  const FittedStar &first = *Fitted.front();
+  Frame frame(first.x, first.y, first.x, first.y);
+  for (FittedStarCIterator i = Fitted.begin(); i != Fitted.end(); ++i)
+    {
+      const FittedStar &fs = **i;
+      frame.xMin = std::min(frame.xMin, fs.x);
+      frame.xMax = std::max(frame.xMax, fs.x);
+      frame.yMin = std::min(frame.yMin, fs.y);
+      frame.yMax = std::max(frame.yMax, fs.y);
+    }
+  frame.CutMargin(-MaxDist);
+  const size_t chunk = 16384;
+  ParallelFor((nRefs+chunk-1)/chunk, NThreads, [&](unsigned c)
+	      {
+		std::vector<Point> where;
+		std::vector<size_t> index;
+		for (size_t k = c*chunk; k < std::min(nRefs, (c+1)*chunk); ++k)
+		  {
+		    if (Taken && (*Taken)[k]) continue;
+		    Point p(Refs.x[k], Refs.y[k]);
+		    if (!frame.InFrame(p)) continue;
+		    where.push_back(p);
+		    index.push_back(k);
+		  }
+		std::vector<const BaseStar *> found;
+		finder->FindClosest(where, MaxDist, found);
+		for (size_t j=0; j < index.size(); ++j) closest[index[j]] = found[j];
+	      });
+
+  /* several reference stars may pick the same FittedStar : keep the
+     closest one (the first one for ties), as RemoveAmbiguities would do */
+  std::vector<std::pair<const BaseStar *, size_t> > matches;
+  for (size_t k=0; k < closest.size(); ++k)
+    if (closest[k]) matches.push_back(std::make_pair(closest[k], k));
+  auto dist2 = [&](const std::pair<const BaseStar *, size_t> &M)
+    { return sqr(M.first->x-Refs.x[M.second])+sqr(M.first->y-Refs.y[M.second]);};
+  std::sort(matches.begin(), matches.end(),
+	    [&](const std::pair<const BaseStar *, size_t> &A, const std::pair<const BaseStar *, size_t> &B)
+	    {
+	      if (A.first != B.first) return A.first < B.first;
+	      double da = dist2(A), db = dist2(B);
+	      if (da != db) return da < db;
+	      return A.second < B.second;
+	    });
+  std::cout << " number of matches before removing ambiguities " << matches.size() << std::endl;
+  for (size_t m=0; m < matches.size(); ++m)
+    if (m == 0 || matches[m].first != matches[m-1].first)
+      kept.push_back(std::make_pair(matches[m].second, matches[m].first));
+  std::sort(kept.begin(), kept.end());
+  return kept;
+}
     
 // Source selection is performed in the python, so Associations' constructor is just initializing couple of variables
 Associations::Associations()
-  : nshoots_(0), nb_photref_associations(0)
+  : nshoots_(0), nb_photref_associations(0), nThreads(1)
 {
   commonTangentPoint = Point(0,0);
 }
@@ -105,106 +291,239 @@ void Associations::AssociateCatalogs(const double MatchCutInArcSec,
 	}
     }
 
+  /* Frames of the CcdImage's in the CTP, with a 10% margin. Used to
+     select in the fittedStarList the objects that are within reach of
+     each ccdImage. */
+  std::vector<Frame> ccdImageFramesCTP;
   for (CcdImageIterator i=ccdImageList.begin(); i != ccdImageList.end(); ++i)
-    {
-      CcdImage &ccdImage = **i;
-      
-      const Gtransfo *toCommonTangentPlane = 
-	ccdImage.Pix2CommonTangentPlane(); 
+    ccdImageFramesCTP.push_back(ccd_frame_ctp(**i));
 
-      /* clear the catalog to fit and copy the whole catalog into it.
-	 this enables to reassociate from scratch after a fit
-      */
-      
-      ccdImage.CatalogForFit().clear();
-      ccdImage.WholeCatalog().CopyTo(ccdImage.CatalogForFit());
-      MeasuredStarList &catalog = ccdImage.CatalogForFit();
+  /* Spatial index of the fittedStarList, updated when FittedStar's
+     are added. */
+  FittedStarGrid fittedStarGrid(grid_cell_size(ccdImageFramesCTP));
+  fittedStarGrid.Insert(fittedStarList);
 
-      // associate with previous lists
-      /* to speed up the match (more precisely the contruction of the
-	 FastFinder), select in the fittedStarList the objects that
-	 are within reach of the current ccdImage
-      */
-      Frame ccdImageFrameCPT = 
-	ApplyTransfo(ccdImage.ImageFrame(), *toCommonTangentPlane, LargeFrame);
-      ccdImageFrameCPT = ccdImageFrameCPT.Rescale(1.10); // add 10 % margin.
-      /* we cannot use FittedStarList::ExtractInFrame, because it does an 
-	 actual copy, which we don't want here: we want the pointers in 
-	 the StarMatch to refer to fittedStarList elements. */
-      FittedStarList toMatch;
-      
-      for (FittedStarCIterator i=fittedStarList.begin(); 
-	   i!= fittedStarList.end(); ++i)
+  unsigned ccdRank = 0;
+  for (CcdImageIterator i=ccdImageList.begin(); i != ccdImageList.end(); ++i, ++ccdRank)
+    associate_ccd_image(**i, ccdImageFramesCTP[ccdRank], fittedStarGrid, matchCut,
+			EnlargeFittedList, fittedStarList);
+    
+  AssignMags();
+}
+
+void Associations::AssociateCatalogsParallel(const double MatchCutInArcSec,
+					     const bool UseFittedList,
+					     const bool EnlargeFittedList)
+{
+  std::cout << " associating (all images at once) using a cut of " 
+	    << MatchCutInArcSec << " arcsec" << std::endl;
+
+  if (!UseFittedList) fittedStarList.clear();
+  else // clear measurement counts and associations to refstars.
+    {
+      for (FittedStarIterator i= fittedStarList.begin(); 
+	 i != fittedStarList.end(); ++i)
 	{
-	  if (ccdImageFrameCPT.InFrame(**i)) 
-	  {
-	    toMatch.push_back(*i);
-	  }
+	  (*i)->ClearBeforeAssoc();
 	}
+    }
 
+  /* positions on the CTP: the FittedStar's we start from (source 0),
+     and then the measurements of each CcdImage (source k+1), in
+     catalog order. */
+  std::vector<FittedStar *> fitted;
+  for (FittedStarIterator i= fittedStarList.begin(); i != fittedStarList.end(); ++i)
+    fitted.push_back(&(**i));
+  const unsigned nFitted = fitted.size();
 
-      // divide by 3600 because coordinates in CTP are in degrees.
-      StarMatchList *smList = ListMatchCollect(Measured2Base(catalog),
-					   Fitted2Base(toMatch),
-					   toCommonTangentPlane,
-					   matchCut/3600.);
-
-      /* should check what this RemoveAmbiguities does... */
-//      if (Preferences().cleanMatches)
-	smList->RemoveAmbiguities(*toCommonTangentPlane);
+  std::vector<CcdImage *> ccdImages;
+  for (CcdImageIterator i=ccdImageList.begin(); i != ccdImageList.end(); ++i)
+    ccdImages.push_back(&(**i));
+  const unsigned nCcd = ccdImages.size();
+  // clear the catalog to fit and copy the whole catalog into it.
+  ParallelFor(nCcd, nThreads, [&](unsigned k)
+	      {
+		CcdImage &ccdImage = *ccdImages[k];
+		ccdImage.CatalogForFit().clear();
+		ccdImage.WholeCatalog().CopyTo(ccdImage.CatalogForFit());
+	      });
+  std::vector<unsigned> offset(nCcd+1, nFitted);
+  for (unsigned k=0; k < nCcd; ++k)
+    offset[k+1] = offset[k]+ccdImages[k]->CatalogForFit().size();
+  const unsigned n = offset[nCcd];
+
+  FatPointArrays ctp;
+  ctp.resize(n);
+  std::vector<unsigned> source(n, 0);
+  std::vector<MeasuredStar *> measured(n, NULL);
+  for (unsigned k=0; k < nFitted; ++k) ctp.Set(k, *fitted[k]);
+  ParallelFor(nCcd, nThreads, [&](unsigned k)
+	      {
+		MeasuredStarList &catalog = ccdImages[k]->CatalogForFit();
+		FatPointArrays in, out;
+		in.resize(catalog.size());
+		unsigned p = 0;
+		for (MeasuredStarIterator i = catalog.begin(); i!= catalog.end(); ++i, ++p)
+		  {
+		    in.Set(p, **i);
+		    measured[offset[k]+p] = &(**i);
+		    source[offset[k]+p] = k+1;
+		  }
+		ccdImages[k]->Pix2CommonTangentPlane()->TransformPosAndErrorsBatch(in, out);
+		for (p=0; p < out.size(); ++p) ctp.Set(offset[k]+p, out.Get(p));
+	      });
+
+  // divide by 3600 because coordinates in CTP are in degrees.
+  AssociationGroups groups;
+  groups.Build(ctp.x, ctp.y, source, MatchCutInArcSec/3600., nThreads);
+
+  unsigned matchedCount = 0;
+  unsigned unMatchedCount = 0;
+  for (unsigned g=0; g < groups.size(); ++g)
+    {
+      const unsigned *group = groups.Group(g);
+      const unsigned size = groups.GroupSize(g);
+      FittedStar *fs = NULL;
+      if (group[0] < nFitted) fs = fitted[group[0]];
+      else if (EnlargeFittedList)
+	{
+	  fs = new FittedStar(*measured[group[0]]);
+	  // coordinates on the CommonTangentPlane
+	  static_cast<FatPoint &>(*fs) = ctp.Get(group[0]);
+	  fittedStarList.push_back(fs);
+	  unMatchedCount++;
+	}
+      else
+	{
+	  unMatchedCount += size;
+	  continue;
+	}
+      for (unsigned p=0; p < size; ++p)
+	{
+	  if (group[p] < nFitted) continue;
+	  measured[group[p]]->SetFittedStar(fs);
+	  if (p > 0) matchedCount++;
+	}
+    }
+  std::cout << " matched " << matchedCount << " objects, unmatched objects :"
+	    << unMatchedCount << " in " << nCcd << " images" << std::endl;
+  std::cout << " number of fitted stars " << fittedStarList.size() << std::endl;
+    
+  AssignMags();
+}
 
-      /* associate MeasuredStar -> FittedStar using the 
-	 surviving matches */
+/* The FittedStar's in place are matched through the grid on the common
+   tangent plane. When they are on the sky, the ones within reach of
+   the new CcdImage's are matched through copies projected on the CTP,
+   so that they are not modified, and the new FittedStar's are built on
+   the CTP, and deprojected at the end. */
+void Associations::AssociateNewCatalogs(const double MatchCutInArcSec, const unsigned FirstNew)
+{
+  std::vector<CcdImage *> newImages;
+  unsigned rank = 0;
+  for (CcdImageIterator i=ccdImageList.begin(); i != ccdImageList.end(); ++i, ++rank)
+    if (rank >= FirstNew) newImages.push_back(&(**i));
+  if (newImages.empty()) return;
+
+  std::cout << " associating " << newImages.size() << " new images with " 
+	    << fittedStarList.size() << " fitted stars, using a cut of " 
+	    << MatchCutInArcSec << " arcsec" << std::endl;
+
+  std::vector<Frame> framesCTP;
+  Frame reach;
+  for (unsigned k=0; k < newImages.size(); ++k)
+    {
+      framesCTP.push_back(ccd_frame_ctp(*newImages[k]));
+      if (k == 0) reach = framesCTP[k];
+      else reach += framesCTP[k];
+    }
 
-      int matchedCount = 0;
-      for (StarMatchIterator i= smList->begin(); i != smList->end(); ++i)
+  const bool onSky = !fittedStarList.inTangentPlaneCoordinates;
+  GtransfoLin identity;
+  TanRaDec2Pix sky2CTP(identity, commonTangentPoint);
+  FittedStarList proxies;
+  std::unordered_map<const FittedStar *, FittedStar *> originals;
+  FittedStarGrid grid(grid_cell_size(framesCTP));
+  for (FittedStarIterator i = fittedStarList.begin(); i != fittedStarList.end(); ++i)
+    {
+      FittedStar *fs = &(**i);
+      if (!onSky)
 	{
-	  StarMatch &starMatch = *i;
-	  const BaseStar &bs = *starMatch.s1;
-	  const MeasuredStar &ms_const = dynamic_cast<const MeasuredStar &>(bs);
-	  MeasuredStar &ms= const_cast<MeasuredStar &>(ms_const);
-	  const BaseStar &bs2 = *starMatch.s2;
-	  const FittedStar &fs_const = dynamic_cast<const FittedStar &>(bs2);
-	  FittedStar &fs = const_cast<FittedStar &>(fs_const);
-	  ms.SetFittedStar(&fs);
-	  matchedCount++;
-	  
-	  //	  if(  fs->Distance(toCommonTangentPlane->apply(*ms)) > 1.5/3600. )
-	  //	    cout << " OUTLIER: " << ccdImage.Shoot() << "p" << ccdImage.Chip() 
-	  //		 << ms->x << "," << ms->y 
-	  //		 << endl;
+	  if (reach.InFrame(*fs)) grid.Insert(fs);
+	  continue;
+	}
+      Point whereCTP = sky2CTP.apply(*fs);
+      if (!reach.InFrame(whereCTP)) continue;
+      FittedStar *proxy = new FittedStar(*fs);
+      proxy->x = whereCTP.x;
+      proxy->y = whereCTP.y;
+      proxies.push_back(proxy);
+      originals[proxy] = fs;
+      grid.Insert(proxy);
+    }
+
+  FittedStarList newStars;
+  for (unsigned k=0; k < newImages.size(); ++k)
+    associate_ccd_image(*newImages[k], framesCTP[k], grid, MatchCutInArcSec,
+			true, newStars, &originals);
+  proxies.clear();
+  AssignMags(FirstNew);
 
+  /* the reference stars that are not associated yet may go to the new
+     FittedStar's */
+  if (refStarArrays.size())
+    {
+      std::vector<bool> taken(refStarArrays.size(), false);
+      for (RefStarCIterator i = refStarList.begin(); i != refStarList.end(); ++i)
+	if ((*i)->Index() < taken.size()) taken[(*i)->Index()] = true;
+      std::vector<std::pair<size_t, const BaseStar *> > kept = 
+	match_ref_star_arrays(refStarArrays, newStars, usnoMatchCut/3600., nThreads, &taken);
+      for (auto m = kept.cbegin(); m != kept.cend(); ++m)
+	{
+	  RefStar *rs = refStarArrays.MakeRefStar(m->first);
+	  refStarList.push_back(rs);
+	  FittedStar &fs = const_cast<FittedStar &>(dynamic_cast<const FittedStar &>(*m->second));
+	  fs.SetRefStar(rs);
 	}
-      std::cout << " matched " << matchedCount << " objects" 
-		<< " in " << ccdImage.Name() << std::endl;
-      // delete the matches
-      delete smList;
+      std::cout << " associated " << kept.size() << " more REFERENCE stars" << std::endl;
+    }
 
-      // add unmatched objets to FittedStarList
-      int unMatchedCount = 0;
-      for (MeasuredStarIterator i = catalog.begin(); i!= catalog.end(); ++i)
+  /* the cuts of SelectFittedStars, for the new FittedStar's only: the
+     ones in place were selected already. */
+  std::unordered_map<const FittedStar *, bool> isNew;
+  for (FittedStarCIterator i = newStars.begin(); i != newStars.end(); ++i)
+    isNew[&(**i)] = true;
+  for (unsigned k=0; k < newImages.size(); ++k)
+    {
+      MeasuredStarList &catalog = newImages[k]->CatalogForFit();
+      for (MeasuredStarIterator mi = catalog.begin(); mi != catalog.end(); )
 	{
-	  MeasuredStar &mstar = **i;
-	  // to check if it was matched, just check if it has 
-	  // a fittedStar Pointer assigned
-	  if (mstar.GetFittedStar()) continue;
-	  if (EnlargeFittedList)
+	  const FittedStar *fstar = (*mi)->GetFittedStar();
+	  if (fstar && isNew.count(fstar) && !fstar->GetRefStar() 
+	      && fstar->MeasurementCount() < minMeasurementCount)
 	    {
-	      FittedStar *fs = new FittedStar(mstar);
-	      // transform coordinates to CommonTangentPlane
-	      toCommonTangentPlane->TransformPosAndErrors(*fs, *fs);
-	      //	      fs->Apply(*toCommonTangentPlane);
-	      fittedStarList.push_back(fs);
-	      mstar.SetFittedStar(fs);
+	      const_cast<FittedStar *>(fstar)->MeasurementCount()--;
+	      mi = catalog.erase(mi);
 	    }
-	  unMatchedCount++;
+	  else ++mi;
 	}
-      std::cout << " unmatched objects :" << unMatchedCount << std::endl;
-      std::cout << " ************" << std::endl;
-    } // end of loop on CcdImage's
-    
-  AssignMags();
+    }
+  for (FittedStarIterator fi = newStars.begin(); fi != newStars.end(); )
+    {
+      if ((*fi)->MeasurementCount() == 0) fi = newStars.erase(fi);
+      else ++fi;
+    }
+
+  if (onSky)
+    {
+      TanPix2RaDec ctp2Sky(identity, commonTangentPoint);
+      newStars.ApplyTransfo(ctp2Sky);
+    }
+  std::cout << " INFO: " << newStars.size() << " new fitted stars, " 
+	    << fittedStarList.size()+newStars.size() << " in total" << std::endl;
+  fittedStarList.splice(fittedStarList.end(), newStars);
 }
+
 void Associations::CollectRefStars(const bool ProjectOnTP)
 {
 
@@ -271,35 +590,64 @@ void Associations::CollectLSSTRefStars(lsst::afw::table::SortedCatalogT< lsst::a
 //  auto coordKey = Ref.getSchema().find<lsst::afw::coord::Coord>("coord").key;	
 // Same syntax as the following line but with auto :  auto coordKey = afwTable::CoordKey(Ref.getSchema()["coord"]);
   afw::table::CoordKey coordKey = Ref.getSchema()["coord"];
+  auto raKey = coordKey.getRa();
+  auto decKey = coordKey.getDec();
   auto fluxKey = Ref.getSchema().find<double>(filter + "_flux").key;
 //  auto fluxSigmaKey = Ref.getSchema().find<double>(filter + "_fluxSigma").key;
-    
-  for (auto i = Ref.begin(); i != Ref.end(); i++)
-    {
-	lsst::afw::coord::Coord coord = i->get(coordKey);
-	double flux = i->get(fluxKey);
-//	double fluxErr = i->get(fluxSigmaKey);
-	double mag = lsst::afw::image::abMagFromFlux(flux);
-	double ra = lsst::afw::geom::radToDeg(coord.getLongitude());
-	double dec = lsst::afw::geom::radToDeg(coord.getLatitude());
-//	std::cout << flux/fluxErr << " " << mag << std::endl;
-//	if (flux/fluxErr < 10.0 || mag > 20. || mag < 16.) {
-//	    continue;
-//	}
-	BaseStar s(ra,dec,mag);
-	// cook up errors: 100 mas per cooordinate
-	s.vx = sqr(0.1/3600/cos(coord.getLatitude()));
-	s.vy = sqr(0.1/3600);
-	s.vxy = 0.;
-	RefStar *r = new RefStar(s, s);
-	refStarList.push_back(r);
+
+  // copy the columns, without building Coord's and RefStar's
+  RefStarArrays &refs = refStarArrays;
+  size_t nRefs = Ref.size();
+  refs.resize(nRefs);
+  std::vector<double> flux(nRefs);
+  size_t k = 0;
+  for (auto i = Ref.begin(); i != Ref.end(); ++i, ++k)
+    {
+      refs.ra[k] = i->get(raKey).asDegrees();
+      refs.dec[k] = i->get(decKey).asDegrees();
+      flux[k] = i->get(fluxKey);
     }
-      
+  const double deg = M_PI/180.;
+  for (k=0; k < nRefs; ++k)
+    {
+      refs.mag[k] = lsst::afw::image::abMagFromFlux(flux[k]);
+      // cook up errors: 100 mas per cooordinate
+      refs.vx[k] = sqr(0.1/3600/cos(refs.dec[k]*deg));
+      refs.vy[k] = sqr(0.1/3600);
+    }
+
   // project on CTP (i.e. RaDec2CTP), in degrees
   GtransfoLin identity;
   TanRaDec2Pix RaDec2CTP(identity, commonTangentPoint);
+  refs.Project(RaDec2CTP, nThreads);
   
-  AssociateRefStars(usnoMatchCut, &RaDec2CTP);
+  AssociateRefStarArrays(usnoMatchCut);
+}
+
+void Associations::AssociateRefStarArrays(const double MatchCutInArcSec)
+{
+  // clear previous associations if any : 
+  for (FittedStarIterator i = fittedStarList.begin(); i != fittedStarList.end(); ++i)
+    (*i)->SetRefStar(NULL);
+  refStarList.clear();
+
+  std::cout << " AssociateRefStarArrays : MatchCutInArcSec " << MatchCutInArcSec << std::endl;
+
+  // 3600 because coordinates are in degrees (in CTP).
+  const RefStarArrays &refs = refStarArrays;
+  std::vector<std::pair<size_t, const BaseStar *> > kept = 
+    match_ref_star_arrays(refs, fittedStarList, MatchCutInArcSec/3600., nThreads);
+  // build the RefStar's in the order of the catalog
+  for (auto m = kept.cbegin(); m != kept.cend(); ++m)
+    {
+      RefStar *rs = refs.MakeRefStar(m->first);
+      refStarList.push_back(rs);
+      FittedStar &fs = const_cast<FittedStar &>(dynamic_cast<const FittedStar &>(*m->second));
+      fs.SetRefStar(rs);
+    }
+
+  std::cout << " associated " << refStarList.size() << " REFERENCE stars " 
+	    << " among a list of " << refs.size() << std::endl;
 }
 
 const lsst::afw::geom::Box2D Associations::GetRaDecBBox()
@@ -328,6 +676,23 @@ const lsst::afw::geom::Box2D Associations::GetRaDecBBox()
   
 }
 
+std::vector<lsst::afw::geom::Box2D> Associations::GetCcdRaDecBBoxes() const
+{
+  GtransfoLin identity;
+  TanPix2RaDec CTP2RaDec(identity, commonTangentPoint);
+  std::vector<lsst::afw::geom::Box2D> boxes;
+  for (CcdImageCIterator i=ccdImageList.begin(); i!= ccdImageList.end(); ++i)
+    {
+      const CcdImage &ccdImage = **i;
+      Frame CTPFrame = ApplyTransfo(ccdImage.ImageFrame(),*ccdImage.Pix2CommonTangentPlane(),LargeFrame);
+      Frame raDecFrame = ApplyTransfo(CTPFrame,CTP2RaDec,LargeFrame);  
+      lsst::afw::geom::Point<double> min(raDecFrame.xMin, raDecFrame.yMin);
+      lsst::afw::geom::Point<double> max(raDecFrame.xMax, raDecFrame.yMax);
+      boxes.push_back(lsst::afw::geom::Box2D(min, max));
+    }
+  return boxes;
+}
+
 void Associations::AssociateRefStars(const double &MatchCutInArcSec, 
 				     const Gtransfo* T)
 {
@@ -435,9 +800,11 @@ void Associations::SelectFittedStars()
     << fittedStarList.size() << std::endl;
 }
 
-void Associations::AssignMags()
+void Associations::AssignMags(const unsigned FirstCcd)
 {
-  for (CcdImageIterator i=ccdImageList.begin(); i!= ccdImageList.end(); ++i)
+  CcdImageIterator first = ccdImageList.begin();
+  for (unsigned k=0; k < FirstCcd && first != ccdImageList.end(); ++k) ++first;
+  for (CcdImageIterator i=first; i!= ccdImageList.end(); ++i)
     {
       CcdImage &ccdImage = **i;
       MeasuredStarList &catalog = ccdImage.CatalogForFit();
@@ -471,6 +838,167 @@ void Associations::DeprojectFittedStars()
 }
 
 
+static const char assoc_checkpoint_magic[] = "SIMASSOC";
+
+/* In checkpoints, links to FittedStar's and RefStar's are saved as
+   ranks in fittedStarList and refStarList, -1 meaning no link. */
+template <class Star> static std::unordered_map<const Star*, long long> star_ranks(const StarList<Star> &L)
+{
+  std::unordered_map<const Star*, long long> ranks(L.size());
+  long long rank = 0;
+  for (auto i = L.cbegin(); i != L.end(); ++i, ++rank) ranks[&**i] = rank;
+  return ranks;
+}
+
+template <class Star> static long long rank_of(const std::unordered_map<const Star*, long long> &Ranks, const Star *S)
+{
+  if (!S) return -1;
+  auto i = Ranks.find(S);
+  // a star that is not in the list any longer : the link is lost
+  return (i == Ranks.end()) ? -1 : i->second;
+}
+
+template <class Star> static Star *star_at(const std::vector<Star*> &Stars, const long long Rank, const std::string &FileName)
+{
+  if (Rank < 0) return NULL;
+  if (Rank >= (long long)(Stars.size()))
+    throw LSST_EXCEPT(pex::exceptions::InvalidParameterError, "Associations::ReadCheckpoint : "+FileName+" is corrupted");
+  return Stars[Rank];
+}
+
+static void write_fitted_links(CheckpointWriter &W, const MeasuredStarList &Catalog,
+			       const std::unordered_map<const FittedStar*, long long> &FittedRanks)
+{
+  std::vector<long long> links;
+  links.reserve(Catalog.size());
+  for (auto i = Catalog.cbegin(); i != Catalog.end(); ++i)
+    links.push_back(rank_of(FittedRanks, (*i)->GetFittedStar()));
+  W.PutVector(links);
+}
+
+// the list is not modified, only its stars
+static void read_fitted_links(CheckpointReader &R, const MeasuredStarList &Catalog,
+			      const std::vector<FittedStar*> &FittedStars)
+{
+  std::vector<long long> links;
+  R.GetVector(links);
+  if (links.size() != Catalog.size())
+    throw LSST_EXCEPT(pex::exceptions::InvalidParameterError, "Associations::ReadCheckpoint : "+R.FileName()+" is corrupted");
+  auto l = links.cbegin();
+  for (auto i = Catalog.cbegin(); i != Catalog.end(); ++i, ++l)
+    (*i)->SetFittedStar(star_at(FittedStars, *l, R.FileName()));
+}
+
+void Associations::WriteCheckpoint(const std::string &FileName) const
+{
+  CheckpointWriter w(FileName, assoc_checkpoint_magic);
+  w.Put(commonTangentPoint.x); w.Put(commonTangentPoint.y);
+  w.Put(nshoots_);
+  w.Put(fittedStarList.inTangentPlaneCoordinates);
+
+  auto fittedRanks = star_ranks(fittedStarList);
+  auto refRanks = star_ranks<RefStar>(refStarList);
+
+  w.Put<unsigned long long>(fittedStarList.size());
+  for (auto f = fittedStarList.cbegin(); f != fittedStarList.end(); ++f)
+    {
+      (*f)->Write(w);
+      w.Put(rank_of(refRanks, (*f)->GetRefStar()));
+    }
+  w.Put<unsigned long long>(refStarList.size());
+  for (auto r = refStarList.cbegin(); r != refStarList.end(); ++r)
+    {
+      (*r)->Write(w);
+      w.Put(rank_of<FittedStar>(fittedRanks, (*r)->fittedStar.get()));
+    }
+  w.PutVector(refStarArrays.ra); w.PutVector(refStarArrays.dec);
+  w.PutVector(refStarArrays.mag);
+  w.PutVector(refStarArrays.vx); w.PutVector(refStarArrays.vy);
+  w.PutVector(refStarArrays.x); w.PutVector(refStarArrays.y);
+
+  w.Put<unsigned long long>(ccdImageList.size());
+  for (auto i = ccdImageList.cbegin(); i != ccdImageList.end(); ++i)
+    {
+      const CcdImage &ccdImage = **i;
+      ccdImage.Write(w);
+      write_fitted_links(w, ccdImage.WholeCatalog(), fittedRanks);
+      write_fitted_links(w, ccdImage.CatalogForFit(), fittedRanks);
+    }
+  w.Close();
+  std::cout << "INFO: wrote " << ccdImageList.size() << " CcdImage's, "
+	    << fittedStarList.size() << " fitted stars and "
+	    << refStarList.size() << " reference stars into " << FileName << std::endl;
+}
+
+void Associations::ReadCheckpoint(const std::string &FileName)
+{
+  CheckpointReader r(FileName, assoc_checkpoint_magic);
+  ccdImageList.clear();
+  refStarList.clear();
+  fittedStarList.clear();
+  refStarArrays.clear();
+
+  r.Get(commonTangentPoint.x); r.Get(commonTangentPoint.y);
+  r.Get(nshoots_);
+  r.Get(fittedStarList.inTangentPlaneCoordinates);
+
+  unsigned long long nFitted = r.Get<unsigned long long>();
+  r.CheckSize(nFitted, 1);
+  std::vector<FittedStar*> fittedStars;
+  std::vector<long long> refLinks;
+  fittedStars.reserve(nFitted);
+  refLinks.reserve(nFitted);
+  for (unsigned long long k=0; k < nFitted; ++k)
+    {
+      FittedStar *f = new FittedStar();
+      f->Read(r);
+      refLinks.push_back(r.Get<long long>());
+      fittedStarList.push_back(f);
+      fittedStars.push_back(f);
+    }
+  // MeasuredStar::SetFittedStar increments them: restored at the end.
+  std::vector<int> measurementCounts;
+  measurementCounts.reserve(nFitted);
+  for (auto f = fittedStars.cbegin(); f != fittedStars.end(); ++f)
+    measurementCounts.push_back((*f)->MeasurementCount());
+
+  unsigned long long nRefs = r.Get<unsigned long long>();
+  r.CheckSize(nRefs, 1);
+  std::vector<RefStar*> refStars;
+  refStars.reserve(nRefs);
+  for (unsigned long long k=0; k < nRefs; ++k)
+    {
+      RefStar *ref = new RefStar(BaseStar(), Point());
+      ref->Read(r);
+      ref->fittedStar = star_at(fittedStars, r.Get<long long>(), FileName);
+      refStarList.push_back(ref);
+      refStars.push_back(ref);
+    }
+  for (unsigned long long k=0; k < nFitted; ++k)
+    fittedStars[k]->SetRefStar(star_at(refStars, refLinks[k], FileName));
+
+  r.GetVector(refStarArrays.ra); r.GetVector(refStarArrays.dec);
+  r.GetVector(refStarArrays.mag);
+  r.GetVector(refStarArrays.vx); r.GetVector(refStarArrays.vy);
+  r.GetVector(refStarArrays.x); r.GetVector(refStarArrays.y);
+
+  unsigned long long nCcds = r.Get<unsigned long long>();
+  r.CheckSize(nCcds, 1);
+  for (unsigned long long k=0; k < nCcds; ++k)
+    {
+      boost::shared_ptr<CcdImage> ccdImage(new CcdImage(r));
+      read_fitted_links(r, ccdImage->WholeCatalog(), fittedStars);
+      read_fitted_links(r, ccdImage->CatalogForFit(), fittedStars);
+      ccdImageList.push_back(ccdImage);
+    }
+  for (unsigned long long k=0; k < nFitted; ++k)
+    fittedStars[k]->MeasurementCount() = measurementCounts[k];
+  std::cout << "INFO: read " << ccdImageList.size() << " CcdImage's, "
+	    << fittedStarList.size() << " fitted stars and "
+	    << refStarList.size() << " reference stars from " << FileName << std::endl;
+}
+
+
 #ifdef STORAGE
 void Associations::CollectMCStars(int realization)
 {
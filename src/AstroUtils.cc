@@ -9,6 +9,7 @@
 #include "lsst/meas/simastrom/AstroUtils.h"
 #include "lsst/meas/simastrom/Frame.h"
 #include "lsst/meas/simastrom/Gtransfo.h"
+#include "lsst/meas/simastrom/RefCatalog.h"
 
 namespace lsst {
 namespace meas {
@@ -364,6 +365,13 @@ int UsnoRead(double minra, double maxra,
   if (ascii_source)
     read_ascii_astrom_file(ascii_source, minra,maxra,mindec,maxdec, 
 			   ApmList);
+  else if (getenv("REFCATFILE"))
+    {
+      MappedRefCatalog refCat(getenv("REFCATFILE"));
+      unsigned count = refCat.Read(Frame(minra, mindec, maxra, maxdec), Color, ApmList);
+      std::cout << " collected " << count << " objects from " 
+		<< getenv("REFCATFILE") << std::endl;
+    }
   else
     {
       const char *usno_dir = getenv("USNODIR");
@@ -375,7 +383,7 @@ int UsnoRead(double minra, double maxra,
 	}
       else
 	{
-	  std::cerr << " ERROR : You should define USNODIR or USNOFILE env var, " 
+	  std::cerr << " ERROR : You should define USNODIR, REFCATFILE or USNOFILE env var, " 
 		    << std::endl
 		    << " or provide ASTROM_CATALOG_NAME via datacards to run this code " << std::endl;
 	  return 0;
@@ -392,18 +400,15 @@ int UsnoRead(const Frame &W, UsnoColor Color, BaseStarList &ApmList)
 
 Frame ApplyTransfo(const Frame& inputframe,const Gtransfo &T, const WhichTransformed W) 
 {
-  // 2 opposite corners
-  double xtmin1, xtmax1, ytmin1, ytmax1;
-  T.apply(inputframe.xMin,inputframe.yMin,xtmin1,ytmin1);
-  T.apply(inputframe.xMax,inputframe.yMax,xtmax1,ytmax1);
-  Frame fr1(std::min(xtmin1,xtmax1), std::min(ytmin1,ytmax1), 
-	    std::max(xtmin1,xtmax1), std::max(ytmin1,ytmax1));
-  // 2 other corners
-  double xtmin2, xtmax2, ytmin2, ytmax2;
-  T.apply(inputframe.xMin, inputframe.yMax, xtmin2, ytmax2);
-  T.apply(inputframe.xMax, inputframe.yMin, xtmax2, ytmin2);
-  Frame fr2(std::min(xtmin2,xtmax2), std::min(ytmin2,ytmax2), 
-	    std::max(xtmin2,xtmax2), std::max(ytmin2,ytmax2));
+  // the 4 corners, in one call: 2 opposite corners, then the 2 other ones
+  double x[4] = {inputframe.xMin, inputframe.xMax, inputframe.xMin, inputframe.xMax};
+  double y[4] = {inputframe.yMin, inputframe.yMax, inputframe.yMax, inputframe.yMin};
+  double xt[4], yt[4];
+  T.ApplyBatch(x, y, xt, yt, 4);
+  Frame fr1(std::min(xt[0],xt[1]), std::min(yt[0],yt[1]), 
+	    std::max(xt[0],xt[1]), std::max(yt[0],yt[1]));
+  Frame fr2(std::min(xt[2],xt[3]), std::min(yt[2],yt[3]), 
+	    std::max(xt[2],xt[3]), std::max(yt[2],yt[3]));
 
   if (W == SmallFrame) return fr1*fr2;
   return fr1+fr2;
@@ -1,138 +1,26 @@
 #include <iostream>
 #include <iomanip>
 #include <algorithm>
+#include <unordered_map>
 #include "lsst/meas/simastrom/AstromFit.h"
 #include "lsst/meas/simastrom/Associations.h"
 #include "lsst/meas/simastrom/Mapping.h"
 
 #include "lsst/meas/simastrom/Gtransfo.h"
 #include "Eigen/Sparse"
-#include "Eigen/CholmodSupport" // to switch to cholmod
 #include <time.h> // for clock
 #include "lsst/pex/exceptions.h"
 #include <fstream>
+#include "lsst/meas/simastrom/MeasuredStarArrays.h"
 #include "lsst/meas/simastrom/Tripletlist.h"
+#include "lsst/meas/simastrom/ParallelFor.h"
+#include "lsst/meas/simastrom/ResidualTable.h"
+#include "lsst/meas/simastrom/SparseSolver.h"
+#include "lsst/meas/simastrom/SparseHessian.h"
 
 typedef Eigen::SparseMatrix<double> SpMat;
 
 
-#if 0
-template<typename _MatrixType, int _UpLo = Eigen::Lower>
-class CholmodSupernodalLLT2 : public Eigen::CholmodBase<_MatrixType, _UpLo, CholmodSupernodalLLT2<_MatrixType, _UpLo> >
-{
-  typedef Eigen::CholmodBase<_MatrixType, _UpLo, CholmodSupernodalLLT2> Base;
-    using Base::m_cholmod;
-    
-  public:
-    
-    typedef _MatrixType MatrixType;
-    typedef typename MatrixType::Index Index;
-    
-    CholmodSupernodalLLT2() : Base() { init(); }
-  //! The factorization happens in the constructor.
-    CholmodSupernodalLLT2(const MatrixType& matrix) : Base()
-    {
-      init();
-      this->compute(matrix);
-    }
-
-  //! this routine is the one we added.
-  int update(const SpMat &H, const bool UpOrDown)
-  {
-    // check size
-    const Index size = Base::m_cholmodFactor->n;
-    EIGEN_UNUSED_VARIABLE(size);
-    eigen_assert(size==H.rows());
-    cholmod_sparse C_cs = viewAsCholmod(H);
-    /* We have to apply the magic permutation to the update matrix, 
-       read page 117 of Cholmod UserGuide.pdf */
-    cholmod_sparse *C_cs_perm = cholmod_submatrix(C_cs,
-						  Base::m_cholmodFactor->Perm,
-						  Base::m_cholmodFactor->n,
-						  NULL, -1, NULL, true, true,
-						  &this->cholmod());
-    
-    int ret = cholmod_updown(UpOrDown, &C_cs_perm, Base::m_cholmodFactor, &this->cholmod());
-    cholmod_free_sparse(C_cs_perm,  &this->cholmod());
-    return ret;
-  }
-
-    ~CholmodSupernodalLLT2() {}
-  protected:
-    void init()
-    {
-      m_cholmod.final_asis = 1;
-      m_cholmod.supernodal = CHOLMOD_SUPERNODAL;
-      // In CholmodBase::CholmodBase(), the following statement is missing in
-      // SuiteSparse 3.2.0.8. Fixed in 3.2.7
-      Base::m_shiftOffset[0] = Base::m_shiftOffset[1] = RealScalar(0.0);
-    }
-};
-#endif
-
-
-//! Cholesky factorization class using cholmod, with the small-rank update capability. 
-/*! Class derived from Eigen's CholmodBase, to add the factorization
-    update capability to the interface. Besides this addition, it
-    behaves the same way as Eigen's native Cholesky factorization
-    classes. It relies on the simplicial LDLt factorization.*/
-template<typename _MatrixType, int _UpLo = Eigen::Lower>
-class CholmodSimplicialLDLT2 : public Eigen::CholmodBase<_MatrixType, _UpLo, CholmodSimplicialLDLT2<_MatrixType, _UpLo> >
-{
-  typedef Eigen::CholmodBase<_MatrixType, _UpLo, CholmodSimplicialLDLT2> Base;
-    using Base::m_cholmod;
-    
-  public:
-    
-    typedef _MatrixType MatrixType;
-    typedef typename MatrixType::Index Index;
-    typedef typename MatrixType::RealScalar RealScalar;
-    
-    CholmodSimplicialLDLT2() : Base() { init(); }
-
-    CholmodSimplicialLDLT2(const MatrixType& matrix) : Base()
-    {
-      init();
-      this->compute(matrix);
-    }
-
-    // this routine is the one we added
-    int update(const SpMat &H, const bool UpOrDown)
-    {
-      // check size
-      const Index size = Base::m_cholmodFactor->n;
-      EIGEN_UNUSED_VARIABLE(size);
-      eigen_assert(size==H.rows());
-      
-      cholmod_sparse C_cs = viewAsCholmod(H);
-      /* We have to apply the magic permutation to the update matrix, 
-	 read page 117 of Cholmod UserGuide.pdf */
-      cholmod_sparse *C_cs_perm = cholmod_submatrix(&C_cs,
-						    (int *) Base::m_cholmodFactor->Perm,
-						    Base::m_cholmodFactor->n,
-						    NULL, -1, true, true,
-						    &this->cholmod());
-      assert(C_cs_perm);
-      int ret = cholmod_updown(UpOrDown, C_cs_perm, Base::m_cholmodFactor, &this->cholmod());
-      cholmod_free_sparse(&C_cs_perm,  &this->cholmod());
-      assert(ret != 0);
-      return ret;
-    }
-
-    ~CholmodSimplicialLDLT2() {}
-  protected:
-    void init()
-    {
-      m_cholmod.final_asis = 1;
-      m_cholmod.supernodal = CHOLMOD_SIMPLICIAL;
-      // In CholmodBase::CholmodBase(), the following statement is missing in
-      // SuiteSparse 3.2.0.8. Fixed in 3.2.7
-      Base::m_shiftOffset[0] = Base::m_shiftOffset[1] = RealScalar(0.0);
-    }
-};
-
-
-
 using namespace std;
 
 static double sqr(const double &x) {return x*x;}
@@ -144,8 +32,52 @@ namespace meas {
 namespace simastrom {
 
 
+//! The factorization of the last Minimize call, and the pattern it was analyzed for.
+/*! The symbolic analysis (fill-reducing ordering, elimination tree
+  and column counts) only depends on the nonzero pattern of the
+  Hessian, and remains valid for any matrix whose pattern is
+  included in the analyzed one. This is the case when the parameter
+  layout did not change and measurements were only discarded since
+  the analysis. The numeric factorization can then be redone without
+  a new analysis. */
+struct AstromFit::FactorizationCache
+{
+  std::string whatToFit;
+  SparsePattern pattern;
+  std::unique_ptr<SparseSolver> solver;
+  SchurSolver *schur; // same object as solver when positions are eliminated, NULL otherwise.
+
+  FactorizationCache(const std::string &SolverName, const unsigned MaxIterations,
+		     const bool EliminatePositions, const unsigned NThreads) : schur(NULL)
+  {
+    if (EliminatePositions)
+      {
+	schur = new SchurSolver(MakeSparseSolver(SolverName, true /* lower triangle only */), NThreads);
+	solver.reset(schur);
+      }
+    else solver = MakeSparseSolver(SolverName);
+    solver->SetMaxIterations(MaxIterations);
+  }
+
+  //! whether the analysis can be reused to factorize H.
+  bool Covers(const std::string &WhatToFit, const SpMat &H) const
+  {
+    return (WhatToFit == whatToFit && pattern.Covers(H));
+  }
+
+  void SetPattern(const std::string &WhatToFit, const SpMat &H)
+  {
+    whatToFit = WhatToFit;
+    pattern.Set(H);
+  }
+};
+
+
+
 AstromFit::AstromFit(Associations &A, DistortionModel *D, double PosError) : 
-  _assoc(A),  _distortionModel(D), _posError(PosError)
+  _assoc(A),  _distortionModel(D), _posError(PosError), _nThreads(1),
+  _solverName("simplicial"), _solverMaxIterations(0), _eliminatePositions(false), _directAssembly(false),
+  _firstNewCcd(0), _nAnalyses(0)
 {
   _LastNTrip = 0;
   _JDRef = 0;
@@ -180,6 +112,54 @@ AstromFit::AstromFit(Associations &A, DistortionModel *D, double PosError) :
 
 }
 
+AstromFit::~AstromFit()
+{
+}
+
+void AstromFit::SetSolver(const std::string &SolverName, const unsigned MaxIterations)
+{
+  MakeSparseSolver(SolverName); // throws if unknown
+  _solverName = SolverName;
+  _solverMaxIterations = MaxIterations;
+  _factorizationCache.reset();
+}
+
+void AstromFit::SetEliminatePositions(const bool Eliminate)
+{
+  _eliminatePositions = Eliminate;
+  _factorizationCache.reset();
+}
+
+void AstromFit::RestrictToNewCcdImages(const unsigned FirstNew)
+{
+  _firstNewCcd = FirstNew;
+  _factorizationCache.reset(); // the parameter layout changes
+  AssignIndices(_WhatToFit);
+}
+
+std::vector<const CcdImage *> AstromFit::FittedCcdImages() const
+{
+  const CcdImageList &L = _assoc.TheCcdImageList();
+  std::vector<const CcdImage *> ccds;
+  ccds.reserve(L.size());
+  unsigned rank = 0;
+  for (auto im=L.cbegin(); im!=L.end() ; ++im, ++rank)
+    if (rank >= _firstNewCcd) ccds.push_back(im->get());
+  return ccds;
+}
+
+void AstromFit::ToFitIndices(std::vector<unsigned> &Indices) const
+{
+  if (_fitIndex.empty()) return;
+  size_t n = 0;
+  for (size_t k=0; k < Indices.size(); ++k)
+    {
+      int index = FitIndex(Indices[k]);
+      if (index >= 0) Indices[n++] = index;
+    }
+  Indices.resize(n);
+}
+
 
 
 #define NPAR_PM 2
@@ -213,17 +193,32 @@ Point AstromFit::TransformFittedStar(const FittedStar &F,
   we need it.  */
 static void TweakAstromMeasurementErrors(FatPoint &P, const MeasuredStar &Ms, double error)
 {
-  static bool called=false;
-  static double increment = 0;
-  if (!called)
-    {
-      increment = sqr(error); // was in Preferences
-      called = true;
-    }
+  /* no static caching of the increment here: this routine is called
+     concurrently when looping over CcdImage's with several threads. */
+  double increment = sqr(error); // was in Preferences
   P.vx += increment;
   P.vy += increment;
 }
 
+/* The valid measurements of Meas, with their tweaked errors, in In, to
+   be handed over to Mapping::TransformPosAndErrorsBatch (et al). Rank[n]
+   is the index in Meas of point n of In. */
+static void gather_valid_positions(const MeasuredStarArrays &Meas, const double PosError,
+				   FatPointArrays &In, std::vector<unsigned> &Rank)
+{
+  In.resize(Meas.size());
+  Rank.clear();
+  for (size_t k=0; k < Meas.size(); ++k)
+    {
+      if (!Meas.valid[k]) continue;
+      FatPoint inPos = Meas.Position(k);
+      TweakAstromMeasurementErrors(inPos, *Meas.star[k], PosError);
+      In.Set(Rank.size(), inPos);
+      Rank.push_back(k);
+    }
+  In.resize(Rank.size());
+}
+
 static bool heavyDebug = false;
 static unsigned fsIndexDebug = 0;
 
@@ -234,9 +229,21 @@ static unsigned fsIndexDebug = 0;
 void AstromFit::LSDerivatives1(const CcdImage &Ccd, 
 			      TripletList &TList, Eigen::VectorXd &Rhs,
 			      const MeasuredStarList *M) const
+{
+  FillLSDerivatives1(Ccd, TList, Rhs, M);
+}
+
+/* The actual routine is a template so that the gradient can either be
+   a dense vector, or a GradientSlice when computing the derivatives of
+   several CcdImage's concurrently (see LSDerivatives). */
+template <class RhsType>
+void AstromFit::FillLSDerivatives1(const CcdImage &Ccd,
+				   TripletList &TList, RhsType &Rhs,
+				   const MeasuredStarList *M) const
 {
   /***************************************************************************/
   /**  Changes in this routine should be reflected into AccumulateStatImage  */
+  /**  and, for the parameter indices, into HessianPattern                   */
   /***************************************************************************/
   /* Setup */
   /* this routine works in two different ways: either providing the
@@ -277,26 +284,31 @@ void AstromFit::LSDerivatives1(const CcdImage &Ccd,
   Eigen::VectorXd grad(npar_tot);
   // current position in the Jacobian
   unsigned kTriplets = TList.NextFreeIndex();
-  const MeasuredStarList &catalog = (M) ? *M : Ccd.CatalogForFit();
+  // the measurements of the list, or of the whole CcdImage
+  const MeasuredStarArrays meas((M) ? *M : Ccd.CatalogForFit());
+  // transform all measurements at once (with tweaked errors)
+  FatPointArrays inArrays, outArrays;
+  vector<unsigned> rank;
+  gather_valid_positions(meas, _posError, inArrays, rank);
+  Eigen::MatrixXd hMapping; // 2 columns per measurement
+  // should *not* fill h if WhatToFit excludes mapping parameters.
+  if (_fittingDistortions)
+    mapping->ComputeTransformAndDerivativesBatch(inArrays, outArrays, hMapping);
+  else mapping->TransformPosAndErrorsBatch(inArrays, outArrays);
 
-  for (auto i = catalog.begin(); i!= catalog.end(); ++i)
+  for (size_t n=0; n < rank.size(); ++n)
     {
-      const MeasuredStar& ms = **i;
-      if (!ms.IsValid()) continue;
-      // tweak the measurement errors
-      FatPoint inPos = ms;
-      TweakAstromMeasurementErrors(inPos, ms, _posError);
+      const size_t k = rank[n];
+      FatPoint inPos = inArrays.Get(n);
+      FatPoint outPos = outArrays.Get(n);
       h.setZero(); // we cannot be sure that all entries will be overwritten.
-      FatPoint outPos;
-      // should *not* fill h if WhatToFit excludes mapping parameters.
-      if (_fittingDistortions) 
-	  mapping->ComputeTransformAndDerivatives(inPos, outPos, h);
-      else mapping->TransformPosAndErrors(inPos,outPos);
+      if (_fittingDistortions)
+	h.topRows(npar_mapping) = hMapping.middleCols(2*n,2);
 
       unsigned ipar = npar_mapping;
       double det = outPos.vx*outPos.vy-sqr(outPos.vxy);
       if (det <=0 || outPos.vx <=0 || outPos.vy<=0) {
-	cout << " WARNING: inconsistent measurement errors :drop measurement at " << Point(ms) << " in image " << Ccd.Name() << endl;
+	cout << " WARNING: inconsistent measurement errors :drop measurement at " << Point(inPos) << " in image " << Ccd.Name() << endl;
 	continue;
       }	
       transW(0,0) = outPos.vy/det;
@@ -312,7 +324,7 @@ void AstromFit::LSDerivatives1(const CcdImage &Ccd,
       alpha(1,1) = 1./sqrt(det*transW(0,0));
       alpha(0,1) = 0;
       
-      const FittedStar *fs = ms.GetFittedStar();
+      const FittedStar *fs = meas.fittedStar[k];
 
       Point fittedStarInTP = TransformFittedStar(*fs, sky2TP,
 						 refractionVector, 
@@ -366,17 +378,19 @@ void AstromFit::LSDerivatives1(const CcdImage &Ccd,
       // now feed in triplets and Rhs
       for (unsigned ipar=0; ipar<npar_tot; ++ipar)
 	{
+	  int index = FitIndex(indices[ipar]);
+	  if (index < 0) continue; // held fixed
 	  for (unsigned  ic=0; ic<2; ++ic)
 	    {
 	      double val = halpha(ipar,ic);
 	      if (val ==0) continue;
 #if (TRIPLET_INTERNAL_COORD == COL)
-	      TList.AddTriplet(indices[ipar], kTriplets+ic,val);
+	      TList.AddTriplet(index, kTriplets+ic,val);
 #else
-	      TList.AddTriplet(kTriplets+ic, indices[ipar], val);
+	      TList.AddTriplet(kTriplets+ic, index, val);
 #endif
 	    }
-	  Rhs(indices[ipar]) += grad(ipar); 
+	  AddToGradient(Rhs, index, grad(ipar)); 
 	}
       kTriplets += 2; // each measurement contributes 2 columns in the Jacobian
     } // end loop on measurements
@@ -416,6 +430,8 @@ void AstromFit::LSDerivatives2(const FittedStarList &Fsl, TripletList &TList, Ei
       const FittedStar &fs = **i;
       const RefStar *rs = fs.GetRefStar();
       if (rs == NULL) continue;
+      int index = FitIndex(fs.IndexInMatrix());
+      if (index < 0) continue; // held fixed
       proj.SetTangentPoint(fs);
       // fs projects to (0,0), no need to compute its transform.
       FatPoint rsProj;
@@ -446,8 +462,8 @@ void AstromFit::LSDerivatives2(const FittedStarList &Fsl, TripletList &TList, Ei
       alpha(1,0) = w(0,1)/alpha(0,0); 
       alpha(1,1) = 1./sqrt(det*w(0,0));
       alpha(0,1) = 0;
-      indices[0] = fs.IndexInMatrix();
-      indices[1] = fs.IndexInMatrix()+1;
+      indices[0] = index;
+      indices[1] = index+1;
       unsigned npar_tot = 2;
       /* TODO: account here for proper motions in the reference
       catalog. We can code the effect and set the value to 0. Most
@@ -487,14 +503,130 @@ void AstromFit::LSDerivatives2(const FittedStarList &Fsl, TripletList &TList, Ei
 //! this routine computes the derivatives of all LS terms, including the ones that refer to references stars, if any
 void AstromFit::LSDerivatives(TripletList &TList, Eigen::VectorXd &Rhs) const
 {
-  auto L = _assoc.TheCcdImageList();
-  for (auto im=L.cbegin(); im!=L.end() ; ++im)
+  std::vector<const CcdImage *> ccds = FittedCcdImages();
+  if (EffectiveNThreads(_nThreads) <= 1)
     {
-      LSDerivatives1(**im, TList, Rhs);
+      for (auto im=ccds.cbegin(); im!=ccds.end() ; ++im)
+	{
+	  LSDerivatives1(**im, TList, Rhs);
+	}
+    }
+  else
+    {
+      /* Each CcdImage fills its own block of triplets (with Jacobian
+	 columns starting at 0) and records its gradient contributions.
+	 The blocks are then merged in the list order, so that the
+	 Jacobian and the gradient are exactly the ones the serial loop
+	 above would produce. */
+      unsigned nCcd = ccds.size();
+      std::vector<TripletList> tBlocks(nCcd, TripletList(0));
+      std::vector<GradientSlice> gBlocks(nCcd);
+      ParallelFor(nCcd, _nThreads, [&](unsigned k)
+		  {
+		    FillLSDerivatives1(*ccds[k], tBlocks[k], gBlocks[k], NULL);
+		  });
+      size_t nTrip = TList.size();
+      for (unsigned k=0; k<nCcd; ++k) nTrip += tBlocks[k].size();
+      TList.reserve(nTrip);
+      for (unsigned k=0; k<nCcd; ++k)
+	{
+	  TList.AppendBlock(tBlocks[k]);
+	  gBlocks[k].AddTo(Rhs);
+	  // release memory as we go
+	  TripletList(0).swap(tBlocks[k]);
+	  GradientSlice().swap(gBlocks[k]);
+	}
     }
   LSDerivatives2(_assoc.fittedStarList, TList, Rhs);
 }
 
+/* The parameter indices here should be the ones FillLSDerivatives1
+   and LSDerivatives2 use. A few declared pairs may end up with zero
+   values (e.g. for measurements dropped because of inconsistent
+   errors). */
+void AstromFit::HessianPattern(SparseHessian &H) const
+{
+  std::vector<const CcdImage *> ccds = FittedCcdImages();
+  std::vector<unsigned> ccdIndices, starIndices;
+  for (auto im=ccds.cbegin(); im!=ccds.end() ; ++im)
+    {
+      const CcdImage &ccd = **im;
+      // the parameters shared by all measurements of this CcdImage
+      ccdIndices.clear();
+      if (_fittingDistortions)
+	_distortionModel->GetMapping(ccd)->GetMappingIndices(ccdIndices);
+      if (_fittingRefrac) ccdIndices.push_back(_refracPosInMatrix+ccd.BandRank());
+      ToFitIndices(ccdIndices);
+      H.AddCoupling(ccdIndices);
+      if (!_fittingPos && !_fittingPM) continue;
+      const MeasuredStarList &catalog = ccd.CatalogForFit();
+      for (auto i = catalog.cbegin(); i!= catalog.end(); ++i)
+	{
+	  const MeasuredStar& ms = **i;
+	  if (!ms.IsValid()) continue;
+	  const FittedStar *fs = ms.GetFittedStar();
+	  starIndices.clear();
+	  if (_fittingPos)
+	    {
+	      starIndices.push_back(fs->IndexInMatrix());
+	      starIndices.push_back(fs->IndexInMatrix()+1);
+	    }
+	  if (_fittingPM && fs->mightMove)
+	    for (unsigned k=0; k<NPAR_PM; ++k) starIndices.push_back(fs->IndexInMatrix()+2+k);
+	  ToFitIndices(starIndices);
+	  H.AddCoupling(starIndices);
+	  H.AddCoupling(starIndices, ccdIndices);
+	}
+    }
+  // reference terms
+  if (!_fittingPos || _assoc.refStarList.size() == 0) return;
+  const FittedStarList &fsl = _assoc.fittedStarList;
+  for (auto i = fsl.cbegin(); i!= fsl.end(); ++i)
+    {
+      const FittedStar &fs = **i;
+      if (fs.GetRefStar() == NULL) continue;
+      int index = FitIndex(fs.IndexInMatrix());
+      if (index < 0) continue;
+      starIndices.clear();
+      starIndices.push_back(index);
+      starIndices.push_back(index+1);
+      H.AddCoupling(starIndices);
+    }
+}
+
+/*! The Jacobian of a few CcdImage's at a time is computed (in
+  parallel), and added to the Hessian, whose nonzero pattern was
+  set up beforehand. */
+void AstromFit::AssembleNormalEquations(SpMat &Hessian, Eigen::VectorXd &Rhs) const
+{
+  SparseHessian h(_nParTot);
+  HessianPattern(h);
+  h.EndPattern();
+
+  std::vector<const CcdImage *> ccds = FittedCcdImages();
+  const unsigned nCcd = ccds.size();
+  // bounds the memory taken by the derivatives
+  const unsigned groupSize = 4*EffectiveNThreads(_nThreads);
+  std::vector<TripletList> tBlocks;
+  std::vector<GradientSlice> gBlocks;
+  for (unsigned first=0; first < nCcd; first += groupSize)
+    {
+      unsigned count = std::min(groupSize, nCcd-first);
+      tBlocks.assign(count, TripletList(0));
+      gBlocks.assign(count, GradientSlice());
+      ParallelFor(count, _nThreads, [&](unsigned k)
+		  {
+		    FillLSDerivatives1(*ccds[first+k], tBlocks[k], gBlocks[k], NULL);
+		  });
+      h.Accumulate(tBlocks, _nThreads);
+      for (unsigned k=0; k<count; ++k) gBlocks[k].AddTo(Rhs);
+    }
+  tBlocks.assign(1, TripletList(0));
+  LSDerivatives2(_assoc.fittedStarList, tBlocks[0], Rhs);
+  h.Accumulate(tBlocks, _nThreads);
+  h.Extract(Hessian);
+}
+
 
 // This is almost a selection of lines of LSDerivatives1(CcdImage ...)
 /* This routine (and the following one) is template because it is used
@@ -521,28 +653,29 @@ void AstromFit::AccumulateStatImage(ImType &Ccd, Accum &Accu) const
   // reserve matrix once for all measurements
   Eigen::Matrix2Xd transW(2,2);
 
-  auto &catalog = Ccd.CatalogForFit();
-  for (auto i = catalog.begin(); i!= catalog.end(); ++i)
+  const MeasuredStarArrays meas(Ccd.CatalogForFit());
+  // transform all measurements at once (with tweaked errors)
+  FatPointArrays inArrays, outArrays;
+  vector<unsigned> rank;
+  gather_valid_positions(meas, _posError, inArrays, rank);
+  mapping->TransformPosAndErrorsBatch(inArrays, outArrays);
+
+  for (size_t n=0; n < rank.size(); ++n)
     {
-      auto &ms = **i;
-      if (!ms.IsValid()) continue;
-      // tweak the measurement errors
-      FatPoint inPos = ms;
-      TweakAstromMeasurementErrors(inPos, ms, _posError);
-
-      FatPoint outPos;
-      // should *not* fill h if WhatToFit excludes mapping parameters.
-      mapping->TransformPosAndErrors(inPos, outPos);
+      const size_t k = rank[n];
+      MeasuredStar &ms = *meas.star[k];
+      FatPoint inPos = inArrays.Get(n);
+      FatPoint outPos = outArrays.Get(n);
       double det = outPos.vx*outPos.vy-sqr(outPos.vxy);
       if (det <=0 || outPos.vx <=0 || outPos.vy<=0) {
-	cout << " WARNING: inconsistent measurement errors :drop measurement at " << Point(ms) << " in image " << Ccd.Name() << endl;
+	cout << " WARNING: inconsistent measurement errors :drop measurement at " << Point(inPos) << " in image " << Ccd.Name() << endl;
 	continue;
       }	
       transW(0,0) = outPos.vy/det;
       transW(1,1) = outPos.vx/det;
       transW(0,1) = transW(1,0) = -outPos.vxy/det;
 
-      const FittedStar *fs = ms.GetFittedStar();
+      const FittedStar *fs = meas.fittedStar[k];
       Point fittedStarInTP = TransformFittedStar(*fs, sky2TP,
 						 refractionVector, 
 						 refractionCoefficient,
@@ -557,13 +690,23 @@ void AstromFit::AccumulateStatImage(ImType &Ccd, Accum &Accu) const
 
 
 //! for a list of images.
+/*! The images are processed concurrently (see SetNThreads). Each
+  image accumulates into its own Accum, and these partial results are
+  added in the list order, so that the result does not depend on the
+  number of threads. */
 template <class ListType, class Accum> 
 void AstromFit::AccumulateStatImageList(ListType &L, Accum &Accu) const
 {
-  for (auto im=L.begin(); im!=L.end() ; ++im)
-    {
-      AccumulateStatImage(**im, Accu);
-    }
+  typedef decltype(&**L.begin()) ImPtr; // constness follows ListType
+  std::vector<ImPtr> images;
+  images.reserve(L.size());
+  for (auto im=L.begin(); im!=L.end() ; ++im) images.push_back(&**im);
+  std::vector<Accum> partial(images.size());
+  ParallelFor(images.size(), _nThreads, [&](const unsigned k)
+	      {
+		AccumulateStatImage(*images[k], partial[k]);
+	      });
+  for (unsigned k=0; k < partial.size(); ++k) Accu += partial[k];
 }
 
 template <class Accum> 
@@ -578,6 +721,7 @@ void AstromFit::AccumulateStatRefStars(Accum &Accu) const
       FittedStar &fs = **i;
       const RefStar *rs = fs.GetRefStar();
       if (rs == NULL) continue;
+      if (_firstNewCcd && !_newStars.count(&fs)) continue;
       proj.SetTangentPoint(fs);
       // fs projects to (0,0), no need to compute its transform.
       FatPoint rsProj;
@@ -598,10 +742,13 @@ void AstromFit::AccumulateStatRefStars(Accum &Accu) const
 
 
 //! for the list of images in the provided  association and the reference stars, if any
+/*! When the fit is restricted (see RestrictToNewCcdImages), only
+  the terms that enter the fit are accounted for. */
 Chi2 AstromFit::ComputeChi2() const
 {
   Chi2 chi2;
-  AccumulateStatImageList(_assoc.TheCcdImageList(), chi2);
+  std::vector<const CcdImage *> ccds = FittedCcdImages();
+  AccumulateStatImageList(ccds, chi2);
   // now ref stars:
   AccumulateStatRefStars(chi2);
   // so far, ndof contains the number of squares.
@@ -627,8 +774,13 @@ struct Chi2Entry
 
 struct Chi2Vect : public std::vector<Chi2Entry>
 {
+  Chi2 total; // the chi2 and number of terms of the entries
+
   void AddEntry(const double &Chi2Val, unsigned ndof, BaseStar *ps)
-  { this->push_back(Chi2Entry(Chi2Val,ps));}
+  { this->push_back(Chi2Entry(Chi2Val,ps)); total.AddEntry(Chi2Val, ndof, ps);}
+
+  void operator += (const Chi2Vect &R)
+  { this->insert(this->end(), R.begin(), R.end()); total += R.total;}
 
 };
 
@@ -657,6 +809,7 @@ void AstromFit::GetMeasuredStarIndices(const MeasuredStar &Ms,
      }
   /* Should not put the index of refaction stuff or we will not be
      able to remove more than 1 star at a time. */
+  ToFitIndices(Indices);
 }
 
 //! contributions to derivatives of (presumambly) outlier terms. No discarding done.
@@ -700,36 +853,41 @@ unsigned AstromFit::FindOutliers(const double &NSigCut,
 				 MeasuredStarList &MSOutliers,
 				 FittedStarList &FSOutliers,
 				 const std::string &MeasOrRef) const
+{
+  Chi2Vect chi2s;
+  CollectChi2Contributions(chi2s, MeasOrRef);
+  return SelectOutliers(chi2s, NSigCut, MSOutliers, FSOutliers);
+}
+
+//! Collects the chi2 contributions (measurement and/or reference terms) together with their contributors.
+/*! Chi2s.total then holds the chi2 of these terms, so that the
+  outlier search and the chi2 of the fit come out of the same walk
+  through the measurements. */
+void AstromFit::CollectChi2Contributions(Chi2Vect &Chi2s,
+					 const std::string &MeasOrRef) const
 {
   bool searchMeas = (MeasOrRef.find("Meas") != std::string::npos);
   bool searchRef = (MeasOrRef.find("Ref") != std::string::npos);
 
-  CcdImageList &L=_assoc.ccdImageList;
-  // collect chi2 contributions
-  Chi2Vect chi2s;
-  chi2s.reserve(_nMeasuredStars+_assoc.refStarList.size());
+  Chi2s.reserve(_nMeasuredStars+_assoc.refStarList.size());
   // contributions from measurement terms:
   if (searchMeas)
-    AccumulateStatImageList(_assoc.ccdImageList, chi2s);
+    {
+      std::vector<const CcdImage *> ccds = FittedCcdImages();
+      AccumulateStatImageList(ccds, Chi2s);
+    }
   // and from reference terms
   if (searchRef)
-    AccumulateStatRefStars(chi2s);
-
-  // do some stat
-  unsigned nval = chi2s.size();
-  if (nval==0) return 0;
-  sort(chi2s.begin(), chi2s.end());
-  double median = (nval & 1)? chi2s[nval/2].chi2 :  
-    0.5*(chi2s[nval/2-1].chi2 + chi2s[nval/2].chi2);
-  // some more stats. should go into the class if recycled anywhere else
-  double sum=0; double sum2 = 0;
-  for (auto i=chi2s.begin(); i!=chi2s.end(); ++i) 
-    {sum+= i->chi2;sum2+= sqr(i->chi2);}
-  double average = sum/nval;
-  double sigma = sqrt(sum2/nval - sqr(average));
-  cout << "INFO : RemoveOutliers chi2 stat: mean/median/sigma " 
-       << average << '/'<< median << '/' << sigma << endl;
-  double cut = average+NSigCut*sigma;
+    AccumulateStatRefStars(Chi2s);
+}
+
+//! The outlier search of FindOutliers, from already collected contributions. Reorders Chi2s.
+unsigned AstromFit::SelectOutliers(Chi2Vect &chi2s, const double &NSigCut,
+				   MeasuredStarList &MSOutliers,
+				   FittedStarList &FSOutliers) const
+{
+  // the contributions above the cut, strongest first.
+  size_t nAbove = SelectLargeChi2s(chi2s, NSigCut, "RemoveOutliers");
   /* For each of the parameters, we will not remove more than 1
      measurement that contributes to constraining it. Keep track using
      of what we are touching using an integer vector. This is the
@@ -740,9 +898,8 @@ unsigned AstromFit::FindOutliers(const double &NSigCut,
 
   unsigned nOutliers = 0; // returned to the caller
   // start from the strongest outliers.
-  for (auto i = chi2s.rbegin(); i != chi2s.rend(); ++i)
+  for (auto i = chi2s.begin(); i != chi2s.begin()+nAbove; ++i)
     {
-      if (i->chi2 < cut) break; // because the array is sorted. 
       vector<unsigned> indices;
       indices.reserve(100); // just there to limit reallocations.
       /* now, we want to get the indices of the parameters this chi2
@@ -754,8 +911,12 @@ unsigned AstromFit::FindOutliers(const double &NSigCut,
       if (!ms) // it is reference term.
 	{
 	  fs = dynamic_cast<FittedStar *>(i->ps); 
-	  indices.push_back(fs->IndexInMatrix());
-	  indices.push_back(fs->IndexInMatrix()+1); // probably useless
+	  int index = FitIndex(fs->IndexInMatrix());
+	  if (index >= 0)
+	    {
+	      indices.push_back(index);
+	      indices.push_back(index+1); // probably useless
+	    }
 	  /* One might think it would be useful to account for PM
 	     parameters here, but it is just useless */
 	}
@@ -870,6 +1031,61 @@ void AstromFit::AssignIndices(const std::string &WhatToFit)
     }
   _nParTot = ipar;
 
+  _fitIndex.clear();
+  _newStars.clear();
+  if (_firstNewCcd == 0) return;
+  /* Restricted fit (see RestrictToNewCcdImages): the parameters that
+     the new CcdImage's constrain, but not the other ones. FittedStar's
+     only measured by the new CcdImage's have all their valid
+     measurements there. */
+  std::vector<const CcdImage *> newCcds = FittedCcdImages();
+  std::unordered_map<const FittedStar *, int> newCounts;
+  for (auto im = newCcds.cbegin(); im != newCcds.end(); ++im)
+    {
+      const MeasuredStarList &catalog = (*im)->CatalogForFit();
+      for (auto i = catalog.cbegin(); i!= catalog.end(); ++i)
+	if ((*i)->IsValid() && (*i)->GetFittedStar()) newCounts[(*i)->GetFittedStar()]++;
+    }
+  for (auto c = newCounts.cbegin(); c != newCounts.end(); ++c)
+    if (c->second == c->first->MeasurementCount()) _newStars.insert(c->first);
+  std::vector<signed char> status(_nParTot, 0); // 1 : free, -1 : fixed
+  std::vector<unsigned> indices;
+  if (_fittingDistortions)
+    {
+      const CcdImageList &L = _assoc.TheCcdImageList();
+      unsigned rank = 0;
+      for (auto im=L.cbegin(); im!=L.end() ; ++im, ++rank)
+	if (rank >= _firstNewCcd)
+	  {
+	    indices.clear();
+	    _distortionModel->GetMapping(**im)->GetMappingIndices(indices);
+	    for (auto k = indices.cbegin(); k != indices.end(); ++k) if (status[*k] == 0) status[*k] = 1;
+	  }
+      // parameters shared with the other CcdImage's are held fixed
+      rank = 0;
+      for (auto im=L.cbegin(); im!=L.end() && rank < _firstNewCcd ; ++im, ++rank)
+	{
+	  indices.clear();
+	  _distortionModel->GetMapping(**im)->GetMappingIndices(indices);
+	  for (auto k = indices.cbegin(); k != indices.end(); ++k) status[*k] = -1;
+	}
+    }
+  if (_fittingPos)
+    for (auto s = _newStars.cbegin(); s != _newStars.end(); ++s)
+      {
+	const FittedStar &fs = **s;
+	unsigned npar = ((_fittingPM) & fs.mightMove) ? 2+NPAR_PM : 2;
+	for (unsigned k=0; k < npar; ++k) status[fs.IndexInMatrix()+k] = 1;
+      }
+  _fitIndex.assign(_nParTot, -1);
+  unsigned nFree = 0;
+  for (unsigned k=0; k < _nParTot; ++k)
+    if (status[k] == 1) _fitIndex[k] = nFree++;
+  cout << "INFO: restricted to the " << newCcds.size() << " new CcdImage's : " 
+       << nFree << " parameters out of " << _nParTot << ", " 
+       << _newStars.size() << " new fitted stars" << endl;
+  _nParTot = nFree;
+
 #if (0)  
   //DEBUG
   cout << " INFO: np(d,p, total) = " 
@@ -888,6 +1104,21 @@ void AstromFit::OffsetParams(const Eigen::VectorXd& Delta)
 {
   if (Delta.size() != _nParTot) 
     throw LSST_EXCEPT(pex::exceptions::InvalidParameterError, "AstromFit::OffsetParams : the provided vector length is not compatible with the current WhatToFit setting");
+  if (_fitIndex.empty())
+    {
+      OffsetAllParams(Delta);
+      return;
+    }
+  // back to the whole layout: the fixed parameters do not move
+  Eigen::VectorXd delta(_fitIndex.size());
+  delta.setZero();
+  for (unsigned k=0; k < _fitIndex.size(); ++k)
+    if (_fitIndex[k] >= 0) delta(k) = Delta(_fitIndex[k]);
+  OffsetAllParams(delta);
+}
+
+void AstromFit::OffsetAllParams(const Eigen::VectorXd& Delta)
+{
   if (_fittingDistortions) 
     _distortionModel->OffsetParams(Delta);
 
@@ -917,6 +1148,27 @@ void AstromFit::OffsetParams(const Eigen::VectorXd& Delta)
     }
 }
 
+/*! The blocks follow the layout set by AssignIndices : the
+  parameters of one FittedStar do not couple to the ones of any
+  other star. */
+SchurSolver::BlockList AstromFit::PositionBlocks() const
+{
+  SchurSolver::BlockList blocks;
+  if (!_fittingPos) return blocks;
+  const FittedStarList &fsl = _assoc.fittedStarList;
+  blocks.reserve(fsl.size());
+  for (auto i = fsl.cbegin(); i != fsl.end(); ++i)
+    {
+      const FittedStar &fs = **i;
+      int index = FitIndex(fs.IndexInMatrix());
+      if (index < 0) continue; // held fixed
+      unsigned npar = 2;
+      if ((_fittingPM) & fs.mightMove) npar += NPAR_PM;
+      blocks.push_back(std::make_pair(index, npar));
+    }
+  return blocks;
+}
+
 // should not be too large !
 #ifdef STORAGE
 static void write_sparse_matrix_in_fits(const SpMat &mat, const string &FitsName)
@@ -945,27 +1197,18 @@ static void write_vect_in_fits(const Eigen::VectorXd &V, const string &FitsName)
 #endif
 
 
-/*! This is a complete Newton Raphson step. Compute first and 
-  second derivatives, solve for the step and apply it, without 
-  a line search. */
-unsigned AstromFit::Minimize(const std::string &WhatToFit, const double NSigRejCut)
+/* The original route to the normal equations : the whole Jacobian is
+   stored (as triplets, and then as a sparse matrix), and multiplied by
+   its transpose. */
+void AstromFit::HessianFromJacobian(SpMat &Hessian, Eigen::VectorXd &Grad)
 {
-  AssignIndices(WhatToFit);
-  
-  // return code can take 3 values : 
-  // 0 : fit has converged - no more outliers
-  // 1 : still some ouliers but chi2 increases
-  // 2 : factorization failed
-  unsigned returnCode = 0;
-
   // TODO : write a guesser for the number of triplets
   unsigned nTrip = (_LastNTrip) ? _LastNTrip: 1e6;
   TripletList tList(nTrip);
-  Eigen::VectorXd grad(_nParTot);  grad.setZero();
 
   //Fill the triplets
   clock_t tstart = clock();
-  LSDerivatives(tList, grad);
+  LSDerivatives(tList, Grad);
   clock_t tend = clock();
   _LastNTrip = tList.size(); 
 
@@ -973,29 +1216,48 @@ unsigned AstromFit::Minimize(const std::string &WhatToFit, const double NSigRejC
        << " CPU = " << float(tend-tstart)/float(CLOCKS_PER_SEC) 
        << endl;
 
-  SpMat hessian;
-  {
 #if (TRIPLET_INTERNAL_COORD == COL)
-    SpMat jacobian(_nParTot,tList.NextFreeIndex());
-    jacobian.setFromTriplets(tList.begin(), tList.end());
-    // release memory shrink_to_fit is C++11
-    tList.clear(); //tList.shrink_to_fit();
-    clock_t tstart = clock();
-    hessian = jacobian*jacobian.transpose();
-    clock_t tend = clock();
-    std::cout << "INFO: CPU for J*Jt " 
-	      << float(tend-tstart)/float(CLOCKS_PER_SEC) << std::endl;
-
+  SpMat jacobian(_nParTot,tList.NextFreeIndex());
+  jacobian.setFromTriplets(tList.begin(), tList.end());
+  // release memory shrink_to_fit is C++11
+  tList.clear(); //tList.shrink_to_fit();
+  tstart = clock();
+  Hessian = jacobian*jacobian.transpose();
+  tend = clock();
+  std::cout << "INFO: CPU for J*Jt " 
+	    << float(tend-tstart)/float(CLOCKS_PER_SEC) << std::endl;
 #else
-    SpMat jacobian(tList.NextRank(), _nParTot);
-    jacobian.setFromTriplets(tList.begin(), tList.end());
-    // release memory shrink_to_fit is C++11
-    tList.clear(); //tList.shrink_to_fit(); 
-    cout << " starting H=JtJ " << endl;
-    hessian = jacobian.transpose()*jacobian;
+  SpMat jacobian(tList.NextRank(), _nParTot);
+  jacobian.setFromTriplets(tList.begin(), tList.end());
+  // release memory shrink_to_fit is C++11
+  tList.clear(); //tList.shrink_to_fit(); 
+  cout << " starting H=JtJ " << endl;
+  Hessian = jacobian.transpose()*jacobian;
 #endif
-  }// release the Jacobian
+}
+
+
+/*! This is a complete Newton Raphson step. Compute first and 
+  second derivatives, solve for the step and apply it, without 
+  a line search. */
+unsigned AstromFit::Minimize(const std::string &WhatToFit, const double NSigRejCut)
+{
+  AssignIndices(WhatToFit);
+  
+  // return code can take 3 values : 
+  // 0 : fit has converged - no more outliers
+  // 1 : still some ouliers but chi2 increases
+  // 2 : factorization failed, or the solver did not converge
+  unsigned returnCode = 0;
 
+  Eigen::VectorXd grad(_nParTot);  grad.setZero();
+  SpMat hessian;
+  clock_t tstart = clock();
+  if (_directAssembly) AssembleNormalEquations(hessian, grad);
+  else HessianFromJacobian(hessian, grad);
+  clock_t tend = clock();
+  std::cout << "INFO: CPU for the normal equations " 
+	    << float(tend-tstart)/float(CLOCKS_PER_SEC) << std::endl;
 
   cout << "INFO: hessian : dim=" << hessian.rows() 
        << " nnz=" << hessian.nonZeros() 
@@ -1003,12 +1265,32 @@ unsigned AstromFit::Minimize(const std::string &WhatToFit, const double NSigRejC
   cout << "INFO: starting factorization" << endl;
 
   tstart = clock();
-  CholmodSimplicialLDLT2<SpMat> chol(hessian);
-  if (chol.info() != Eigen::Success)
+  hessian.makeCompressed();
+  bool eliminatePositions = _eliminatePositions && _fittingPos;
+  if (_factorizationCache && ((_factorizationCache->schur != NULL) != eliminatePositions))
+    _factorizationCache.reset();
+  if (!_factorizationCache) 
+    _factorizationCache.reset(new FactorizationCache(_solverName, _solverMaxIterations,
+							  eliminatePositions, _nThreads));
+  SparseSolver &chol = *(_factorizationCache->solver);
+  chol.SetNThreads(_nThreads);
+  if (eliminatePositions) _factorizationCache->schur->SetBlocks(PositionBlocks());
+  if (_factorizationCache->Covers(_WhatToFit, hessian))
+    cout << "INFO: reusing the symbolic analysis of the previous factorization" << endl;
+  else
+    {
+      chol.Analyze(hessian);
+      _nAnalyses++;
+      _factorizationCache->SetPattern(_WhatToFit, hessian);
+    }
+  if (!chol.Factorize(hessian))
     {
       cout << "ERROR: AstromFit::Minimize : factorization failed " << endl;
+      _factorizationCache.reset();
       return 2;
     }
+  chol.Report(cout, hessian);
+  hessian = SpMat(); // the solver has what it needs
 
   tend = clock();
   std::cout << "INFO: CPU for factorize-solve " 
@@ -1020,10 +1302,27 @@ unsigned AstromFit::Minimize(const std::string &WhatToFit, const double NSigRejC
 
   while (true)
     {
-      Eigen::VectorXd delta = chol.solve(grad);
+      Eigen::VectorXd delta = chol.Solve(grad);
+      if (!chol.Converged())
+	{
+	  cout << "ERROR: AstromFit::Minimize : the solver did not converge, step not applied" << endl;
+	  returnCode = 2;
+	  break;
+	}
       //  cout << " offsetting parameters" << endl;
       OffsetParams(delta);
-      Chi2 current_chi2(ComputeChi2());
+      /* when rejecting, one walk through the measurements provides
+	 both the chi2 and the contributions needed to find outliers.
+	 Otherwise, the totals are enough. */
+      Chi2Vect chi2s;
+      Chi2 current_chi2;
+      if (NSigRejCut == 0) current_chi2 = ComputeChi2();
+      else
+	{
+	  CollectChi2Contributions(chi2s, "Meas Ref");
+	  current_chi2 = chi2s.total;
+	  current_chi2.ndof -= _nParTot;
+	}
       cout << current_chi2 << endl;
       if (current_chi2.chi2 > old_chi2)
 	{
@@ -1036,7 +1335,7 @@ unsigned AstromFit::Minimize(const std::string &WhatToFit, const double NSigRejC
       if (NSigRejCut == 0) break;
       MeasuredStarList moutliers;
       FittedStarList foutliers;
-      int n_outliers = FindOutliers(NSigRejCut, moutliers, foutliers);
+      int n_outliers = SelectOutliers(chi2s, NSigRejCut, moutliers, foutliers);
       tot_outliers += n_outliers;
       if (n_outliers == 0) break;
       TripletList tList(1000); // initial allocation size.
@@ -1049,8 +1348,8 @@ unsigned AstromFit::Minimize(const std::string &WhatToFit, const double NSigRejC
       // convert triplet list to eigen internal format
       SpMat h(_nParTot,tList.NextFreeIndex());
       h.setFromTriplets(tList.begin(), tList.end());
-      int update_status = chol.update(h, false /* means downdate */);
-      cout << "INFO: cholmod  update_status " << update_status << endl;
+      int update_status = chol.Update(h, false /* means downdate */);
+      cout << "INFO: factorization update_status " << update_status << endl;
       /* The contribution of outliers to the gradient is the opposite
 	 of the contribution of all other terms, because they add up
 	 to 0 */
@@ -1119,49 +1418,73 @@ void AstromFit::MakeResTuple(const std::string &TupleName) const
   MakeRefResTuple(ref_tuple);
 }
 
-void AstromFit::MakeMeasResTuple(const std::string &TupleName) const
+static ResidualColumnList meas_residual_columns()
 {
-  std::ofstream tuple(TupleName.c_str());
-  tuple << "#xccd: coordinate in CCD" << endl
-	<< "#yccd: " << endl
-	<< "#rx:   residual in degrees in TP" << endl
-	<< "#ry:" << endl
-	<< "#xtp: transformed coordinate in TP " << endl
-	<< "#ytp:" << endl 
-	<< "#mag: rough mag" << endl
-	<< "#jd: Julian date of the measurement" << endl
-    	<< "#rvx: transformed measurement uncertainty " << endl
-    	<< "#rvy:" << endl
-    	<< "#rvxy:" << endl
-	<< "#color : " << endl
-	<< "#fsindex: some unique index of the object" << endl
-	<< "#ra: pos of fitted star" << endl
-	<< "#dec: pos of fitted star" << endl
-	<< "#chi2: contribution to Chi2 (2D dofs)" << endl
-	<< "#nm: number of measurements of this FittedStar" << endl
-    	<< "#chip: chip number" << endl
-    	<< "#shoot: shoot id" << endl
-	<< "#end" << endl;
+  ResidualColumnList columns;
+  columns.push_back(ResidualColumn("xccd", false, "coordinate in CCD"));
+  columns.push_back(ResidualColumn("yccd", false, ""));
+  columns.push_back(ResidualColumn("rx", false, "residual in degrees in TP"));
+  columns.push_back(ResidualColumn("ry", false, ""));
+  columns.push_back(ResidualColumn("xtp", false, "transformed coordinate in TP"));
+  columns.push_back(ResidualColumn("ytp", false, ""));
+  columns.push_back(ResidualColumn("mag", false, "rough mag"));
+  columns.push_back(ResidualColumn("jd", false, "Julian date of the measurement"));
+  columns.push_back(ResidualColumn("rvx", false, "transformed measurement uncertainty"));
+  columns.push_back(ResidualColumn("rvy", false, ""));
+  columns.push_back(ResidualColumn("rvxy", false, ""));
+  columns.push_back(ResidualColumn("color", false, ""));
+  columns.push_back(ResidualColumn("fsindex", true, "some unique index of the object"));
+  columns.push_back(ResidualColumn("ra", false, "pos of fitted star"));
+  columns.push_back(ResidualColumn("dec", false, "pos of fitted star"));
+  columns.push_back(ResidualColumn("chi2", false, "contribution to Chi2 (2D dofs)"));
+  columns.push_back(ResidualColumn("nm", true, "number of measurements of this FittedStar"));
+  columns.push_back(ResidualColumn("chip", true, "chip number"));
+  columns.push_back(ResidualColumn("shoot", true, "shoot id"));
+  return columns;
+}
+
+static ResidualColumnList ref_residual_columns()
+{
+  ResidualColumnList columns;
+  columns.push_back(ResidualColumn("ra", false, "coordinates of FittedStar"));
+  columns.push_back(ResidualColumn("dec", false, ""));
+  columns.push_back(ResidualColumn("rx", false, "residual in degrees in TP"));
+  columns.push_back(ResidualColumn("ry", false, ""));
+  columns.push_back(ResidualColumn("mag", false, "mag"));
+  columns.push_back(ResidualColumn("rvx", false, "transformed measurement uncertainty"));
+  columns.push_back(ResidualColumn("rvy", false, ""));
+  columns.push_back(ResidualColumn("rvxy", false, ""));
+  columns.push_back(ResidualColumn("color", false, ""));
+  columns.push_back(ResidualColumn("fsindex", true, "some unique index of the object"));
+  columns.push_back(ResidualColumn("chi2", false, "contribution to Chi2 (2D dofs)"));
+  columns.push_back(ResidualColumn("nm", true, "number of measurements of this FittedStar"));
+  return columns;
+}
+
+//! Sends one row per valid measurement to S, with the columns described in meas_residual_columns().
+template <class Sink> 
+void AstromFit::FillMeasResiduals(Sink &S) const
+{
+  double row[19];
+  FatPointArrays inArrays, tpArrays;
+  vector<unsigned> rank;
   const CcdImageList &L=_assoc.TheCcdImageList();
   for (auto i=L.cbegin(); i!=L.end() ; ++i)
     {
       const CcdImage &im = **i;
-      const MeasuredStarList &cat = im.CatalogForFit();
+      const MeasuredStarArrays meas(im.CatalogForFit());
       const Mapping *mapping = _distortionModel->GetMapping(im);
       const Point &refractionVector = im.ParallacticVector();
       double jd = im.JD() - _JDRef;
-      double zp = im.ZP();
       unsigned iband= im.BandRank();
-      for (auto is=cat.cbegin(); is!=cat.end(); ++is)
+      const Gtransfo* sky2TP = _distortionModel->Sky2TP(im);
+      gather_valid_positions(meas, _posError, inArrays, rank);
+      mapping->TransformPosAndErrorsBatch(inArrays, tpArrays);
+      for (size_t n=0; n < rank.size(); ++n)
 	{
-	  const MeasuredStar &ms = **is;
-	  if (!ms.IsValid()) continue;
-	  FatPoint tpPos;
-	  FatPoint inPos = ms;
-	  TweakAstromMeasurementErrors(inPos, ms, _posError);
-	  mapping->TransformPosAndErrors(inPos, tpPos);
-	  const Gtransfo* sky2TP = _distortionModel->Sky2TP(im);
-	  const FittedStar *fs = ms.GetFittedStar();
+	  const size_t k = rank[n];
+	  FatPoint tpPos = tpArrays.Get(n);
+	  const FittedStar *fs = meas.fittedStar[k];
 	  
 	  Point fittedStarInTP = TransformFittedStar(*fs, sky2TP,
 						     refractionVector, 
@@ -1172,41 +1495,28 @@ void AstromFit::MakeMeasResTuple(const std::string &TupleName) const
 	  double wxx = tpPos.vy/det;
 	  double wyy = tpPos.vx/det;
 	  double wxy = -tpPos.vxy/det;
-	  //	  double chi2 = rx*(wxx*rx+wxy*ry)+ry*(wxy*rx+wyy*ry);
 	  double chi2 = wxx*res.x*res.x + wyy*res.y*res.y + 2*wxy*res.x*res.y;
-	  tuple << std::setprecision(9);
-	  tuple << ms.x << ' ' << ms.y << ' ' 
-		<< res.x << ' ' << res.y << ' '
-		<< tpPos.x << ' ' << tpPos.y << ' '
-		<< fs->Mag() << ' ' << jd << ' ' 
-		<< tpPos.vx << ' ' << tpPos.vy << ' ' << tpPos.vxy << ' ' 
-		<< fs->color << ' ' 
-		<< fs->IndexInMatrix() << ' '
-	        << fs->x << ' ' << fs->y << ' '
-		<< chi2 << ' ' 
-		<< fs->MeasurementCount() << ' ' 
-		<< im.Chip() << ' ' << im.Shoot() << endl;
+	  row[0] = meas.x[k]; row[1] = meas.y[k];
+	  row[2] = res.x; row[3] = res.y;
+	  row[4] = tpPos.x; row[5] = tpPos.y;
+	  row[6] = fs->Mag(); row[7] = jd;
+	  row[8] = tpPos.vx; row[9] = tpPos.vy; row[10] = tpPos.vxy;
+	  row[11] = fs->color;
+	  row[12] = fs->IndexInMatrix();
+	  row[13] = fs->x; row[14] = fs->y;
+	  row[15] = chi2;
+	  row[16] = fs->MeasurementCount();
+	  row[17] = im.Chip(); row[18] = im.Shoot();
+	  S.AddRow(row);
 	}// loop on measurements in image
     }// loop on images
-
 }
 
-void AstromFit::MakeRefResTuple(const std::string &TupleName) const
+//! Sends one row per reference term to S, with the columns described in ref_residual_columns().
+template <class Sink> 
+void AstromFit::FillRefResiduals(Sink &S) const
 {
-  std::ofstream tuple(TupleName.c_str());
-  tuple << "#ra: coordinates of FittedStar" << endl
-	<< "#dec: " << endl
-	<< "#rx:   residual in degrees in TP" << endl
-	<< "#ry:" << endl
-	<< "#mag: mag" << endl
-    	<< "#rvx: transformed measurement uncertainty " << endl
-    	<< "#rvy:" << endl
-    	<< "#rvxy:" << endl
-	<< "#color : " << endl
-	<< "#fsindex: some unique index of the object" << endl
-	<< "#chi2: contribution to Chi2 (2D dofs)" << endl
-	<< "#nm: number of measurements of this FittedStar" << endl
-	<< "#end" << endl;
+  double row[12];
   // The following loop is heavily inspired from AstromFit::ComputeChi2()
   const FittedStarList &fsl = _assoc.fittedStarList;
   TanRaDec2Pix proj(GtransfoLin(), Point(0.,0.));
@@ -1226,17 +1536,64 @@ void AstromFit::MakeRefResTuple(const std::string &TupleName) const
       double wyy = rsProj.vx/det;
       double wxy = -rsProj.vxy/det;
       double chi2 = wxx*sqr(rx) + 2*wxy*rx*ry+ wyy*sqr(ry);
-      tuple << std::setprecision(9);
-      tuple << fs.x << ' ' << fs.y << ' ' 
-	    << rx << ' ' << ry << ' '
-	    << fs.Mag() << ' ' 
-	    << rsProj.vx << ' ' << rsProj.vy << ' ' << rsProj.vxy << ' ' 
-	    << fs.color << ' ' 
-	    << fs.IndexInMatrix() << ' '
-	    << chi2 << ' ' 
-	    << fs.MeasurementCount() << endl;
+      row[0] = fs.x; row[1] = fs.y;
+      row[2] = rx; row[3] = ry;
+      row[4] = fs.Mag();
+      row[5] = rsProj.vx; row[6] = rsProj.vy; row[7] = rsProj.vxy;
+      row[8] = fs.color;
+      row[9] = fs.IndexInMatrix();
+      row[10] = chi2;
+      row[11] = fs.MeasurementCount();
+      S.AddRow(row);
     }// loop on FittedStars
 }
 
+/*! The tuple is written in binary (NumPy .npy, see NpyRowWriter) if
+  TupleName ends with ".npy", and as text otherwise. */
+void AstromFit::MakeMeasResTuple(const std::string &TupleName) const
+{
+  if (IsNpyFileName(TupleName))
+    {
+      NpyRowWriter writer(TupleName, meas_residual_columns());
+      FillMeasResiduals(writer);
+      writer.Close();
+    }
+  else
+    {
+      AsciiRowWriter writer(TupleName, meas_residual_columns());
+      FillMeasResiduals(writer);
+    }
+}
+
+//! Same as MakeMeasResTuple, for reference terms.
+void AstromFit::MakeRefResTuple(const std::string &TupleName) const
+{
+  if (IsNpyFileName(TupleName))
+    {
+      NpyRowWriter writer(TupleName, ref_residual_columns());
+      FillRefResiduals(writer);
+      writer.Close();
+    }
+  else
+    {
+      AsciiRowWriter writer(TupleName, ref_residual_columns());
+      FillRefResiduals(writer);
+    }
+}
+
+ResidualTable AstromFit::MeasResiduals() const
+{
+  ResidualTable table(meas_residual_columns());
+  FillMeasResiduals(table);
+  return table;
+}
+
+ResidualTable AstromFit::RefResiduals() const
+{
+  ResidualTable table(ref_residual_columns());
+  FillRefResiduals(table);
+  return table;
+}
+
 
 }}}
@@ -3,6 +3,7 @@
 #include <string.h> // strstr
 
 #include "lsst/meas/simastrom/BaseStar.h"
+#include "lsst/meas/simastrom/Checkpoint.h"
 #include "lsst/meas/simastrom/StarList.cc"
 #include "lsst/pex/exceptions.h"
 
@@ -112,6 +113,21 @@ return (S1->flux < S2->flux);
 
 
 
+void BaseStar::Write(CheckpointWriter &W) const
+{
+  W.Put(x); W.Put(y);
+  W.Put(vx); W.Put(vy); W.Put(vxy);
+  W.Put(flux);
+}
+
+void BaseStar::Read(CheckpointReader &R)
+{
+  R.Get(x); R.Get(y);
+  R.Get(vx); R.Get(vy); R.Get(vxy);
+  R.Get(flux);
+}
+
+
 /**************** BaseStarList ******************/
 
 
@@ -9,6 +9,7 @@
 #include "lsst/afw/image/Image.h"
 #include "lsst/meas/simastrom/Gtransfo.h"
 #include "lsst/meas/simastrom/Point.h"
+#include "lsst/meas/simastrom/Checkpoint.h"
 #include "lsst/pex/exceptions.h"
 #include "lsst/afw/geom/Angle.h"
 
@@ -137,13 +138,8 @@ CcdImage::CcdImage(lsst::afw::table::SortedCatalogT<lsst::afw::table::SourceReco
     imageFrame = Frame(lowerLeft, upperRight);
     
     readWcs = new simAstrom::TanSipPix2RaDec(simAstrom::ConvertTanWcs(wcs));
+    InitTransfos();
 
-    // use some other variable in case we later have to actually convert the 
-    // read wcs:
-    const BaseTanWcs* tanWcs = readWcs.get();
-
-    inverseReadWcs = readWcs->InverseTransfo(0.01, imageFrame);
- 
     band = filter;
     bandIndex = getBandIndex(band);
     chip = ccd;
@@ -153,27 +149,6 @@ CcdImage::CcdImage(lsst::afw::table::SortedCatalogT<lsst::afw::table::SourceReco
     out << visit << "_" << ccd;
     riName = out.str();
 
-  /* we don't assume here that we know the internals of TanPix2RaDec:
-     to construct pix->TP, we do pix->sky->TP, although pix->sky 
-     actually goes through TP */
-
-    GtransfoLin identity;
-    TanRaDec2Pix raDec2TP(identity, tanWcs->TangentPoint());
-    pix2TP = GtransfoCompose(&raDec2TP, tanWcs);
-    TanPix2RaDec CTP2RaDec(identity, CommonTangentPoint);
-    CTP2TP = GtransfoCompose(&raDec2TP, &CTP2RaDec);
-
-    // jump from one TP to an other:
-    TanRaDec2Pix raDec2CTP(identity, CommonTangentPoint);
-    //  TanPix2RaDec TP2RaDec(identity, tanWcs->TangentPoint());
-    //  TP2CTP = GtransfoCompose(&raDec2CTP, &TP2RaDec);
-    TanPix2RaDec TP2RaDec(identity, tanWcs->TangentPoint());
-    TP2CTP = GtransfoCompose(&raDec2CTP, &TP2RaDec);
-    sky2TP = new TanRaDec2Pix(identity, tanWcs->TangentPoint());
-
-      // this one is needed for matches :
-    pix2CommonTangentPlane = GtransfoCompose(&raDec2CTP, tanWcs);
-    
     // In the following we read informations directly from the fits header which is instrument dependent
     // We rely on the camera name which is not optimal as a camera can be mounted on different telescopes. 
     // We would rather need the telescope name. 
@@ -221,5 +196,123 @@ CcdImage::CcdImage(lsst::afw::table::SortedCatalogT<lsst::afw::table::SourceReco
     }
     bandRank = 0; // will be set by Associations if pertinent.
 }
+
+void CcdImage::InitTransfos()
+{
+    // use some other variable in case we later have to actually convert the 
+    // read wcs:
+    const BaseTanWcs* tanWcs = readWcs.get();
+
+  /* we don't assume here that we know the internals of TanPix2RaDec:
+     to construct pix->TP, we do pix->sky->TP, although pix->sky 
+     actually goes through TP */
+
+    GtransfoLin identity;
+    TanRaDec2Pix raDec2TP(identity, tanWcs->TangentPoint());
+    pix2TP = GtransfoCompose(&raDec2TP, tanWcs);
+    TanPix2RaDec CTP2RaDec(identity, commonTangentPoint);
+    CTP2TP = GtransfoCompose(&raDec2TP, &CTP2RaDec);
+
+    // jump from one TP to an other:
+    TanRaDec2Pix raDec2CTP(identity, commonTangentPoint);
+    //  TanPix2RaDec TP2RaDec(identity, tanWcs->TangentPoint());
+    //  TP2CTP = GtransfoCompose(&raDec2CTP, &TP2RaDec);
+    TanPix2RaDec TP2RaDec(identity, tanWcs->TangentPoint());
+    TP2CTP = GtransfoCompose(&raDec2CTP, &TP2RaDec);
+    sky2TP = new TanRaDec2Pix(identity, tanWcs->TangentPoint());
+
+      // this one is needed for matches :
+    pix2CommonTangentPlane = GtransfoCompose(&raDec2CTP, tanWcs);
+}
+
+
+static void write_catalog(CheckpointWriter &W, const MeasuredStarList &Catalog)
+{
+  W.Put<unsigned long long>(Catalog.size());
+  for (auto i = Catalog.cbegin(); i != Catalog.end(); ++i) (*i)->Write(W);
+}
+
+static void read_catalog(CheckpointReader &R, MeasuredStarList &Catalog, const CcdImage *C)
+{
+  unsigned long long n = R.Get<unsigned long long>();
+  R.CheckSize(n, 1);
+  Catalog.clear();
+  for (unsigned long long k=0; k < n; ++k)
+    {
+      MeasuredStar *ms = new MeasuredStar();
+      ms->Read(R);
+      ms->SetCcdImage(C);
+      Catalog.push_back(ms);
+    }
+}
+
+/* The WCS read from the header is a TanSipPix2RaDec (see the
+   constructor): we save its parts, and the transfos derived from it
+   are recomputed. */
+void CcdImage::Write(CheckpointWriter &W) const
+{
+  W.Put(imageFrame.xMin); W.Put(imageFrame.yMin);
+  W.Put(imageFrame.xMax); W.Put(imageFrame.yMax);
+  W.PutPoly(readWcs->LinPart());
+  Point tangentPoint = readWcs->TangentPoint();
+  W.Put(tangentPoint.x); W.Put(tangentPoint.y);
+  const GtransfoPoly *corr = readWcs->Corr();
+  W.Put(bool(corr));
+  if (corr) W.PutPoly(*corr);
+  W.Put(commonTangentPoint.x); W.Put(commonTangentPoint.y);
+
+  W.PutString(riName); W.PutString(riDir); W.PutString(instrument);
+  W.PutString(dateObs); W.PutString(band); W.PutString(flatName);
+  W.PutString(cfhtscatter); W.PutString(snlsgrid); W.PutString(flatcvmap);
+  W.Put(chip); W.Put(shoot); W.Put(bandRank);
+  W.Put(bandIndex); W.Put(index); W.Put(expindex);
+  W.Put(expTime); W.Put(airMass); W.Put(fluxCoeff); W.Put(jd);
+  W.Put(toadsZeroPoint); W.Put(elixirZP); W.Put(photk); W.Put(photc);
+  W.Put(zp); W.Put(psfzp);
+  W.Put(sineta); W.Put(coseta); W.Put(tgz); W.Put(hourAngle);
+
+  write_catalog(W, wholeCatalog);
+  write_catalog(W, catalogForFit);
+}
+
+CcdImage::CcdImage(CheckpointReader &R)
+{
+  R.Get(imageFrame.xMin); R.Get(imageFrame.yMin);
+  R.Get(imageFrame.xMax); R.Get(imageFrame.yMax);
+  GtransfoPoly linPart;
+  R.GetPoly(linPart);
+  Point tangentPoint;
+  R.Get(tangentPoint.x); R.Get(tangentPoint.y);
+  GtransfoPoly corr;
+  bool hasCorr = R.Get<bool>();
+  if (hasCorr) R.GetPoly(corr);
+  readWcs = new TanSipPix2RaDec(GtransfoLin(linPart), tangentPoint, hasCorr ? &corr : NULL);
+  R.Get(commonTangentPoint.x); R.Get(commonTangentPoint.y);
+  InitTransfos();
+
+  riName = R.GetString(); riDir = R.GetString(); instrument = R.GetString();
+  dateObs = R.GetString(); band = R.GetString(); flatName = R.GetString();
+  cfhtscatter = R.GetString(); snlsgrid = R.GetString(); flatcvmap = R.GetString();
+  R.Get(chip); R.Get(shoot); R.Get(bandRank);
+  R.Get(bandIndex); R.Get(index); R.Get(expindex);
+  R.Get(expTime); R.Get(airMass); R.Get(fluxCoeff); R.Get(jd);
+  R.Get(toadsZeroPoint); R.Get(elixirZP); R.Get(photk); R.Get(photc);
+  R.Get(zp); R.Get(psfzp);
+  R.Get(sineta); R.Get(coseta); R.Get(tgz); R.Get(hourAngle);
+
+  read_catalog(R, wholeCatalog, this);
+  read_catalog(R, catalogForFit, this);
+}
+
+
+/* The inverse of the WCS is a polynomial fit (see
+   TanSipPix2RaDec::InverseTransfo), which is not cheap and seldom
+   needed : it is done at the first call, and then kept. */
+const Gtransfo *CcdImage::InverseReadWCS() const
+{
+  std::call_once(inverseReadWcsDone, [this]()
+		 { inverseReadWcs = readWcs->InverseTransfo(0.01, imageFrame);});
+  return inverseReadWcs.get();
+}
     
 }}} // end of namespaces
@@ -0,0 +1,155 @@
+#include <cstdio>
+#include <cstring>
+#include <sstream>
+#include <sys/stat.h>
+
+#include "lsst/meas/simastrom/Checkpoint.h"
+#include "lsst/meas/simastrom/Gtransfo.h"
+#include "lsst/pex/exceptions.h"
+
+namespace lsst {
+namespace meas {
+namespace simastrom {
+
+static const unsigned checkpoint_byte_order = 0x01020304;
+static const unsigned checkpoint_version = 1;
+
+struct CheckpointHeader
+{
+  char magic[8];
+  unsigned byteOrder;
+  unsigned version;
+};
+
+
+CheckpointWriter::CheckpointWriter(const std::string &FileName, const char *Magic)
+  : fileName(FileName), tmpName(FileName+".tmp"), ofp(NULL), ok(true)
+{
+  ofp = fopen(tmpName.c_str(), "w");
+  if (!ofp)
+    throw LSST_EXCEPT(pex::exceptions::InvalidParameterError, "CheckpointWriter : cannot open "+tmpName);
+  CheckpointHeader header;
+  memcpy(header.magic, Magic, 8);
+  header.byteOrder = checkpoint_byte_order;
+  header.version = checkpoint_version;
+  PutBytes(&header, sizeof(header));
+}
+
+void CheckpointWriter::PutBytes(const void *Data, const size_t Size)
+{
+  if (ok && Size) ok = (fwrite(Data, Size, 1, ofp) == 1);
+}
+
+void CheckpointWriter::PutString(const std::string &S)
+{
+  Put<unsigned long long>(S.size());
+  PutBytes(S.data(), S.size());
+}
+
+void CheckpointWriter::PutParams(const Gtransfo &T)
+{
+  int npar = T.Npar();
+  Put(npar);
+  for (int k=0; k < npar; ++k) Put(T.ParamRef(k));
+}
+
+void CheckpointWriter::PutPoly(const GtransfoPoly &P)
+{
+  Put(P.Degree());
+  PutParams(P);
+}
+
+void CheckpointWriter::Close()
+{
+  ok = (fclose(ofp) == 0) && ok;
+  ofp = NULL;
+  if (ok) ok = (rename(tmpName.c_str(), fileName.c_str()) == 0);
+  if (!ok)
+    {
+      remove(tmpName.c_str());
+      throw LSST_EXCEPT(pex::exceptions::InvalidParameterError, "CheckpointWriter : error while writing "+fileName);
+    }
+}
+
+CheckpointWriter::~CheckpointWriter()
+{
+  if (!ofp) return;
+  fclose(ofp);
+  remove(tmpName.c_str());
+}
+
+
+CheckpointReader::CheckpointReader(const std::string &FileName, const char *Magic)
+  : fileName(FileName), ifp(NULL), remaining(0)
+{
+  ifp = fopen(FileName.c_str(), "r");
+  if (!ifp)
+    throw LSST_EXCEPT(pex::exceptions::InvalidParameterError, "CheckpointReader : cannot open "+FileName);
+  struct stat st;
+  if (fstat(fileno(ifp), &st) == 0) remaining = st.st_size;
+  CheckpointHeader header;
+  std::string error;
+  if (remaining < sizeof(header) || fread(&header, sizeof(header), 1, ifp) != 1)
+    error = FileName+" is too short to be a checkpoint";
+  else if (memcmp(header.magic, Magic, 8) != 0)
+    error = FileName+" is not a checkpoint of the expected kind";
+  else if (header.byteOrder != checkpoint_byte_order)
+    error = FileName+" was written on a machine with a different byte order";
+  else if (header.version != checkpoint_version)
+    error = FileName+" was written with another version of the checkpoint format";
+  if (!error.empty())
+    {
+      fclose(ifp); // the destructor will not be called
+      throw LSST_EXCEPT(pex::exceptions::InvalidParameterError, "CheckpointReader : "+error);
+    }
+  remaining -= sizeof(header);
+}
+
+void CheckpointReader::GetBytes(void *Data, const size_t Size)
+{
+  if (Size == 0) return;
+  if (Size > remaining || fread(Data, Size, 1, ifp) != 1)
+    throw LSST_EXCEPT(pex::exceptions::InvalidParameterError, "CheckpointReader : "+fileName+" is truncated");
+  remaining -= Size;
+}
+
+void CheckpointReader::CheckSize(const unsigned long long N, const size_t ItemSize) const
+{
+  if (ItemSize && N > remaining/ItemSize)
+    throw LSST_EXCEPT(pex::exceptions::InvalidParameterError, "CheckpointReader : "+fileName+" is truncated or corrupted");
+}
+
+std::string CheckpointReader::GetString()
+{
+  unsigned long long n = Get<unsigned long long>();
+  CheckSize(n, 1);
+  std::string s(n, ' ');
+  if (n) GetBytes(&s[0], n);
+  return s;
+}
+
+void CheckpointReader::GetParams(Gtransfo &T)
+{
+  int npar = Get<int>();
+  if (npar != T.Npar())
+    {
+      std::stringstream message;
+      message << "CheckpointReader : " << fileName << " holds " << npar
+	      << " parameters for a transfo that has " << T.Npar();
+      throw LSST_EXCEPT(pex::exceptions::InvalidParameterError, message.str());
+    }
+  for (int k=0; k < npar; ++k) Get(T.ParamRef(k));
+}
+
+void CheckpointReader::GetPoly(GtransfoPoly &P)
+{
+  P.SetDegree(Get<unsigned>());
+  GetParams(P);
+}
+
+CheckpointReader::~CheckpointReader()
+{
+  if (ifp) fclose(ifp);
+}
+
+}}}
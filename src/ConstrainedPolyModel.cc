@@ -4,12 +4,14 @@
 #include "lsst/meas/simastrom/CcdImage.h"
 #include "lsst/meas/simastrom/Gtransfo.h"
 #include "lsst/meas/simastrom/AstroUtils.h" // ApplyTransfo(Frame)
+#include "lsst/meas/simastrom/Checkpoint.h"
 
 #include "lsst/pex/exceptions.h"
 namespace pexExcept = lsst::pex::exceptions;
 
 #include <string>
 #include <iostream>
+#include <sstream>
 
 namespace lsst {
 namespace meas {
@@ -200,6 +202,63 @@ void ConstrainedPolyModel::FreezeErrorScales()
   for (auto i = _chipMap.begin(); i!=_chipMap.end(); ++i)
     i->second->FreezeErrorScales();
 }
+
+
+static const char model_checkpoint_magic[] = "SIMCPOLY";
+
+template <class MapType> static void write_mappings(CheckpointWriter &W, const MapType &Mappings)
+{
+  W.Put<unsigned>(Mappings.size());
+  for (auto i = Mappings.cbegin(); i != Mappings.end(); ++i)
+    {
+      W.Put(i->first);
+      i->second->Write(W);
+    }
+}
+
+template <class MapType> static void read_mappings(CheckpointReader &R, MapType &Mappings, const std::string &What,
+						   const bool AllowNew)
+{
+  unsigned n = R.Get<unsigned>();
+  if (n > Mappings.size() || (n < Mappings.size() && !AllowNew))
+    {
+      std::stringstream message;
+      message << "ConstrainedPolyModel::ReadParams : " << R.FileName() << " holds " << n
+	      << " " << What << " mappings, and the model has " << Mappings.size();
+      throw LSST_EXCEPT(pexExcept::InvalidParameterError, message.str());
+    }
+  for (unsigned k=0; k < n; ++k)
+    {
+      typename MapType::key_type key;
+      R.Get(key);
+      auto m = Mappings.find(key);
+      if (m == Mappings.end())
+	{
+	  std::stringstream message;
+	  message << "ConstrainedPolyModel::ReadParams : " << R.FileName()
+		  << " holds a mapping for " << What << " " << key << ", which the model does not have";
+	  throw LSST_EXCEPT(pexExcept::InvalidParameterError, message.str());
+	}
+      m->second->Read(R);
+    }
+}
+
+/* The TwoTransfoMapping's refer to the chip and shoot mappings,
+   which are updated in place. */
+void ConstrainedPolyModel::WriteParams(const std::string &FileName) const
+{
+  CheckpointWriter w(FileName, model_checkpoint_magic);
+  write_mappings(w, _chipMap);
+  write_mappings(w, _shootMap);
+  w.Close();
+}
+
+void ConstrainedPolyModel::ReadParams(const std::string &FileName, const bool AllowNew)
+{
+  CheckpointReader r(FileName, model_checkpoint_magic);
+  read_mappings(r, _chipMap, "chip", AllowNew);
+  read_mappings(r, _shootMap, "shoot", AllowNew);
+}
   
 
 const Gtransfo& ConstrainedPolyModel::GetChipTransfo(const unsigned Chip) const
@@ -5,6 +5,7 @@
 #include "lsst/meas/simastrom/RefStar.h"
 #include "lsst/meas/simastrom/MeasuredStar.h"
 #include "lsst/meas/simastrom/Gtransfo.h"
+#include "lsst/meas/simastrom/Checkpoint.h"
 #include "lsst/meas/simastrom/StarList.cc"
 
 
@@ -214,4 +215,27 @@ BaseStar* FittedStar::read(std::istream& s, const char* format)
 }
 
 
+void FittedStar::Write(CheckpointWriter &W) const
+{
+  BaseStar::Write(W);
+  W.Put(pmx); W.Put(pmy);
+  W.Put(epmx); W.Put(epmy); W.Put(epmxy);
+  W.Put(color); W.Put(mightMove);
+  W.Put(mag); W.Put(emag); W.Put(col); W.Put(gen); W.Put(wmag);
+  W.Put(indexInMatrix); W.Put(measurementCount);
+  W.Put(flux2); W.Put(fluxErr); W.Put(fluxErr2);
+}
+
+void FittedStar::Read(CheckpointReader &R)
+{
+  BaseStar::Read(R);
+  R.Get(pmx); R.Get(pmy);
+  R.Get(epmx); R.Get(epmy); R.Get(epmxy);
+  R.Get(color); R.Get(mightMove);
+  R.Get(mag); R.Get(emag); R.Get(col); R.Get(gen); R.Get(wmag);
+  R.Get(indexInMatrix); R.Get(measurementCount);
+  R.Get(flux2); R.Get(fluxErr); R.Get(fluxErr2);
+}
+
+
 }}} // end of namespaces
@@ -0,0 +1,66 @@
+#include <cmath>
+#include <algorithm>
+
+#include "lsst/meas/simastrom/FittedStarGrid.h"
+#include "lsst/pex/exceptions.h"
+
+namespace lsst {
+namespace meas {
+namespace simastrom {
+
+
+FittedStarGrid::FittedStarGrid(const double CellSize) :
+  cellSize(CellSize), count(0)
+{
+  if (!(cellSize > 0))
+    throw LSST_EXCEPT(pex::exceptions::InvalidParameterError, "FittedStarGrid : cell size should be positive");
+}
+
+int FittedStarGrid::CellCoord(const double &X) const
+{
+  return int(std::floor(X/cellSize));
+}
+
+void FittedStarGrid::Insert(FittedStar *Fs)
+{
+  cells[CellKey(CellCoord(Fs->x), CellCoord(Fs->y))].push_back(Entry(count, Fs));
+  count++;
+}
+
+void FittedStarGrid::Insert(const FittedStarList &L)
+{
+  for (auto i = L.cbegin(); i != L.end(); ++i) Insert(&(**i));
+}
+
+void FittedStarGrid::ExtractInFrame(const Frame &F, FittedStarList &Out) const
+{
+  int iMin = CellCoord(F.xMin);
+  int iMax = CellCoord(F.xMax);
+  int jMin = CellCoord(F.yMin);
+  int jMax = CellCoord(F.yMax);
+  std::vector<Entry> found;
+  /* if the frame covers more cells than exist, scanning the existing
+     cells is cheaper */
+  if (double(iMax-iMin+1)*double(jMax-jMin+1) > cells.size())
+    {
+      for (auto c = cells.cbegin(); c != cells.end(); ++c)
+	for (auto e = c->second.cbegin(); e != c->second.end(); ++e)
+	  if (F.InFrame(*e->fs)) found.push_back(*e);
+    }
+  else
+    {
+      for (int i = iMin; i <= iMax; ++i)
+	for (int j = jMin; j <= jMax; ++j)
+	  {
+	    auto c = cells.find(CellKey(i,j));
+	    if (c == cells.end()) continue;
+	    for (auto e = c->second.cbegin(); e != c->second.end(); ++e)
+	      if (F.InFrame(*e->fs)) found.push_back(*e);
+	  }
+    }
+  // restore the insertion order, so that results do not depend on the cell size
+  std::sort(found.begin(), found.end());
+  for (auto e = found.cbegin(); e != found.end(); ++e) Out.push_back(e->fs);
+}
+
+}}}
@@ -215,6 +215,31 @@ void Gtransfo::ParamDerivatives(const Point &Where,
   if ((Where.x || Dx ) || Dy) {} // compilation warning killer
   throw LSST_EXCEPT(pex::exceptions::InvalidParameterError, "Gtransfo::ParamDerivatives() should never be called ");
 }
+
+void Gtransfo::ApplyBatch(const double *Xin, const double *Yin,
+			  double *Xout, double *Yout, const size_t N) const
+{
+  for (size_t k=0; k<N; ++k) apply(Xin[k], Yin[k], Xout[k], Yout[k]);
+}
+
+void Gtransfo::TransformPosAndErrorsBatch(const FatPointArrays &In, FatPointArrays &Out) const
+{
+  size_t n = In.size();
+  Out.resize(n);
+  FatPoint res;
+  for (size_t k=0; k<n; ++k)
+    {
+      TransformPosAndErrors(In.Get(k), res);
+      Out.Set(k, res);
+    }
+}
+
+void Gtransfo::ParamDerivativesBatch(const FatPointArrays &Where, double *Der) const
+{
+  unsigned npar = Npar();
+  for (size_t k=0; k<Where.size(); ++k)
+    ParamDerivatives(Point(Where.x[k], Where.y[k]), Der+2*k*npar, Der+(2*k+1)*npar);
+}
   
 
 ostream & operator << (ostream &stream, const Gtransfo & T)
@@ -398,6 +423,11 @@ class GtransfoComposition : public Gtransfo {
 
     //! return Second(First(Xin,Yin))
     void apply(const double Xin, const double Yin, double &Xout, double &Yout) const;
+
+    //! each stage transforms all points before the next one starts
+    void ApplyBatch(const double *Xin, const double *Yin,
+		    double *Xout, double *Yout, const size_t N) const;
+
     void dump(ostream &stream = cout) const; 
 
     //!
@@ -406,6 +436,9 @@ class GtransfoComposition : public Gtransfo {
     Gtransfo *Clone() const;
     ~GtransfoComposition();
 
+    // flattens nested compositions
+    friend Gtransfo *GtransfoCompose(const Gtransfo *Left, const Gtransfo *Right);
+
     //#ifndef SWIG
     //  ClassDef(GtransfoComposition,1);
     //#endif /*SWIG */
@@ -425,6 +458,15 @@ first->apply(Xin,Yin, xout,yout);
 second->apply(xout,yout,Xout,Yout);
 }
 
+void GtransfoComposition::ApplyBatch(const double *Xin, const double *Yin,
+				     double *Xout, double *Yout, const size_t N) const
+{
+  vector<double> xtmp(N), ytmp(N);
+  if (N == 0) return;
+  first->ApplyBatch(Xin, Yin, &xtmp[0], &ytmp[0], N);
+  second->ApplyBatch(&xtmp[0], &ytmp[0], Xout, Yout, N);
+}
+
 void GtransfoComposition::dump(ostream &stream) const
 {
 first->dump(stream); second->dump(stream);
@@ -448,7 +490,10 @@ delete first; delete second;
 
 /*!  This routine implements "run-time" compositions. When
  there is a possible "reduction" (e.g. compositions of polynomials),
- GtransfoCompose detects it and returns a genuine Gtransfo.
+ GtransfoCompose detects it and returns a genuine Gtransfo. When
+ Left or Right are themselves compositions, the reduction is also
+ attempted with their adjacent stage, so that chains do not grow
+ needlessly.
  */
 Gtransfo *GtransfoCompose(const Gtransfo *Left, const Gtransfo *Right)
 {
@@ -461,10 +506,34 @@ Gtransfo *GtransfoCompose(const Gtransfo *Left, const Gtransfo *Right)
      Gtransfo::ReduceCompo return NULL. ReduceCompo is non trivial for
      polynomials */
   Gtransfo *composition = Left->ReduceCompo(Right);
-  /* composition == NULL means no reduction : just build a Composition
-     that pipelines "Left" and "Right" */
-  if (composition == NULL) return new GtransfoComposition(Left,Right);
-  else return composition;
+  if (composition) return composition;
+  // Left o (Second o First) = (Left o Second) o First
+  const GtransfoComposition *right = dynamic_cast<const GtransfoComposition *>(Right);
+  if (right)
+    {
+      Gtransfo *reduced = Left->ReduceCompo(right->second);
+      if (reduced)
+	{
+	  composition = GtransfoCompose(reduced, right->first);
+	  delete reduced;
+	  return composition;
+	}
+    }
+  // (Second o First) o Right = Second o (First o Right)
+  const GtransfoComposition *left = dynamic_cast<const GtransfoComposition *>(Left);
+  if (left)
+    {
+      Gtransfo *reduced = left->first->ReduceCompo(Right);
+      if (reduced)
+	{
+	  composition = GtransfoCompose(left->second, reduced);
+	  delete reduced;
+	  return composition;
+	}
+    }
+  /* no reduction : just build a Composition that pipelines "Left"
+     and "Right" */
+  return new GtransfoComposition(Left,Right);
 }
 
 
@@ -535,13 +604,20 @@ GtransfoPoly::GtransfoPoly(const Gtransfo* T,
   BaseStarList toDelete; // just here to handle stuff that should be deleted
 
   double step = sqrt(fabs(F.Area())/double(NPoint));
+  vector<double> xs, ys;
   for (double x=F.xMin+step/2; x<=F.xMax; x+=step)
   for (double y=F.yMin+step/2; y<=F.yMax; y+=step)
     {
-      BaseStar *pix = new BaseStar(x,y,0);
-      double xtr, ytr;
-      T->apply(x,y,xtr,ytr);
-      BaseStar *tp = new BaseStar(xtr,ytr,0);
+      xs.push_back(x);
+      ys.push_back(y);
+    }
+  // transform the whole grid at once
+  vector<double> xtr(xs.size()), ytr(ys.size());
+  if (!xs.empty()) T->ApplyBatch(&xs[0], &ys[0], &xtr[0], &ytr[0], xs.size());
+  for (size_t k=0; k<xs.size(); ++k)
+    {
+      BaseStar *pix = new BaseStar(xs[k],ys[k],0);
+      BaseStar *tp = new BaseStar(xtr[k],ytr[k],0);
       /* These are fake stars so no need to transform fake errors.
 	 all errors (and weights) will be equal : */
       sm.push_back(StarMatch(*pix,*tp,pix,tp));
@@ -587,6 +663,62 @@ void GtransfoPoly::compute_monomials(const double &Xin, const double &Yin,
 }
 
 
+/* number of points handled at once by the GtransfoPoly batch
+   routines : the monomials of a block should stay in cache. */
+static const unsigned poly_block = 128;
+
+/* Work space of the batch routines, allocated once per call : Count
+   arrays of poly_block monomials, followed by the powers
+   compute_monomials needs. */
+static std::vector<double> batch_work(const unsigned NTerms, const unsigned Deg, const unsigned Count)
+{
+  return std::vector<double>((Count*NTerms + 2*(Deg+1))*poly_block);
+}
+
+void GtransfoPoly::compute_monomials(const double *Xin, const double *Yin, 
+				     const unsigned N, double *Powers,
+				     double *Monom, double *DerMx, double *DerMy) const
+{
+  /* same ordering as above : the monomial x^ix*y^iy has rank
+     d*(d+1)/2+iy with d=ix+iy. Powers are computed once for all
+     monomials. */
+  double *xp = Powers; // xp[i*N+p] = Xin[p]^i
+  double *yp = Powers+(deg+1)*N;
+  for (unsigned p=0; p<N; ++p) { xp[p] = 1; yp[p] = 1;}
+  for (unsigned i=1; i<=deg; ++i)
+    for (unsigned p=0; p<N; ++p)
+      {
+	xp[i*N+p] = xp[(i-1)*N+p]*Xin[p];
+	yp[i*N+p] = yp[(i-1)*N+p]*Yin[p];
+      }
+  for (unsigned ix = 0; ix<=deg; ++ix)
+    for (unsigned iy = 0; iy<=deg-ix; ++iy)
+      {
+	unsigned d = ix+iy;
+	unsigned k = d*(d+1)/2+iy;
+	const double *px = xp+ix*N;
+	const double *py = yp+iy*N;
+	double *m = Monom+k*N;
+	for (unsigned p=0; p<N; ++p) m[p] = px[p]*py[p];
+	if (!DerMx) continue;
+	double *mx = DerMx+k*N;
+	double *my = DerMy+k*N;
+	if (ix == 0) for (unsigned p=0; p<N; ++p) mx[p] = 0;
+	else
+	  {
+	    const double *pxm1 = xp+(ix-1)*N;
+	    for (unsigned p=0; p<N; ++p) mx[p] = ix*pxm1[p]*py[p];
+	  }
+	if (iy == 0) for (unsigned p=0; p<N; ++p) my[p] = 0;
+	else
+	  {
+	    const double *pym1 = yp+(iy-1)*N;
+	    for (unsigned p=0; p<N; ++p) my[p] = iy*px[p]*pym1[p];
+	  }
+      }
+}
+
+
 void GtransfoPoly::SetDegree(const unsigned Deg)
 {
   deg = Deg;
@@ -787,6 +919,110 @@ void GtransfoPoly::TransformPosAndErrors(const FatPoint &In, FatPoint &Out) cons
 }
 
 
+void GtransfoPoly::ApplyBatch(const double *Xin, const double *Yin,
+			      double *Xout, double *Yout, const size_t N) const
+{
+  std::vector<double> work = batch_work(nterms, deg, 1);
+  double *monomials = &work[0];
+  double *powers = monomials+nterms*poly_block;
+  for (size_t first=0; first<N; first += poly_block)
+    {
+      unsigned n = std::min(size_t(poly_block), N-first);
+      compute_monomials(Xin+first, Yin+first, n, powers, monomials);
+      // the input is not used beyond this point: Xin may be Xout.
+      double *xout = Xout+first;
+      double *yout = Yout+first;
+      for (unsigned p=0; p<n; ++p) xout[p] = yout[p] = 0;
+      // same summation order as apply()
+      for (unsigned k=0; k<nterms; ++k)
+	{
+	  const double cx = coeffs[k];
+	  const double cy = coeffs[k+nterms];
+	  const double *m = monomials+k*n;
+	  for (unsigned p=0; p<n; ++p)
+	    {
+	      xout[p] += cx*m[p];
+	      yout[p] += cy*m[p];
+	    }
+	}
+    }
+}
+
+void GtransfoPoly::TransformPosAndErrorsBatch(const FatPointArrays &In, FatPointArrays &Out) const
+{
+  size_t n = In.size();
+  Out.resize(n); // no-op if &In == &Out
+  std::vector<double> work = batch_work(nterms, deg, 3);
+  double *monomials = &work[0];
+  double *dermx = monomials+nterms*poly_block;
+  double *dermy = dermx+nterms*poly_block;
+  double *powers = dermy+nterms*poly_block;
+  double xout[poly_block], yout[poly_block];
+  double a11[poly_block], a12[poly_block], a21[poly_block], a22[poly_block];
+  for (size_t first=0; first<n; first += poly_block)
+    {
+      unsigned nb = std::min(size_t(poly_block), n-first);
+      compute_monomials(&In.x[first], &In.y[first], nb, powers, monomials, dermx, dermy);
+      for (unsigned p=0; p<nb; ++p) 
+	xout[p] = yout[p] = a11[p] = a12[p] = a21[p] = a22[p] = 0;
+      for (unsigned k=0; k<nterms; ++k)
+	{
+	  const double cx = coeffs[k];
+	  const double cy = coeffs[k+nterms];
+	  const double *m = monomials+k*nb;
+	  const double *mx = dermx+k*nb;
+	  const double *my = dermy+k*nb;
+	  for (unsigned p=0; p<nb; ++p)
+	    {
+	      xout[p] += cx*m[p];
+	      yout[p] += cy*m[p];
+	      a11[p] += cx*mx[p];
+	      a12[p] += cx*my[p];
+	      a21[p] += cy*mx[p];
+	      a22[p] += cy*my[p];
+	    }
+	}
+      for (unsigned p=0; p<nb; ++p)
+	{
+	  size_t i = first+p;
+	  double vx = In.vx[i];
+	  double vy = In.vy[i];
+	  double vxy = In.vxy[i];
+	  Out.x[i] = xout[p];
+	  Out.y[i] = yout[p];
+	  Out.vx[i] = a11[p]*(a11[p]*vx + 2*a12[p]*vxy) + a12[p]*a12[p]*vy;
+	  Out.vy[i] = a21[p]*a21[p]*vx + a22[p]*a22[p]*vy + 2.*a21[p]*a22[p]*vxy;
+	  Out.vxy[i] = a21[p]*a11[p]*vx + a22[p]*a12[p]*vy + (a21[p]*a12[p]+a11[p]*a22[p])*vxy;
+	}
+    }
+}
+
+void GtransfoPoly::ParamDerivativesBatch(const FatPointArrays &Where, double *Der) const
+{
+  const unsigned npar = 2*nterms;
+  size_t n = Where.size();
+  std::vector<double> work = batch_work(nterms, deg, 1);
+  double *monomials = &work[0];
+  double *powers = monomials+nterms*poly_block;
+  for (size_t first=0; first<n; first += poly_block)
+    {
+      unsigned nb = std::min(size_t(poly_block), n-first);
+      compute_monomials(&Where.x[first], &Where.y[first], nb, powers, monomials);
+      for (unsigned p=0; p<nb; ++p)
+	{
+	  // see ParamDerivatives : first half : dxout/dpar, second half : dyout/dpar
+	  double *dx = Der+2*(first+p)*npar;
+	  double *dy = dx+npar;
+	  for (unsigned k=0; k<nterms; ++k)
+	    {
+	      dx[k] = dy[nterms+k] = monomials[k*nb+p];
+	      dx[nterms+k] = dy[k] = 0;
+	    }
+	}
+    }
+}
+
+
 /* The coefficient ordering is defined both here *AND* in the 
    GtransfoPoly::apply, GtransfoPoly::Derivative, ... routines
    Change all or none ! */
@@ -996,52 +1232,75 @@ double GtransfoPoly::do_the_fit(const StarMatchList &List,
   Eigen::MatrixXd A(2*nterms,2*nterms);   A.setZero();
   Eigen::VectorXd B(2*nterms);   B.setZero();
   double sumr2 = 0;
-  double monomials[nterms];
-  for (auto it = List.begin(); it != List.end(); ++it)
+  /* The matches are processed in blocks of poly_block. The monomials
+     of a block make a (poly_block x nterms) design matrix M, and the
+     block contributes M^T*W*M to the normal matrix, computed with
+     matrix products rather than term by term. */
+  std::vector<double> work = batch_work(nterms, deg, 1);
+  double *monomials = &work[0];
+  double *powers = monomials+nterms*poly_block;
+  Eigen::MatrixXd wm(poly_block, nterms);
+  Eigen::VectorXd wxx(poly_block), wyy(poly_block), wxy(poly_block);
+  Eigen::VectorXd bx(poly_block), by(poly_block);
+  FatPointArrays point1, point2, tr1;
+  auto it = List.begin();
+  while (it != List.end())
     {
-      const StarMatch &a_match = *it;
-      Point tmp = ShiftToCenter.apply(a_match.point1);
-      FatPoint point1(tmp, a_match.point1.vx, a_match.point1.vy, 
-		      a_match.point1.vxy);
-      const FatPoint &point2 = a_match.point2;
-      double wxx,wyy,wxy;
-      FatPoint tr1;
-      compute_monomials(point1.x, point1.y, monomials);
+      point1.resize(poly_block);
+      point2.resize(poly_block);
+      unsigned n = 0;
+      for ( ; it != List.end() && n < poly_block; ++it, ++n)
+	{
+	  const StarMatch &a_match = *it;
+	  Point tmp = ShiftToCenter.apply(a_match.point1);
+	  point1.Set(n, FatPoint(tmp, a_match.point1.vx, a_match.point1.vy, 
+				 a_match.point1.vxy));
+	  point2.Set(n, a_match.point2);
+	}
+      point1.resize(n);
+      point2.resize(n);
+      compute_monomials(&point1.x[0], &point1.y[0], n, powers, monomials);
+      // the monomials are stored term-major, i.e. as a column-major M
+      Eigen::Map<const Eigen::MatrixXd> m(monomials, n, nterms);
       if (UseErrors)
 	{
-	  TransformPosAndErrors(point1, tr1);// we might consider recycling the monomials
-	  double vxx = (tr1.vx+point2.vx);
-	  double vyy = (tr1.vy+point2.vy);
-	  double vxy = (tr1.vxy+point2.vxy);
-	  double det = vxx*vyy-vxy*vxy;
-	  wxx = vyy/det;
-	  wyy = vxx/det;
-	  wxy = -vxy/det;
+	  TransformPosAndErrorsBatch(point1, tr1);
+	  for (unsigned p=0; p<n; ++p)
+	    {
+	      double vxx = (tr1.vx[p]+point2.vx[p]);
+	      double vyy = (tr1.vy[p]+point2.vy[p]);
+	      double vxy = (tr1.vxy[p]+point2.vxy[p]);
+	      double det = vxx*vyy-vxy*vxy;
+	      wxx(p) = vyy/det;
+	      wyy(p) = vxx/det;
+	      wxy(p) = -vxy/det;
+	    }
 	}
       else 
 	{
-	  wxx = wyy = 1; wxy = 0;
-	  apply(point1.x, point1.y ,tr1.x, tr1.y);
+	  tr1.resize(n);
+	  ApplyBatch(&point1.x[0], &point1.y[0], &tr1.x[0], &tr1.y[0], n);
+	  wxx.head(n).setOnes(); wyy.head(n).setOnes(); wxy.head(n).setZero();
 	}
-      double resx = point2.x - tr1.x;
-      double resy = point2.y - tr1.y;
-      sumr2 += wxx*sq(resx) + wyy*sq(resy) 
-	+2*wxy*resx*resy;
-
-      double bxcoeff = wxx*resx + wxy*resy ;
-      double bycoeff = wyy*resy + wxy*resx;
-      for (unsigned j=0; j<nterms; ++j)
+      for (unsigned p=0; p<n; ++p)
 	{
-	  for (unsigned i=j; i<nterms; ++i)
-	    {
-	      A(i,j) += wxx*monomials[i]*monomials[j];
-	      A(i+nterms,j+nterms) += wyy*monomials[i]*monomials[j];
-	      A(j,i+nterms) = A(i,j+nterms) += wxy*monomials[i]*monomials[j];
-	    }
-	  B(j)        += bxcoeff*monomials[j];
-	  B(j+nterms) += bycoeff*monomials[j];
+	  double resx = point2.x[p] - tr1.x[p];
+	  double resy = point2.y[p] - tr1.y[p];
+	  sumr2 += wxx(p)*sq(resx) + wyy(p)*sq(resy) 
+	    +2*wxy(p)*resx*resy;
+	  bx(p) = wxx(p)*resx + wxy(p)*resy ;
+	  by(p) = wyy(p)*resy + wxy(p)*resx;
 	}
-    } // end loop on points
+      wm.topRows(n).noalias() = wxx.head(n).asDiagonal()*m;
+      A.topLeftCorner(nterms,nterms).noalias() += m.transpose()*wm.topRows(n);
+      wm.topRows(n).noalias() = wyy.head(n).asDiagonal()*m;
+      A.bottomRightCorner(nterms,nterms).noalias() += m.transpose()*wm.topRows(n);
+      wm.topRows(n).noalias() = wxy.head(n).asDiagonal()*m;
+      A.bottomLeftCorner(nterms,nterms).noalias() += m.transpose()*wm.topRows(n);
+      B.head(nterms).noalias() += m.transpose()*bx.head(n);
+      B.tail(nterms).noalias() += m.transpose()*by.head(n);
+    } // end loop on blocks
+  A.topRightCorner(nterms,nterms) = A.bottomLeftCorner(nterms,nterms).transpose();
   Eigen::LDLT<Eigen::MatrixXd, Eigen::Lower> factor(A);
   // should probably throw
   if (factor.info() != Eigen::Success)
@@ -1289,6 +1548,31 @@ void GtransfoPoly::Read(istream &s)
 }  
 
 
+/* The largest distance between Inverse(Direct(p)) and p, over a
+   grid of NxN points in F. With Offset = 0.5, the grid points sit
+   between the ones of an Offset = 0 grid. */
+static double max_inverse_error(const Gtransfo &Direct, const Gtransfo &Inverse,
+				const Frame &F, const unsigned N, const double Offset)
+{
+  double stepx = F.Width()/(N+1);
+  double stepy = F.Height()/(N+1);
+  vector<double> x(N*N), y(N*N), xtr(N*N), ytr(N*N);
+  for (unsigned i=0 ;i<N; ++i)
+    for (unsigned j=0; j<N; ++j)
+      {
+	x[i*N+j] = F.xMin+(i+0.5+Offset)*stepx;
+	y[i*N+j] = F.yMin+(j+0.5+Offset)*stepy;
+      }
+  Direct.ApplyBatch(&x[0], &y[0], &xtr[0], &ytr[0], N*N);
+  Inverse.ApplyBatch(&xtr[0], &ytr[0], &xtr[0], &ytr[0], N*N);
+  double dist2 = 0;
+  for (unsigned k=0; k<N*N; ++k)
+    dist2 = std::max(dist2, sqr(xtr[k]-x[k]) + sqr(ytr[k]-y[k]));
+  return sqrt(dist2);
+}
+
+/*! The degree is raised until the largest residual over the fitting
+  grid is below Prec (and not only the rms residual). */
 GtransfoPoly *InversePolyTransfo(const Gtransfo &Direct, const Frame &F, const double Prec)
 {
   StarMatchList sm;
@@ -1296,27 +1580,31 @@ GtransfoPoly *InversePolyTransfo(const Gtransfo &Direct, const Frame &F, const d
   double stepx = F.Width()/(nx+1);
   unsigned ny = 50;
   double stepy= F.Height()/(ny+1);
+  vector<double> x(nx*ny), y(nx*ny), xtr(nx*ny), ytr(nx*ny);
   for (unsigned i=0 ;i<nx; ++i)
     for (unsigned j=0; j<ny; ++j)
       {
-	Point in((i+0.5)*stepx, (j+0.5)*stepy);
-	Point out(Direct.apply(in));
-	sm.push_back(StarMatch(out, in , NULL,NULL));
+	x[i*ny+j] = F.xMin+(i+0.5)*stepx;
+	y[i*ny+j] = F.yMin+(j+0.5)*stepy;
       }
-  unsigned npairs = sm.size();
+  Direct.ApplyBatch(&x[0], &y[0], &xtr[0], &ytr[0], nx*ny);
+  for (unsigned k=0; k<nx*ny; ++k)
+    sm.push_back(StarMatch(Point(xtr[k],ytr[k]), Point(x[k],y[k]), NULL,NULL));
   int maxdeg = 9;
   int degree;
   GtransfoPoly *poly = NULL;
+  vector<double> xback(nx*ny), yback(nx*ny);
   for (degree=1; degree<=maxdeg; ++degree)
     {
       delete poly;
       poly = new GtransfoPoly(degree);
       poly->fit(sm);
-      // compute the chi2 ignoring errors:
-      double chi2 = 0;
-      for (auto i=sm.cbegin(); i!= sm.end(); ++i)
-	chi2 +=  i->point2.Dist2(poly->apply((i->point1)));
-      if (chi2/npairs< Prec*Prec) break;
+      // largest residual, ignoring errors:
+      poly->ApplyBatch(&xtr[0], &ytr[0], &xback[0], &yback[0], nx*ny);
+      double dist2 = 0;
+      for (unsigned k=0; k<nx*ny; ++k)
+	dist2 = std::max(dist2, sqr(xback[k]-x[k]) + sqr(yback[k]-y[k]));
+      if (dist2 < Prec*Prec) break;
     }
   if (degree>maxdeg)
     cout << " InversePolyTransfo : Reached  max degree without reaching  requested precision = " << Prec << endl;
@@ -1324,6 +1612,27 @@ GtransfoPoly *InversePolyTransfo(const Gtransfo &Direct, const Frame &F, const d
 }  
 
 
+/* The inverse of a WCS with polynomial corrections : sky to tangent
+   plane is analytic, and the tangent plane to pixels part is a
+   polynomial fitted over Region (see InversePolyTransfo). The fit is
+   then checked on points it did not use. If it is not precise
+   enough, we fall back on the iterative inverse. */
+static Gtransfo *fitted_wcs_inverse(const BaseTanWcs &Wcs, const double Precision,
+				    const Frame &Region)
+{
+  GtransfoPoly pix2TP = Wcs.Pix2TangentPlane();
+  GtransfoPoly *tp2Pix = InversePolyTransfo(pix2TP, Region, Precision);
+  if (max_inverse_error(pix2TP, *tp2Pix, Region, 50, 0.5) > Precision)
+    {
+      delete tp2Pix;
+      return new GtransfoInverse(&Wcs, Precision, Region);
+    }
+  TanRaDec2Pix raDec2TP(GtransfoLin(), Wcs.TangentPoint());
+  Gtransfo *inverse = GtransfoCompose(tp2Pix, &raDec2TP);
+  delete tp2Pix;
+  return inverse;
+}
+
 
 /**************** GtransfoLin ***************************************/
 /* GtransfoLin is a specialized constructor of GtransfoPoly 
@@ -1682,7 +1991,7 @@ Gtransfo*  TanPix2RaDec::InverseTransfo(const double Precision,
 					const Frame& Region) const
 {
   if (!corr) return new TanRaDec2Pix(LinPart().invert(),TangentPoint());
-  else return new GtransfoInverse(this, Precision, Region);
+  else return fitted_wcs_inverse(*this, Precision, Region);
 }
 
 
@@ -1764,8 +2073,10 @@ Gtransfo* TanPix2RaDec::RoughInverse(const Frame &Region) const
 
 Gtransfo*  TanSipPix2RaDec::InverseTransfo(const double Precision,
 					const Frame& Region) const
-{/* We have not implemented (yet) the reverse corrections available in SIP */
-   return new GtransfoInverse(this, Precision, Region);
+{/* We have not implemented (yet) the reverse corrections available
+    in SIP. We fit them instead. */
+  if (!corr) return new TanRaDec2Pix(LinPart().invert(),TangentPoint());
+  return fitted_wcs_inverse(*this, Precision, Region);
 }
 
 
@@ -1934,6 +2245,40 @@ void TanRaDec2Pix::apply(const double Xin, const double Yin, double &Xout, doubl
   linTan2Pix. apply(l,m, Xout, Yout);
 }
 
+void TanRaDec2Pix::ApplyBatch(const double *Xin, const double *Yin,
+			      double *Xout, double *Yout, const size_t N) const
+{
+  for (size_t k=0; k<N; ++k)
+    {
+      double dec = deg2rad(Yin[k]);
+      double dra = deg2rad(Xin[k])-ra0;
+      if (dra >  M_PI ) dra -= (2.* M_PI);
+      if (dra < -M_PI ) dra += (2.* M_PI);
+      double coss = cos(dec);
+      double sins = sin(dec);
+      double cosdra = cos(dra);
+      // same as apply(), with cos(ra-ra0) computed once
+      double m = sins * sin0 + coss * cos0 * cosdra;
+      Xout[k] = rad2deg(sin(dra) * coss / m);
+      Yout[k] = rad2deg((sins * cos0 - coss * sin0 * cosdra) / m);
+    }
+  linTan2Pix.ApplyBatch(Xout, Yout, Xout, Yout, N);
+}
+
+
+/*! When Right goes from pixels to sky through the same tangent
+  point, the projection undoes the deprojection of Right : the result
+  is the polynomial Right->Pix2TangentPlane(), followed by our linear
+  part. */
+Gtransfo * TanRaDec2Pix::ReduceCompo(const Gtransfo *Right) const
+{
+  const BaseTanWcs *wcs = dynamic_cast<const BaseTanWcs *>(Right);
+  if (!wcs) return NULL;
+  Point tp = wcs->TangentPoint();
+  if (tp.x != TangentPoint().x || tp.y != TangentPoint().y) return NULL;
+  GtransfoPoly pix2TP = wcs->Pix2TangentPlane();
+  return GtransfoPoly(linTan2Pix).ReduceCompo(&pix2TP);
+}
 
 TanPix2RaDec TanRaDec2Pix::invert() const
 {
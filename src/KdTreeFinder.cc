@@ -0,0 +1,119 @@
+#include <algorithm>
+
+#include "lsst/meas/simastrom/KdTreeFinder.h"
+
+namespace lsst {
+namespace meas {
+namespace simastrom {
+
+// objects per leaf
+static const unsigned kdtree_bucket = 8;
+
+KdTreeFinder::KdTreeFinder(const BaseStarList &List)
+{
+  entries.reserve(List.size());
+  for (auto i = List.cbegin(); i != List.end(); ++i)
+    {
+      Entry e = {(*i)->x, (*i)->y, i->get()};
+      entries.push_back(e);
+    }
+  if (entries.empty()) return;
+  nodes.reserve(2*(entries.size()/kdtree_bucket+1));
+  Build(0, entries.size());
+}
+
+unsigned KdTreeFinder::Build(const unsigned Begin, const unsigned End)
+{
+  unsigned inode = nodes.size();
+  nodes.push_back(Node());
+  nodes[inode].begin = Begin;
+  nodes[inode].end = End;
+  nodes[inode].axis = -1;
+  if (End-Begin <= kdtree_bucket) return inode;
+
+  // split along the largest spread, at the median
+  double xmin = entries[Begin].x, xmax = xmin;
+  double ymin = entries[Begin].y, ymax = ymin;
+  for (unsigned k=Begin+1; k<End; ++k)
+    {
+      const Entry &e = entries[k];
+      xmin = std::min(xmin, e.x); xmax = std::max(xmax, e.x);
+      ymin = std::min(ymin, e.y); ymax = std::max(ymax, e.y);
+    }
+  // all objects at the same place : keep them in a (large) leaf
+  if (xmin == xmax && ymin == ymax) return inode;
+  int axis = (xmax-xmin >= ymax-ymin) ? 0 : 1;
+  unsigned mid = (Begin+End)/2;
+  std::nth_element(entries.begin()+Begin, entries.begin()+mid, entries.begin()+End,
+		   [axis](const Entry &E1, const Entry &E2)
+		   { return (axis == 0) ? (E1.x < E2.x) : (E1.y < E2.y);});
+  /* entries before mid have coordinates <= split, and the ones
+     from mid on, >= split. */
+  double split = (axis == 0) ? entries[mid].x : entries[mid].y;
+  unsigned left = Build(Begin, mid);
+  unsigned right = Build(mid, End);
+  // nodes may have been reallocated by the recursive calls
+  Node &node = nodes[inode];
+  node.axis = axis;
+  node.split = split;
+  node.left = left;
+  node.right = right;
+  return inode;
+}
+
+void KdTreeFinder::Search(const unsigned INode, const Point &Where, 
+			  const BaseStar *Best[2], double Dist2[2], 
+			  const bool Two, bool (*SkipIt)(const BaseStar *)) const
+{
+  const Node &node = nodes[INode];
+  if (node.axis < 0)
+    {
+      for (unsigned k=node.begin; k<node.end; ++k)
+	{
+	  const Entry &e = entries[k];
+	  double dist2 = (e.x-Where.x)*(e.x-Where.x) + (e.y-Where.y)*(e.y-Where.y);
+	  if (dist2 >= Dist2[1]) continue;
+	  if (SkipIt && SkipIt(e.star)) continue;
+	  if (!Two) { Best[0] = Best[1] = e.star; Dist2[0] = Dist2[1] = dist2;}
+	  else if (dist2 < Dist2[0])
+	    {
+	      Best[1] = Best[0]; Dist2[1] = Dist2[0];
+	      Best[0] = e.star; Dist2[0] = dist2;
+	    }
+	  else { Best[1] = e.star; Dist2[1] = dist2;}
+	}
+      return;
+    }
+  double diff = ((node.axis == 0) ? Where.x : Where.y) - node.split;
+  unsigned nearSide = (diff < 0) ? node.left : node.right;
+  unsigned farSide = (diff < 0) ? node.right : node.left;
+  Search(nearSide, Where, Best, Dist2, Two, SkipIt);
+  // objects on the other side are at least |diff| away
+  if (diff*diff < Dist2[1]) Search(farSide, Where, Best, Dist2, Two, SkipIt);
+}
+
+const BaseStar *KdTreeFinder::FindClosest(const Point &Where, const double MaxDist, 
+					  bool (*SkipIt)(const BaseStar *)) const
+{
+  if (entries.empty()) return NULL;
+  const BaseStar *best[2] = {NULL, NULL};
+  double dist2[2] = {MaxDist*MaxDist, MaxDist*MaxDist};
+  Search(0, Where, best, dist2, false, SkipIt);
+  return best[0];
+}
+
+const BaseStar *KdTreeFinder::SecondClosest(const Point &Where, 
+					    const double MaxDist, 
+					    const BaseStar* &Closest,
+					    bool (*SkipIt)(const BaseStar *)) const
+{
+  Closest = NULL;
+  if (entries.empty()) return NULL;
+  const BaseStar *best[2] = {NULL, NULL};
+  double dist2[2] = {MaxDist*MaxDist, MaxDist*MaxDist};
+  Search(0, Where, best, dist2, true, SkipIt);
+  Closest = best[0];
+  return best[1];
+}
+
+}}} // end of namespaces
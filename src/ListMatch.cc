@@ -3,6 +3,7 @@
 #include <list>
 #include <memory>
 #include <algorithm>
+#include <vector>
 #ifndef M_PI
 #define     M_PI            3.14159265358979323846  /* pi */
 #endif
@@ -51,6 +52,7 @@ MatchConditions::MatchConditions()
   MinMatchRatio = 1./3.;
   PrintLevel = 0;
   Algorithm = 2;
+  TriangleTolerance = 0.005;
   /*
   if (DatacardsName != "")
     {
@@ -498,10 +500,239 @@ SolList Solutions;
 }
 
 
+/* Triangle hashing: triangles of bright stars are described by
+   quantities that do not change under a shift, a rotation and a
+   scaling, i.e. the ratios of their two shortest sides to the
+   longest one. Triangles of L2 are indexed in this (2d) space, and
+   each triangle of L1 looks for its look-alikes there. Compared to
+   segment pairs, one triangle pair defines the transformation, and
+   constrains 3 star pairs rather than one. */
+
+struct Triangle
+{
+  double ra, rb; // a/c and b/c, where a <= b <= c are the sides
+  double c, angle; // length and orientation of the longest side (from v[0] to v[1])
+  bool direct; // orientation of (v[0],v[1],v[2])
+  unsigned v[3]; // ranks of the vertices opposite to a, b, c (hence c joins v[0] and v[1])
+};
+
+/* the triangles of the NStars first stars of L (with positions
+   transformed by Tin) made of a star and two of its
+   triangle_neighbours closest neighbours, leaving out the elongated
+   ones, and the ones where the ordering of sides is not well defined.
+   Using all triangles would yield O(NStars^6) candidate pairs. */
+static const unsigned triangle_neighbours = 10;
+
+static void build_triangles(const BaseStarList &L, const int NStars, const Gtransfo &Tin,
+			    const double Tolerance, std::vector<const BaseStar *> &Stars,
+			    std::vector<Triangle> &Triangles)
+{
+  Stars.clear();
+  Triangles.clear();
+  std::vector<Point> pos;
+  for (auto si = L.cbegin(); si != L.end() && int(Stars.size()) < NStars; ++si)
+    {
+      Stars.push_back(&(**si));
+      pos.push_back(Tin.apply(**si));
+    }
+  const unsigned n = Stars.size();
+  std::vector<double> dist(n*n);
+  for (unsigned i=0; i<n; ++i)
+    for (unsigned j=0; j<n; ++j) dist[i*n+j] = pos[i].Distance(pos[j]);
+  // vertex triplets, as (sorted) ranks packed into one integer
+  std::vector<unsigned long long> triplets;
+  std::vector<std::pair<double, unsigned> > neighbours;
+  for (unsigned i=0; i<n; ++i)
+    {
+      neighbours.clear();
+      for (unsigned j=0; j<n; ++j) 
+	if (j != i) neighbours.push_back(std::make_pair(dist[i*n+j], j));
+      unsigned nn = std::min<unsigned>(triangle_neighbours, neighbours.size());
+      std::partial_sort(neighbours.begin(), neighbours.begin()+nn, neighbours.end());
+      for (unsigned a=0; a<nn; ++a)
+	for (unsigned b=a+1; b<nn; ++b)
+	  {
+	    unsigned long long v[3] = {i, neighbours[a].second, neighbours[b].second};
+	    std::sort(v, v+3);
+	    triplets.push_back((v[0] << 42) | (v[1] << 21) | v[2]);
+	  }
+    }
+  std::sort(triplets.begin(), triplets.end());
+  triplets.erase(std::unique(triplets.begin(), triplets.end()), triplets.end());
+  const unsigned long long mask = (1ULL << 21)-1;
+  for (auto tr = triplets.cbegin(); tr != triplets.end(); ++tr)
+    {
+      unsigned i = *tr >> 42;
+      unsigned j = (*tr >> 21) & mask;
+      unsigned k = *tr & mask;
+      // sides, with the rank of the opposite vertex
+      std::pair<double, unsigned> side[3] = {std::make_pair(dist[j*n+k], i),
+					     std::make_pair(dist[i*n+k], j),
+					     std::make_pair(dist[i*n+j], k)};
+      std::sort(side, side+3);
+      double c = side[2].first;
+      if (c == 0) continue;
+      Triangle t;
+      t.ra = side[0].first/c;
+      t.rb = side[1].first/c;
+      if (t.ra < 0.1) continue;
+      if (t.rb-t.ra < Tolerance || 1-t.rb < Tolerance) continue;
+      t.c = c;
+      for (int s=0; s<3; ++s) t.v[s] = side[s].second;
+      const Point &p0 = pos[t.v[0]];
+      const Point &p1 = pos[t.v[1]];
+      const Point &p2 = pos[t.v[2]];
+      t.angle = atan2(p1.y-p0.y, p1.x-p0.x);
+      t.direct = ((p1.x-p0.x)*(p2.y-p0.y)-(p1.y-p0.y)*(p2.x-p0.x) > 0);
+      Triangles.push_back(t);
+    }
+}
+
+static StarMatchList *ListMatchupRotShift_Triangles(BaseStarList &L1, BaseStarList &L2, 
+						    const Gtransfo &Tin, 
+						    const MatchConditions &Conditions) 
+{
+  if (L1.size() <= 4 || L2.size() <= 4)
+    {
+      std::cout << " ListMatchupRotShift_Triangles : (at least) one of the lists is too short " << std::endl;
+      return NULL;
+    }
+  const double tol = Conditions.TriangleTolerance;
+  std::vector<const BaseStar *> stars1, stars2;
+  std::vector<Triangle> tri1, tri2;
+  build_triangles(L1, Conditions.NStarsL1, Tin, tol, stars1, tri1);
+  build_triangles(L2, Conditions.NStarsL2, GtransfoIdentity(), tol, stars2, tri2);
+
+  /* index the triangles of L2 in (ra,rb) cells of the size of the
+     tolerance: start[cell] is the first of them in "indexed". */
+  const int nCells = int(ceil(1./tol));
+  std::vector<unsigned> start(nCells*nCells+1, 0);
+  std::vector<unsigned> cellOf(tri2.size());
+  for (unsigned t=0; t < tri2.size(); ++t)
+    {
+      int i = std::min(nCells-1, int(tri2[t].ra/tol));
+      int j = std::min(nCells-1, int(tri2[t].rb/tol));
+      cellOf[t] = i*nCells+j;
+      start[cellOf[t]+1]++;
+    }
+  for (int c=0; c < nCells*nCells; ++c) start[c+1] += start[c];
+  std::vector<unsigned> indexed(tri2.size());
+  {
+    std::vector<unsigned> next(start.begin(), start.end()-1);
+    for (unsigned t=0; t < tri2.size(); ++t) indexed[next[cellOf[t]]++] = t;
+  }
+
+  /* same binning as the segment based searches for (ratio, angle) of
+     the candidate transformations */
+  int nBinsR = 21;
+  int nBinsAngle = 180; /* can be divided by 4 */
+  double angleOffset = M_PI/nBinsAngle;
+  double minRatio = Conditions.MinSizeRatio();
+  double maxRatio = Conditions.MaxSizeRatio();
+  Histo2d histo(nBinsR, minRatio, maxRatio,  
+		nBinsAngle, -M_PI- angleOffset, M_PI - angleOffset);
+
+  struct TrianglePair { unsigned t1, t2; double ratio, angle;};
+  std::vector<TrianglePair> pairs;
+  const double tol2 = tol*tol;
+  for (unsigned t=0; t < tri1.size(); ++t)
+    {
+      const Triangle &a = tri1[t];
+      int ia = std::min(nCells-1, int(a.ra/tol));
+      int ja = std::min(nCells-1, int(a.rb/tol));
+      for (int i = std::max(0, ia-1); i <= std::min(nCells-1, ia+1); ++i)
+	for (int j = std::max(0, ja-1); j <= std::min(nCells-1, ja+1); ++j)
+	  for (unsigned p = start[i*nCells+j]; p < start[i*nCells+j+1]; ++p)
+	    {
+	      const Triangle &b = tri2[indexed[p]];
+	      if (b.direct != a.direct) continue;
+	      if (sqr(b.ra-a.ra)+sqr(b.rb-a.rb) > tol2) continue;
+	      double ratio = b.c/a.c;
+	      if (ratio > maxRatio || ratio < minRatio) continue;
+	      double angle = b.angle-a.angle;
+	      if (angle <= -M_PI- angleOffset) angle += 2.*M_PI;
+	      if (angle > M_PI - angleOffset) angle -= 2.*M_PI;
+	      TrianglePair tp = {t, indexed[p], ratio, angle};
+	      pairs.push_back(tp);
+	      histo.Fill(ratio, angle);
+	    }
+    }
+  if (Conditions.PrintLevel >=1)
+    std::cout << " ListMatchupRotShift_Triangles : " << tri1.size() << " and " 
+	      << tri2.size() << " triangles, " << pairs.size() << " candidate pairs" << std::endl;
+
+  double binr, bina;
+  histo.BinWidth(binr, bina);
+  SolList Solutions;
+  const unsigned n1 = stars1.size();
+  const unsigned n2 = stars2.size();
+  std::vector<int> votes(n1*n2);
+  for (int trial = 0; trial<Conditions.MaxTrialCount; ++trial)
+    {
+      double ratioMax, angleMax;
+      double maxContent = histo.MaxBin(ratioMax, angleMax);
+      if (maxContent <= 0) break;
+      histo.ZeroBin(ratioMax, angleMax);
+      if (Conditions.PrintLevel >= 1) 
+	std::cout << " valMax " << maxContent << " ratio " << ratioMax 
+		  << " angle " << angleMax << std::endl;
+      /* the vertices of the triangle pairs in this bin vote for star
+	 pairs. Keep the pairs that are the best for both stars. */
+      std::fill(votes.begin(), votes.end(), 0);
+      for (auto tp = pairs.cbegin(); tp != pairs.end(); ++tp)
+	{
+	  if (fabs(tp->ratio-ratioMax) > binr/2 || fabs(tp->angle-angleMax) > bina/2) continue;
+	  for (int s=0; s<3; ++s) votes[tri1[tp->t1].v[s]*n2+tri2[tp->t2].v[s]]++;
+	}
+      std::vector<int> best2(n2, 0);
+      for (unsigned i=0; i<n1; ++i)
+	for (unsigned j=0; j<n2; ++j) best2[j] = std::max(best2[j], votes[i*n2+j]);
+      StarMatchList *a_list = new StarMatchList;
+      for (unsigned i=0; i<n1; ++i)
+	{
+	  const int *row = &votes[i*n2];
+	  unsigned j = std::max_element(row, row+n2)-row;
+	  if (row[j] == 0 || row[j] < best2[j]) continue;
+	  const BaseStar *s1 = stars1[i];
+	  const BaseStar *s2 = stars2[j];
+	  a_list->push_back(StarMatch(*s1, *s2, s1, s2));
+	}
+      if (a_list->size() < 3)
+	{
+	  delete a_list;
+	  continue;
+	}
+      a_list->RefineTransfo(Conditions.NSigmas);
+      Solutions.push_back(a_list);
+    }
+
+  if (Solutions.size() == 0)
+    {
+      std::cout << " error In ListMatchupRotShift_Triangles : not a single triangle match " << std::endl;
+      std::cout << " Probably, the relative scale of lists is not within bounds" << std::endl;
+      std::cout << " here : " << minRatio << ' ' << maxRatio << std::endl;
+      return NULL;
+    }
+
+  Solutions.sort(DecreasingQuality);
+  StarMatchList *best = *Solutions.begin();
+  /* remove the first one from the list */
+  Solutions.pop_front();
+  if (Conditions.PrintLevel >=1) 
+    {
+      std::cout << " best solution " << best->Residual() << " npairs " << best->size() << std::endl << *(best->Transfo());
+      std::cout << " Chi2 " << best->Chi2() << ','
+	   << " Number of solutions " << Solutions.size() << std::endl;
+    }
+  return best;
+}
+
+
 static StarMatchList *ListMatchupRotShift(BaseStarList &L1, BaseStarList &L2, 
                                           const Gtransfo &Tin, const MatchConditions &Conditions)
 {
   if (Conditions.Algorithm == 1) return ListMatchupRotShift_Old(L1, L2, Tin, Conditions);
+  else if (Conditions.Algorithm == 3) return ListMatchupRotShift_Triangles(L1, L2, Tin, Conditions);
   else return ListMatchupRotShift_New(L1, L2, Tin, Conditions);
 }
 
@@ -669,16 +900,35 @@ StarMatchList *ListMatchCollect_Slow(const BaseStarList &L1, const BaseStarList
 
 StarMatchList *ListMatchCollect(const BaseStarList &L1, 
 				const BaseStarList &L2,
-				const Gtransfo *Guess, const double MaxDist)
+				const Gtransfo *Guess, const double MaxDist,
+				const FinderStrategy Strategy)
 {
   StarMatchList *matches = new StarMatchList;
   /****** Collect ***********/
-  FastFinder finder(L2);
+  std::unique_ptr<StarFinder> finder = MakeStarFinder(L2, Strategy);
+  // transform all of L1, and query all at once
+  std::vector<double> x1, y1;
+  x1.reserve(L1.size()); y1.reserve(L1.size());
   for (BaseStarCIterator si = L1.begin(); si != L1.end(); ++si)
+    {
+      x1.push_back((*si)->x);
+      y1.push_back((*si)->y);
+    }
+  std::vector<Point> where(L1.size());
+  if (!where.empty())
+    {
+      std::vector<double> x2(L1.size()), y2(L1.size());
+      Guess->ApplyBatch(&x1[0], &y1[0], &x2[0], &y2[0], L1.size());
+      for (size_t k=0; k<where.size(); ++k) where[k] = Point(x2[k], y2[k]);
+    }
+  std::vector<const BaseStar *> neighbours;
+  finder->FindClosest(where, MaxDist, neighbours);
+  size_t k = 0;
+  for (BaseStarCIterator si = L1.begin(); si != L1.end(); ++si, ++k)
     {
       const BaseStarRef &p1 = (*si);
-      Point p2 = Guess->apply(*p1);
-      const BaseStar *neighbour = finder.FindClosest(p2,MaxDist);
+      const Point &p2 = where[k];
+      const BaseStar *neighbour = neighbours[k];
       if (!neighbour) continue;
       double distance =p2.Distance(*neighbour); 
       if (distance < MaxDist)
@@ -731,14 +981,21 @@ StarMatchList *CollectAndFit(const BaseStarList &L1, const BaseStarList &L2,
 
 
 
-StarMatchList *ListMatchCollect(const BaseStarList &L1, const BaseStarList &L2, const double MaxDist)
+StarMatchList *ListMatchCollect(const BaseStarList &L1, const BaseStarList &L2, const double MaxDist,
+				const FinderStrategy Strategy)
 {
   StarMatchList *matches = new StarMatchList;
-  FastFinder finder(L2);
-  for (BaseStarCIterator si = L1.begin(); si != L1.end(); ++si)
+  std::unique_ptr<StarFinder> finder = MakeStarFinder(L2, Strategy);
+  std::vector<Point> where;
+  where.reserve(L1.size());
+  for (BaseStarCIterator si = L1.begin(); si != L1.end(); ++si) where.push_back(**si);
+  std::vector<const BaseStar *> neighbours;
+  finder->FindClosest(where, MaxDist, neighbours);
+  size_t k = 0;
+  for (BaseStarCIterator si = L1.begin(); si != L1.end(); ++si, ++k)
     {
       const BaseStarRef &p1 = (*si);
-      const BaseStar *neighbour = finder.FindClosest(*p1,MaxDist);
+      const BaseStar *neighbour = neighbours[k];
       if (!neighbour) continue;
       double distance =p1->Distance(*neighbour); 
       if (distance < MaxDist)
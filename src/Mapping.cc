@@ -0,0 +1,39 @@
+#include "lsst/meas/simastrom/Mapping.h"
+#include "lsst/meas/simastrom/FatPoint.h"
+
+namespace lsst {
+namespace meas {
+namespace simastrom {
+
+void Mapping::TransformPosAndErrorsBatch(const FatPointArrays &Where,
+					 FatPointArrays &OutPos) const
+{
+  size_t n = Where.size();
+  OutPos.resize(n);
+  FatPoint out;
+  for (size_t k=0; k < n; ++k)
+    {
+      TransformPosAndErrors(Where.Get(k), out);
+      OutPos.Set(k, out);
+    }
+}
+
+void Mapping::ComputeTransformAndDerivativesBatch(const FatPointArrays &Where,
+						  FatPointArrays &OutPos,
+						  Eigen::MatrixXd &H) const
+{
+  size_t n = Where.size();
+  unsigned npar = Npar();
+  OutPos.resize(n);
+  H.resize(npar, 2*n);
+  Eigen::MatrixX2d h(npar,2);
+  FatPoint out;
+  for (size_t k=0; k < n; ++k)
+    {
+      ComputeTransformAndDerivatives(Where.Get(k), out, h);
+      OutPos.Set(k, out);
+      H.middleCols(2*k,2) = h;
+    }
+}
+
+}}}
@@ -5,6 +5,7 @@
 #include "lsst/meas/simastrom/MeasuredStar.h"
 #include "lsst/meas/simastrom/StarList.cc"
 #include "lsst/meas/simastrom/CcdImage.h"
+#include "lsst/meas/simastrom/Checkpoint.h"
 
 //#include "preferences.h"
 //#include "ccdimage.h"
@@ -91,6 +92,23 @@ const BaseStarList* Measured2Base(const MeasuredStarList *This)
 }
 
 
+void MeasuredStar::Write(CheckpointWriter &W) const
+{
+  BaseStar::Write(W);
+  W.Put(mag); W.Put(wmag); W.Put(eflux); W.Put(aperrad); W.Put(chi2);
+  W.PutVector(usrVals);
+  W.Put(valid);
+}
+
+void MeasuredStar::Read(CheckpointReader &R)
+{
+  BaseStar::Read(R);
+  R.Get(mag); R.Get(wmag); R.Get(eflux); R.Get(aperrad); R.Get(chi2);
+  R.GetVector(usrVals);
+  R.Get(valid);
+}
+
+
 //! StarList ascii IO's
 
   std::string MeasuredStar::WriteHeader_(std::ostream & pr , 
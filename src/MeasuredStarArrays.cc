@@ -0,0 +1,43 @@
+#include "lsst/meas/simastrom/MeasuredStarArrays.h"
+
+namespace lsst {
+namespace meas {
+namespace simastrom {
+
+void MeasuredStarArrays::Set(const MeasuredStarList &L)
+{
+  clear();
+  size_t n = L.size();
+  x.reserve(n); y.reserve(n);
+  vx.reserve(n); vy.reserve(n); vxy.reserve(n);
+  flux.reserve(n); eflux.reserve(n);
+  fittedStar.reserve(n);
+  valid.reserve(n);
+  star.reserve(n);
+  for (auto i = L.cbegin(); i != L.end(); ++i)
+    {
+      MeasuredStar &ms = **i;
+      x.push_back(ms.x);
+      y.push_back(ms.y);
+      vx.push_back(ms.vx);
+      vy.push_back(ms.vy);
+      vxy.push_back(ms.vxy);
+      flux.push_back(ms.flux);
+      eflux.push_back(ms.eflux);
+      fittedStar.push_back(ms.GetFittedStar());
+      valid.push_back(ms.IsValid());
+      star.push_back(&ms);
+    }
+}
+
+void MeasuredStarArrays::clear()
+{
+  x.clear(); y.clear();
+  vx.clear(); vy.clear(); vxy.clear();
+  flux.clear(); eflux.clear();
+  fittedStar.clear();
+  valid.clear();
+  star.clear();
+}
+
+}}}
@@ -10,7 +10,10 @@
 #include <time.h> // for clock
 #include "lsst/pex/exceptions.h"
 #include <fstream>
+#include "lsst/meas/simastrom/MeasuredStarArrays.h"
 #include "lsst/meas/simastrom/Tripletlist.h"
+#include "lsst/meas/simastrom/ParallelFor.h"
+#include "lsst/meas/simastrom/SparseSolver.h"
 
 typedef Eigen::SparseMatrix<double> SpMat;
 
@@ -24,7 +27,8 @@ namespace simastrom {
 
 
 PhotomFit::PhotomFit(Associations &A, PhotomModel *M, double FluxError) : 
-  _assoc(A),  _photomModel(M), _fluxError(FluxError)
+  _assoc(A),  _photomModel(M), _fluxError(FluxError), _nThreads(1),
+  _solverName("simplicial"), _solverMaxIterations(0), _nAnalyses(0)
 {
   _LastNTrip = 0;
 
@@ -38,6 +42,14 @@ PhotomFit::PhotomFit(Associations &A, PhotomModel *M, double FluxError) :
 
 }
 
+void PhotomFit::SetSolver(const std::string &SolverName, const unsigned MaxIterations)
+{
+  MakeSparseSolver(SolverName); // throws if unknown
+  _solverName = SolverName;
+  _solverMaxIterations = MaxIterations;
+  _solver.reset();
+}
+
 
 
 
@@ -66,10 +78,36 @@ static void TweakPhotomMeasurementErrors(const MeasuredStar &Ms, double error)
 
 void PhotomFit::LSDerivatives(TripletList &TList, Eigen::VectorXd &Rhs) const
 {
-  auto L = _assoc.TheCcdImageList();
-  for (auto im=L.cbegin(); im!=L.end() ; ++im)
+  const CcdImageList &L = _assoc.TheCcdImageList();
+  if (EffectiveNThreads(_nThreads) <= 1)
+    {
+      for (auto im=L.cbegin(); im!=L.end() ; ++im)
+	{
+	  LSDerivatives(**im, TList, Rhs);
+	}
+      return;
+    }
+  /* Same scheme as in AstromFit::LSDerivatives : per-CcdImage blocks
+     filled concurrently, merged in the list order. */
+  std::vector<const CcdImage *> ccds;
+  ccds.reserve(L.size());
+  for (auto im=L.cbegin(); im!=L.end() ; ++im) ccds.push_back(im->get());
+  unsigned nCcd = ccds.size();
+  std::vector<TripletList> tBlocks(nCcd, TripletList(0));
+  std::vector<GradientSlice> gBlocks(nCcd);
+  ParallelFor(nCcd, _nThreads, [&](unsigned k)
+	      {
+		FillLSDerivatives(*ccds[k], tBlocks[k], gBlocks[k], NULL);
+	      });
+  size_t nTrip = TList.size();
+  for (unsigned k=0; k<nCcd; ++k) nTrip += tBlocks[k].size();
+  TList.reserve(nTrip);
+  for (unsigned k=0; k<nCcd; ++k)
     {
-      LSDerivatives(**im, TList, Rhs);
+      TList.AppendBlock(tBlocks[k]);
+      gBlocks[k].AddTo(Rhs);
+      TripletList(0).swap(tBlocks[k]);
+      GradientSlice().swap(gBlocks[k]);
     }
 }
 
@@ -78,6 +116,14 @@ void PhotomFit::LSDerivatives(TripletList &TList, Eigen::VectorXd &Rhs) const
 void PhotomFit::LSDerivatives(const CcdImage &Ccd, 
 			      TripletList &TList, Eigen::VectorXd &Rhs,
 			      const MeasuredStarList *M) const
+{
+  FillLSDerivatives(Ccd, TList, Rhs, M);
+}
+
+template <class RhsType>
+void PhotomFit::FillLSDerivatives(const CcdImage &Ccd,
+				  TripletList &TList, RhsType &Rhs,
+				  const MeasuredStarList *M) const
 {
   /***************************************************************************/
   /**  Changes in this routine should be reflected into AccumulateStat       */
@@ -95,42 +141,42 @@ void PhotomFit::LSDerivatives(const CcdImage &Ccd,
   Eigen::VectorXd grad(npar_max);
   // current position in the Jacobian
   unsigned kTriplets = TList.NextFreeIndex();
-  const MeasuredStarList &catalog = (M) ? *M : Ccd.CatalogForFit();
+  // the measurements of the list, or of the whole CcdImage
+  const MeasuredStarArrays meas((M) ? *M : Ccd.CatalogForFit());
 
-  for (auto i = catalog.begin(); i!= catalog.end(); ++i)
+  for (size_t k=0; k < meas.size(); ++k)
     {
-      const MeasuredStar& ms = **i;
-      if (!ms.IsValid()) continue;
+      if (!meas.valid[k]) continue;
       // tweak the measurement errors
-      double sigma=ms.eflux;
+      double sigma=meas.eflux[k];
 #ifdef FUTURE
       TweakPhotomMeasurementErrors(inPos, ms, _posError);
 #endif
       h.setZero(); // we cannot be sure that all entries will be overwritten.
 
-      double pf = _photomModel->PhotomFactor(Ccd, ms);
-      const FittedStar *fs = ms.GetFittedStar();
+      double pf = _photomModel->PhotomFactor(Ccd, Point(meas.x[k], meas.y[k]));
+      const FittedStar *fs = meas.fittedStar[k];
 
-      double res = ms.flux - pf * fs->flux;
+      double res = meas.flux[k] - pf * fs->flux;
             
       if (_fittingModel) 
 	{
-	  _photomModel->GetIndicesAndDerivatives(ms,
+	  _photomModel->GetIndicesAndDerivatives(*meas.star[k],
 						 Ccd, 
 						 indices,
 						 h);
-	  for (unsigned k=0; k<indices.size(); k++)
+	  for (unsigned j=0; j<indices.size(); j++)
 	    {
-	      unsigned l = indices[k];
-	      TList.AddTriplet(l, kTriplets, h[k]*fs->flux/sigma);
-	      Rhs[l] += h[k]*res/sqr(sigma);
+	      unsigned l = indices[j];
+	      TList.AddTriplet(l, kTriplets, h[j]*fs->flux/sigma);
+	      AddToGradient(Rhs, l, h[j]*fs->flux*res/sqr(sigma));
 	    }
 	}
       if (_fittingFluxes)
 	{
 	  unsigned index = fs->IndexInMatrix();
 	  TList.AddTriplet(index,kTriplets, pf/sigma);
-	  Rhs[index] += res*pf/sqr(sigma);
+	  AddToGradient(Rhs, index, res*pf/sqr(sigma));
 	}
       kTriplets += 1; // each measurement contributes 1 column in the Jacobian
     } // end loop on measurements
@@ -153,23 +199,22 @@ void PhotomFit::AccumulateStat(ListType &L, Accum &Accu) const
   /**  Changes in this routine should be reflected into LSDerivatives  */
   /**********************************************************************/
       auto &Ccd = **im;
-      auto &catalog = Ccd.CatalogForFit();
+      const MeasuredStarArrays meas(Ccd.CatalogForFit());
 
-      for (auto i = catalog.begin(); i!= catalog.end(); ++i)
+      for (size_t k=0; k < meas.size(); ++k)
 	{
-	  auto &ms = **i;
-	  if (!ms.IsValid()) continue;
+	  if (!meas.valid[k]) continue;
 	  // tweak the measurement errors
-	  double sigma=ms.eflux;
+	  double sigma=meas.eflux[k];
 #ifdef FUTURE
 	  TweakPhotomMeasurementErrors(inPos, ms, _posError);
 #endif
 	  
-	  double pf = _photomModel->PhotomFactor(Ccd, ms);
-	  const FittedStar *fs = ms.GetFittedStar();
-	  double res = ms.flux - pf * fs->flux;            
+	  double pf = _photomModel->PhotomFactor(Ccd, Point(meas.x[k], meas.y[k]));
+	  const FittedStar *fs = meas.fittedStar[k];
+	  double res = meas.flux[k] - pf * fs->flux;            
 	  double chi2Val = sqr(res/sigma);
-	  Accu.AddEntry(chi2Val, 1, &ms);
+	  Accu.AddEntry(chi2Val, 1, meas.star[k]);
 	} // end loop on measurements
     }
 }
@@ -203,6 +248,8 @@ void PhotomFit::OutliersContributions(MeasuredStarList &Outliers,
 }
 
 
+namespace { // AstromFit.cc has its own Chi2Entry and Chi2Vect
+
 //! a class to accumulate chi2 contributions together with pointers to the contributors.
 /*! This structure allows to compute the chi2 statistics (average and
   variance) and directly point back to the bad guys without
@@ -225,6 +272,8 @@ struct Chi2Vect : public vector<Chi2Entry>
 
 };
 
+}
+
 //! this routine is to be used only in the framework of outlier removal
 /*! it fills the array of indices of parameters that a Measured star
     constrains. Not really all of them if you check. */
@@ -260,21 +309,8 @@ void PhotomFit::FindOutliers(const double &NSigCut,
   Chi2Vect chi2s;
   //  chi2s.reserve(_nMeasuredStars);
   AccumulateStat(_assoc.ccdImageList, chi2s);
-  // do some stat
-  unsigned nval = chi2s.size();
-  if (nval==0) return;
-  sort(chi2s.begin(), chi2s.end()); // increasing order. We rely on this later.
-  double median = (nval & 1)? chi2s[nval/2].chi2 :  
-    0.5*(chi2s[nval/2-1].chi2 + chi2s[nval/2].chi2);
-  // some more stats. should go into the class if recycled anywhere else
-  double sum=0; double sum2 = 0;
-  for (auto i=chi2s.begin(); i!=chi2s.end(); ++i) 
-    {sum+= i->chi2;sum2+= sqr(i->chi2);}
-  double average = sum/nval;
-  double sigma = sqrt(sum2/nval - sqr(average));
-  cout << "INFO : FindOutliers chi2 stat: mean/median/sigma " 
-       << average << '/'<< median << '/' << sigma << endl;
-  double cut = average+NSigCut*sigma;
+  // the contributions above the cut, strongest first.
+  size_t nAbove = SelectLargeChi2s(chi2s, NSigCut, "FindOutliers");
   /* For each of the parameters, we will not remove more than 1
      measurement that contributes to constraining it. Keep track 
      of the affected parameters using an integer vector. This is the
@@ -283,10 +319,9 @@ void PhotomFit::FindOutliers(const double &NSigCut,
   Eigen::VectorXi affectedParams(_nParTot);
   affectedParams.setZero();
 
-  // start from the strongest outliers, i.e. at the end of the array.
-  for (auto i = chi2s.rbegin(); i != chi2s.rend(); ++i)
+  // start from the strongest outliers, i.e. at the beginning of the array.
+  for (auto i = chi2s.begin(); i != chi2s.begin()+nAbove; ++i)
     {
-      if (i->chi2 < cut) break; // because the array is sorted. 
       vector<unsigned> indices;
       GetMeasuredStarIndices(*(i->ms), indices);
       bool drop_it = true;
@@ -441,13 +476,24 @@ void PhotomFit::OffsetParams(const Eigen::VectorXd& Delta)
 }
 
 
+bool PhotomFit::Minimize(const std::string &WhatToFit, const double NSigRejCut)
+{
+  return (MinimizeWithStatus(WhatToFit, NSigRejCut) != 2);
+}
+
 /*! This is a complete Newton Raphson step. Compute first and 
   second derivatives, solve for the step and apply it, without 
   a line search. */
-bool PhotomFit::Minimize(const std::string &WhatToFit)
+unsigned PhotomFit::MinimizeWithStatus(const std::string &WhatToFit, const double NSigRejCut)
 {
   AssignIndices(WhatToFit);
 
+  // return code can take 3 values : 
+  // 0 : fit has converged - no more outliers
+  // 1 : still some ouliers but chi2 increases
+  // 2 : factorization failed, or the solver did not converge
+  unsigned returnCode = 0;
+
   // TODO : write a guesser for the number of triplets
   unsigned nTrip = (_LastNTrip) ? _LastNTrip: 1e6;
   TripletList tList(nTrip);
@@ -483,48 +529,144 @@ bool PhotomFit::Minimize(const std::string &WhatToFit)
   cout << "INFO: starting factorization" << endl;
 
   tstart = clock();
-  Eigen::SimplicialLDLT<SpMat> chol(hessian);
-  if (chol.info() != Eigen::Success)
+  hessian.makeCompressed();
+  if (!_solver)
+    {
+      _solver = MakeSparseSolver(_solverName);
+      _solver->SetMaxIterations(_solverMaxIterations);
+      _analyzedPattern.clear(); // a new solver has analyzed nothing
+    }
+  SparseSolver &chol = *_solver;
+  chol.SetNThreads(_nThreads);
+  if (_analyzedWhatToFit == _WhatToFit && _analyzedPattern.Covers(hessian))
+    cout << "INFO: reusing the symbolic analysis of the previous factorization" << endl;
+  else
+    {
+      chol.Analyze(hessian);
+      _nAnalyses++;
+      _analyzedPattern.Set(hessian);
+      _analyzedWhatToFit = _WhatToFit;
+    }
+  if (!chol.Factorize(hessian))
     {
       cout << "ERROR: PhotomFit::Minimize : factorization failed " << endl;
-      return false;
+      _solver.reset();
+      return 2;
     }
+  chol.Report(cout, hessian);
+  hessian = SpMat(); // the solver has what it needs
 
-  Eigen::VectorXd delta = chol.solve(grad);
-
-  //  cout << " offsetting parameters" << endl;
-  OffsetParams(delta);
   tend = clock();
-  std::cout << "INFO: CPU for factor-solve-update " 
+  std::cout << "INFO: CPU for factorize " 
   	    << float(tend-tstart)/float(CLOCKS_PER_SEC) << std::endl;
-  return true;
+  tstart = tend;
+
+  unsigned tot_outliers = 0;
+  double old_chi2 = ComputeChi2().chi2;
+
+  while (true)
+    {
+      Eigen::VectorXd delta = chol.Solve(grad);
+      if (!chol.Converged())
+	{
+	  cout << "ERROR: PhotomFit::Minimize : the solver did not converge, step not applied" << endl;
+	  returnCode = 2;
+	  break;
+	}
+      OffsetParams(delta);
+      Chi2 current_chi2 = ComputeChi2();
+      cout << current_chi2 << endl;
+      if (current_chi2.chi2 > old_chi2)
+	{
+	  cout << "WARNING: chi2 went up, exiting outlier rejection loop" << endl;
+	  returnCode = 1;
+	  break;
+	}
+      old_chi2 = current_chi2.chi2;
+
+      if (NSigRejCut == 0) break;
+      MeasuredStarList outliers;
+      FindOutliers(NSigRejCut, outliers);
+      tot_outliers += outliers.size();
+      if (outliers.size() == 0) break;
+      TripletList tList(1000); // initial allocation size.
+      grad.setZero(); // recycle the gradient
+      // compute the contributions of outliers to derivatives, and discard them
+      OutliersContributions(outliers, tList, grad);
+      // convert triplet list to eigen internal format
+      SpMat h(_nParTot,tList.NextFreeIndex());
+      h.setFromTriplets(tList.begin(), tList.end());
+      int update_status = chol.Update(h, false /* means downdate */);
+      cout << "INFO: factorization update_status " << update_status << endl;
+      /* The contribution of outliers to the gradient is the opposite
+	 of the contribution of all other terms, because they add up
+	 to 0 */
+      grad *= -1;
+      tend = clock();
+      std::cout << "INFO: CPU for chi2-update_factor "  
+		<< float(tend-tstart)/float(CLOCKS_PER_SEC) << std::endl;
+      tstart = tend;
+    }
+
+  cout << "INFO: total number of outliers " << tot_outliers << endl;
+
+  return returnCode;
 }
 
+unsigned PhotomFit::MinimizeToConvergence(const std::string &WhatToFit, const double NSigRejCut,
+					  const unsigned MaxIterations, const double RelTolerance)
+{
+  unsigned returnCode = 2;
+  double old_chi2 = ComputeChi2().chi2;
+  for (unsigned iter = 0; iter < MaxIterations; ++iter)
+    {
+      returnCode = MinimizeWithStatus(WhatToFit, NSigRejCut);
+      if (returnCode == 2) break;
+      double chi2 = ComputeChi2().chi2;
+      cout << "INFO: PhotomFit::MinimizeToConvergence : iteration " << iter 
+	   << " chi2 " << chi2 << " return code " << returnCode << endl;
+      /* with return code 1, outliers were left over : they are
+	 searched again by the next call, unless the chi2 stopped
+	 decreasing. */
+      bool converged = (old_chi2-chi2 <= RelTolerance*chi2);
+      old_chi2 = chi2;
+      if (converged) break;
+    }
+  return returnCode;
+}
 
-void PhotomFit::MakeResTuple(const std::string &TupleName) const
+
+static ResidualColumnList residual_columns()
 {
-  std::ofstream tuple(TupleName.c_str());
   /* If we think the some coordinate on the focal plane is relevant in
      the ntuple, because thmodel relies on it, then we have to add
      some function to the model that returns this relevant
      coordinate. */
-  tuple << "#xccd: coordinate in CCD" << endl
-	<< "#yccd: " << endl
-	<< "#mag: rough mag" << endl
-	<< "#flux : measured flux" << endl
-	<< "#eflux : measured flux erro" << endl
-	<< "#fflux : fitted flux" << endl
-	<< "#phot_factor:" <<  endl
-	<< "#jd: Julian date of the measurement" << endl
-	<< "#color : " << endl
-	<< "#fsindex: some unique index of the object" << endl
-	<< "#ra: pos of fitted star" << endl
-	<< "#dec: pos of fitted star" << endl
-	<< "#chi2: contribution to Chi2 (1 dof)" << endl
-	<< "#nm: number of measurements of this FittedStar" << endl
-    	<< "#chip: chip number" << endl
-    	<< "#shoot: shoot id" << endl
-	<< "#end" << endl;
+  ResidualColumnList columns;
+  columns.push_back(ResidualColumn("xccd", false, "coordinate in CCD"));
+  columns.push_back(ResidualColumn("yccd", false, ""));
+  columns.push_back(ResidualColumn("mag", false, "rough mag"));
+  columns.push_back(ResidualColumn("flux", false, "measured flux"));
+  columns.push_back(ResidualColumn("eflux", false, "measured flux erro"));
+  columns.push_back(ResidualColumn("fflux", false, "fitted flux"));
+  columns.push_back(ResidualColumn("phot_factor", false, ""));
+  columns.push_back(ResidualColumn("jd", false, "Julian date of the measurement"));
+  columns.push_back(ResidualColumn("color", false, ""));
+  columns.push_back(ResidualColumn("fsindex", true, "some unique index of the object"));
+  columns.push_back(ResidualColumn("ra", false, "pos of fitted star"));
+  columns.push_back(ResidualColumn("dec", false, "pos of fitted star"));
+  columns.push_back(ResidualColumn("chi2", false, "contribution to Chi2 (1 dof)"));
+  columns.push_back(ResidualColumn("nm", true, "number of measurements of this FittedStar"));
+  columns.push_back(ResidualColumn("chip", true, "chip number"));
+  columns.push_back(ResidualColumn("shoot", true, "shoot id"));
+  return columns;
+}
+
+//! Sends one row per valid measurement to S, with the columns described in residual_columns().
+template <class Sink> 
+void PhotomFit::FillResiduals(Sink &S) const
+{
+  double row[16];
   const CcdImageList &L=_assoc.TheCcdImageList();
   for (auto i=L.cbegin(); i!=L.end() ; ++i)
     {
@@ -543,21 +685,43 @@ void PhotomFit::MakeResTuple(const std::string &TupleName) const
 	  const FittedStar *fs = ms.GetFittedStar();
 	  double res = ms.flux - pf * fs->flux;            
 	  double chi2Val = sqr(res/sigma);
-	  tuple << ms.x << ' ' << ms.y << ' ' 
-		<< fs->Mag() << ' '
-		<< ms.flux << ' ' << ms.eflux << ' '
-		<< fs->flux << ' ' 
-		<< pf << ' ' 
-		<< jd << ' '
-		<< fs->color << ' ' 
-		<< fs->IndexInMatrix() << ' '
-	        << fs->x << ' ' << fs->y << ' '
-		<< chi2Val << ' ' 
-		<< fs->MeasurementCount() << ' ' 
-		<< im.Chip() << ' ' << im.Shoot() << endl;
+	  row[0] = ms.x; row[1] = ms.y;
+	  row[2] = fs->Mag();
+	  row[3] = ms.flux; row[4] = ms.eflux;
+	  row[5] = fs->flux;
+	  row[6] = pf;
+	  row[7] = jd;
+	  row[8] = fs->color;
+	  row[9] = fs->IndexInMatrix();
+	  row[10] = fs->x; row[11] = fs->y;
+	  row[12] = chi2Val;
+	  row[13] = fs->MeasurementCount();
+	  row[14] = im.Chip(); row[15] = im.Shoot();
+	  S.AddRow(row);
 	}// loop on measurements in image
     }// loop on images
+}
 
+void PhotomFit::MakeResTuple(const std::string &TupleName) const
+{
+  if (IsNpyFileName(TupleName))
+    {
+      NpyRowWriter writer(TupleName, residual_columns());
+      FillResiduals(writer);
+      writer.Close();
+    }
+  else
+    {
+      AsciiRowWriter writer(TupleName, residual_columns());
+      FillResiduals(writer);
+    }
+}
+
+ResidualTable PhotomFit::Residuals() const
+{
+  ResidualTable table(residual_columns());
+  FillResiduals(table);
+  return table;
 }
 
 
@@ -0,0 +1,262 @@
+#include <cmath>
+#include <cstdio>
+#include <cstring>
+#include <iostream>
+#include <algorithm>
+#include <endian.h>
+#include <fcntl.h>
+#include <unistd.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
+
+#include "lsst/meas/simastrom/RefCatalog.h"
+#include "lsst/pex/exceptions.h"
+
+namespace lsst {
+namespace meas {
+namespace simastrom {
+
+#ifndef M_PI
+#define     M_PI            3.14159265358979323846  /* pi */
+#endif
+
+static double sq(const double &x) { return x*x;}
+
+static const char ref_cat_magic[8] = {'S','I','M','R','E','F','C','1'};
+static const unsigned ref_cat_byte_order = 0x01020304;
+
+struct RefCatHeader
+{
+  char magic[8];
+  unsigned byteOrder;
+  unsigned nZones;
+  double zoneHeight;
+  unsigned long long nStars;
+};
+
+static unsigned zone_of(const double Dec, const double ZoneHeight, const unsigned NZones)
+{
+  int z = int(floor((Dec+90.)/ZoneHeight));
+  if (z < 0) return 0;
+  return std::min(unsigned(z), NZones-1);
+}
+
+
+void RefCatalogBuilder::Add(const double Ra, const double Dec, const double MagR, const double MagB,
+			    const double SigRa, const double SigDec)
+{
+  RefCatRecord r;
+  r.ra = fmod(Ra, 360.);
+  if (r.ra < 0) r.ra += 360.;
+  if (r.ra >= 360.) r.ra = 0; // fmod of tiny negative values
+  r.dec = Dec;
+  r.magR = MagR;
+  r.magB = MagB;
+  r.sigRa = SigRa;
+  r.sigDec = SigDec;
+  records.push_back(r);
+}
+
+/* One USNO-A zone file (see readusno in AstroUtils.cc), read at
+   once: 3 big-endian words per star: ra and spd in units of 0.01",
+   and magnitudes, as B*1000+R in units of 0.1 mag. */
+static unsigned read_usno_zone(const std::string &CatName, std::vector<unsigned> &Words)
+{
+  FILE *ifp = fopen(CatName.c_str(),"r");
+  if (!ifp) return 0;
+  fseek(ifp, 0, SEEK_END);
+  long size = ftell(ifp);
+  fseek(ifp, 0, SEEK_SET);
+  unsigned nStars = size/12;
+  Words.resize(3*nStars);
+  if (nStars) nStars = fread(&Words[0], 12, nStars, ifp);
+  fclose(ifp);
+  Words.resize(3*nStars);
+  for (auto w = Words.begin(); w != Words.end(); ++w) *w = be32toh(*w);
+  return nStars;
+}
+
+unsigned RefCatalogBuilder::AddUsno(const std::string &UsnoDir)
+{
+  unsigned count = 0;
+  std::vector<unsigned> words;
+  for (int zone = 0; zone < 1800; zone += 75)
+    {
+      char catName[16];
+      sprintf(catName,"zone%04d.cat", zone);
+      std::string fileName = UsnoDir+'/'+catName;
+      unsigned nStars = read_usno_zone(fileName, words);
+      if (nStars == 0)
+	{
+	  std::cout << "WARNING: RefCatalogBuilder::AddUsno : nothing read from " << fileName << std::endl;
+	  continue;
+	}
+      for (unsigned k=0; k < nStars; ++k)
+	{
+	  double ra = double(words[3*k])/3600./100.;
+	  double dec = double(words[3*k+1])/3600./100.-90;
+	  unsigned magword = words[3*k+2];
+	  double magR = double(magword%1000)/10.;
+	  double magB = double((magword/1000)%1000)/10.;
+	  // 0.3" r.m.s, as in readusno
+	  Add(ra, dec, magR, magB, 0.3, 0.3);
+	}
+      count += nStars;
+    }
+  return count;
+}
+
+void RefCatalogBuilder::Write(const std::string &FileName, const double ZoneHeight)
+{
+  if (!(ZoneHeight > 0))
+    throw LSST_EXCEPT(pex::exceptions::InvalidParameterError, "RefCatalogBuilder::Write : the zone height should be positive");
+  RefCatHeader header;
+  memcpy(header.magic, ref_cat_magic, 8);
+  header.byteOrder = ref_cat_byte_order;
+  header.nZones = unsigned(ceil(180./ZoneHeight));
+  header.zoneHeight = ZoneHeight;
+  header.nStars = records.size();
+  const unsigned nZones = header.nZones;
+  // sort by zone, then RA
+  std::sort(records.begin(), records.end(), [&](const RefCatRecord &A, const RefCatRecord &B)
+	    {
+	      unsigned za = zone_of(A.dec, ZoneHeight, nZones);
+	      unsigned zb = zone_of(B.dec, ZoneHeight, nZones);
+	      if (za != zb) return za < zb;
+	      return A.ra < B.ra;
+	    });
+  std::vector<unsigned long long> zoneStart(nZones+1, 0);
+  for (auto r = records.cbegin(); r != records.end(); ++r)
+    zoneStart[zone_of(r->dec, ZoneHeight, nZones)+1]++;
+  for (unsigned z=0; z < nZones; ++z) zoneStart[z+1] += zoneStart[z];
+
+  FILE *ofp = fopen(FileName.c_str(), "w");
+  if (!ofp)
+    throw LSST_EXCEPT(pex::exceptions::InvalidParameterError, "RefCatalogBuilder::Write : cannot open "+FileName);
+  bool ok = (fwrite(&header, sizeof(header), 1, ofp) == 1);
+  ok = ok && (fwrite(&zoneStart[0], sizeof(unsigned long long), nZones+1, ofp) == nZones+1);
+  if (ok && !records.empty())
+    ok = (fwrite(&records[0], sizeof(RefCatRecord), records.size(), ofp) == records.size());
+  ok = (fclose(ofp) == 0) && ok;
+  if (!ok)
+    throw LSST_EXCEPT(pex::exceptions::InvalidParameterError, "RefCatalogBuilder::Write : error while writing "+FileName);
+  std::cout << "INFO: wrote " << records.size() << " reference stars in "
+	    << nZones << " zones into " << FileName << std::endl;
+}
+
+
+MappedRefCatalog::MappedRefCatalog(const std::string &FileName) : mapped(NULL), mappedSize(0)
+{
+  int fd = open(FileName.c_str(), O_RDONLY);
+  if (fd < 0)
+    throw LSST_EXCEPT(pex::exceptions::InvalidParameterError, "MappedRefCatalog : cannot open "+FileName);
+  struct stat st;
+  if (fstat(fd, &st) != 0 || size_t(st.st_size) < sizeof(RefCatHeader))
+    {
+      close(fd);
+      throw LSST_EXCEPT(pex::exceptions::InvalidParameterError, "MappedRefCatalog : "+FileName+" is too short to be a reference catalog");
+    }
+  mappedSize = st.st_size;
+  void *p = mmap(NULL, mappedSize, PROT_READ, MAP_SHARED, fd, 0);
+  close(fd); // the mapping stays valid
+  if (p == MAP_FAILED)
+    throw LSST_EXCEPT(pex::exceptions::InvalidParameterError, "MappedRefCatalog : cannot map "+FileName);
+  mapped = static_cast<const char *>(p);
+  // queries jump around: do not read ahead much
+  madvise(p, mappedSize, MADV_RANDOM);
+
+  const RefCatHeader &header = *reinterpret_cast<const RefCatHeader *>(mapped);
+  std::string error;
+  if (memcmp(header.magic, ref_cat_magic, 8) != 0)
+    error = FileName+" is not a reference catalog";
+  else if (header.byteOrder != ref_cat_byte_order)
+    error = FileName+" was written on a machine with a different byte order";
+  else if (sizeof(RefCatHeader)+(header.nZones+1)*sizeof(unsigned long long)
+	   +header.nStars*sizeof(RefCatRecord) != mappedSize)
+    error = FileName+" has not the expected size";
+  if (!error.empty())
+    {
+      munmap(const_cast<char *>(mapped), mappedSize);
+      throw LSST_EXCEPT(pex::exceptions::InvalidParameterError, "MappedRefCatalog : "+error);
+    }
+  nZones = header.nZones;
+  zoneHeight = header.zoneHeight;
+  zoneStart = reinterpret_cast<const unsigned long long *>(mapped+sizeof(RefCatHeader));
+  records = reinterpret_cast<const RefCatRecord *>(zoneStart+nZones+1);
+}
+
+MappedRefCatalog::~MappedRefCatalog()
+{
+  if (mapped) munmap(const_cast<char *>(mapped), mappedSize);
+}
+
+static bool ra_less(const RefCatRecord &R, const double &Ra) { return R.ra < Ra;}
+
+void MappedRefCatalog::ReadBox(const double MinRa, const double MaxRa,
+			       const double MinDec, const double MaxDec,
+			       const double RaShift, const UsnoColor Color,
+			       BaseStarList &Out) const
+{
+  unsigned z0 = zone_of(MinDec, zoneHeight, nZones);
+  unsigned z1 = zone_of(MaxDec, zoneHeight, nZones);
+  for (unsigned z = z0; z <= z1; ++z)
+    {
+      const RefCatRecord *end = records+zoneStart[z+1];
+      for (const RefCatRecord *r = std::lower_bound(records+zoneStart[z], end, MinRa, ra_less);
+	   r != end && r->ra <= MaxRa; ++r)
+	{
+	  if (r->dec < MinDec || r->dec > MaxDec) continue;
+	  double mag = (Color == RColor) ? r->magR : r->magB;
+	  if (mag >= 99.9) continue;
+	  BaseStar *s = new BaseStar(r->ra+RaShift, r->dec, mag);
+	  s->vx = sq(r->sigRa/3600/cos(r->dec*M_PI/180.));
+	  s->vy = sq(r->sigDec/3600);
+	  s->vxy = 0;
+	  Out.push_back(s);
+	}
+    }
+}
+
+unsigned MappedRefCatalog::Read(const Frame &F, const UsnoColor Color, BaseStarList &Out) const
+{
+  size_t initialSize = Out.size();
+  double minDec = std::max(-90., F.yMin);
+  double maxDec = std::min(90., F.yMax);
+  if (minDec > maxDec) return 0;
+  if (F.xMax-F.xMin >= 360.)
+    ReadBox(0, 360., minDec, maxDec, 0, Color, Out);
+  else // the frame may extend below 0 or above 360
+    for (int turn = -1; turn <= 1; ++turn)
+      {
+	double shift = 360.*turn;
+	double minRa = std::max(F.xMin-shift, 0.);
+	double maxRa = std::min(F.xMax-shift, 360.);
+	if (minRa <= maxRa) ReadBox(minRa, maxRa, minDec, maxDec, shift, Color, Out);
+      }
+  return Out.size()-initialSize;
+}
+
+unsigned MappedRefCatalog::ReadCone(const double Ra, const double Dec, const double Radius,
+				    const UsnoColor Color, BaseStarList &Out) const
+{
+  const double deg = M_PI/180.;
+  // the RA extent of the cone, unless it contains a pole
+  double halfWidth = 180.;
+  if (fabs(Dec)+Radius < 90.)
+    halfWidth = asin(std::min(1., sin(Radius*deg)/cos(Dec*deg)))/deg;
+  BaseStarList box;
+  Read(Frame(Ra-halfWidth, Dec-Radius, Ra+halfWidth, Dec+Radius), Color, box);
+  size_t initialSize = Out.size();
+  const double cosRadius = cos(Radius*deg);
+  const double sinDec = sin(Dec*deg);
+  const double cosDec = cos(Dec*deg);
+  for (auto si = box.begin(); si != box.end(); ++si)
+    {
+      const BaseStar &s = **si;
+      double cosDist = sinDec*sin(s.y*deg)+cosDec*cos(s.y*deg)*cos((s.x-Ra)*deg);
+      if (cosDist >= cosRadius) Out.push_back(*si);
+    }
+  return Out.size()-initialSize;
+}
+
+}}}
@@ -4,6 +4,9 @@
 #include <iomanip>
 
 #include "lsst/meas/simastrom/RefStar.h"
+#include "lsst/meas/simastrom/Gtransfo.h"
+#include "lsst/meas/simastrom/ParallelFor.h"
+#include "lsst/meas/simastrom/Checkpoint.h"
 
 namespace lsst {
 namespace meas {
@@ -39,6 +42,23 @@ void RefStar::AssignRefFluxes(std::vector<double> const& reffluxes)
 }
 
 
+void RefStar::Write(CheckpointWriter &W) const
+{
+  BaseStar::Write(W);
+  W.Put(index);
+  W.Put(raDec.x); W.Put(raDec.y);
+  W.PutVector(refFlux);
+}
+
+void RefStar::Read(CheckpointReader &R)
+{
+  BaseStar::Read(R);
+  R.Get(index);
+  R.Get(raDec.x); R.Get(raDec.y);
+  R.GetVector(refFlux);
+}
+
+
 //#include <starlist.cc>
 /** RefStarList ***/
 //template class StarList<RefStar>; /* to force instanciation */
@@ -67,6 +87,40 @@ const BaseStarList* Ref2Base(const RefStarList *This)
   
 
 
+/********* RefStarArrays *************/
+
+void RefStarArrays::resize(const size_t N)
+{
+  ra.resize(N); dec.resize(N); mag.resize(N); vx.resize(N); vy.resize(N);
+  x.resize(N); y.resize(N);
+}
+
+void RefStarArrays::Project(const Gtransfo &RaDec2TP, const unsigned NThreads)
+{
+  const size_t n = size();
+  x.resize(n);
+  y.resize(n);
+  const size_t chunk = 16384;
+  ParallelFor((n+chunk-1)/chunk, NThreads, [&](unsigned c)
+	      {
+		size_t begin = c*chunk;
+		size_t count = std::min(chunk, n-begin);
+		RaDec2TP.ApplyBatch(&ra[begin], &dec[begin], &x[begin], &y[begin], count);
+	      });
+}
+
+RefStar *RefStarArrays::MakeRefStar(const size_t K) const
+{
+  BaseStar s(ra[K], dec[K], mag[K]);
+  s.vx = vx[K];
+  s.vy = vy[K];
+  s.vxy = 0.;
+  RefStar *rs = new RefStar(s, s);
+  rs->Index() = K;
+  return rs;
+}
+
+
 /********* RefStarStuple *************/
 RefStarTuple::RefStarTuple(const std::string &FileName) 
   : stream(FileName.c_str())
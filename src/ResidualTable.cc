@@ -0,0 +1,222 @@
+#include <iostream>
+#include <iomanip>
+#include <sstream>
+#include <cstring>
+#include <stdint.h>
+
+#include "lsst/meas/simastrom/ResidualTable.h"
+#include "lsst/pex/exceptions.h"
+
+namespace lsst {
+namespace meas {
+namespace simastrom {
+
+using namespace std;
+
+
+AsciiRowWriter::AsciiRowWriter(const std::string &FileName,
+			       const ResidualColumnList &Columns) :
+  stream(FileName.c_str()), nCols(Columns.size())
+{
+  for (auto i = Columns.cbegin(); i != Columns.end(); ++i)
+    {
+      stream << '#' << i->name << ": " << i->comment << endl;
+      isInteger.push_back(i->isInteger);
+    }
+  stream << "#end" << endl;
+  stream << std::setprecision(9);
+}
+
+void AsciiRowWriter::AddRow(const double *Values)
+{
+  // integers (indices) would lose digits with setprecision
+  for (unsigned k=0; k < nCols; ++k)
+    {
+      if (isInteger[k]) stream << (long long) Values[k];
+      else stream << Values[k];
+      stream << ((k+1 == nCols)? '\n' : ' ');
+    }
+}
+
+
+
+static bool little_endian()
+{
+  const uint16_t one = 1;
+  return *reinterpret_cast<const char *>(&one) == 1;
+}
+
+/* The .npy format (version 1.0) is : the magic string "\x93NUMPY",
+   2 bytes of version, a 2-byte (little endian) header length, and
+   the header, which is the text of a python dictionary, padded with
+   spaces and terminated by '\n', so that the data starts on a 64-byte
+   boundary. The data follows as is. */
+std::string NpyRowWriter::Header(const size_t NRows) const
+{
+  const char endian = little_endian() ? '<' : '>';
+  std::stringstream s;
+  s << "{'descr': [";
+  for (auto i = columns.cbegin(); i != columns.end(); ++i)
+    s << "('" << i->name << "', '" << endian << (i->isInteger ? "i8" : "f8") << "'), ";
+  s << "], 'fortran_order': False, 'shape': (" << NRows << ",), }";
+  std::string dict = s.str();
+
+  std::string header("\x93NUMPY\x01\x00", 8);
+  unsigned dictSize = (headerSize == 0) ?
+    // leave room for any row count when rewriting the header at the end.
+    ((10 + dict.size() + 20 + 1 + 63)/64)*64 - 10 :
+    headerSize - 10;
+  if (dict.size()+1 > dictSize || dictSize > 65535)
+    throw LSST_EXCEPT(pex::exceptions::InvalidParameterError, "NpyRowWriter : header too long for " + fileName);
+  header += char(dictSize & 0xFF);
+  header += char(dictSize >> 8);
+  header += dict;
+  header += std::string(dictSize-dict.size()-1, ' ');
+  header += '\n';
+  return header;
+}
+
+
+NpyRowWriter::NpyRowWriter(const std::string &FileName,
+			   const ResidualColumnList &Columns,
+			   const size_t ChunkRows) :
+  fileName(FileName),
+  stream(FileName.c_str(), std::ios::out | std::ios::binary | std::ios::trunc),
+  columns(Columns), headerSize(0), rowSize(0), chunkRows(ChunkRows),
+  nRows(0), bufferedRows(0)
+{
+  if (!stream)
+    throw LSST_EXCEPT(pex::exceptions::InvalidParameterError, "NpyRowWriter : cannot open " + FileName);
+  for (auto i = columns.cbegin(); i != columns.end(); ++i)
+    rowSize += (i->isInteger) ? sizeof(int64_t) : sizeof(double);
+  if (chunkRows == 0) chunkRows = 1;
+  buffer.resize(chunkRows*rowSize);
+  std::string header = Header(0);
+  headerSize = header.size();
+  stream.write(header.data(), header.size());
+}
+
+void NpyRowWriter::AddRow(const double *Values)
+{
+  char *p = &buffer[bufferedRows*rowSize];
+  unsigned k = 0;
+  for (auto i = columns.cbegin(); i != columns.end(); ++i, ++k)
+    {
+      if (i->isInteger)
+	{
+	  int64_t v = int64_t(Values[k]);
+	  memcpy(p, &v, sizeof(v));
+	  p += sizeof(v);
+	}
+      else
+	{
+	  memcpy(p, &Values[k], sizeof(double));
+	  p += sizeof(double);
+	}
+    }
+  nRows++;
+  bufferedRows++;
+  if (bufferedRows == chunkRows) Flush();
+}
+
+void NpyRowWriter::Flush()
+{
+  if (bufferedRows == 0) return;
+  stream.write(&buffer[0], bufferedRows*rowSize);
+  bufferedRows = 0;
+}
+
+void NpyRowWriter::Close()
+{
+  if (!stream.is_open()) return;
+  Flush();
+  stream.seekp(0);
+  std::string header = Header(nRows);
+  stream.write(header.data(), header.size());
+  bool ok = !stream.fail();
+  stream.close();
+  if (!ok)
+    throw LSST_EXCEPT(pex::exceptions::InvalidParameterError, "NpyRowWriter, something went wrong for file " + fileName);
+}
+
+NpyRowWriter::~NpyRowWriter()
+{
+  try
+    {
+      Close();
+    }
+  catch (...)
+    {
+      cout << "WARNING: NpyRowWriter : could not properly close " << fileName << endl;
+    }
+}
+
+
+
+bool IsNpyFileName(const std::string &FileName)
+{
+  const std::string ext(".npy");
+  return (FileName.size() >= ext.size() &&
+	  FileName.compare(FileName.size()-ext.size(), ext.size(), ext) == 0);
+}
+
+
+ResidualTable::ResidualTable(const ResidualColumnList &Columns) :
+  columns(Columns)
+{
+  for (unsigned k=0; k < columns.size(); ++k)
+    data.push_back(boost::shared_ptr<std::vector<double> >(new std::vector<double>));
+}
+
+void ResidualTable::AddRow(const double *Values)
+{
+  for (unsigned k=0; k < data.size(); ++k) data[k]->push_back(Values[k]);
+}
+
+std::vector<std::string> ResidualTable::ColumnNames() const
+{
+  std::vector<std::string> names;
+  for (auto i = columns.cbegin(); i != columns.end(); ++i)
+    names.push_back(i->name);
+  return names;
+}
+
+unsigned ResidualTable::ColumnRank(const std::string &Name) const
+{
+  for (unsigned k=0; k < columns.size(); ++k)
+    if (columns[k].name == Name) return k;
+  throw LSST_EXCEPT(pex::exceptions::InvalidParameterError, "ResidualTable : no column named " + Name);
+}
+
+void ResidualTable::SetValue(const std::string &Name, const size_t Row, const double Value)
+{
+  std::vector<double> &col = *data[ColumnRank(Name)];
+  if (Row >= col.size())
+    throw LSST_EXCEPT(pex::exceptions::InvalidParameterError, "ResidualTable::SetValue : no such row");
+  col[Row] = Value;
+}
+
+ndarray::Array<double const,1,1> ResidualTable::Column(const std::string &Name) const
+{
+  const boost::shared_ptr<std::vector<double> > &col = data[ColumnRank(Name)];
+  // the array owns a reference to the column storage
+  return ndarray::external(col->data(),
+			   ndarray::makeVector(int(col->size())),
+			   ndarray::makeVector(1),
+			   col);
+}
+
+void ResidualTable::WriteNpy(const std::string &FileName) const
+{
+  NpyRowWriter writer(FileName, columns);
+  std::vector<double> row(columns.size());
+  for (size_t r=0; r < size(); ++r)
+    {
+      for (unsigned k=0; k < data.size(); ++k) row[k] = (*data[k])[r];
+      writer.AddRow(&row[0]);
+    }
+  writer.Close();
+}
+
+
+}}} // end of namespaces
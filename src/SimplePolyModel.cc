@@ -3,8 +3,10 @@
 #include "lsst/meas/simastrom/SimplePolyMapping.h"
 #include "lsst/meas/simastrom/CcdImage.h"
 #include "lsst/meas/simastrom/Projectionhandler.h"
+#include "lsst/meas/simastrom/Checkpoint.h"
 #include "lsst/pex/exceptions.h"
 #include <string>
+#include <sstream>
 
 #include "lsst/meas/simastrom/Gtransfo.h"
 
@@ -145,5 +147,44 @@ PTR(TanSipPix2RaDec) SimplePolyModel::ProduceSipWcs(const CcdImage &Ccd) const
 }
 
 
+static const char model_checkpoint_magic[] = "SIMPOLYM";
+
+void SimplePolyModel::WriteParams(const std::string &FileName) const
+{
+  CheckpointWriter w(FileName, model_checkpoint_magic);
+  w.Put<unsigned>(_myMap.size());
+  for (auto i = _myMap.cbegin(); i != _myMap.end(); ++i)
+    {
+      w.PutString(i->first->Name());
+      i->second->Write(w);
+    }
+  w.Close();
+}
+
+void SimplePolyModel::ReadParams(const std::string &FileName, const bool AllowNew)
+{
+  CheckpointReader r(FileName, model_checkpoint_magic);
+  std::map<std::string, SimpleGtransfoMapping*> byName;
+  for (auto i = _myMap.begin(); i != _myMap.end(); ++i)
+    byName[i->first->Name()] = i->second.get();
+  unsigned n = r.Get<unsigned>();
+  if (n > _myMap.size() || (n < _myMap.size() && !AllowNew))
+    {
+      std::stringstream message;
+      message << "SimplePolyModel::ReadParams : " << FileName << " holds " << n
+	      << " mappings, and the model has " << _myMap.size();
+      throw LSST_EXCEPT(pex::exceptions::InvalidParameterError, message.str());
+    }
+  for (unsigned k=0; k < n; ++k)
+    {
+      std::string name = r.GetString();
+      auto m = byName.find(name);
+      if (m == byName.end())
+	throw LSST_EXCEPT(pex::exceptions::InvalidParameterError,"SimplePolyModel::ReadParams, never heard of CcdImage "+name+" found in "+FileName);
+      m->second->Read(r);
+    }
+}
+
+
 
 }}}
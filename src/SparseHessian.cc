@@ -0,0 +1,197 @@
+#include <algorithm>
+
+#include "lsst/meas/simastrom/SparseHessian.h"
+#include "lsst/meas/simastrom/ParallelFor.h"
+#include "lsst/pex/exceptions.h"
+
+namespace lsst {
+namespace meas {
+namespace simastrom {
+
+typedef std::pair<int, double> RowValue;
+
+static bool row_less(const RowValue &A, const RowValue &B) { return A.first < B.first;}
+
+//! The Jacobian columns of a block, each one as a list of (row, value) sorted by row.
+struct GroupedColumns
+{
+  std::vector<unsigned> start; // of each column in entries
+  std::vector<RowValue> entries;
+
+  void Set(const TripletList &Block)
+  {
+    unsigned nCols = Block.NextFreeIndex();
+    for (auto t = Block.cbegin(); t != Block.end(); ++t)
+      nCols = std::max(nCols, unsigned(t->col()+1));
+    start.assign(nCols+1, 0);
+    for (auto t = Block.cbegin(); t != Block.end(); ++t) start[t->col()+1]++;
+    for (unsigned j=0; j < nCols; ++j) start[j+1] += start[j];
+    entries.resize(Block.size());
+    std::vector<unsigned> next(start.begin(), start.end()-1);
+    for (auto t = Block.cbegin(); t != Block.end(); ++t)
+      entries[next[t->col()]++] = RowValue(t->row(), t->value());
+    for (unsigned j=0; j < nCols; ++j)
+      std::sort(entries.begin()+start[j], entries.begin()+start[j+1], row_less);
+  }
+
+  /* byTask[t] lists the (column, entry) pairs whose entry row is a
+     column of H handled by task t (First is the result of
+     SplitColumns), in column order. */
+  std::vector<std::vector<std::pair<unsigned, unsigned> > > byTask;
+
+  void SplitByTask(const std::vector<unsigned> &First)
+  {
+    const unsigned nTasks = First.size()-1;
+    byTask.assign(nTasks, std::vector<std::pair<unsigned, unsigned> >());
+    for (unsigned j=0; j+1 < start.size(); ++j)
+      for (unsigned e = start[j]; e < start[j+1]; ++e)
+	{
+	  // the task owning column c is the last one with First[task] <= c
+	  unsigned c = entries[e].first;
+	  if (c >= First.back())
+	    throw LSST_EXCEPT(pex::exceptions::LogicError, "SparseHessian::Accumulate : a term involves a parameter index beyond the matrix size");
+	  unsigned task = std::upper_bound(First.begin(), First.end()-1, c) - First.begin() - 1;
+	  byTask[task].push_back(std::make_pair(j,e));
+	}
+  }
+};
+
+/* Position of Row in Inner[Pos,End), which is sorted. Searches
+   forward from Pos with increasing steps, since the rows we look for
+   come in increasing order. Returns End if Row is absent. */
+static int find_forward(const int *Inner, const int Pos, const int End, const int Row)
+{
+  int lo = Pos;
+  int hi = Pos+1;
+  int step = 1;
+  while (hi < End && Inner[hi] < Row)
+    {
+      lo = hi;
+      step *= 2;
+      hi = std::min(End, hi+step);
+    }
+  const int *p = std::lower_bound(Inner+lo, Inner+std::min(hi+1, End), Row);
+  if (p == Inner+End || *p != Row) return End;
+  return p-Inner;
+}
+
+
+SparseHessian::SparseHessian(const unsigned N) : pattern(N), patternDone(false)
+{
+}
+
+void SparseHessian::AddCoupling(const std::vector<unsigned> &Indices)
+{
+  for (auto c = Indices.cbegin(); c != Indices.end(); ++c)
+    {
+      std::vector<int> &rows = pattern.at(*c);
+      rows.insert(rows.end(), Indices.begin(), Indices.end());
+    }
+}
+
+void SparseHessian::AddCoupling(const std::vector<unsigned> &A, const std::vector<unsigned> &B)
+{
+  for (auto c = A.cbegin(); c != A.end(); ++c)
+    {
+      std::vector<int> &rows = pattern.at(*c);
+      rows.insert(rows.end(), B.begin(), B.end());
+    }
+  for (auto c = B.cbegin(); c != B.end(); ++c)
+    {
+      std::vector<int> &rows = pattern.at(*c);
+      rows.insert(rows.end(), A.begin(), A.end());
+    }
+}
+
+void SparseHessian::EndPattern()
+{
+  const unsigned n = pattern.size();
+  size_t nnz = 0;
+  for (unsigned col=0; col < n; ++col)
+    {
+      std::vector<int> &rows = pattern[col];
+      std::sort(rows.begin(), rows.end());
+      rows.erase(std::unique(rows.begin(), rows.end()), rows.end());
+      nnz += rows.size();
+    }
+  h.resize(n,n);
+  h.resizeNonZeros(nnz);
+  int *outer = h.outerIndexPtr();
+  int *inner = h.innerIndexPtr();
+  outer[0] = 0;
+  for (unsigned col=0; col < n; ++col)
+    {
+      std::vector<int> &rows = pattern[col];
+      std::copy(rows.begin(), rows.end(), inner+outer[col]);
+      outer[col+1] = outer[col]+rows.size();
+      std::vector<int>().swap(rows); // release memory as we go
+    }
+  std::fill(h.valuePtr(), h.valuePtr()+nnz, 0.);
+  pattern.clear();
+  patternDone = true;
+}
+
+std::vector<unsigned> SparseHessian::SplitColumns(const unsigned NTasks) const
+{
+  // columns of the Hessian do not have the same length: balance the nonzeros.
+  std::vector<unsigned> first(NTasks+1, h.cols());
+  const int *outer = h.outerIndexPtr();
+  double nnzPerTask = double(h.nonZeros())/NTasks;
+  unsigned task = 0;
+  for (unsigned col=0; col < h.cols() && task < NTasks; ++col)
+    while (task < NTasks && outer[col] >= task*nnzPerTask) first[task++] = col;
+  return first;
+}
+
+void SparseHessian::Accumulate(const std::vector<TripletList> &Blocks, const unsigned NThreads)
+{
+  if (!patternDone)
+    throw LSST_EXCEPT(pex::exceptions::LogicError, "SparseHessian::Accumulate : EndPattern was not called");
+  const int *outer = h.outerIndexPtr();
+  const int *inner = h.innerIndexPtr();
+  double *values = h.valuePtr();
+  const unsigned nTasks = 4*EffectiveNThreads(NThreads);
+  std::vector<unsigned> first = SplitColumns(nTasks);
+  /* each Jacobian term is dispatched once to the task owning its
+     column of H, rather than having every task scan all terms. */
+  std::vector<GroupedColumns> grouped(Blocks.size());
+  ParallelFor(Blocks.size(), NThreads, [&](unsigned k)
+    {
+      grouped[k].Set(Blocks[k]);
+      grouped[k].SplitByTask(first);
+    });
+
+  ParallelFor(nTasks, NThreads, [&](unsigned task)
+    {
+      for (auto g = grouped.cbegin(); g != grouped.end(); ++g)
+	{
+	  const std::vector<std::pair<unsigned, unsigned> > &mine = g->byTask[task];
+	  for (auto je = mine.cbegin(); je != mine.end(); ++je)
+	    {
+	      auto begin = g->entries.cbegin()+g->start[je->first];
+	      auto end = g->entries.cbegin()+g->start[je->first+1];
+	      const RowValue &a = g->entries[je->second];
+	      const int col = a.first;
+	      int pos = outer[col];
+	      const int last = outer[col+1];
+	      for (auto b = begin; b != end; ++b)
+		{
+		  pos = find_forward(inner, pos, last, b->first);
+		  if (pos == last)
+		    throw LSST_EXCEPT(pex::exceptions::LogicError, "SparseHessian::Accumulate : a term couples parameters that were not declared as coupled");
+		  values[pos] += a.second*b->second;
+		}
+	    }
+	}
+    });
+}
+
+void SparseHessian::Extract(Matrix &H)
+{
+  H.swap(h);
+  h = Matrix();
+  pattern.clear();
+  patternDone = false;
+}
+
+}}}
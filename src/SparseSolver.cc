@@ -0,0 +1,487 @@
+#include <iostream>
+#include <chrono>
+#include <algorithm>
+
+#include "lsst/meas/simastrom/SparseSolver.h"
+#include "lsst/meas/simastrom/ParallelFor.h"
+#include "lsst/pex/exceptions.h"
+
+#include "Eigen/Sparse"
+#include "Eigen/Dense"
+#include "Eigen/IterativeLinearSolvers"
+#include "Eigen/CholmodSupport" // to switch to cholmod
+
+using namespace std;
+
+//! number of terms in a cholmod factor
+static size_t cholmod_factor_nnz(const cholmod_factor *F)
+{
+  if (!F) return 0;
+  if (F->is_super) return F->xsize;
+  size_t nnz = 0;
+  const int *nz = (const int *) F->nz;
+  if (nz) for (size_t j=0; j < F->n; ++j) nnz += nz[j];
+  return nnz;
+}
+
+
+//! Cholesky factorization class using cholmod, with the small-rank update capability.
+/*! Class derived from Eigen's CholmodBase, to add the factorization
+    update capability to the interface. Besides this addition, it
+    behaves the same way as Eigen's native Cholesky factorization
+    classes. It relies on the simplicial LDLt factorization.*/
+template<typename _MatrixType, int _UpLo = Eigen::Lower>
+class CholmodSimplicialLDLT2 : public Eigen::CholmodBase<_MatrixType, _UpLo, CholmodSimplicialLDLT2<_MatrixType, _UpLo> >
+{
+  typedef Eigen::CholmodBase<_MatrixType, _UpLo, CholmodSimplicialLDLT2> Base;
+    using Base::m_cholmod;
+
+  public:
+
+    typedef _MatrixType MatrixType;
+    typedef typename MatrixType::Index Index;
+    typedef typename MatrixType::RealScalar RealScalar;
+
+    CholmodSimplicialLDLT2() : Base() { init(); }
+
+    CholmodSimplicialLDLT2(const MatrixType& matrix) : Base()
+    {
+      init();
+      this->compute(matrix);
+    }
+
+    // this routine is the one we added
+    int update(const MatrixType &H, const bool UpOrDown)
+    {
+      // check size
+      const Index size = Base::m_cholmodFactor->n;
+      EIGEN_UNUSED_VARIABLE(size);
+      eigen_assert(size==H.rows());
+
+      cholmod_sparse C_cs = viewAsCholmod(H);
+      /* We have to apply the magic permutation to the update matrix,
+	 read page 117 of Cholmod UserGuide.pdf */
+      cholmod_sparse *C_cs_perm = cholmod_submatrix(&C_cs,
+						    (int *) Base::m_cholmodFactor->Perm,
+						    Base::m_cholmodFactor->n,
+						    NULL, -1, true, true,
+						    &this->cholmod());
+      assert(C_cs_perm);
+      int ret = cholmod_updown(UpOrDown, C_cs_perm, Base::m_cholmodFactor, &this->cholmod());
+      cholmod_free_sparse(&C_cs_perm,  &this->cholmod());
+      assert(ret != 0);
+      return ret;
+    }
+
+    size_t FactorNonZeros() const { return cholmod_factor_nnz(Base::m_cholmodFactor);}
+
+    ~CholmodSimplicialLDLT2() {}
+  protected:
+    void init()
+    {
+      m_cholmod.final_asis = 1;
+      m_cholmod.supernodal = CHOLMOD_SIMPLICIAL;
+      // In CholmodBase::CholmodBase(), the following statement is missing in
+      // SuiteSparse 3.2.0.8. Fixed in 3.2.7
+      Base::m_shiftOffset[0] = Base::m_shiftOffset[1] = RealScalar(0.0);
+    }
+};
+
+
+namespace lsst {
+namespace meas {
+namespace simastrom {
+
+typedef SparseSolver::Matrix SpMat;
+
+static double seconds_since(const std::chrono::steady_clock::time_point &Start)
+{
+  return std::chrono::duration<double>(std::chrono::steady_clock::now()-Start).count();
+}
+
+void SparseSolver::Analyze(const Matrix &H)
+{
+  auto start = std::chrono::steady_clock::now();
+  DoAnalyze(H);
+  analysisTime = seconds_since(start);
+}
+
+bool SparseSolver::Factorize(const Matrix &H)
+{
+  auto start = std::chrono::steady_clock::now();
+  bool ok = DoFactorize(H);
+  factorizationTime = seconds_since(start);
+  return ok;
+}
+
+void SparseSolver::Report(std::ostream &S, const Matrix &H) const
+{
+  // the factor is compared to the lower triangle of H (which may be all of H)
+  double lowerNnz = 0;
+  for (int col=0; col < H.outerSize(); ++col)
+    for (Matrix::InnerIterator it(H,col); it; ++it)
+      if (it.row() >= it.col()) lowerNnz++;
+  S << "INFO: solver " << Name()
+    << " : analysis " << analysisTime << " s,"
+    << " factorization " << factorizationTime << " s (wall),"
+    << " factor nnz=" << FactorNonZeros()
+    << " fill-in=" << ((lowerNnz>0) ? FactorNonZeros()/lowerNnz : 0.)
+    << std::endl;
+}
+
+
+//! Wraps the cholmod factorization (CholmodSimplicialLDLT2).
+template <class Factorization> class CholmodSolver : public SparseSolver
+{
+  std::string name;
+  Factorization chol;
+
+ protected :
+  void DoAnalyze(const Matrix &H) { chol.analyzePattern(H);}
+
+  bool DoFactorize(const Matrix &H)
+  {
+    chol.factorize(H);
+    return (chol.info() == Eigen::Success);
+  }
+
+ public :
+  CholmodSolver(const std::string &Name) : name(Name) {}
+
+  std::string Name() const { return name;}
+
+  Eigen::VectorXd Solve(const Eigen::VectorXd &B) { return chol.solve(B);}
+
+  bool Update(const Matrix &W, const bool UpOrDown)
+  { return (chol.update(W, UpOrDown) != 0);}
+
+  size_t FactorNonZeros() const { return chol.FactorNonZeros();}
+};
+
+
+//! Conjugate gradient, preconditioned by the diagonal of H.
+/*! There is no factorization: the matrix is kept, and updates are
+  applied to it. Convergence is declared when the relative residual
+  goes below 1e-10, within at most twice as many iterations as
+  unknowns (unless SetMaxIterations says otherwise). Otherwise,
+  Converged() returns false after Solve. UpLo tells which triangles
+  of H are stored: Eigen only runs the matrix-vector products on
+  several threads with Eigen::Lower|Eigen::Upper. */
+template <int UpLo> class PCGSolver : public SparseSolver
+{
+  Matrix h;
+  Eigen::ConjugateGradient<Matrix, UpLo> cg;
+  bool converged; // of the last Solve
+  unsigned nThreads;
+
+ protected :
+  void DoAnalyze(const Matrix &H) {}
+
+  bool DoFactorize(const Matrix &H)
+  {
+    h = H;
+    cg.compute(h);
+    return (cg.info() == Eigen::Success);
+  }
+
+ public :
+  PCGSolver() : converged(true), nThreads(1) { cg.setTolerance(1e-10);}
+
+  std::string Name() const { return "pcg";}
+
+  void SetNThreads(const unsigned NThreads) { nThreads = NThreads;}
+
+  Eigen::VectorXd Solve(const Eigen::VectorXd &B)
+  {
+    // Eigen's thread count is global: restore it afterwards
+    int eigenThreads = Eigen::nbThreads();
+    Eigen::setNbThreads(EffectiveNThreads(nThreads));
+    Eigen::VectorXd x = cg.solve(B);
+    Eigen::setNbThreads(eigenThreads);
+    converged = (cg.info() == Eigen::Success);
+    if (!converged)
+      cout << "WARNING: pcg did not converge: " << cg.iterations()
+	   << " iterations, relative residual " << cg.error() << endl;
+    return x;
+  }
+
+  bool Converged() const { return converged;}
+
+  // Eigen's default (twice the number of unknowns) is restored by a negative value
+  void SetMaxIterations(const unsigned MaxIterations)
+  { cg.setMaxIterations(MaxIterations ? int(MaxIterations) : -1);}
+
+  bool Update(const Matrix &W, const bool UpOrDown)
+  {
+    Matrix wwt = W*W.transpose();
+    if (UpOrDown) h += wwt; else h -= wwt;
+    cg.compute(h);
+    return (cg.info() == Eigen::Success);
+  }
+
+  size_t FactorNonZeros() const
+  { return (UpLo == Eigen::Lower) ? h.nonZeros() : (h.nonZeros()+h.rows())/2;}
+
+  void Report(std::ostream &S, const Matrix &H) const
+  {
+    SparseSolver::Report(S,H);
+    S << "INFO: pcg : " << cg.iterations() << " iterations in the last solve,"
+      << " relative residual " << cg.error() << std::endl;
+  }
+};
+
+
+std::unique_ptr<SparseSolver> MakeSparseSolver(const std::string &Name, const bool LowerOnly)
+{
+  if (Name == "simplicial")
+    return std::unique_ptr<SparseSolver>(new CholmodSolver<CholmodSimplicialLDLT2<SpMat> >(Name));
+  if (Name == "pcg" && LowerOnly)
+    return std::unique_ptr<SparseSolver>(new PCGSolver<Eigen::Lower>);
+  if (Name == "pcg")
+    return std::unique_ptr<SparseSolver>(new PCGSolver<Eigen::Lower|Eigen::Upper>);
+  throw LSST_EXCEPT(pex::exceptions::InvalidParameterError, "MakeSparseSolver : unknown solver " + Name);
+}
+
+void SparsePattern::Set(const SparseSolver::Matrix &H)
+{
+  outer.assign(H.outerIndexPtr(), H.outerIndexPtr()+H.outerSize()+1);
+  inner.assign(H.innerIndexPtr(), H.innerIndexPtr()+H.nonZeros());
+}
+
+bool SparsePattern::Covers(const SparseSolver::Matrix &H) const
+{
+  if (outer.size() != unsigned(H.outerSize()+1)) return false;
+  for (int col=0; col < H.outerSize(); ++col)
+    {
+      // both index lists are sorted : look for the ones of H in the old ones
+      int k = outer[col];
+      for (SpMat::InnerIterator it(H,col); it; ++it)
+	{
+	  while (k < outer[col+1] && inner[k] < it.row()) ++k;
+	  if (k == outer[col+1] || inner[k] != it.row()) return false;
+	}
+    }
+  return true;
+}
+
+
+SchurSolver::SchurSolver(std::unique_ptr<SparseSolver> ReducedSolver,
+			 const unsigned NThreads) :
+  reducedSolver(std::move(ReducedSolver)), nThreads(NThreads)
+{
+}
+
+typedef Eigen::Triplet<double> Triplet;
+
+// number of blocks handled in one go by a thread.
+static const unsigned schurChunkSize = 256;
+// number of pending terms of the reduced matrix before summing them up (~256 MB).
+static const size_t schurMaxPending = 1 << 24;
+
+/* Inverts the diagonal blocks, and accumulates the B D^-1 B^T terms
+   of each block into the reduced matrix. The blocks are processed in
+   chunks (in parallel), and the chunk results are summed in chunk
+   order, so that the result does not depend on the number of
+   threads. */
+bool SchurSolver::Eliminate()
+{
+  const unsigned n = h.rows();
+  reducedIndex.assign(n, 0);
+  unsigned end = 0;
+  for (auto b = blocks.cbegin(); b != blocks.end(); ++b)
+    {
+      if (b->first < end || b->first+b->second > n)
+	throw LSST_EXCEPT(pex::exceptions::InvalidParameterError, "SchurSolver : blocks should be sorted, disjoint, and within the matrix");
+      end = b->first+b->second;
+      for (unsigned k = b->first; k < end; ++k) reducedIndex[k] = -1;
+    }
+  unsigned nReduced = 0;
+  for (unsigned k=0; k < n; ++k) if (reducedIndex[k] >= 0) reducedIndex[k] = nReduced++;
+
+  // A : the lower triangle of H restricted to the remaining parameters
+  std::vector<Triplet> pending;
+  for (unsigned col=0; col < n; ++col)
+    {
+      int rc = reducedIndex[col];
+      if (rc < 0) continue;
+      for (Matrix::InnerIterator it(h,col); it; ++it)
+	{
+	  int rr = reducedIndex[it.row()];
+	  if (rr >= rc) pending.push_back(Triplet(rr, rc, it.value()));
+	}
+    }
+  s.resize(nReduced, nReduced);
+  s.setFromTriplets(pending.begin(), pending.end());
+  pending.clear();
+
+  dInv.assign(blocks.size(), Eigen::MatrixXd());
+  const unsigned nChunks = (blocks.size()+schurChunkSize-1)/schurChunkSize;
+  const unsigned wave = 4*EffectiveNThreads(nThreads);
+  std::vector<std::vector<Triplet> > chunkTerms(wave);
+  std::vector<char> chunkOk(wave);
+  for (unsigned first=0; first < nChunks; first += wave)
+    {
+      unsigned count = std::min(wave, nChunks-first);
+      ParallelFor(count, nThreads, [&](unsigned c)
+	{
+	  std::vector<Triplet> &terms = chunkTerms[c];
+	  terms.clear();
+	  chunkOk[c] = true;
+	  unsigned bBegin = (first+c)*schurChunkSize;
+	  unsigned bEnd = std::min(unsigned(blocks.size()), bBegin+schurChunkSize);
+	  std::vector<int> rows;
+	  for (unsigned kb = bBegin; kb < bEnd; ++kb)
+	    {
+	      const unsigned start = blocks[kb].first;
+	      const unsigned size = blocks[kb].second;
+	      // the reduced parameters coupled to this block
+	      rows.clear();
+	      for (unsigned col = start; col < start+size; ++col)
+		for (Matrix::InnerIterator it(h,col); it; ++it)
+		  {
+		    int r = reducedIndex[it.row()];
+		    if (r >= 0) rows.push_back(r);
+		    else if (unsigned(it.row()) < start || unsigned(it.row()) >= start+size)
+		      throw LSST_EXCEPT(pex::exceptions::InvalidParameterError, "SchurSolver : the matrix couples two eliminated blocks");
+		  }
+	      std::sort(rows.begin(), rows.end());
+	      rows.erase(std::unique(rows.begin(), rows.end()), rows.end());
+	      Eigen::MatrixXd d = Eigen::MatrixXd::Zero(size, size);
+	      Eigen::MatrixXd bt = Eigen::MatrixXd::Zero(size, rows.size());
+	      for (unsigned col = start; col < start+size; ++col)
+		for (Matrix::InnerIterator it(h,col); it; ++it)
+		  {
+		    int r = reducedIndex[it.row()];
+		    if (r >= 0)
+		      bt(col-start, std::lower_bound(rows.begin(), rows.end(), r)-rows.begin()) = it.value();
+		    else
+		      d(it.row()-start, col-start) = it.value();
+		  }
+	      // parameters that nothing constrains anymore stay where they are
+	      if (d.isZero(0) && rows.empty())
+		{
+		  dInv[kb] = d;
+		  continue;
+		}
+	      Eigen::LLT<Eigen::MatrixXd> llt(d);
+	      if (llt.info() != Eigen::Success)
+		{
+		  chunkOk[c] = false;
+		  return;
+		}
+	      dInv[kb] = llt.solve(Eigen::MatrixXd::Identity(size, size));
+	      Eigen::MatrixXd c2 = bt.transpose()*dInv[kb]*bt;
+	      for (unsigned j=0; j < rows.size(); ++j)
+		for (unsigned i=j; i < rows.size(); ++i)
+		  terms.push_back(Triplet(rows[i], rows[j], -c2(i,j)));
+	    }
+	});
+      for (unsigned c=0; c < count; ++c)
+	{
+	  if (!chunkOk[c]) return false;
+	  if (pending.size() + chunkTerms[c].size() > schurMaxPending && !pending.empty())
+	    {
+	      Matrix m(nReduced, nReduced);
+	      m.setFromTriplets(pending.begin(), pending.end());
+	      s += m;
+	      pending.clear();
+	    }
+	  pending.insert(pending.end(), chunkTerms[c].begin(), chunkTerms[c].end());
+	}
+    }
+  Matrix m(nReduced, nReduced);
+  m.setFromTriplets(pending.begin(), pending.end());
+  s += m;
+  s.makeCompressed();
+  return true;
+}
+
+bool SchurSolver::DoFactorize(const Matrix &H)
+{
+  if (&H != &h) h = H;
+  if (!Eliminate()) return false;
+  if (s.rows() == 0) return true;
+  if (!sPattern.Covers(s))
+    {
+      reducedSolver->Analyze(s);
+      sPattern.Set(s);
+    }
+  return reducedSolver->Factorize(s);
+}
+
+Eigen::VectorXd SchurSolver::Solve(const Eigen::VectorXd &B)
+{
+  const unsigned n = h.rows();
+  Eigen::VectorXd bReduced(s.rows());
+  for (unsigned k=0; k < n; ++k)
+    if (reducedIndex[k] >= 0) bReduced(reducedIndex[k]) = B(k);
+  // bReduced -= B D^-1 B_blocks
+  for (unsigned kb=0; kb < blocks.size(); ++kb)
+    {
+      const unsigned start = blocks[kb].first;
+      const unsigned size = blocks[kb].second;
+      Eigen::VectorXd y = dInv[kb]*B.segment(start, size);
+      for (unsigned col = start; col < start+size; ++col)
+	for (Matrix::InnerIterator it(h,col); it; ++it)
+	  {
+	    int r = reducedIndex[it.row()];
+	    if (r >= 0) bReduced(r) -= it.value()*y(col-start);
+	  }
+    }
+  Eigen::VectorXd xReduced;
+  if (s.rows()) xReduced = reducedSolver->Solve(bReduced);
+  Eigen::VectorXd x(n);
+  for (unsigned k=0; k < n; ++k)
+    if (reducedIndex[k] >= 0) x(k) = xReduced(reducedIndex[k]);
+  // back-substitution, independently for each block
+  ParallelFor(blocks.size(), nThreads, [&](unsigned kb)
+    {
+      const unsigned start = blocks[kb].first;
+      const unsigned size = blocks[kb].second;
+      Eigen::VectorXd rhs = B.segment(start, size);
+      for (unsigned col = start; col < start+size; ++col)
+	for (Matrix::InnerIterator it(h,col); it; ++it)
+	  {
+	    int r = reducedIndex[it.row()];
+	    if (r >= 0) rhs(col-start) -= it.value()*xReduced(r);
+	  }
+      x.segment(start, size) = dInv[kb]*rhs;
+    });
+  return x;
+}
+
+bool SchurSolver::Update(const Matrix &W, const bool UpOrDown)
+{
+  Matrix wwt = W*W.transpose();
+  if (UpOrDown) h += wwt; else h -= wwt;
+  return Factorize(h);
+}
+
+size_t SchurSolver::FactorNonZeros() const
+{
+  size_t nnz = (s.rows()) ? reducedSolver->FactorNonZeros() : 0;
+  for (auto b = blocks.cbegin(); b != blocks.end(); ++b) nnz += b->second*b->second;
+  return nnz;
+}
+
+void SchurSolver::Report(std::ostream &S, const Matrix &H) const
+{
+  SparseSolver::Report(S,H);
+  unsigned nEliminated = 0;
+  for (auto b = blocks.cbegin(); b != blocks.end(); ++b) nEliminated += b->second;
+  S << "INFO: schur : eliminated " << nEliminated << " parameters in "
+    << blocks.size() << " blocks, reduced system dim=" << s.rows()
+    << " nnz(lower)=" << s.nonZeros() << std::endl;
+  if (s.rows()) reducedSolver->Report(S,s);
+}
+
+
+std::vector<std::string> SparseSolverNames()
+{
+  std::vector<std::string> names;
+  names.push_back("simplicial");
+  names.push_back("pcg");
+  return names;
+}
+
+}}}
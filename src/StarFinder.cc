@@ -0,0 +1,26 @@
+#include "lsst/meas/simastrom/StarFinder.h"
+#include "lsst/meas/simastrom/FastFinder.h"
+#include "lsst/meas/simastrom/KdTreeFinder.h"
+
+namespace lsst {
+namespace meas {
+namespace simastrom {
+
+void StarFinder::FindClosest(const std::vector<Point> &Where, const double MaxDist,
+			     std::vector<const BaseStar *> &Closest) const
+{
+  Closest.resize(Where.size());
+  for (size_t k=0; k<Where.size(); ++k)
+    Closest[k] = FindClosest(Where[k], MaxDist);
+}
+
+std::unique_ptr<StarFinder> MakeStarFinder(const BaseStarList &List, 
+					   const FinderStrategy Strategy)
+{
+  bool kdTree = (Strategy == FinderKdTree) 
+    || (Strategy == FinderAuto && List.size() > KdTreeMinCount);
+  if (kdTree) return std::unique_ptr<StarFinder>(new KdTreeFinder(List));
+  return std::unique_ptr<StarFinder>(new FastFinder(List));
+}
+
+}}} // end of namespaces
@@ -98,6 +98,38 @@ void TwoTransfoMapping::TransformPosAndErrors(const FatPoint &Where,
   _m2->TransformPosAndErrors(pMid, OutPos);
 }
 
+void TwoTransfoMapping::TransformPosAndErrorsBatch(const FatPointArrays &Where,
+						   FatPointArrays &OutPos) const
+{
+  _m1->TransformPosAndErrorsBatch(Where, tmp->mid);
+  _m2->TransformPosAndErrorsBatch(tmp->mid, OutPos);
+}
+
+void TwoTransfoMapping::ComputeTransformAndDerivativesBatch(const FatPointArrays &Where,
+							    FatPointArrays &OutPos,
+							    Eigen::MatrixXd &H) const
+{
+  size_t n = Where.size();
+  FatPointArrays &pMid = tmp->mid;
+  H.resize(Npar(), 2*n);
+  if (_nPar1)
+    {
+      _m1->ComputeTransformAndDerivativesBatch(Where, pMid, tmp->hb1);
+      for (size_t k=0; k < n; ++k)
+	{
+	  _m2->PosDerivative(Point(pMid.x[k], pMid.y[k]), tmp->dt2dx, 1e-4);
+	  H.block(0,2*k,_nPar1,2) = tmp->hb1.middleCols(2*k,2)*tmp->dt2dx;
+	}
+    }
+  else _m1->TransformPosAndErrorsBatch(Where, pMid);
+  if (_nPar2)
+    {
+      _m2->ComputeTransformAndDerivativesBatch(pMid, OutPos, tmp->hb2);
+      H.bottomRows(_nPar2) = tmp->hb2;
+    }
+  else _m2->TransformPosAndErrorsBatch(pMid, OutPos);
+}
+
 void  TwoTransfoMapping::PosDerivative(const Point &Where, 
 				       Eigen::Matrix2d &Der, 
 				       const double & Eps) const
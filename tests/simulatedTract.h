@@ -0,0 +1,162 @@
+// -*- C++ -*-
+#ifndef SIMULATEDTRACT__H
+#define SIMULATEDTRACT__H
+
+/* A simulated tract for the tests of the associations and fits: a few
+   dithered visits of a row of chips, measuring stars drawn at random
+   around the common tangent point, with a slightly distorted optics,
+   and a reference catalog that holds every third star. CcdImage's can
+   only be built from afw objects or from a checkpoint: the tract is
+   written as an association checkpoint, with the layout of
+   Associations::WriteCheckpoint and no FittedStar yet, and read
+   back. */
+
+#include <cstdio>
+#include <string>
+#include <sstream>
+#include <vector>
+#include <random>
+#include <cmath>
+
+#include "lsst/meas/simastrom/Associations.h"
+#include "lsst/meas/simastrom/CcdImage.h"
+#include "lsst/meas/simastrom/Checkpoint.h"
+#include "lsst/meas/simastrom/Gtransfo.h"
+#include "lsst/meas/simastrom/MeasuredStar.h"
+
+namespace simAstrom = lsst::meas::simastrom;
+
+struct SimulatedTract
+{
+  unsigned nVisits;
+  unsigned nChips;
+  unsigned nStars;
+  unsigned seed;
+
+  SimulatedTract(const unsigned NVisits=3, const unsigned NChips=4,
+		 const unsigned NStars=600, const unsigned Seed=12345)
+    : nVisits(NVisits), nChips(NChips), nStars(NStars), seed(Seed) {}
+
+  //! the association checkpoint. Visits are numbered from FirstVisit.
+  void Write(const std::string &FileName, const unsigned FirstVisit=1000) const
+  {
+    std::mt19937 rng(seed);
+    std::uniform_real_distribution<double> u(0,1);
+    std::normal_distribution<double> g(0,1);
+    const simAstrom::Point ctp(150., 2.);
+    const double scale = 0.2/3600.; // degrees per pixel
+    const double sigPix = 0.02;
+    const double nx = 1000, ny = 2000;
+    const double deg = M_PI/180.;
+
+    std::vector<simAstrom::Point> stars;
+    std::vector<double> fluxes;
+    const double size = (nChips*nx)*scale;
+    for (unsigned k=0; k < nStars; ++k)
+      {
+	stars.push_back(simAstrom::Point(ctp.x + (u(rng)-0.5)*size/cos(ctp.y*deg),
+					 ctp.y + (u(rng)-0.5)*ny*scale));
+	fluxes.push_back(1000*pow(100., u(rng)));
+      }
+
+    simAstrom::CheckpointWriter w(FileName, "SIMASSOC");
+    w.Put(ctp.x); w.Put(ctp.y);
+    w.Put(nVisits);
+    w.Put(true); // inTangentPlaneCoordinates
+    w.Put<unsigned long long>(0); // FittedStar's
+    w.Put<unsigned long long>(0); // RefStar's
+
+    // the reference catalog, projected on the common tangent plane
+    simAstrom::GtransfoLin identity;
+    simAstrom::TanRaDec2Pix raDec2CTP(identity, ctp);
+    std::vector<double> ra, dec, mag, vx, vy, x, y;
+    for (unsigned k=0; k < nStars; k += 3)
+      {
+	ra.push_back(stars[k].x); dec.push_back(stars[k].y);
+	mag.push_back(25-2.5*log10(fluxes[k]));
+	vx.push_back(pow(0.1/3600/cos(stars[k].y*deg),2)); vy.push_back(pow(0.1/3600,2));
+	simAstrom::Point p = raDec2CTP.apply(stars[k]);
+	x.push_back(p.x); y.push_back(p.y);
+      }
+    w.PutVector(ra); w.PutVector(dec); w.PutVector(mag);
+    w.PutVector(vx); w.PutVector(vy); w.PutVector(x); w.PutVector(y);
+
+    w.Put<unsigned long long>(nVisits*nChips);
+    for (unsigned visit=0; visit < nVisits; ++visit)
+      {
+	simAstrom::Point tangentPoint(ctp.x + 0.01*(u(rng)-0.5), ctp.y + 0.01*(u(rng)-0.5));
+	simAstrom::TanRaDec2Pix raDec2TP(identity, tangentPoint);
+	for (unsigned chip=0; chip < nChips; ++chip)
+	  {
+	    double xOffset = (chip - 0.5*(nChips-1))*nx*scale;
+	    simAstrom::GtransfoLin pix2TP(xOffset-0.5*nx*scale, -0.5*ny*scale, scale, 0, 0, scale);
+	    simAstrom::GtransfoLin tp2Pix = pix2TP.invert();
+	    w.Put(0.); w.Put(0.); w.Put(nx); w.Put(ny);
+	    w.PutPoly(pix2TP);
+	    w.Put(tangentPoint.x); w.Put(tangentPoint.y);
+	    w.Put(false); // no SIP correction
+	    w.Put(ctp.x); w.Put(ctp.y);
+	    std::stringstream name;
+	    name << FirstVisit+visit << "_" << chip;
+	    w.PutString(name.str()); w.PutString(""); w.PutString("simulated");
+	    w.PutString(""); w.PutString("r"); w.PutString("");
+	    w.PutString(""); w.PutString(""); w.PutString("");
+	    w.Put(int(chip)); w.Put(int(FirstVisit+visit)); w.Put(0u);
+	    w.Put(2); w.Put(int(visit*nChips+chip)); w.Put(int(visit));
+	    w.Put(30.); w.Put(1.2); w.Put(1.); w.Put(57000.+visit); // expTime, airMass, fluxCoeff, jd
+	    for (unsigned k=0; k < 6; ++k) w.Put(0.); // zero points and photometric terms
+	    w.Put(0.); w.Put(1.); w.Put(0.); w.Put(0.); // sineta, coseta, tgz, hourAngle
+
+	    simAstrom::MeasuredStarList catalog;
+	    for (unsigned k=0; k < nStars; ++k)
+	      {
+		simAstrom::Point pix = tp2Pix.apply(raDec2TP.apply(stars[k]));
+		// the optics the fit should find (up to a few pixels at the corners)
+		double dx = pix.x/nx-0.5, dy = pix.y/ny-0.5;
+		pix.x += 3*dx*dy + 2*dy*dy;
+		pix.y += 2*dx*dx - 1*dx*dy;
+		if (pix.x < 0 || pix.x > nx || pix.y < 0 || pix.y > ny) continue;
+		simAstrom::MeasuredStar *ms = new simAstrom::MeasuredStar(
+		  simAstrom::BaseStar(pix.x+sigPix*g(rng), pix.y+sigPix*g(rng), fluxes[k]));
+		ms->vx = ms->vy = sigPix*sigPix;
+		ms->vxy = 0;
+		ms->eflux = 0.01*fluxes[k];
+		ms->mag = 25-2.5*log10(fluxes[k]);
+		catalog.push_back(ms);
+	      }
+	    w.Put<unsigned long long>(catalog.size());
+	    for (auto i = catalog.cbegin(); i != catalog.end(); ++i) (*i)->Write(w);
+	    w.Put<unsigned long long>(0); // CatalogForFit
+	    w.PutVector(std::vector<long long>(catalog.size(), -1));
+	    w.PutVector(std::vector<long long>());
+	  }
+      }
+    w.Close();
+  }
+
+  //! reads the checkpoint, associates the catalogs and the reference stars, and deprojects, as simAstrom3.py does.
+  static void Load(simAstrom::Associations &A, const std::string &FileName)
+  {
+    A.ReadCheckpoint(FileName);
+    A.AssociateCatalogs(1.0);
+    A.AssociateRefStarArrays(1.0);
+    A.SelectFittedStars();
+    A.DeprojectFittedStars();
+  }
+};
+
+//! the checkpoint of a SimulatedTract, in the current directory, removed at destruction.
+struct SimulatedTractFile
+{
+  std::string name;
+
+  SimulatedTractFile(const SimulatedTract &T, const std::string &Tag)
+    : name("simulatedTract_" + Tag + ".assoc")
+  {
+    T.Write(name);
+  }
+
+  ~SimulatedTractFile() { remove(name.c_str());}
+};
+
+#endif /* SIMULATEDTRACT__H */
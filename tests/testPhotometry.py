@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+#
+# LSST Data Management System
+# Copyright 2008, 2009, 2010, 2011, 2012 LSST Corporation.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.    See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+"""Tests of the photometric conversions"""
+
+import unittest
+import numpy as np
+
+import lsst.utils.tests as utilsTests
+
+from lsst.meas.simastrom.photometry import fluxToAbMag
+
+
+class FluxToAbMagTestCase(unittest.TestCase):
+    """Reference fluxes are in Jy"""
+
+    def testKnownFlux(self):
+        # 3631 Jy is AB magnitude 0, and a factor 100 fainter adds 5 magnitudes
+        mags = fluxToAbMag([3631., 3.631e-3])
+        self.assertAlmostEqual(mags[0], 0., places=10)
+        self.assertAlmostEqual(mags[1], 15., places=10)
+
+    def testUndefined(self):
+        mags = fluxToAbMag(np.array([0., -1., np.nan]))
+        self.assertTrue(np.all(mags == 99.9))
+
+
+def suite():
+    utilsTests.init()
+    suites = []
+    suites += unittest.makeSuite(FluxToAbMagTestCase)
+    suites += unittest.makeSuite(utilsTests.MemoryTestCase)
+    return unittest.TestSuite(suites)
+
+
+def run(shouldExit=False):
+    utilsTests.run(suite(), shouldExit)
+
+if __name__ == "__main__":
+    run(True)
@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+#
+# LSST Data Management System
+# Copyright 2008, 2009, 2010, 2011, 2012 LSST Corporation.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.    See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+"""Tests of the reference catalog helpers of refCatCache"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+import lsst.utils.tests as utilsTests
+import lsst.afw.geom as afwGeom
+
+from lsst.meas.simastrom.refCatCache import RefCatCache, skyCellsCovering, nRaCells
+
+
+class SkyCellsCoveringTestCase(unittest.TestCase):
+    """The cells that cover (RA,Dec) boxes"""
+
+    def checkCovered(self, box, cells):
+        """Every point of the box falls in exactly one of the cells"""
+        rng = np.random.RandomState(2468)
+        ra = rng.uniform(box.getMinX(), box.getMaxX(), 10000) % 360.
+        dec = rng.uniform(box.getMinY(), box.getMaxY(), 10000)
+        count = sum(cell.contains(ra, dec).astype(int) for cell in cells)
+        self.assertTrue(np.all(count == 1))
+
+    def testPoles(self):
+        """A box around a pole spans RA in [0,360]: all the RA cells of its bands are needed"""
+        cellSize = 1.
+        for decMin, decMax in ((88.5, 90.), (-90., -88.2)):
+            box = afwGeom.Box2D(afwGeom.Point2D(0., decMin), afwGeom.Point2D(360., decMax))
+            for margin in (0., 0.1):
+                cells = skyCellsCovering([box], cellSize, margin)
+                iDecs = sorted(set(cell.iDec for cell in cells))
+                self.assertEqual(len(iDecs), 2)
+                self.assertEqual(len(cells), sum(nRaCells(iDec, cellSize) for iDec in iDecs))
+                self.checkCovered(box, cells)
+        # a box that only reaches the pole through the margin
+        box = afwGeom.Box2D(afwGeom.Point2D(0., 89.95), afwGeom.Point2D(360., 89.99))
+        cells = skyCellsCovering([box], cellSize, 0.1)
+        self.assertEqual(len(cells), nRaCells(179, cellSize))
+
+    def testCrossingRaZero(self):
+        """A box wider than 180 degrees away from the poles wraps around RA=0"""
+        box = afwGeom.Box2D(afwGeom.Point2D(0.2, 10.), afwGeom.Point2D(359.8, 10.5))
+        cells = skyCellsCovering([box], 1.)
+        nRa = nRaCells(100, 1.)
+        self.assertEqual(sorted((cell.iDec, cell.iRa) for cell in cells), [(100, 0), (100, nRa-1)])
+        self.checkCovered(afwGeom.Box2D(afwGeom.Point2D(-0.2, 10.), afwGeom.Point2D(0.2, 10.5)), cells)
+
+
+class RefCatCacheEvictTestCase(unittest.TestCase):
+    """Eviction of the least recently used files"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = RefCatCache(self.directory, 1e-3)  # 1048 bytes
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def makeFile(self, name, size, mtime):
+        path = os.path.join(self.directory, name)
+        with open(path, "wb") as f:
+            f.write(b"x"*size)
+        os.utime(path, (mtime, mtime))
+        return path
+
+    def testLeastRecentlyUsed(self):
+        old = self.makeFile("old.fits", 600, 1000)
+        recent = self.makeFile("recent.fits", 600, 2000)
+        self.cache.evict()
+        self.assertFalse(os.path.exists(old))
+        self.assertTrue(os.path.exists(recent))
+
+    def testTemporaryFilesKept(self):
+        # a file another process is writing, older than anything else
+        tmp = self.makeFile("cell" + RefCatCache.tmpSuffix, 2000, 500)
+        recent = self.makeFile("recent.fits", 600, 2000)
+        self.cache.evict()
+        self.assertTrue(os.path.exists(tmp))
+        self.assertTrue(os.path.exists(recent))
+
+    def testVanishedFiles(self):
+        recent = self.makeFile("recent.fits", 600, 2000)
+        listdir = os.listdir
+        try:
+            # files listed, but removed before they are looked at
+            os.listdir = lambda d: listdir(d) + ["gone.fits", "gone2.fits"]
+            self.cache.evict()
+        finally:
+            os.listdir = listdir
+        self.assertTrue(os.path.exists(recent))
+
+    def testRemovedMeanwhile(self):
+        old = self.makeFile("old.fits", 600, 1000)
+        self.makeFile("recent.fits", 600, 2000)
+        remove = os.remove
+
+        def removedByAnotherProcess(path):
+            remove(path)
+            raise OSError("No such file or directory: %s" % path)
+        try:
+            os.remove = removedByAnotherProcess
+            self.cache.evict()
+        finally:
+            os.remove = remove
+        self.assertFalse(os.path.exists(old))
+
+
+def suite():
+    utilsTests.init()
+    suites = []
+    suites += unittest.makeSuite(SkyCellsCoveringTestCase)
+    suites += unittest.makeSuite(RefCatCacheEvictTestCase)
+    suites += unittest.makeSuite(utilsTests.MemoryTestCase)
+    return unittest.TestSuite(suites)
+
+
+def run(shouldExit=False):
+    utilsTests.run(suite(), shouldExit)
+
+if __name__ == "__main__":
+    run(True)
@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+#
+# LSST Data Management System
+# Copyright 2008, 2009, 2010, 2011, 2012 LSST Corporation.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.    See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+"""Tests of ResidualTable: .npy files and numpy views of the columns"""
+
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+import numpy as np
+
+import lsst.utils.tests as utilsTests
+
+import lsst.meas.simastrom.simastromLib as simastromLib
+
+
+def makeTable(nRows):
+    """A table with an integer column and two float ones"""
+    columns = simastromLib.ResidualColumnList()
+    columns.push_back(simastromLib.ResidualColumn("id", True, "an integer"))
+    columns.push_back(simastromLib.ResidualColumn("x", False, "a float"))
+    columns.push_back(simastromLib.ResidualColumn("y", False, ""))
+    table = simastromLib.ResidualTable(columns)
+    for k in range(nRows):
+        table.AddRowArray(np.array([10*k, 0.5*k, -1./(k+1)]))
+    return table
+
+
+class NpyFileTestCase(unittest.TestCase):
+    """What ResidualTable.WriteNpy writes, numpy reads back"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.fileName = os.path.join(self.directory, "residuals.npy")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def testPreamble(self):
+        makeTable(7).WriteNpy(self.fileName)
+        with open(self.fileName, "rb") as f:
+            content = f.read()
+        self.assertEqual(content[:6], b"\x93NUMPY")
+        self.assertEqual(content[6:8], b"\x01\x00")
+        headerLength = struct.unpack("<H", content[8:10])[0]
+        # the data starts on a 64-byte boundary, after a '\n'-terminated header
+        self.assertEqual((10 + headerLength) % 64, 0)
+        self.assertEqual(content[10 + headerLength - 1:10 + headerLength], b"\n")
+        self.assertEqual(len(content), 10 + headerLength + 7*3*8)
+        self.assertIn(b"'shape': (7,)", content[10:10 + headerLength])
+
+    def testReadBack(self):
+        nRows = 100
+        makeTable(nRows).WriteNpy(self.fileName)
+        data = np.load(self.fileName, mmap_mode='r')
+        self.assertEqual(data.shape, (nRows,))
+        self.assertEqual(data.dtype.names, ("id", "x", "y"))
+        self.assertEqual(data.dtype["id"], np.dtype(np.int64))
+        self.assertEqual(data.dtype["x"], np.dtype(np.float64))
+        self.assertEqual(data.dtype["y"], np.dtype(np.float64))
+        k = np.arange(nRows)
+        self.assertTrue(np.all(data["id"] == 10*k))
+        self.assertTrue(np.all(data["x"] == 0.5*k))
+        self.assertTrue(np.all(data["y"] == -1./(k + 1)))
+
+    def testEmpty(self):
+        makeTable(0).WriteNpy(self.fileName)
+        data = np.load(self.fileName, mmap_mode='r')
+        self.assertEqual(data.shape, (0,))
+        self.assertEqual(data.dtype.names, ("id", "x", "y"))
+
+
+class ColumnViewTestCase(unittest.TestCase):
+    """The columns reach python without copy"""
+
+    def testValues(self):
+        columns = makeTable(5).asDict()
+        self.assertEqual(sorted(columns.keys()), ["id", "x", "y"])
+        self.assertTrue(np.all(columns["id"] == 10*np.arange(5)))
+        self.assertTrue(np.all(columns["x"] == 0.5*np.arange(5)))
+
+    def testAliasing(self):
+        table = makeTable(5)
+        x = table.asDict()["x"]
+        self.assertTrue(np.may_share_memory(x, table.Column("x")))
+        table.SetValue("x", 3, 42.)
+        self.assertEqual(x[3], 42.)
+        self.assertEqual(table.Column("x")[3], 42.)
+
+    def testOutlivesTable(self):
+        table = makeTable(5)
+        y = table.Column("y")
+        del table
+        self.assertTrue(np.all(y == -1./(np.arange(5) + 1)))
+
+    def testBadRow(self):
+        table = makeTable(5)
+        self.assertRaises(Exception, table.AddRowArray, np.array([1., 2.]))
+        self.assertRaises(Exception, table.SetValue, "x", 5, 0.)
+        self.assertRaises(Exception, table.Column, "z")
+
+
+def suite():
+    utilsTests.init()
+    suites = []
+    suites += unittest.makeSuite(NpyFileTestCase)
+    suites += unittest.makeSuite(ColumnViewTestCase)
+    suites += unittest.makeSuite(utilsTests.MemoryTestCase)
+    return unittest.TestSuite(suites)
+
+
+def run(shouldExit=False):
+    utilsTests.run(suite(), shouldExit)
+
+if __name__ == "__main__":
+    run(True)
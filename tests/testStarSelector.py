@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+#
+# LSST Data Management System
+# Copyright 2008, 2009, 2010, 2011, 2012 LSST Corporation.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.    See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+"""Tests of the reference catalog helpers of refCatCache"""
+"""Tests of StarSelector.select against the per-source loop it replaced"""
+
+import unittest
+import numpy as np
+
+import lsst.utils.tests as utilsTests
+import lsst.afw.table as afwTable
+import lsst.afw.image as afwImage
+import lsst.afw.detection as afwDetection
+
+from lsst.meas.simastrom.simAstrom3 import StarSelector, StarSelectorConfig
+
+fluxField = "base_PsfFlux"
+centroid = "base_SdssCentroid"
+shape = "base_SdssShape"
+maxMag = 22.
+
+
+def loopSelect(config, srcCat, calib):
+    """The former StarSelector.select (calib.getMagnitude raises for flux == 0)"""
+    schema = srcCat.getSchema()
+    newCat = afwTable.SourceCatalog(schema)
+    fluxKey = schema[fluxField+"_flux"].asKey()
+    fluxErrKey = schema[fluxField+"_fluxSigma"].asKey()
+    parentKey = schema["parent"].asKey()
+    flagKeys = [schema[f].asKey() for f in config.badFlags]
+    flagKeys.append(schema[fluxField+"_flag"].asKey())
+    for src in srcCat :
+        if any(src.get(f) for f in flagKeys) :
+            continue
+        flux = src.get(fluxKey)
+        if flux < 0 :
+            continue
+        fluxErr = src.get(fluxErrKey)
+        mag, magErr = calib.getMagnitude(flux, fluxErr)
+        if mag > maxMag or magErr > 0.1 or flux/fluxErr < 10 :
+            continue
+        if src.get(parentKey) != 0 :
+            continue
+        footprint = src.getFootprint()
+        if footprint is not None and len(footprint.getPeaks()) > 1 :
+            continue
+        vx = np.square(src.get(centroid + "_xSigma"))
+        vy = np.square(src.get(centroid + "_ySigma"))
+        mxx = src.get(shape + "_xx")
+        myy = src.get(shape + "_yy")
+        mxy = src.get(shape + "_xy")
+        vxy = mxy*(vx+vy)/(mxx+myy)
+        if vx < 0 or vy < 0 or (vxy*vxy) > (vx*vy) or np.isnan(vx) or np.isnan(vy):
+            continue
+        newCat.append(src)
+    return newCat
+
+
+class StarSelectorTestCase(unittest.TestCase):
+    """The column cuts of StarSelector.select"""
+
+    def setUp(self):
+        self.config = StarSelectorConfig()
+        schema = afwTable.SourceTable.makeMinimalSchema()
+        for f in list(self.config.badFlags) + [fluxField+"_flag"] :
+            schema.addField(f, type="Flag", doc="")
+        for f in [fluxField+"_flux", fluxField+"_fluxSigma",
+                  shape+"_xx", shape+"_yy", shape+"_xy"] :
+            schema.addField(f, type="D", doc="")
+        for f in [centroid+"_xSigma", centroid+"_ySigma"] :
+            schema.addField(f, type="F", doc="")
+        self.schema = schema
+        self.calib = afwImage.Calib()
+        self.calib.setFluxMag0(1e10, 1e7)  # flux 1000 is magnitude 17.5
+        self.selector = StarSelector(self.config, fluxField, maxMag, centroid, shape)
+
+    def addSource(self, cat, flux=1000., fluxSigma=10., sigma=0.1, mxx=2., myy=2., mxy=0.,
+                  flags=(), parent=0, nPeaks=0):
+        """A source that passes the cuts, unless told otherwise"""
+        rec = cat.addNew()
+        rec.set(fluxField+"_flux", flux)
+        rec.set(fluxField+"_fluxSigma", fluxSigma)
+        rec.set(centroid+"_xSigma", sigma)
+        rec.set(centroid+"_ySigma", sigma)
+        rec.set(shape+"_xx", mxx)
+        rec.set(shape+"_yy", myy)
+        rec.set(shape+"_xy", mxy)
+        for f in flags :
+            rec.set(f, True)
+        rec.setParent(parent)
+        if nPeaks :
+            footprint = afwDetection.Footprint()
+            for k in range(nPeaks) :
+                footprint.addPeak(10.+5*k, 10., 100.)
+            rec.setFootprint(footprint)
+        return rec.getId()
+
+    def selectedIds(self, cat):
+        return set(src.getId() for src in self.selector.select(cat, self.calib))
+
+    def testCuts(self):
+        cat = afwTable.SourceCatalog(self.schema)
+        kept = set()
+        kept.add(self.addSource(cat))
+        for f in list(self.config.badFlags) + [fluxField+"_flag"] :
+            self.addSource(cat, flags=[f])
+        self.addSource(cat, flux=-1000.)
+        self.addSource(cat, flux=10., fluxSigma=0.1)  # magnitude 22.5
+        self.addSource(cat, fluxSigma=200.)  # S/N 5
+        # NaN's fail no comparison: these go through
+        kept.add(self.addSource(cat, fluxSigma=np.nan))
+        kept.add(self.addSource(cat, mxy=np.nan))
+        self.addSource(cat, parent=1)
+        self.addSource(cat, nPeaks=2)
+        kept.add(self.addSource(cat, nPeaks=1))
+        self.addSource(cat, sigma=np.nan)
+        # vxy^2 > vx*vy, i.e. |2 mxy| > mxx+myy here
+        self.addSource(cat, mxy=2.5)
+        kept.add(self.addSource(cat, mxy=1.5))
+        self.assertEqual(self.selectedIds(cat), kept)
+        self.assertEqual(self.selectedIds(cat),
+                         set(src.getId() for src in loopSelect(self.config, cat, self.calib)))
+
+    def testZeroFlux(self):
+        """The former loop raised (calib.getMagnitude) on flux == 0: it is now rejected"""
+        cat = afwTable.SourceCatalog(self.schema)
+        good = self.addSource(cat)
+        self.addSource(cat, flux=0.)
+        self.assertEqual(self.selectedIds(cat), set([good]))
+
+    def testRandomCatalog(self):
+        """Same selection as the loop, on sources close to the cuts"""
+        rng = np.random.RandomState(12345)
+        cat = afwTable.SourceCatalog(self.schema)
+        flagNames = list(self.config.badFlags) + [fluxField+"_flag"]
+        for k in range(500) :
+            flux = 10**rng.uniform(0.5, 4)
+            sigma = rng.uniform(0.05, 0.2)
+            flags = [f for f in flagNames if rng.uniform() < 0.05]
+            self.addSource(cat, flux=flux*rng.choice([1, 1, 1, -1]),
+                           fluxSigma=flux/rng.uniform(5, 50),
+                           sigma=np.nan if rng.uniform() < 0.05 else sigma,
+                           mxy=rng.uniform(-2.5, 2.5), flags=flags,
+                           parent=int(rng.uniform() < 0.05),
+                           nPeaks=rng.choice([0, 1, 2]))
+        selected = self.selectedIds(cat)
+        self.assertTrue(0 < len(selected) < len(cat))
+        self.assertEqual(selected,
+                         set(src.getId() for src in loopSelect(self.config, cat, self.calib)))
+
+
+def suite():
+    utilsTests.init()
+    suites = []
+    suites += unittest.makeSuite(StarSelectorTestCase)
+    suites += unittest.makeSuite(utilsTests.MemoryTestCase)
+    return unittest.TestSuite(suites)
+
+
+def run(shouldExit=False):
+    utilsTests.run(suite(), shouldExit)
+
+if __name__ == "__main__":
+    run(True)
@@ -0,0 +1,75 @@
+#define BOOST_TEST_DYN_LINK
+
+#define BOOST_TEST_MODULE test_associations
+
+//The boost unit test header
+#include "boost/test/unit_test.hpp"
+
+#include <algorithm>
+#include <map>
+#include <set>
+#include <string>
+#include <tuple>
+#include <vector>
+
+#include "lsst/meas/simastrom/Associations.h"
+#include "lsst/meas/simastrom/CcdImage.h"
+#include "lsst/meas/simastrom/FittedStar.h"
+
+#include "simulatedTract.h"
+
+// a measurement, identified independently of the object holding it
+typedef std::tuple<std::string, double, double> MeasurementKey;
+typedef std::set<std::vector<MeasurementKey> > Grouping;
+
+//! the measurements of each FittedStar, as a set of (sorted) groups.
+static Grouping grouping(const simAstrom::Associations &A)
+{
+  std::map<const simAstrom::FittedStar *, std::vector<MeasurementKey> > groups;
+  const simAstrom::CcdImageList &ccds = A.TheCcdImageList();
+  for (auto im = ccds.cbegin(); im != ccds.end(); ++im)
+    {
+      const simAstrom::MeasuredStarList &catalog = (*im)->CatalogForFit();
+      for (auto i = catalog.cbegin(); i != catalog.end(); ++i)
+	{
+	  const simAstrom::FittedStar *fs = (*i)->GetFittedStar();
+	  if (fs == NULL) continue;
+	  groups[fs].push_back(MeasurementKey((*im)->Name(), (*i)->x, (*i)->y));
+	}
+    }
+  Grouping result;
+  for (auto g = groups.begin(); g != groups.end(); ++g)
+    {
+      std::sort(g->second.begin(), g->second.end());
+      result.insert(g->second);
+    }
+  return result;
+}
+
+BOOST_AUTO_TEST_SUITE(test_associations)
+
+/* AssociateCatalogsParallel should group the measurements the same
+   way whatever the number of threads and the order of the CcdImage's. */
+BOOST_AUTO_TEST_CASE(test_parallel_association)
+{
+  SimulatedTractFile file(SimulatedTract(), "parallel");
+  std::vector<Grouping> groupings;
+  const unsigned nThreads[] = {1, 4, 4};
+  for (unsigned k=0; k < 3; ++k)
+    {
+      simAstrom::Associations assoc;
+      assoc.ReadCheckpoint(file.name);
+      assoc.SetNThreads(nThreads[k]);
+      if (k == 2) assoc.ccdImageList.reverse();
+      assoc.AssociateCatalogsParallel(1.0);
+      groupings.push_back(grouping(assoc));
+    }
+  unsigned nMatched = 0;
+  for (auto g = groupings[0].cbegin(); g != groupings[0].end(); ++g)
+    if (g->size() > 1) nMatched++;
+  BOOST_CHECK(nMatched > 0);
+  BOOST_CHECK(groupings[0] == groupings[1]);
+  BOOST_CHECK(groupings[0] == groupings[2]);
+}
+
+BOOST_AUTO_TEST_SUITE_END()
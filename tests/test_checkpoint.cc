@@ -0,0 +1,207 @@
+#define BOOST_TEST_DYN_LINK
+
+#define BOOST_TEST_MODULE test_checkpoint
+
+//The boost unit test header
+#include "boost/test/unit_test.hpp"
+
+#include <cstdio>
+#include <fstream>
+#include <sstream>
+#include <string>
+#include <vector>
+
+#include "lsst/meas/simastrom/Associations.h"
+#include "lsst/meas/simastrom/CcdImage.h"
+#include "lsst/meas/simastrom/Checkpoint.h"
+#include "lsst/meas/simastrom/Gtransfo.h"
+#include "lsst/meas/simastrom/SimplePolyModel.h"
+#include "lsst/meas/simastrom/ConstrainedPolyModel.h"
+#include "lsst/meas/simastrom/Projectionhandler.h"
+#include "lsst/pex/exceptions.h"
+
+#include "Eigen/Core"
+
+#include "simulatedTract.h"
+
+static std::string file_content(const std::string &FileName)
+{
+  std::ifstream f(FileName.c_str(), std::ios::binary);
+  std::stringstream s;
+  s << f.rdbuf();
+  return s.str();
+}
+
+static bool file_exists(const std::string &FileName)
+{
+  std::ifstream f(FileName.c_str());
+  return f.good();
+}
+
+static bool same_params(const simAstrom::Gtransfo &A, const simAstrom::Gtransfo &B)
+{
+  if (A.Npar() != B.Npar()) return false;
+  for (int k=0; k < A.Npar(); ++k)
+    if (A.ParamRef(k) != B.ParamRef(k)) return false;
+  return true;
+}
+
+//! moves all the distortion parameters of M away from their initial values.
+static void perturb(simAstrom::DistortionModel &M)
+{
+  std::string what("Distortions");
+  unsigned npar = M.AssignIndices(0, what);
+  Eigen::VectorXd delta(npar);
+  for (unsigned k=0; k < npar; ++k) delta(k) = 1e-7*(k%7+1);
+  M.OffsetParams(delta);
+}
+
+BOOST_AUTO_TEST_SUITE(test_checkpoints)
+
+/* What CheckpointWriter writes, CheckpointReader reads back, and
+   files of another kind, or truncated, are rejected. */
+BOOST_AUTO_TEST_CASE(test_checkpoint_io)
+{
+  const std::string name("checkpoint_io.ckpt");
+  simAstrom::GtransfoPoly poly(3);
+  for (int k=0; k < poly.Npar(); ++k) poly.ParamRef(k) = 0.5*k-1;
+  std::vector<double> values;
+  values.push_back(1.5); values.push_back(-2e10);
+  {
+    simAstrom::CheckpointWriter w(name, "TESTCKPT");
+    w.Put(42); w.Put(true); w.Put(3.25);
+    w.PutString("a string");
+    w.PutVector(values);
+    w.PutVector(std::vector<long long>());
+    w.PutPoly(poly);
+    w.Close();
+  }
+  BOOST_REQUIRE(file_exists(name));
+  BOOST_CHECK(!file_exists(name+".tmp"));
+  {
+    simAstrom::CheckpointReader r(name, "TESTCKPT");
+    BOOST_CHECK_EQUAL(r.Get<int>(), 42);
+    BOOST_CHECK_EQUAL(r.Get<bool>(), true);
+    BOOST_CHECK_EQUAL(r.Get<double>(), 3.25);
+    BOOST_CHECK_EQUAL(r.GetString(), "a string");
+    std::vector<double> v;
+    r.GetVector(v);
+    BOOST_CHECK(v == values);
+    std::vector<long long> empty(3);
+    r.GetVector(empty);
+    BOOST_CHECK(empty.empty());
+    simAstrom::GtransfoPoly p;
+    r.GetPoly(p);
+    BOOST_CHECK_EQUAL(p.Degree(), 3u);
+    BOOST_CHECK(same_params(p, poly));
+    // nothing left
+    BOOST_CHECK_THROW(r.Get<char>(), lsst::pex::exceptions::InvalidParameterError);
+  }
+  BOOST_CHECK_THROW(simAstrom::CheckpointReader(name, "OTHERKND"), lsst::pex::exceptions::InvalidParameterError);
+
+  // a truncated file
+  std::string content = file_content(name);
+  {
+    std::ofstream f(name.c_str(), std::ios::binary | std::ios::trunc);
+    f.write(content.data(), content.size()-4);
+  }
+  {
+    simAstrom::CheckpointReader r(name, "TESTCKPT");
+    r.Get<int>(); r.Get<bool>(); r.Get<double>(); r.GetString();
+    std::vector<double> v;
+    r.GetVector(v);
+    std::vector<long long> empty;
+    r.GetVector(empty);
+    simAstrom::GtransfoPoly p;
+    BOOST_CHECK_THROW(r.GetPoly(p), lsst::pex::exceptions::InvalidParameterError);
+  }
+  remove(name.c_str());
+
+  // a writer that is not closed (e.g. because of an exception) leaves nothing behind
+  {
+    simAstrom::CheckpointWriter w(name, "TESTCKPT");
+    w.Put(1);
+  }
+  BOOST_CHECK(!file_exists(name));
+  BOOST_CHECK(!file_exists(name+".tmp"));
+}
+
+/* An association checkpoint read back (Associations::ReadCheckpoint,
+   which rebuilds the CcdImage's) holds the same state: writing it
+   again gives the same file. */
+BOOST_AUTO_TEST_CASE(test_association_round_trip)
+{
+  SimulatedTractFile file(SimulatedTract(), "roundtrip");
+  simAstrom::Associations assoc;
+  SimulatedTract::Load(assoc, file.name);
+  // an outlier, whose status should be kept
+  assoc.TheCcdImageList().front()->CatalogForFit().front()->SetValid(false);
+  BOOST_REQUIRE(assoc.fittedStarList.size() > 0);
+  BOOST_REQUIRE(assoc.refStarList.size() > 0);
+
+  const std::string first("roundtrip_1.assoc"), second("roundtrip_2.assoc");
+  assoc.WriteCheckpoint(first);
+  simAstrom::Associations back;
+  back.ReadCheckpoint(first);
+  back.WriteCheckpoint(second);
+
+  BOOST_CHECK_EQUAL(back.NCcdImages(), assoc.NCcdImages());
+  BOOST_CHECK_EQUAL(back.fittedStarList.size(), assoc.fittedStarList.size());
+  BOOST_CHECK_EQUAL(back.refStarList.size(), assoc.refStarList.size());
+  const simAstrom::CcdImage &ccd = *back.TheCcdImageList().front();
+  BOOST_CHECK_EQUAL(ccd.Name(), assoc.TheCcdImageList().front()->Name());
+  BOOST_CHECK(!ccd.CatalogForFit().front()->IsValid());
+  BOOST_CHECK(ccd.CatalogForFit().front()->GetFittedStar() != NULL);
+  std::string content = file_content(first);
+  BOOST_CHECK(content.size() > 0);
+  BOOST_CHECK(content == file_content(second));
+  remove(first.c_str());
+  remove(second.c_str());
+}
+
+/* The parameters of the distortion models read back are the ones that
+   were saved, and a file that does not match the model is rejected. */
+BOOST_AUTO_TEST_CASE(test_model_params_round_trip)
+{
+  SimulatedTractFile file(SimulatedTract(), "params");
+  simAstrom::Associations assoc;
+  SimulatedTract::Load(assoc, file.name);
+  const simAstrom::CcdImageList &ccds = assoc.TheCcdImageList();
+  simAstrom::OneTPPerShoot sky2TP(ccds);
+  const std::string name("params.model");
+
+  simAstrom::SimplePolyModel spm(ccds, &sky2TP, true, 0, 3);
+  perturb(spm);
+  spm.WriteParams(name);
+  simAstrom::SimplePolyModel spmBack(ccds, &sky2TP, true, 0, 3);
+  BOOST_CHECK(!same_params(spmBack.GetTransfo(*ccds.front()), spm.GetTransfo(*ccds.front())));
+  spmBack.ReadParams(name);
+  for (auto i = ccds.cbegin(); i != ccds.end(); ++i)
+    BOOST_CHECK(same_params(spmBack.GetTransfo(**i), spm.GetTransfo(**i)));
+
+  // the same CcdImage's, but some are missing
+  simAstrom::CcdImageList fewer(ccds);
+  fewer.pop_back();
+  simAstrom::SimplePolyModel spmFewer(fewer, &sky2TP, true, 0, 3);
+  spmFewer.WriteParams(name);
+  BOOST_CHECK_THROW(spmBack.ReadParams(name), lsst::pex::exceptions::InvalidParameterError);
+  spmBack.ReadParams(name, /* AllowNew = */ true);
+
+  simAstrom::ConstrainedPolyModel cpm(ccds, &sky2TP, true);
+  perturb(cpm);
+  cpm.WriteParams(name);
+  simAstrom::ConstrainedPolyModel cpmBack(ccds, &sky2TP, true);
+  cpmBack.ReadParams(name);
+  std::vector<simAstrom::ShootIdType> shoots = cpm.GetShoots();
+  BOOST_CHECK(shoots == cpmBack.GetShoots());
+  for (auto s = shoots.cbegin(); s != shoots.end(); ++s)
+    BOOST_CHECK(same_params(cpmBack.GetShootTransfo(*s), cpm.GetShootTransfo(*s)));
+  for (auto i = ccds.cbegin(); i != ccds.end(); ++i)
+    BOOST_CHECK(same_params(cpmBack.GetChipTransfo((*i)->Chip()), cpm.GetChipTransfo((*i)->Chip())));
+  // a file of the other model
+  spm.WriteParams(name);
+  BOOST_CHECK_THROW(cpmBack.ReadParams(name), lsst::pex::exceptions::InvalidParameterError);
+  remove(name.c_str());
+}
+
+BOOST_AUTO_TEST_SUITE_END()
@@ -0,0 +1,882 @@
+#define BOOST_TEST_DYN_LINK
+
+#define BOOST_TEST_MODULE test_fit
+
+//The boost unit test header
+#include "boost/test/unit_test.hpp"
+
+#include "lsst/meas/simastrom/Associations.h"
+#include "lsst/meas/simastrom/AstromFit.h"
+#include "lsst/meas/simastrom/PhotomFit.h"
+#include "lsst/meas/simastrom/SimplePhotomModel.h"
+#include "lsst/meas/simastrom/SimplePolyModel.h"
+#include "lsst/meas/simastrom/SimplePolyMapping.h"
+#include "lsst/meas/simastrom/TwoTransfoMapping.h"
+#include "lsst/meas/simastrom/FatPoint.h"
+#include "lsst/meas/simastrom/MeasuredStarArrays.h"
+#include "lsst/meas/simastrom/Projectionhandler.h"
+#include "lsst/meas/simastrom/Tripletlist.h"
+#include "lsst/meas/simastrom/SparseSolver.h"
+#include "lsst/meas/simastrom/SparseHessian.h"
+
+#include <algorithm>
+#include <map>
+#include <random>
+#include <set>
+
+#include "Eigen/Sparse"
+#include "Eigen/SparseCholesky"
+
+#include "simulatedTract.h"
+
+typedef Eigen::SparseMatrix<double> SpMat;
+
+static SpMat jacobian_of(const simAstrom::TripletList &TList, const unsigned NPar)
+{
+  SpMat j(NPar, TList.NextFreeIndex());
+  j.setFromTriplets(TList.begin(), TList.end());
+  return j;
+}
+
+// exact comparison: the results should not depend on the number of threads at all
+static bool same_matrices(const SpMat &A, const SpMat &B)
+{
+  if (A.rows() != B.rows() || A.cols() != B.cols() || A.nonZeros() != B.nonZeros()) return false;
+  SpMat d = A-B;
+  for (int col=0; col < d.outerSize(); ++col)
+    for (SpMat::InnerIterator it(d,col); it; ++it)
+      if (it.value() != 0) return false;
+  return true;
+}
+
+//! A direct solver (Eigen's LDLt) for the tests, that does not depend on cholmod.
+class EigenLDLTSolver : public simAstrom::SparseSolver
+{
+  Eigen::SimplicialLDLT<Matrix> ldlt;
+
+ protected :
+  void DoAnalyze(const Matrix &H) { ldlt.analyzePattern(H);}
+  bool DoFactorize(const Matrix &H) { ldlt.factorize(H); return ldlt.info() == Eigen::Success;}
+
+ public :
+  std::string Name() const { return "eigen_ldlt";}
+  Eigen::VectorXd Solve(const Eigen::VectorXd &B) { return ldlt.solve(B);}
+  bool Update(const Matrix &W, const bool UpOrDown) { return false;}
+  size_t FactorNonZeros() const { return ldlt.matrixL().nestedExpression().nonZeros();}
+};
+
+/* Turns the exact fluxes of the simulated tract into measured ones:
+   a zero point that changes with the visit, 1% noise (the assigned
+   errors), and a few outliers off by 50%. */
+static void measure_fluxes(simAstrom::Associations &A, const unsigned NChips)
+{
+  std::mt19937 rng(4321);
+  std::normal_distribution<double> g(0,1);
+  unsigned rank = 0, count = 0;
+  const simAstrom::CcdImageList &ccds = A.TheCcdImageList();
+  for (auto im = ccds.cbegin(); im != ccds.end(); ++im, ++rank)
+    {
+      double zp = 1 + 0.02*(rank/NChips);
+      const simAstrom::MeasuredStarList &catalog = (*im)->CatalogForFit();
+      for (auto i = catalog.cbegin(); i != catalog.end(); ++i)
+	{
+	  simAstrom::MeasuredStar &ms = **i;
+	  ms.flux *= zp*(1+0.01*g(rng));
+	  if (++count % 50 == 0) ms.flux *= 1.5;
+	}
+    }
+}
+
+//! the valid flags of the measurements, in the CcdImage's order.
+static std::vector<bool> valid_flags(const simAstrom::Associations &A)
+{
+  std::vector<bool> flags;
+  const simAstrom::CcdImageList &ccds = A.TheCcdImageList();
+  for (auto im = ccds.cbegin(); im != ccds.end(); ++im)
+    {
+      const simAstrom::MeasuredStarList &catalog = (*im)->CatalogForFit();
+      for (auto i = catalog.cbegin(); i != catalog.end(); ++i) flags.push_back((*i)->IsValid());
+    }
+  return flags;
+}
+
+//! the photometric factors of the CcdImage's.
+static Eigen::VectorXd photom_factors(const simAstrom::Associations &A, const simAstrom::PhotomModel &M)
+{
+  const simAstrom::CcdImageList &ccds = A.TheCcdImageList();
+  Eigen::VectorXd factors(ccds.size());
+  unsigned k = 0;
+  for (auto im = ccds.cbegin(); im != ccds.end(); ++im)
+    factors(k++) = M.PhotomFactor(**im, simAstrom::Point(0,0));
+  return factors;
+}
+
+//! the fluxes of the FittedStar's.
+static Eigen::VectorXd fitted_fluxes(const simAstrom::Associations &A)
+{
+  const simAstrom::FittedStarList &fsl = A.fittedStarList;
+  Eigen::VectorXd fluxes(fsl.size());
+  unsigned k = 0;
+  for (auto i = fsl.cbegin(); i != fsl.end(); ++i) fluxes(k++) = (*i)->flux;
+  return fluxes;
+}
+
+//! the parameters of the mappings of SPM, and the positions of the FittedStar's.
+static std::vector<double> astrom_params(const simAstrom::Associations &A,
+					 const simAstrom::SimplePolyModel &SPM)
+{
+  std::vector<double> params;
+  const simAstrom::CcdImageList &ccds = A.TheCcdImageList();
+  for (auto im = ccds.cbegin(); im != ccds.end(); ++im)
+    {
+      const simAstrom::Gtransfo &t = SPM.GetTransfo(**im);
+      for (int k=0; k < t.Npar(); ++k) params.push_back(t.ParamRef(k));
+    }
+  const simAstrom::FittedStarList &fsl = A.fittedStarList;
+  for (auto i = fsl.cbegin(); i != fsl.end(); ++i)
+    {
+      params.push_back((*i)->x);
+      params.push_back((*i)->y);
+    }
+  return params;
+}
+
+//! a polynomial with all coefficients set, close to the identity.
+//! a valid measurement of a FittedStar measured at least 3 times, so that the fit does without it.
+static simAstrom::MeasuredStar &some_measurement(const simAstrom::Associations &A)
+{
+  const simAstrom::CcdImageList &ccds = A.TheCcdImageList();
+  for (auto im = ccds.cbegin(); im != ccds.end(); ++im)
+    {
+      const simAstrom::MeasuredStarList &catalog = (*im)->CatalogForFit();
+      for (auto i = catalog.cbegin(); i != catalog.end(); ++i)
+	if ((*i)->IsValid() && (*i)->GetFittedStar() && (*i)->GetFittedStar()->MeasurementCount() >= 3)
+	  return **i;
+    }
+  BOOST_FAIL("no measurement of a FittedStar measured 3 times");
+  return *ccds.front()->CatalogForFit().front();
+}
+
+//! discards (or restores) a measurement, as the outlier removal does.
+static void set_valid(simAstrom::MeasuredStar &M, const bool Valid)
+{
+  if (M.IsValid() == Valid) return;
+  M.SetValid(Valid);
+  const_cast<simAstrom::FittedStar *>(M.GetFittedStar())->MeasurementCount() += (Valid ? 1 : -1);
+}
+
+static simAstrom::GtransfoPoly some_poly(const unsigned Degree, std::mt19937 &Rng)
+{
+  std::uniform_real_distribution<double> u(-1,1);
+  simAstrom::GtransfoPoly poly(Degree);
+  for (int k=0; k < poly.Npar(); ++k) poly.ParamRef(k) = 1e-2*u(Rng);
+  poly.ParamRef(1) += 1; // x' = x
+  poly.ParamRef(poly.Npar()/2+2) += 1; // y' = y
+  return poly;
+}
+
+//! the batch routines of M against its per-point ones, on In.
+static void check_mapping_batch(const simAstrom::Mapping &M, const simAstrom::FatPointArrays &In)
+{
+  simAstrom::FatPointArrays out, outDer;
+  Eigen::MatrixXd h;
+  M.TransformPosAndErrorsBatch(In, out);
+  M.ComputeTransformAndDerivativesBatch(In, outDer, h);
+  BOOST_REQUIRE_EQUAL(out.size(), In.size());
+  BOOST_REQUIRE_EQUAL(outDer.size(), In.size());
+  BOOST_REQUIRE_EQUAL(h.rows(), M.Npar());
+  BOOST_REQUIRE_EQUAL(h.cols(), 2*In.size());
+  const double eps = 1e-12;
+  Eigen::MatrixX2d h1(M.Npar(), 2);
+  for (size_t k=0; k < In.size(); ++k)
+    {
+      simAstrom::FatPoint ref, refDer;
+      M.TransformPosAndErrors(In.Get(k), ref);
+      h1.setZero();
+      M.ComputeTransformAndDerivatives(In.Get(k), refDer, h1);
+      const simAstrom::FatPoint outs[] = {out.Get(k), outDer.Get(k)};
+      for (unsigned l=0; l < 2; ++l)
+	{
+	  const simAstrom::FatPoint &p = outs[l];
+	  const simAstrom::FatPoint &r = (l == 0) ? ref : refDer;
+	  BOOST_CHECK_SMALL(p.x-r.x, eps*(1+fabs(r.x)));
+	  BOOST_CHECK_SMALL(p.y-r.y, eps*(1+fabs(r.y)));
+	  BOOST_CHECK_SMALL(p.vx-r.vx, eps*r.vx);
+	  BOOST_CHECK_SMALL(p.vy-r.vy, eps*r.vy);
+	  BOOST_CHECK_SMALL(p.vxy-r.vxy, eps*sqrt(r.vx*r.vy));
+	}
+      if (M.Npar())
+	BOOST_CHECK_SMALL((h.middleCols(2*k,2)-h1).norm(), eps*(1+h1.norm()));
+    }
+}
+
+BOOST_AUTO_TEST_SUITE(test_fits)
+
+/* LSDerivatives loops over the CcdImage's with NThreads threads: the
+   Jacobian and gradient should be the same as with 1 thread. */
+BOOST_AUTO_TEST_CASE(test_derivatives_threads)
+{
+  SimulatedTractFile file(SimulatedTract(), "derivatives");
+  simAstrom::Associations assoc;
+  SimulatedTract::Load(assoc, file.name);
+  simAstrom::OneTPPerShoot sky2TP(assoc.TheCcdImageList());
+  simAstrom::SimplePolyModel spm(assoc.TheCcdImageList(), &sky2TP, true, 0, 3);
+  simAstrom::AstromFit fit(assoc, &spm, 0.02);
+  fit.AssignIndices("Distortions Positions");
+  unsigned npar = fit.NParTot();
+  BOOST_REQUIRE(npar > 0);
+
+  std::vector<SpMat> jacobians;
+  std::vector<Eigen::VectorXd> grads;
+  const unsigned nThreads[] = {1, 4};
+  for (unsigned k=0; k < 2; ++k)
+    {
+      fit.SetNThreads(nThreads[k]);
+      simAstrom::TripletList tList(10000);
+      Eigen::VectorXd grad(npar); grad.setZero();
+      fit.LSDerivatives(tList, grad);
+      jacobians.push_back(jacobian_of(tList, npar));
+      grads.push_back(grad);
+    }
+  BOOST_CHECK(jacobians[0].nonZeros() > 0);
+  BOOST_CHECK(same_matrices(jacobians[0], jacobians[1]));
+  BOOST_CHECK(grads[0] == grads[1]);
+}
+
+/* ComputeChi2 and FindOutliers accumulate the CcdImage's with
+   NThreads threads: the chi2 and the outliers should be the same as
+   with 1 thread. */
+BOOST_AUTO_TEST_CASE(test_chi2_threads)
+{
+  SimulatedTractFile file(SimulatedTract(), "chi2");
+  simAstrom::Associations assoc;
+  SimulatedTract::Load(assoc, file.name);
+  simAstrom::OneTPPerShoot sky2TP(assoc.TheCcdImageList());
+  simAstrom::SimplePolyModel spm(assoc.TheCcdImageList(), &sky2TP, true, 0, 3);
+  simAstrom::AstromFit fit(assoc, &spm, 0.02);
+  fit.AssignIndices("Distortions Positions");
+
+  std::vector<simAstrom::Chi2> chi2s;
+  std::vector<std::vector<const simAstrom::MeasuredStar *> > measOutliers;
+  std::vector<std::vector<const simAstrom::FittedStar *> > refOutliers;
+  const unsigned nThreads[] = {1, 4};
+  for (unsigned k=0; k < 2; ++k)
+    {
+      fit.SetNThreads(nThreads[k]);
+      chi2s.push_back(fit.ComputeChi2());
+      simAstrom::MeasuredStarList msOutliers;
+      simAstrom::FittedStarList fsOutliers;
+      // a low cut, for the outlier lists not to be empty
+      fit.FindOutliers(2., msOutliers, fsOutliers);
+      measOutliers.push_back(std::vector<const simAstrom::MeasuredStar *>());
+      for (auto i = msOutliers.cbegin(); i != msOutliers.end(); ++i) measOutliers.back().push_back(&**i);
+      refOutliers.push_back(std::vector<const simAstrom::FittedStar *>());
+      for (auto i = fsOutliers.cbegin(); i != fsOutliers.end(); ++i) refOutliers.back().push_back(&**i);
+    }
+  BOOST_CHECK(chi2s[0].chi2 > 0);
+  BOOST_CHECK_EQUAL(chi2s[0].chi2, chi2s[1].chi2);
+  BOOST_CHECK_EQUAL(chi2s[0].ndof, chi2s[1].ndof);
+  BOOST_CHECK(measOutliers[0].size() > 0);
+  BOOST_CHECK(measOutliers[0] == measOutliers[1]);
+  BOOST_CHECK(refOutliers[0] == refOutliers[1]);
+}
+
+/* Eliminating the positions of the fitted stars (SchurSolver) should
+   give the same solution of the normal equations as solving the
+   whole system, whatever solver factorizes the reduced system. */
+BOOST_AUTO_TEST_CASE(test_schur_solution)
+{
+  SimulatedTractFile file(SimulatedTract(), "schur");
+  simAstrom::Associations assoc;
+  SimulatedTract::Load(assoc, file.name);
+  simAstrom::OneTPPerShoot sky2TP(assoc.TheCcdImageList());
+  simAstrom::SimplePolyModel spm(assoc.TheCcdImageList(), &sky2TP, true, 0, 3);
+  simAstrom::AstromFit fit(assoc, &spm, 0.02);
+  fit.AssignIndices("Distortions Positions");
+  unsigned npar = fit.NParTot();
+
+  simAstrom::TripletList tList(10000);
+  Eigen::VectorXd grad(npar); grad.setZero();
+  fit.LSDerivatives(tList, grad);
+  SpMat jac = jacobian_of(tList, npar);
+  SpMat hessian = jac*jac.transpose();
+
+  // the direct solution
+  Eigen::SimplicialLDLT<SpMat> ldlt(hessian);
+  BOOST_REQUIRE(ldlt.info() == Eigen::Success);
+  Eigen::VectorXd direct = ldlt.solve(grad);
+
+  // the positions of a FittedStar only couple to each other
+  simAstrom::SchurSolver::BlockList blocks;
+  std::vector<unsigned> starIndices;
+  const simAstrom::FittedStarList &fsl = assoc.fittedStarList;
+  for (auto i = fsl.cbegin(); i != fsl.end(); ++i) starIndices.push_back((*i)->IndexInMatrix());
+  std::sort(starIndices.begin(), starIndices.end());
+  for (auto i = starIndices.cbegin(); i != starIndices.end(); ++i)
+    blocks.push_back(std::make_pair(*i, 2u));
+  BOOST_REQUIRE(blocks.size() > 0);
+
+  // the direct solvers of this build, and one that is always there.
+  std::vector<std::string> names = simAstrom::SparseSolverNames();
+  names.push_back("eigen_ldlt");
+  for (auto name = names.cbegin(); name != names.end(); ++name)
+    {
+      if (*name == "pcg") continue; // iterative : only approaches the solution
+      std::unique_ptr<simAstrom::SparseSolver> reduced;
+      if (*name == "eigen_ldlt") reduced.reset(new EigenLDLTSolver);
+      else reduced = simAstrom::MakeSparseSolver(*name, true);
+      simAstrom::SchurSolver schur(std::move(reduced), 4);
+      schur.SetBlocks(blocks);
+      schur.Analyze(hessian);
+      BOOST_REQUIRE(schur.Factorize(hessian));
+      Eigen::VectorXd x = schur.Solve(grad);
+      BOOST_TEST_MESSAGE(*name << " : relative difference " << (x-direct).norm()/direct.norm());
+      BOOST_CHECK((x-direct).norm() <= 1e-8*direct.norm());
+    }
+}
+
+/* SparseHessian on a small system: a few blocks of Jacobian columns,
+   each column involving a handful of the parameters, as the
+   measurements of a CcdImage do. H should be J*J^T, with the same
+   values whatever the number of threads. */
+BOOST_AUTO_TEST_CASE(test_sparse_hessian)
+{
+  const unsigned npar = 40;
+  std::mt19937 rng(4321);
+  std::uniform_int_distribution<unsigned> anyPar(0, npar-1);
+  std::normal_distribution<double> g(0,1);
+
+  std::vector<simAstrom::TripletList> blocks;
+  std::vector<std::vector<unsigned> > couplings;
+  simAstrom::TripletList all(1000);
+  for (unsigned b=0; b < 5; ++b)
+    {
+      blocks.push_back(simAstrom::TripletList(100));
+      simAstrom::TripletList &block = blocks.back();
+      for (unsigned col=0; col < 12; ++col)
+	{
+	  std::vector<unsigned> indices;
+	  for (unsigned k=0; k < 4; ++k) indices.push_back(anyPar(rng));
+	  std::sort(indices.begin(), indices.end());
+	  indices.erase(std::unique(indices.begin(), indices.end()), indices.end());
+	  for (auto i = indices.cbegin(); i != indices.end(); ++i)
+	    block.AddTriplet(*i, col, g(rng));
+	  couplings.push_back(indices);
+	}
+      block.SetNextFreeIndex(12);
+      all.AppendBlock(block);
+    }
+  SpMat jac = jacobian_of(all, npar);
+  Eigen::MatrixXd expected = Eigen::MatrixXd(jac*jac.transpose());
+
+  std::vector<SpMat> hessians;
+  const unsigned nThreads[] = {1, 4};
+  for (unsigned k=0; k < 2; ++k)
+    {
+      simAstrom::SparseHessian h(npar);
+      for (auto c = couplings.cbegin(); c != couplings.end(); ++c) h.AddCoupling(*c);
+      h.EndPattern();
+      // two calls, as AstromFit::AssembleNormalEquations does
+      h.Accumulate(std::vector<simAstrom::TripletList>(blocks.begin(), blocks.begin()+3), nThreads[k]);
+      h.Accumulate(std::vector<simAstrom::TripletList>(blocks.begin()+3, blocks.end()), nThreads[k]);
+      hessians.push_back(SpMat());
+      h.Extract(hessians.back());
+    }
+  BOOST_CHECK(same_matrices(hessians[0], hessians[1]));
+  BOOST_CHECK((Eigen::MatrixXd(hessians[0]) - expected).norm() <= 1e-12*expected.norm());
+
+  // a coupling that was not declared
+  simAstrom::SparseHessian h(npar);
+  h.AddCoupling(std::vector<unsigned>(1, 0));
+  h.EndPattern();
+  std::vector<simAstrom::TripletList> undeclared(1, simAstrom::TripletList(2));
+  undeclared[0].AddTriplet(0, 0, 1.);
+  undeclared[0].AddTriplet(1, 0, 1.);
+  BOOST_CHECK_THROW(h.Accumulate(undeclared, 1), lsst::pex::exceptions::LogicError);
+}
+
+/* The normal equations assembled without storing the whole Jacobian
+   should be the ones computed from it. */
+BOOST_AUTO_TEST_CASE(test_assemble_normal_equations)
+{
+  SimulatedTractFile file(SimulatedTract(), "assemble");
+  simAstrom::Associations assoc;
+  SimulatedTract::Load(assoc, file.name);
+  simAstrom::OneTPPerShoot sky2TP(assoc.TheCcdImageList());
+  simAstrom::SimplePolyModel spm(assoc.TheCcdImageList(), &sky2TP, true, 0, 3);
+  simAstrom::AstromFit fit(assoc, &spm, 0.02);
+  fit.AssignIndices("Distortions Positions");
+  unsigned npar = fit.NParTot();
+
+  simAstrom::TripletList tList(10000);
+  Eigen::VectorXd grad(npar); grad.setZero();
+  fit.LSDerivatives(tList, grad);
+  SpMat jac = jacobian_of(tList, npar);
+  SpMat expected = jac*jac.transpose();
+
+  const unsigned nThreads[] = {1, 4};
+  for (unsigned k=0; k < 2; ++k)
+    {
+      fit.SetNThreads(nThreads[k]);
+      SpMat hessian;
+      Eigen::VectorXd rhs(npar); rhs.setZero();
+      fit.AssembleNormalEquations(hessian, rhs);
+      BOOST_CHECK((hessian-expected).norm() <= 1e-12*expected.norm());
+      BOOST_CHECK((rhs-grad).norm() <= 1e-12*grad.norm());
+    }
+}
+
+/* MeasuredStarArrays copies what the fits read from a
+   MeasuredStarList, in the order of the list. */
+BOOST_AUTO_TEST_CASE(test_measured_star_arrays)
+{
+  SimulatedTractFile file(SimulatedTract(1,1,50), "arrays");
+  simAstrom::Associations assoc;
+  SimulatedTract::Load(assoc, file.name);
+  const simAstrom::MeasuredStarList &catalog = assoc.TheCcdImageList().front()->CatalogForFit();
+  catalog.front()->SetValid(false);
+  const simAstrom::MeasuredStarArrays arrays(catalog);
+  BOOST_REQUIRE_EQUAL(arrays.size(), catalog.size());
+  size_t k = 0;
+  for (auto i = catalog.cbegin(); i != catalog.end(); ++i, ++k)
+    {
+      const simAstrom::MeasuredStar &ms = **i;
+      BOOST_CHECK_EQUAL(arrays.star[k], &ms);
+      BOOST_CHECK_EQUAL(arrays.x[k], ms.x);
+      BOOST_CHECK_EQUAL(arrays.y[k], ms.y);
+      BOOST_CHECK_EQUAL(arrays.vxy[k], ms.vxy);
+      BOOST_CHECK_EQUAL(arrays.flux[k], ms.flux);
+      BOOST_CHECK_EQUAL(arrays.eflux[k], ms.eflux);
+      BOOST_CHECK_EQUAL(arrays.fittedStar[k], ms.GetFittedStar());
+      BOOST_CHECK_EQUAL(bool(arrays.valid[k]), ms.IsValid());
+    }
+  BOOST_CHECK(!arrays.valid[0]);
+}
+
+/* PhotomFit reads the fluxes from arrays built at each pass: its chi2
+   should be the one computed from the list, and follow the changes of
+   the measurements, whichever way they are done. */
+BOOST_AUTO_TEST_CASE(test_photom_chi2_from_arrays)
+{
+  const unsigned nChips = 2;
+  SimulatedTractFile file(SimulatedTract(2, nChips, 50), "photomarrays");
+  simAstrom::Associations assoc;
+  SimulatedTract::Load(assoc, file.name);
+  simAstrom::SimplePhotomModel model(assoc.TheCcdImageList());
+  simAstrom::PhotomFit fit(assoc, &model, 0);
+  fit.ComputeChi2();
+  measure_fluxes(assoc, nChips);
+
+  double expected = 0;
+  simAstrom::MeasuredStar *first = NULL;
+  double firstTerm = 0;
+  const simAstrom::CcdImageList &ccds = assoc.TheCcdImageList();
+  for (auto im = ccds.cbegin(); im != ccds.end(); ++im)
+    {
+      const simAstrom::MeasuredStarList &catalog = (*im)->CatalogForFit();
+      for (auto i = catalog.cbegin(); i != catalog.end(); ++i)
+	{
+	  simAstrom::MeasuredStar &ms = **i;
+	  if (!ms.IsValid()) continue;
+	  double res = ms.flux - model.PhotomFactor(**im, ms)*ms.GetFittedStar()->flux;
+	  double term = res*res/(ms.eflux*ms.eflux);
+	  expected += term;
+	  if (!first) { first = &ms; firstTerm = term;}
+	}
+    }
+  BOOST_REQUIRE(first);
+  simAstrom::Chi2 chi2 = fit.ComputeChi2();
+  BOOST_CHECK_CLOSE(chi2.chi2, expected, 1e-10);
+
+  first->SetValid(false);
+  simAstrom::Chi2 chi2Less = fit.ComputeChi2();
+  BOOST_CHECK_EQUAL(chi2Less.ndof, chi2.ndof-1);
+  BOOST_CHECK_CLOSE(chi2Less.chi2, expected-firstTerm, 1e-10);
+}
+
+/* A fit restricted to the CcdImage's added after the first association
+   (Associations::AssociateNewCatalogs, AstromFit::RestrictToNewCcdImages)
+   should leave the parameters of the other CcdImage's and the
+   positions of the FittedStar's they measure untouched. */
+BOOST_AUTO_TEST_CASE(test_restricted_fit)
+{
+  const unsigned nChips = 4;
+  SimulatedTractFile file(SimulatedTract(4, nChips), "restricted");
+  simAstrom::Associations assoc;
+  assoc.ReadCheckpoint(file.name);
+  // the last visit comes later
+  const unsigned firstNew = 3*nChips;
+  simAstrom::CcdImageList later;
+  while (assoc.ccdImageList.size() > firstNew)
+    {
+      later.push_front(assoc.ccdImageList.back());
+      assoc.ccdImageList.pop_back();
+    }
+  assoc.AssociateCatalogs(1.0);
+  assoc.AssociateRefStarArrays(1.0);
+  assoc.SelectFittedStars();
+  assoc.DeprojectFittedStars();
+  assoc.ccdImageList.splice(assoc.ccdImageList.end(), later);
+  assoc.AssociateNewCatalogs(1.0, firstNew);
+
+  simAstrom::OneTPPerShoot sky2TP(assoc.TheCcdImageList());
+  simAstrom::SimplePolyModel spm(assoc.TheCcdImageList(), &sky2TP, true, 0, 3);
+  simAstrom::AstromFit fit(assoc, &spm, 0.02);
+  fit.SetSolver("pcg");
+  fit.AssignIndices("Distortions Positions");
+  fit.RestrictToNewCcdImages(firstNew);
+
+  // the state before the fit, and what should not move
+  const simAstrom::CcdImageList &ccds = assoc.TheCcdImageList();
+  std::vector<std::vector<double> > params;
+  for (auto i = ccds.cbegin(); i != ccds.end(); ++i)
+    {
+      const simAstrom::Gtransfo &t = spm.GetTransfo(**i);
+      params.push_back(std::vector<double>());
+      for (int k=0; k < t.Npar(); ++k) params.back().push_back(t.ParamRef(k));
+    }
+  std::set<const simAstrom::FittedStar *> heldFixed;
+  unsigned rank = 0;
+  for (auto i = ccds.cbegin(); i != ccds.end() && rank < firstNew; ++i, ++rank)
+    {
+      const simAstrom::MeasuredStarList &catalog = (*i)->CatalogForFit();
+      for (auto m = catalog.cbegin(); m != catalog.end(); ++m)
+	if ((*m)->IsValid() && (*m)->GetFittedStar()) heldFixed.insert((*m)->GetFittedStar());
+    }
+  std::map<const simAstrom::FittedStar *, simAstrom::Point> positions;
+  for (auto f = assoc.fittedStarList.cbegin(); f != assoc.fittedStarList.end(); ++f)
+    positions[&**f] = **f;
+  BOOST_REQUIRE(heldFixed.size() > 0);
+
+  BOOST_CHECK(fit.Minimize("Distortions Positions") != 2);
+
+  rank = 0;
+  unsigned newChanged = 0;
+  for (auto i = ccds.cbegin(); i != ccds.end(); ++i, ++rank)
+    {
+      const simAstrom::Gtransfo &t = spm.GetTransfo(**i);
+      bool same = true;
+      for (int k=0; k < t.Npar(); ++k) same = same && (t.ParamRef(k) == params[rank][k]);
+      if (rank < firstNew) BOOST_CHECK(same);
+      else if (!same) newChanged++;
+    }
+  BOOST_CHECK_EQUAL(newChanged, nChips);
+  for (auto f = heldFixed.cbegin(); f != heldFixed.end(); ++f)
+    {
+      BOOST_CHECK_EQUAL((*f)->x, positions[*f].x);
+      BOOST_CHECK_EQUAL((*f)->y, positions[*f].y);
+    }
+}
+
+/* Mapping::TransformPosAndErrorsBatch and
+   ComputeTransformAndDerivativesBatch should give what the per-point
+   routines give, for SimplePolyMapping and TwoTransfoMapping, with
+   errors propagated by the fitted transfos or frozen ones. */
+BOOST_AUTO_TEST_CASE(test_mapping_batches)
+{
+  std::mt19937 rng(2468);
+  std::uniform_real_distribution<double> u(0,1);
+  simAstrom::FatPointArrays in;
+  in.resize(200);
+  for (size_t k=0; k < in.size(); ++k)
+    {
+      in.x[k] = 2000*u(rng); in.y[k] = 4000*u(rng);
+      in.vx[k] = 1e-4*(1+u(rng)); in.vy[k] = 1e-4*(1+u(rng));
+      in.vxy[k] = 0.5e-4*(u(rng)-0.5);
+    }
+  // not diagonal, so that the errors are mixed as well
+  simAstrom::GtransfoLin centerAndScale(-1, -1, 1e-3, 1e-5, -2e-5, 5e-4);
+
+  for (unsigned frozen=0; frozen < 2; ++frozen)
+    {
+      BOOST_TEST_MESSAGE("frozen error scales : " << frozen);
+      simAstrom::SimplePolyMapping poly(centerAndScale, some_poly(3, rng));
+      simAstrom::SimplePolyMapping chip(centerAndScale, some_poly(2, rng));
+      simAstrom::SimpleGtransfoMapping shoot(some_poly(3, rng));
+      simAstrom::TwoTransfoMapping two(&chip, &shoot);
+      if (frozen)
+	{
+	  poly.FreezeErrorScales();
+	  chip.FreezeErrorScales();
+	  shoot.FreezeErrorScales();
+	  // the fitted transfos move away from the frozen ones
+	  std::vector<double> delta(std::max(poly.Npar(), shoot.Npar()));
+	  for (size_t k=0; k < delta.size(); ++k) delta[k] = 1e-3*(u(rng)-0.5);
+	  poly.OffsetParams(&delta[0]);
+	  chip.OffsetParams(&delta[0]);
+	  shoot.OffsetParams(&delta[0]);
+	}
+      check_mapping_batch(poly, in);
+      check_mapping_batch(shoot, in);
+      check_mapping_batch(two, in);
+      // only the first transfo fitted
+      simAstrom::SimpleGtransfoMapping fixedShoot(shoot.Transfo(), false);
+      if (frozen) fixedShoot.FreezeErrorScales();
+      simAstrom::TwoTransfoMapping twoFixed(&chip, &fixedShoot);
+      BOOST_CHECK_EQUAL(twoFixed.Npar(), chip.Npar());
+      check_mapping_batch(twoFixed, in);
+    }
+}
+
+/* PhotomFit::Minimize discards outliers by downdating the
+   factorization. For a linear problem ("Model" or "Fluxes" alone),
+   this should give the parameters of a fit that starts over with the
+   same outliers discarded and factorizes from scratch, which then
+   finds no further outliers. */
+BOOST_AUTO_TEST_CASE(test_photom_outlier_downdates)
+{
+  const unsigned nChips = 4;
+  SimulatedTractFile file(SimulatedTract(3, nChips), "photomdowndates");
+  const std::string whatToFits[] = {"Model", "Fluxes"};
+  std::vector<std::string> names = simAstrom::SparseSolverNames();
+  for (auto name = names.cbegin(); name != names.end(); ++name)
+    for (unsigned w=0; w < 2; ++w)
+      {
+	const std::string &whatToFit = whatToFits[w];
+	BOOST_TEST_MESSAGE(*name << " : " << whatToFit);
+	// with downdates
+	simAstrom::Associations assoc;
+	SimulatedTract::Load(assoc, file.name);
+	measure_fluxes(assoc, nChips);
+	simAstrom::SimplePhotomModel model(assoc.TheCcdImageList());
+	simAstrom::PhotomFit fit(assoc, &model, 0);
+	fit.SetSolver(*name);
+	BOOST_CHECK_EQUAL(fit.MinimizeWithStatus(whatToFit, 5), 0u);
+	std::vector<bool> flags = valid_flags(assoc);
+	unsigned nOutliers = std::count(flags.begin(), flags.end(), false);
+	BOOST_CHECK(nOutliers > 0);
+
+	// the same outliers discarded upfront
+	simAstrom::Associations refAssoc;
+	SimulatedTract::Load(refAssoc, file.name);
+	measure_fluxes(refAssoc, nChips);
+	unsigned k = 0;
+	const simAstrom::CcdImageList &ccds = refAssoc.TheCcdImageList();
+	for (auto im = ccds.cbegin(); im != ccds.end(); ++im)
+	  {
+	    const simAstrom::MeasuredStarList &catalog = (*im)->CatalogForFit();
+	    for (auto i = catalog.cbegin(); i != catalog.end(); ++i, ++k)
+	      if (!flags[k])
+		{
+		  (*i)->SetValid(false);
+		  const_cast<simAstrom::FittedStar *>((*i)->GetFittedStar())->MeasurementCount()--;
+		}
+	  }
+	simAstrom::SimplePhotomModel refModel(refAssoc.TheCcdImageList());
+	simAstrom::PhotomFit refFit(refAssoc, &refModel, 0);
+	refFit.SetSolver(*name);
+	BOOST_CHECK(refFit.Minimize(whatToFit, 5));
+
+	BOOST_CHECK(valid_flags(refAssoc) == flags);
+	Eigen::VectorXd factors = photom_factors(assoc, model);
+	Eigen::VectorXd refFactors = photom_factors(refAssoc, refModel);
+	Eigen::VectorXd fluxes = fitted_fluxes(assoc);
+	Eigen::VectorXd refFluxes = fitted_fluxes(refAssoc);
+	BOOST_TEST_MESSAGE(nOutliers << " outliers, relative differences "
+			   << (factors-refFactors).norm()/refFactors.norm() << ' '
+			   << (fluxes-refFluxes).norm()/refFluxes.norm());
+	BOOST_CHECK((factors-refFactors).norm() <= 1e-8*refFactors.norm());
+	BOOST_CHECK((fluxes-refFluxes).norm() <= 1e-8*refFluxes.norm());
+      }
+}
+
+/* pcg reads both triangles of H when the fits provide them (which
+   lets Eigen spread its products over threads), and only the lower one
+   for the reduced matrix of SchurSolver: both should find the same
+   solution, whatever the number of threads. */
+BOOST_AUTO_TEST_CASE(test_pcg_storage)
+{
+  const unsigned n = 500;
+  std::mt19937 rng(1357);
+  std::uniform_real_distribution<double> u(0,1);
+  simAstrom::TripletList tList(6*n);
+  for (unsigned k=0; k < 6*n; ++k) tList.AddTriplet(unsigned(n*u(rng)), k/6, u(rng)-0.5);
+  tList.SetNextFreeIndex(n);
+  SpMat jac = jacobian_of(tList, n);
+  SpMat identity(n,n);
+  identity.setIdentity();
+  SpMat hessian = jac*jac.transpose()+identity;
+  hessian.makeCompressed();
+  SpMat lower = hessian.triangularView<Eigen::Lower>();
+  lower.makeCompressed();
+  Eigen::VectorXd b = Eigen::VectorXd::Random(n);
+
+  std::unique_ptr<simAstrom::SparseSolver> lowerPcg = simAstrom::MakeSparseSolver("pcg", true);
+  lowerPcg->Analyze(lower);
+  BOOST_REQUIRE(lowerPcg->Factorize(lower));
+  Eigen::VectorXd xLower = lowerPcg->Solve(b);
+  BOOST_REQUIRE(lowerPcg->Converged());
+  BOOST_CHECK((hessian*xLower-b).norm() <= 1e-8*b.norm());
+
+  const unsigned nThreads[] = {1, 4};
+  for (unsigned k=0; k < 2; ++k)
+    {
+      std::unique_ptr<simAstrom::SparseSolver> pcg = simAstrom::MakeSparseSolver("pcg");
+      pcg->SetNThreads(nThreads[k]);
+      pcg->Analyze(hessian);
+      BOOST_REQUIRE(pcg->Factorize(hessian));
+      Eigen::VectorXd x = pcg->Solve(b);
+      BOOST_REQUIRE(pcg->Converged());
+      BOOST_CHECK((x-xLower).norm() <= 1e-8*xLower.norm());
+    }
+}
+
+/* When the solver does not converge (here pcg with a single
+   iteration), Minimize should report it (code 2) and leave the
+   parameters as they were, for both fits, with or without outlier
+   rejection, and with positions eliminated or not. With a direct
+   solver, the same fits move the parameters. */
+BOOST_AUTO_TEST_CASE(test_pcg_not_converged)
+{
+  const unsigned nChips = 4;
+  SimulatedTractFile file(SimulatedTract(3, nChips), "pcgfailure");
+  for (unsigned eliminate=0; eliminate < 2; ++eliminate)
+    for (unsigned rejection=0; rejection < 2; ++rejection)
+      {
+	BOOST_TEST_MESSAGE("eliminate " << eliminate << " rejection " << rejection);
+	simAstrom::Associations assoc;
+	SimulatedTract::Load(assoc, file.name);
+	simAstrom::OneTPPerShoot sky2TP(assoc.TheCcdImageList());
+	simAstrom::SimplePolyModel spm(assoc.TheCcdImageList(), &sky2TP, true, 0, 3);
+	simAstrom::AstromFit fit(assoc, &spm, 0.02);
+	fit.SetEliminatePositions(eliminate);
+	fit.SetSolver("pcg", 1);
+	std::vector<double> before = astrom_params(assoc, spm);
+	BOOST_CHECK_EQUAL(fit.Minimize("Distortions Positions", rejection ? 5 : 0), 2u);
+	BOOST_CHECK(astrom_params(assoc, spm) == before);
+
+	fit.SetSolver(simAstrom::SparseSolverNames().front());
+	BOOST_CHECK(fit.Minimize("Distortions Positions", rejection ? 5 : 0) != 2);
+	BOOST_CHECK(astrom_params(assoc, spm) != before);
+      }
+
+  for (unsigned rejection=0; rejection < 2; ++rejection)
+    {
+      simAstrom::Associations assoc;
+      SimulatedTract::Load(assoc, file.name);
+      measure_fluxes(assoc, nChips);
+      simAstrom::SimplePhotomModel model(assoc.TheCcdImageList());
+      simAstrom::PhotomFit fit(assoc, &model, 0);
+      fit.SetSolver("pcg", 1);
+      Eigen::VectorXd factors = photom_factors(assoc, model);
+      Eigen::VectorXd fluxes = fitted_fluxes(assoc);
+      BOOST_CHECK_EQUAL(fit.MinimizeWithStatus("Model Fluxes", rejection ? 5 : 0), 2u);
+      BOOST_CHECK(!fit.Minimize("Model Fluxes", rejection ? 5 : 0));
+      BOOST_CHECK(photom_factors(assoc, model) == factors);
+      BOOST_CHECK(fitted_fluxes(assoc) == fluxes);
+
+      fit.SetSolver(simAstrom::SparseSolverNames().front());
+      BOOST_CHECK(fit.Minimize("Model Fluxes", rejection ? 5 : 0));
+      BOOST_CHECK(fitted_fluxes(assoc) != fluxes);
+    }
+}
+
+/* The symbolic analysis of the Hessian is reused by consecutive
+   Minimize calls, with or without outlier removal, as long as the
+   parameter layout is the same and the Hessian pattern does not grow.
+   Restoring a discarded measurement grows it, and SetSolver,
+   SetEliminatePositions and RestrictToNewCcdImages drop the analysis
+   (AstromFit), as SetSolver does for PhotomFit. */
+BOOST_AUTO_TEST_CASE(test_analysis_reuse)
+{
+  const unsigned nChips = 4;
+  SimulatedTractFile file(SimulatedTract(3, nChips), "analysisreuse");
+  const std::string solver = simAstrom::SparseSolverNames().front();
+  for (unsigned eliminate=0; eliminate < 2; ++eliminate)
+    {
+      BOOST_TEST_MESSAGE("eliminate " << eliminate);
+      simAstrom::Associations assoc;
+      SimulatedTract::Load(assoc, file.name);
+      simAstrom::OneTPPerShoot sky2TP(assoc.TheCcdImageList());
+      simAstrom::SimplePolyModel spm(assoc.TheCcdImageList(), &sky2TP, true, 0, 3);
+      simAstrom::AstromFit fit(assoc, &spm, 0.02);
+      fit.SetEliminatePositions(eliminate);
+      fit.SetSolver(solver);
+      simAstrom::MeasuredStar &discarded = some_measurement(assoc);
+      set_valid(discarded, false);
+
+      BOOST_CHECK(fit.Minimize("Distortions Positions") != 2);
+      BOOST_CHECK_EQUAL(fit.NAnalyses(), 1u);
+      BOOST_CHECK(fit.Minimize("Distortions Positions") != 2);
+      BOOST_CHECK_EQUAL(fit.NAnalyses(), 1u);
+      BOOST_CHECK(fit.Minimize("Distortions Positions", 5) != 2);
+      BOOST_CHECK(fit.Minimize("Distortions Positions", 5) != 2);
+      BOOST_CHECK_EQUAL(fit.NAnalyses(), 1u);
+      // the pattern grows
+      set_valid(discarded, true);
+      BOOST_CHECK(fit.Minimize("Distortions Positions") != 2);
+      BOOST_CHECK_EQUAL(fit.NAnalyses(), 2u);
+      // the analysis is dropped
+      fit.SetSolver(solver);
+      BOOST_CHECK(fit.Minimize("Distortions Positions") != 2);
+      BOOST_CHECK_EQUAL(fit.NAnalyses(), 3u);
+      fit.SetEliminatePositions(eliminate);
+      BOOST_CHECK(fit.Minimize("Distortions Positions") != 2);
+      BOOST_CHECK_EQUAL(fit.NAnalyses(), 4u);
+      fit.RestrictToNewCcdImages(0);
+      BOOST_CHECK(fit.Minimize("Distortions Positions") != 2);
+      BOOST_CHECK_EQUAL(fit.NAnalyses(), 5u);
+      // another layout
+      BOOST_CHECK(fit.Minimize("Distortions") != 2);
+      BOOST_CHECK_EQUAL(fit.NAnalyses(), 6u);
+    }
+
+  simAstrom::Associations assoc;
+  SimulatedTract::Load(assoc, file.name);
+  measure_fluxes(assoc, nChips);
+  simAstrom::SimplePhotomModel model(assoc.TheCcdImageList());
+  simAstrom::PhotomFit fit(assoc, &model, 0);
+  fit.SetSolver(solver);
+  simAstrom::MeasuredStar &discarded = some_measurement(assoc);
+  set_valid(discarded, false);
+  BOOST_CHECK(fit.MinimizeWithStatus("Model Fluxes") != 2);
+  BOOST_CHECK(fit.MinimizeWithStatus("Model Fluxes") != 2);
+  BOOST_CHECK_EQUAL(fit.NAnalyses(), 1u);
+  BOOST_CHECK(fit.MinimizeWithStatus("Model Fluxes", 5) != 2);
+  BOOST_CHECK(fit.MinimizeWithStatus("Model Fluxes", 5) != 2);
+  BOOST_CHECK_EQUAL(fit.NAnalyses(), 1u);
+  set_valid(discarded, true);
+  BOOST_CHECK(fit.MinimizeWithStatus("Model Fluxes") != 2);
+  BOOST_CHECK_EQUAL(fit.NAnalyses(), 2u);
+  fit.SetSolver(solver);
+  BOOST_CHECK(fit.MinimizeWithStatus("Model Fluxes") != 2);
+  BOOST_CHECK_EQUAL(fit.NAnalyses(), 3u);
+  BOOST_CHECK(fit.MinimizeWithStatus("Fluxes") != 2);
+  BOOST_CHECK_EQUAL(fit.NAnalyses(), 4u);
+}
+
+/* PhotomFit::MinimizeToConvergence fits the (bilinear) "Model Fluxes"
+   problem: it should find the zero points of the visits, discard the
+   outliers, and leave nothing for a further step to improve. */
+BOOST_AUTO_TEST_CASE(test_photom_convergence)
+{
+  const unsigned nChips = 4;
+  SimulatedTractFile file(SimulatedTract(3, nChips), "photomconvergence");
+  simAstrom::Associations assoc;
+  SimulatedTract::Load(assoc, file.name);
+  measure_fluxes(assoc, nChips);
+  simAstrom::SimplePhotomModel model(assoc.TheCcdImageList());
+  simAstrom::PhotomFit fit(assoc, &model, 0);
+  fit.SetSolver(simAstrom::SparseSolverNames().front());
+  const double relTolerance = 1e-6;
+
+  BOOST_CHECK_EQUAL(fit.MinimizeToConvergence("Model Fluxes", 5, 20, relTolerance), 0u);
+  std::vector<bool> flags = valid_flags(assoc);
+  BOOST_CHECK(std::count(flags.begin(), flags.end(), false) > 0);
+  simAstrom::Chi2 chi2 = fit.ComputeChi2();
+  BOOST_TEST_MESSAGE("chi2/ndof " << chi2.chi2/chi2.ndof);
+  BOOST_CHECK(chi2.chi2 < 1.5*chi2.ndof);
+
+  // the first visit is the reference: the factors are the zero point ratios
+  unsigned rank = 0;
+  const simAstrom::CcdImageList &ccds = assoc.TheCcdImageList();
+  for (auto im = ccds.cbegin(); im != ccds.end(); ++im, ++rank)
+    BOOST_CHECK_CLOSE(model.PhotomFactor(**im, simAstrom::Point(0,0)), 1+0.02*(rank/nChips), 0.5);
+
+  // converged : another step does not change anything significant
+  BOOST_CHECK(fit.Minimize("Model Fluxes", 5));
+  BOOST_CHECK(valid_flags(assoc) == flags);
+  BOOST_CHECK(fit.ComputeChi2().chi2 >= (1-10*relTolerance)*chi2.chi2);
+}
+
+BOOST_AUTO_TEST_SUITE_END()
@@ -0,0 +1,145 @@
+#define BOOST_TEST_DYN_LINK
+
+#define BOOST_TEST_MODULE test_listmatch
+
+//The boost unit test header
+#include "boost/test/unit_test.hpp"
+
+#include <cmath>
+#include <memory>
+#include <random>
+
+#include "lsst/meas/simastrom/BaseStar.h"
+#include "lsst/meas/simastrom/ListMatch.h"
+#include "lsst/meas/simastrom/StarMatch.h"
+#include "lsst/meas/simastrom/Gtransfo.h"
+
+namespace simAstrom = lsst::meas::simastrom;
+
+/* L2 is L1 transformed by Truth, with position and flux noise. About
+   Missing of the objects are missing from each list. */
+static void simulate_lists(const simAstrom::GtransfoLin &Truth, const unsigned NObjects,
+			   const double Side, const double Missing, std::mt19937 &Rng,
+			   simAstrom::BaseStarList &L1, simAstrom::BaseStarList &L2)
+{
+  std::uniform_real_distribution<double> u(0,1);
+  std::normal_distribution<double> g(0,1);
+  for (unsigned k=0; k < NObjects; ++k)
+    {
+      simAstrom::Point p(Side*u(Rng), Side*u(Rng));
+      double flux = exp(5*u(Rng));
+      if (u(Rng) > Missing) L1.push_back(new simAstrom::BaseStar(p.x, p.y, flux));
+      if (u(Rng) > Missing)
+	{
+	  simAstrom::Point q = Truth.apply(p);
+	  L2.push_back(new simAstrom::BaseStar(q.x+0.1*g(Rng), q.y+0.1*g(Rng), flux*(1+0.1*g(Rng))));
+	}
+    }
+}
+
+//! a rotation by Angle, scaling by Scale, flip of y if Flip, and shift.
+static simAstrom::GtransfoLin some_transfo(const double Dx, const double Dy, const double Angle,
+					   const double Scale, const bool Flip)
+{
+  const double f = Flip ? -1 : 1;
+  return simAstrom::GtransfoLin(Dx, Dy,
+				Scale*cos(Angle), -f*Scale*sin(Angle),
+				Scale*sin(Angle), f*Scale*cos(Angle));
+}
+
+/* Checks that Match recovers Truth: its transformation maps the L1
+   objects within 1 pixel of where Truth sends them, and its pairs are
+   actual counterparts. */
+static void check_solution(const simAstrom::StarMatchList *Match, const simAstrom::GtransfoLin &Truth,
+			   const simAstrom::BaseStarList &L1)
+{
+  BOOST_REQUIRE(Match);
+  BOOST_REQUIRE(Match->Transfo());
+  unsigned nFar = 0;
+  for (auto s = L1.cbegin(); s != L1.end(); ++s)
+    if (Match->Transfo()->apply(**s).Distance(Truth.apply(**s)) >= 1.) nFar++;
+  BOOST_CHECK_EQUAL(nFar, 0u);
+  BOOST_CHECK(Match->size() >= std::min<size_t>(10, L1.size()-1));
+  unsigned nWrong = 0;
+  for (auto m = Match->cbegin(); m != Match->end(); ++m)
+    if (Truth.apply(m->point1).Distance(m->point2) >= 1.) nWrong++;
+  BOOST_CHECK_EQUAL(nWrong, 0u);
+}
+
+static simAstrom::MatchConditions triangle_conditions()
+{
+  simAstrom::MatchConditions conditions;
+  conditions.Algorithm = 3;
+  return conditions;
+}
+
+BOOST_AUTO_TEST_SUITE(test_triangle_matching)
+
+/* The triangle search (MatchConditions::Algorithm 3) recovers
+   shifted, rotated, rescaled and flipped lists, with 10% of the
+   objects missing from each list. */
+BOOST_AUTO_TEST_CASE(test_recover_transfo)
+{
+  std::mt19937 rng(24680);
+  std::uniform_real_distribution<double> u(0,1);
+  const double side = 2000;
+  for (unsigned trial=0; trial < 8; ++trial)
+    {
+      const bool flip = (trial%2 == 1);
+      const double angle = 2*M_PI*u(rng);
+      const double scale = 1+0.1*(u(rng)-0.5);
+      simAstrom::GtransfoLin truth = some_transfo(side*u(rng), side*u(rng), angle, scale, flip);
+      BOOST_TEST_MESSAGE("trial " << trial << " flip " << flip << " angle " << angle << " scale " << scale);
+      simAstrom::BaseStarList l1, l2;
+      simulate_lists(truth, 500, side, 0.1, rng, l1, l2);
+
+      std::unique_ptr<simAstrom::StarMatchList> match(simAstrom::MatchSearchRotShiftFlip(l1, l2, triangle_conditions()));
+      check_solution(match.get(), truth, l1);
+      if (!flip)
+	{
+	  match.reset(simAstrom::MatchSearchRotShift(l1, l2, triangle_conditions()));
+	  check_solution(match.get(), truth, l1);
+	}
+    }
+}
+
+/* Lists of 4 objects or less cannot be matched with triangles. */
+BOOST_AUTO_TEST_CASE(test_short_lists)
+{
+  std::mt19937 rng(1234);
+  simAstrom::GtransfoLin truth = some_transfo(10, 20, 0.3, 1, false);
+  simAstrom::BaseStarList l1, l2;
+  simulate_lists(truth, 200, 1000, 0, rng, l1, l2);
+  simAstrom::BaseStarList short1, short2;
+  for (auto s = l1.cbegin(); s != l1.end() && short1.size() < 4; ++s)
+    short1.push_back(new simAstrom::BaseStar(**s));
+  for (auto s = l2.cbegin(); s != l2.end() && short2.size() < 4; ++s)
+    short2.push_back(new simAstrom::BaseStar(**s));
+  BOOST_CHECK(!simAstrom::MatchSearchRotShift(short1, l2, triangle_conditions()));
+  BOOST_CHECK(!simAstrom::MatchSearchRotShift(l1, short2, triangle_conditions()));
+  // the full lists do match
+  std::unique_ptr<simAstrom::StarMatchList> match(simAstrom::MatchSearchRotShift(l1, l2, triangle_conditions()));
+  check_solution(match.get(), truth, l1);
+}
+
+/* A scale ratio outside of the allowed range (MatchConditions::SizeRatio
+   and DeltaSizeRatio) leaves no candidate triangle pair. The lists are
+   short, so that no pair of triangles gets there by chance: a single
+   one would already provide a (wrong) solution. */
+BOOST_AUTO_TEST_CASE(test_no_solution)
+{
+  std::mt19937 rng(5678);
+  simAstrom::GtransfoLin truth = some_transfo(100, -50, 1., 10., false);
+  simAstrom::BaseStarList l1, l2;
+  simulate_lists(truth, 15, 1000, 0, rng, l1, l2);
+  simAstrom::MatchConditions conditions = triangle_conditions();
+  BOOST_CHECK(!simAstrom::MatchSearchRotShift(l1, l2, conditions));
+  BOOST_CHECK(!simAstrom::MatchSearchRotShiftFlip(l1, l2, conditions));
+  // with the right scale, it is found
+  conditions.SizeRatio = 10;
+  conditions.DeltaSizeRatio = 1;
+  std::unique_ptr<simAstrom::StarMatchList> match(simAstrom::MatchSearchRotShift(l1, l2, conditions));
+  check_solution(match.get(), truth, l1);
+}
+
+BOOST_AUTO_TEST_SUITE_END()
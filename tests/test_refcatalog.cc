@@ -0,0 +1,242 @@
+#define BOOST_TEST_DYN_LINK
+
+#define BOOST_TEST_MODULE test_refcatalog
+
+//The boost unit test header
+#include "boost/test/unit_test.hpp"
+
+#include <cmath>
+#include <cstdio>
+#include <algorithm>
+#include <fstream>
+#include <iterator>
+#include <map>
+#include <random>
+#include <string>
+#include <vector>
+
+#include "lsst/meas/simastrom/RefCatalog.h"
+#include "lsst/meas/simastrom/BaseStar.h"
+#include "lsst/meas/simastrom/Frame.h"
+#include "lsst/pex/exceptions.h"
+
+namespace simAstrom = lsst::meas::simastrom;
+
+static const double deg = M_PI/180.;
+
+static double angular_distance(const double Ra1, const double Dec1, const double Ra2, const double Dec2)
+{
+  double c = sin(Dec1*deg)*sin(Dec2*deg)+cos(Dec1*deg)*cos(Dec2*deg)*cos((Ra1-Ra2)*deg);
+  return acos(std::max(-1., std::min(1., c)))/deg;
+}
+
+//! the stars of a catalog, as they were added (RA in [0,360)).
+struct TestCatalog
+{
+  std::vector<simAstrom::RefCatRecord> stars;
+
+  /* uniform over the sphere, with denser spots where the queries are
+     done: across RA=0 and around the poles. Some stars have no R
+     magnitude. */
+  TestCatalog(const unsigned N, const unsigned Seed)
+  {
+    std::mt19937 rng(Seed);
+    std::uniform_real_distribution<double> u(0,1);
+    for (unsigned k=0; k < N; ++k)
+      {
+	simAstrom::RefCatRecord r;
+	double dec = asin(2*u(rng)-1)/deg;
+	double ra = 360*u(rng);
+	switch (k%4)
+	  {
+	  case 1 : ra = 10*(u(rng)-0.5); dec = 20*(u(rng)-0.5); break;
+	  case 2 : dec = 85+5*u(rng); break;
+	  case 3 : dec = -85-5*u(rng); break;
+	  }
+	r.ra = ra; r.dec = dec;
+	r.magR = (k%7 == 0) ? 99.9 : 10+10*u(rng);
+	r.magB = 10+10*u(rng);
+	r.sigRa = 0.1+u(rng); r.sigDec = 0.1+u(rng);
+	stars.push_back(r);
+      }
+  }
+
+  void Write(const std::string &FileName, const double ZoneHeight) const
+  {
+    simAstrom::RefCatalogBuilder builder;
+    for (auto s = stars.cbegin(); s != stars.end(); ++s)
+      builder.Add(s->ra, s->dec, s->magR, s->magB, s->sigRa, s->sigDec);
+    BOOST_REQUIRE_EQUAL(builder.size(), stars.size());
+    builder.Write(FileName, ZoneHeight);
+  }
+
+  //! the stars (by Dec, which is unique) with an R magnitude, selected by Cut(ra, dec).
+  template <class Selector> std::map<double, double> Select(const Selector &Cut) const
+  {
+    std::map<double, double> selected;
+    for (auto s = stars.cbegin(); s != stars.end(); ++s)
+      {
+	double ra = fmod(s->ra+360., 360.);
+	if (s->magR < 99.9 && Cut(ra, s->dec)) selected[s->dec] = ra;
+      }
+    return selected;
+  }
+};
+
+/* Compares what a query returned with the brute-force selection:
+   same stars, same positions (RA modulo 360). */
+static void check_selection(const simAstrom::BaseStarList &Returned,
+			    const std::map<double, double> &Expected)
+{
+  std::map<double, double> returned;
+  for (auto s = Returned.cbegin(); s != Returned.end(); ++s)
+    {
+      BOOST_CHECK(returned.count((*s)->y) == 0); // no duplicates
+      returned[(*s)->y] = fmod((*s)->x+360., 360.);
+    }
+  BOOST_CHECK_EQUAL(returned.size(), Expected.size());
+  unsigned nBad = 0;
+  for (auto e = Expected.cbegin(); e != Expected.end(); ++e)
+    {
+      auto r = returned.find(e->first);
+      if (r == returned.end() || fabs(r->second-e->second) > 1e-9) nBad++;
+    }
+  BOOST_CHECK_EQUAL(nBad, 0u);
+}
+
+BOOST_AUTO_TEST_SUITE(test_refcatalogs)
+
+/* What RefCatalogBuilder::Write writes, MappedRefCatalog reads back:
+   all stars, with their magnitudes and errors. */
+BOOST_AUTO_TEST_CASE(test_round_trip)
+{
+  const std::string name("refcatalog_roundtrip.cat");
+  TestCatalog catalog(5000, 123);
+  // a negative RA, and one that rounds to 360
+  catalog.stars.front().ra = -10;
+  catalog.stars.back().ra = -1e-20;
+  catalog.Write(name, 0.25);
+
+  simAstrom::MappedRefCatalog mapped(name);
+  BOOST_CHECK_EQUAL(mapped.size(), catalog.stars.size());
+  simAstrom::BaseStarList all;
+  BOOST_CHECK_EQUAL(mapped.Read(simAstrom::Frame(0, -90, 360, 90), simAstrom::BColor, all),
+		    catalog.stars.size());
+  std::map<double, const simAstrom::RefCatRecord *> byDec;
+  for (auto s = catalog.stars.cbegin(); s != catalog.stars.end(); ++s) byDec[s->dec] = &*s;
+  unsigned nBad = 0;
+  for (auto s = all.cbegin(); s != all.end(); ++s)
+    {
+      const simAstrom::BaseStar &star = **s;
+      const simAstrom::RefCatRecord &r = *byDec.at(star.y);
+      double ra = fmod(r.ra+360., 360.);
+      if (ra >= 360.) ra = 0;
+      bool ok = (star.x >= 0 && star.x < 360. && fabs(star.x-ra) < 1e-12);
+      ok = ok && (star.flux == double(float(r.magB)));
+      ok = ok && fabs(star.vx-pow(float(r.sigRa)/3600/cos(r.dec*deg), 2)) <= 1e-6*star.vx;
+      ok = ok && fabs(star.vy-pow(float(r.sigDec)/3600, 2)) <= 1e-6*star.vy;
+      if (!ok) nBad++;
+    }
+  BOOST_CHECK_EQUAL(nBad, 0u);
+  // stars without an R magnitude are not returned in R
+  simAstrom::BaseStarList allR;
+  mapped.Read(simAstrom::Frame(0, -90, 360, 90), simAstrom::RColor, allR);
+  check_selection(allR, catalog.Select([](double, double) { return true;}));
+  remove(name.c_str());
+}
+
+/* Frame and cone queries against a brute-force selection, across
+   RA=0 (from either side) and close to or around the poles, with
+   several zone heights. */
+BOOST_AUTO_TEST_CASE(test_queries)
+{
+  const std::string name("refcatalog_queries.cat");
+  TestCatalog catalog(20000, 456);
+  const double zoneHeights[] = {0.25, 1, 7};
+  for (unsigned z=0; z < 3; ++z)
+    {
+      BOOST_TEST_MESSAGE("zone height " << zoneHeights[z]);
+      catalog.Write(name, zoneHeights[z]);
+      simAstrom::MappedRefCatalog mapped(name);
+
+      const simAstrom::Frame frames[] = {
+	simAstrom::Frame(-3, -4, 2.5, 3),     // across RA=0, from below
+	simAstrom::Frame(357, -4, 362.5, 3),  // across RA=0, from above
+	simAstrom::Frame(0, 1, 4, 3),         // starting at RA=0
+	simAstrom::Frame(100, 86, 180, 95),   // up to (and beyond) the north pole
+	simAstrom::Frame(-200, -91, 170, -87) // all RA's around the south pole
+      };
+      for (unsigned f=0; f < 5; ++f)
+	{
+	  const simAstrom::Frame &F = frames[f];
+	  simAstrom::BaseStarList found;
+	  unsigned n = mapped.Read(F, simAstrom::RColor, found);
+	  BOOST_CHECK_EQUAL(n, found.size());
+	  // RA's are returned in the frame coordinates, or in [0,360] for all RA's
+	  const bool allRa = (F.xMax-F.xMin >= 360);
+	  unsigned nOut = 0;
+	  for (auto s = found.cbegin(); s != found.end(); ++s)
+	    if (allRa ? ((*s)->x < 0 || (*s)->x > 360) : ((*s)->x < F.xMin || (*s)->x > F.xMax)) nOut++;
+	  BOOST_CHECK_EQUAL(nOut, 0u);
+	  check_selection(found, catalog.Select([&](double Ra, double Dec)
+			  {
+			    if (Dec < F.yMin || Dec > F.yMax) return false;
+			    if (allRa) return true;
+			    for (int turn = -1; turn <= 1; ++turn)
+			      if (Ra+360*turn >= F.xMin && Ra+360*turn <= F.xMax) return true;
+			    return false;
+			  }));
+	  BOOST_CHECK(found.size() > 0);
+	}
+
+      const double cones[][3] = {
+	{0.5, 1, 2},     // across RA=0
+	{359, -2, 3},    // across RA=0, the other way
+	{40, 87.5, 1.5}, // close to the north pole
+	{200, 89, 2},    // around the north pole
+	{10, -89.5, 3}   // around the south pole
+      };
+      for (unsigned c=0; c < 5; ++c)
+	{
+	  const double ra = cones[c][0], dec = cones[c][1], radius = cones[c][2];
+	  simAstrom::BaseStarList found;
+	  unsigned n = mapped.ReadCone(ra, dec, radius, simAstrom::RColor, found);
+	  BOOST_CHECK_EQUAL(n, found.size());
+	  check_selection(found, catalog.Select([&](double Ra, double Dec)
+			  { return angular_distance(Ra, Dec, ra, dec) <= radius;}));
+	  BOOST_CHECK(found.size() > 0);
+	}
+    }
+  remove(name.c_str());
+}
+
+/* Files that are not reference catalogs, or truncated ones, are rejected. */
+BOOST_AUTO_TEST_CASE(test_bad_files)
+{
+  const std::string name("refcatalog_bad.cat");
+  BOOST_CHECK_THROW(simAstrom::MappedRefCatalog("refcatalog_missing.cat"),
+		    lsst::pex::exceptions::InvalidParameterError);
+  {
+    std::ofstream f(name.c_str());
+    f << "this is not a reference catalog, but it is long enough for a header";
+  }
+  BOOST_CHECK_THROW(simAstrom::MappedRefCatalog(name.c_str()),
+		    lsst::pex::exceptions::InvalidParameterError);
+  TestCatalog(100, 789).Write(name, 1);
+  std::string content;
+  {
+    std::ifstream f(name.c_str(), std::ios::binary);
+    content.assign(std::istreambuf_iterator<char>(f), std::istreambuf_iterator<char>());
+  }
+  {
+    std::ofstream f(name.c_str(), std::ios::binary | std::ios::trunc);
+    f.write(content.data(), content.size()-1);
+  }
+  BOOST_CHECK_THROW(simAstrom::MappedRefCatalog(name.c_str()),
+		    lsst::pex::exceptions::InvalidParameterError);
+  BOOST_CHECK_THROW(simAstrom::RefCatalogBuilder().Write(name, 0),
+		    lsst::pex::exceptions::InvalidParameterError);
+  remove(name.c_str());
+}
+
+BOOST_AUTO_TEST_SUITE_END()
@@ -0,0 +1,168 @@
+#define BOOST_TEST_DYN_LINK
+
+#define BOOST_TEST_MODULE test_residuals
+
+//The boost unit test header
+#include "boost/test/unit_test.hpp"
+
+#include <cstdio>
+#include <cstring>
+#include <fstream>
+#include <iterator>
+#include <sstream>
+#include <string>
+#include <stdint.h>
+
+#include "lsst/meas/simastrom/ResidualTable.h"
+
+namespace simAstrom = lsst::meas::simastrom;
+
+static simAstrom::ResidualColumnList some_columns()
+{
+  simAstrom::ResidualColumnList columns;
+  columns.push_back(simAstrom::ResidualColumn("id", true, "an integer"));
+  columns.push_back(simAstrom::ResidualColumn("x", false, "a float"));
+  columns.push_back(simAstrom::ResidualColumn("y", false, ""));
+  return columns;
+}
+
+static void some_row(const unsigned K, double *Values)
+{
+  Values[0] = 10*K; Values[1] = 0.5*K; Values[2] = -1./(K+1);
+}
+
+static std::string file_content(const std::string &FileName)
+{
+  std::ifstream f(FileName.c_str(), std::ios::binary);
+  return std::string(std::istreambuf_iterator<char>(f), std::istreambuf_iterator<char>());
+}
+
+/* Checks the .npy preamble and header of Content, for NRows rows of
+   the columns of some_columns(). Returns the offset of the data. */
+static size_t check_npy_header(const std::string &Content, const size_t NRows)
+{
+  BOOST_REQUIRE(Content.size() >= 10);
+  BOOST_CHECK_EQUAL(Content.substr(0,6), std::string("\x93NUMPY", 6));
+  BOOST_CHECK_EQUAL(Content[6], 1); // version 1.0
+  BOOST_CHECK_EQUAL(Content[7], 0);
+  size_t headerLength = (unsigned char)(Content[8]) + 256*(unsigned char)(Content[9]);
+  size_t dataStart = 10+headerLength;
+  BOOST_CHECK_EQUAL(dataStart % 64, 0u);
+  BOOST_REQUIRE(Content.size() >= dataStart);
+  std::string header = Content.substr(10, headerLength);
+  BOOST_CHECK_EQUAL(header[headerLength-1], '\n');
+  std::stringstream shape;
+  shape << "'shape': (" << NRows << ",)";
+  BOOST_CHECK(header.find(shape.str()) != std::string::npos);
+  const char endian = (*reinterpret_cast<const char *>(&dataStart) == char(dataStart & 0xFF)) ? '<' : '>';
+  const std::string descr = std::string("[('id', '") + endian + "i8'), ('x', '"
+    + endian + "f8'), ('y', '" + endian + "f8'), ]";
+  BOOST_CHECK(header.find("'descr': " + descr) != std::string::npos);
+  BOOST_CHECK(header.find("'fortran_order': False") != std::string::npos);
+  return dataStart;
+}
+
+//! Checks that the rows after DataStart are the ones of some_row.
+static void check_npy_rows(const std::string &Content, const size_t DataStart, const size_t NRows)
+{
+  const size_t rowSize = 3*8;
+  BOOST_REQUIRE_EQUAL(Content.size(), DataStart+NRows*rowSize);
+  unsigned nBad = 0;
+  for (size_t k=0; k < NRows; ++k)
+    {
+      double expected[3];
+      some_row(k, expected);
+      const char *p = Content.data()+DataStart+k*rowSize;
+      int64_t id;
+      double x, y;
+      memcpy(&id, p, 8); memcpy(&x, p+8, 8); memcpy(&y, p+16, 8);
+      if (id != int64_t(expected[0]) || x != expected[1] || y != expected[2]) nBad++;
+    }
+  BOOST_CHECK_EQUAL(nBad, 0u);
+}
+
+BOOST_AUTO_TEST_SUITE(test_residual_files)
+
+/* NpyRowWriter writes rows a chunk at a time, and rewrites the header
+   with the final row count when closing, without moving the data:
+   the header has the size it has for 0 rows. */
+BOOST_AUTO_TEST_CASE(test_npy_chunks)
+{
+  const std::string name("residuals_chunks.npy");
+  size_t emptyDataStart = 0;
+  const size_t nRows[] = {0, 1, 3, 10, 100000};
+  for (unsigned n=0; n < 5; ++n)
+    {
+      BOOST_TEST_MESSAGE(nRows[n] << " rows");
+      {
+	simAstrom::NpyRowWriter writer(name, some_columns(), 3);
+	double values[3];
+	for (size_t k=0; k < nRows[n]; ++k)
+	  {
+	    some_row(k, values);
+	    writer.AddRow(values);
+	  }
+	BOOST_CHECK_EQUAL(writer.NRows(), nRows[n]);
+	if (n%2) writer.Close(); // otherwise, the destructor does it
+      }
+      std::string content = file_content(name);
+      size_t dataStart = check_npy_header(content, nRows[n]);
+      if (n == 0) emptyDataStart = dataStart;
+      BOOST_CHECK_EQUAL(dataStart, emptyDataStart);
+      check_npy_rows(content, dataStart, nRows[n]);
+    }
+  remove(name.c_str());
+}
+
+/* ResidualTable::WriteNpy writes the same file as NpyRowWriter, and
+   integer columns are stored as int64, also for large values. */
+BOOST_AUTO_TEST_CASE(test_table_npy)
+{
+  const std::string name("residuals_table.npy");
+  simAstrom::ResidualTable table(some_columns());
+  double values[3];
+  const size_t nRows = 20;
+  for (size_t k=0; k < nRows; ++k)
+    {
+      some_row(k, values);
+      table.AddRow(values);
+    }
+  BOOST_CHECK_EQUAL(table.size(), nRows);
+  table.WriteNpy(name);
+  std::string content = file_content(name);
+  check_npy_rows(content, check_npy_header(content, nRows), nRows);
+
+  // 2^53 is exact as a double, and not as a float
+  simAstrom::ResidualTable big(some_columns());
+  values[0] = 9007199254740992.; values[1] = values[2] = 0;
+  big.AddRow(values);
+  big.WriteNpy(name);
+  content = file_content(name);
+  size_t dataStart = check_npy_header(content, 1);
+  int64_t id;
+  memcpy(&id, content.data()+dataStart, 8);
+  BOOST_CHECK_EQUAL(id, int64_t(9007199254740992LL));
+  remove(name.c_str());
+}
+
+/* AsciiRowWriter writes the integer columns without decimals (ids
+   of 1e9 and more would lose digits with the precision of floats), and
+   the other ones with 9 digits. */
+BOOST_AUTO_TEST_CASE(test_ascii_integers)
+{
+  const std::string name("residuals_ascii.list");
+  {
+    simAstrom::AsciiRowWriter writer(name, some_columns());
+    double values[3] = {1234567891., 0.5, 1./3.};
+    writer.AddRow(values);
+    values[0] = -7; values[1] = 1e10; values[2] = 0;
+    writer.AddRow(values);
+  }
+  std::string content = file_content(name);
+  BOOST_CHECK_EQUAL(content, "#id: an integer\n#x: a float\n#y: \n#end\n"
+		    "1234567891 0.5 0.333333333\n"
+		    "-7 1e+10 0\n");
+  remove(name.c_str());
+}
+
+BOOST_AUTO_TEST_SUITE_END()
@@ -0,0 +1,212 @@
+#define BOOST_TEST_DYN_LINK
+
+#define BOOST_TEST_MODULE test_starfinder
+
+//The boost unit test header
+#include "boost/test/unit_test.hpp"
+
+#include <random>
+#include <vector>
+
+#include "lsst/meas/simastrom/BaseStar.h"
+#include "lsst/meas/simastrom/StarFinder.h"
+#include "lsst/meas/simastrom/FastFinder.h"
+#include "lsst/meas/simastrom/KdTreeFinder.h"
+
+namespace simAstrom = lsst::meas::simastrom;
+
+// same expression as the finders, so that distances compare exactly
+static double dist2(const simAstrom::Point &Where, const simAstrom::BaseStar *S)
+{
+  return Where.Dist2(*S);
+}
+
+// objects with a negative flux are skipped
+static bool skip_negative(const simAstrom::BaseStar *S) { return S->flux < 0;}
+
+//! The two smallest distances (squared) below MaxDist, by brute force. -1 if there is none.
+static void brute_force(const simAstrom::BaseStarList &L, const simAstrom::Point &Where,
+			const double MaxDist, bool (*SkipIt)(const simAstrom::BaseStar *),
+			double &D1, double &D2)
+{
+  D1 = D2 = -1;
+  for (auto i = L.cbegin(); i != L.end(); ++i)
+    {
+      const simAstrom::BaseStar *s = i->get();
+      if (SkipIt && SkipIt(s)) continue;
+      double d = dist2(Where, s);
+      if (d >= MaxDist*MaxDist) continue;
+      if (D1 < 0 || d < D1) { D2 = D1; D1 = d;}
+      else if (D2 < 0 || d < D2) D2 = d;
+    }
+}
+
+/* Checks FindClosest, SecondClosest and the bulk FindClosest of F
+   against a brute-force search, at the points of Where. Distances are
+   compared rather than objects, because of ties. */
+static void check_finder(const simAstrom::StarFinder &F, const simAstrom::BaseStarList &L,
+			 const std::vector<simAstrom::Point> &Where, const double MaxDist)
+{
+  unsigned nBad = 0, nFound = 0, nSecond = 0;
+  for (unsigned skip=0; skip < 2; ++skip)
+    {
+      bool (*skipIt)(const simAstrom::BaseStar *) = skip ? skip_negative : NULL;
+      for (auto w = Where.cbegin(); w != Where.end(); ++w)
+	{
+	  double d1, d2;
+	  brute_force(L, *w, MaxDist, skipIt, d1, d2);
+	  const simAstrom::BaseStar *closest = F.FindClosest(*w, MaxDist, skipIt);
+	  const simAstrom::BaseStar *first = NULL;
+	  const simAstrom::BaseStar *second = F.SecondClosest(*w, MaxDist, first, skipIt);
+	  bool ok = (d1 < 0) ? (closest == NULL && first == NULL) :
+	    (closest && first && dist2(*w, closest) == d1 && dist2(*w, first) == d1);
+	  ok = ok && ((d2 < 0) ? (second == NULL) :
+		      (second && second != first && dist2(*w, second) == d2));
+	  if (ok && skipIt)
+	    ok = !(closest && skipIt(closest)) && !(second && skipIt(second));
+	  if (!ok) nBad++;
+	  if (d1 >= 0) nFound++;
+	  if (d2 >= 0) nSecond++;
+	}
+    }
+  BOOST_CHECK_EQUAL(nBad, 0u);
+  BOOST_TEST_MESSAGE(nFound << " closest and " << nSecond << " second closest found, "
+		     << 2*Where.size() << " queries");
+
+  std::vector<const simAstrom::BaseStar *> bulk;
+  F.FindClosest(Where, MaxDist, bulk);
+  BOOST_REQUIRE_EQUAL(bulk.size(), Where.size());
+  nBad = 0;
+  for (size_t k=0; k < Where.size(); ++k)
+    {
+      double d1, d2;
+      brute_force(L, Where[k], MaxDist, NULL, d1, d2);
+      if ((d1 < 0) ? (bulk[k] != NULL) : (!bulk[k] || dist2(Where[k], bulk[k]) != d1)) nBad++;
+    }
+  BOOST_CHECK_EQUAL(nBad, 0u);
+}
+
+//! N random objects in [0,Side)^2, a tenth of them with a negative flux.
+static void random_list(simAstrom::BaseStarList &L, const unsigned N, const double Side, std::mt19937 &Rng)
+{
+  std::uniform_real_distribution<double> u(0, Side);
+  for (unsigned k=0; k < N; ++k)
+    L.push_back(new simAstrom::BaseStar(u(Rng), u(Rng), (k%10 == 0) ? -1. : 1.));
+}
+
+static std::vector<simAstrom::Point> random_points(const unsigned N, const double Side, std::mt19937 &Rng)
+{
+  // a margin around the objects
+  std::uniform_real_distribution<double> u(-0.1*Side, 1.1*Side);
+  std::vector<simAstrom::Point> points;
+  for (unsigned k=0; k < N; ++k) points.push_back(simAstrom::Point(u(Rng), u(Rng)));
+  return points;
+}
+
+BOOST_AUTO_TEST_SUITE(test_star_finders)
+
+/* Both engines against brute force, on random lists of various sizes
+   and match distances (from mostly nothing found to many candidates). */
+BOOST_AUTO_TEST_CASE(test_random_lists)
+{
+  std::mt19937 rng(97531);
+  const unsigned sizes[] = {1, 7, 100, 5000};
+  for (unsigned s=0; s < 4; ++s)
+    {
+      simAstrom::BaseStarList list;
+      random_list(list, sizes[s], 1000., rng);
+      std::vector<simAstrom::Point> where = random_points(500, 1000., rng);
+      // a query exactly on each of a few objects
+      for (auto i = list.cbegin(); i != list.end() && where.size() < 510; ++i) where.push_back(**i);
+      const double maxDists[] = {1000./sqrt(double(sizes[s])), 300};
+      for (unsigned d=0; d < 2; ++d)
+	{
+	  BOOST_TEST_MESSAGE(sizes[s] << " objects, MaxDist " << maxDists[d]);
+	  simAstrom::KdTreeFinder kdTree(list);
+	  BOOST_CHECK_EQUAL(kdTree.size(), list.size());
+	  check_finder(kdTree, list, where, maxDists[d]);
+	  simAstrom::FastFinder slices(list);
+	  check_finder(slices, list, where, maxDists[d]);
+	}
+    }
+}
+
+/* Many objects at the very same position cannot be split, and end up
+   in one large leaf of the k-d tree, next to regular ones. */
+BOOST_AUTO_TEST_CASE(test_duplicates)
+{
+  std::mt19937 rng(8642);
+  simAstrom::BaseStarList list;
+  random_list(list, 300, 100., rng);
+  for (unsigned k=0; k < 50; ++k) list.push_back(new simAstrom::BaseStar(50., 50., (k%2) ? 1. : -1.));
+  for (unsigned k=0; k < 20; ++k) list.push_back(new simAstrom::BaseStar(10., 70., 1.));
+  std::vector<simAstrom::Point> where = random_points(300, 100., rng);
+  where.push_back(simAstrom::Point(50., 50.));
+  where.push_back(simAstrom::Point(50.01, 49.99));
+  where.push_back(simAstrom::Point(10., 70.));
+  const double maxDists[] = {0.1, 5, 30};
+  for (unsigned d=0; d < 3; ++d)
+    {
+      simAstrom::KdTreeFinder kdTree(list);
+      check_finder(kdTree, list, where, maxDists[d]);
+    }
+  // the second closest of a duplicated position is another copy
+  simAstrom::KdTreeFinder kdTree(list);
+  const simAstrom::BaseStar *first = NULL;
+  const simAstrom::BaseStar *second = kdTree.SecondClosest(simAstrom::Point(10., 70.), 1, first);
+  BOOST_REQUIRE(first && second);
+  BOOST_CHECK(first != second);
+  BOOST_CHECK_EQUAL(second->x, 10.);
+  BOOST_CHECK_EQUAL(second->y, 70.);
+
+  // only duplicates
+  simAstrom::BaseStarList same;
+  for (unsigned k=0; k < 100; ++k) same.push_back(new simAstrom::BaseStar(1., 2., 1.));
+  simAstrom::KdTreeFinder sameTree(same);
+  BOOST_CHECK(sameTree.FindClosest(simAstrom::Point(1.5, 2.), 1));
+  BOOST_CHECK(!sameTree.FindClosest(simAstrom::Point(3., 2.), 1));
+}
+
+/* Objects exactly at MaxDist are not found (with exactly representable distances). */
+BOOST_AUTO_TEST_CASE(test_strict_bound)
+{
+  simAstrom::BaseStarList list;
+  list.push_back(new simAstrom::BaseStar(1., 1., 1.));
+  list.push_back(new simAstrom::BaseStar(1., 3., 1.));
+  for (unsigned strategy=0; strategy < 2; ++strategy)
+    {
+      std::unique_ptr<simAstrom::StarFinder> f =
+	simAstrom::MakeStarFinder(list, strategy ? simAstrom::FinderKdTree : simAstrom::FinderSlices);
+      const simAstrom::Point where(1., 1.5);
+      BOOST_CHECK(!f->FindClosest(where, 0.5));
+      BOOST_CHECK(f->FindClosest(where, 0.5000001));
+      const simAstrom::BaseStar *first = NULL;
+      // the second one is 1.5 away
+      BOOST_CHECK(!f->SecondClosest(where, 1.5, first));
+      BOOST_CHECK(first && first->y == 1.);
+      BOOST_CHECK(f->SecondClosest(where, 1.5000001, first));
+    }
+  // empty lists
+  simAstrom::BaseStarList empty;
+  simAstrom::KdTreeFinder emptyTree(empty);
+  const simAstrom::BaseStar *first = &**list.begin();
+  BOOST_CHECK(!emptyTree.FindClosest(simAstrom::Point(0,0), 10));
+  BOOST_CHECK(!emptyTree.SecondClosest(simAstrom::Point(0,0), 10, first));
+  BOOST_CHECK(!first);
+}
+
+/* FinderAuto switches to the k-d tree above KdTreeMinCount objects. */
+BOOST_AUTO_TEST_CASE(test_auto_strategy)
+{
+  std::mt19937 rng(1357);
+  simAstrom::BaseStarList small, large;
+  random_list(small, simAstrom::KdTreeMinCount, 1000., rng);
+  random_list(large, simAstrom::KdTreeMinCount+1, 1000., rng);
+  std::unique_ptr<simAstrom::StarFinder> f = simAstrom::MakeStarFinder(small);
+  BOOST_CHECK(dynamic_cast<simAstrom::FastFinder *>(f.get()));
+  f = simAstrom::MakeStarFinder(large);
+  BOOST_CHECK(dynamic_cast<simAstrom::KdTreeFinder *>(f.get()));
+  check_finder(*f, large, random_points(200, 1000., rng), 10);
+}
+
+BOOST_AUTO_TEST_SUITE_END()
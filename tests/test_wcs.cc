@@ -9,12 +9,19 @@
 #include "lsst/meas/simastrom/Gtransfo.h"
 #include "lsst/meas/simastrom/SipToGtransfo.h"
 #include "lsst/meas/simastrom/Frame.h"
+#include "lsst/meas/simastrom/FatPoint.h"
 #include "lsst/afw/image/TanWcs.h"
 #include "lsst/afw/image/Utils.h"
 #include "lsst/afw/fits.h"
 #include "lsst/daf/base.h" 
 
 #include <stdlib.h> /* for getenv */
+#include <memory>
+#include <random>
+#include <sstream>
+#include <vector>
+
+#include "Eigen/Dense"
 
 #define _GNU_SOURCE 1
 #define __USE_GNU
@@ -34,6 +41,84 @@ trapfpe ()
 namespace simAstrom = lsst::meas::simastrom; 
 namespace afwImg = lsst::afw::image;
 
+//! N points spread over [X0,X0+Size]x[Y0,Y0+Size], with (correlated) errors.
+static simAstrom::FatPointArrays some_points(const size_t N, const double X0, const double Y0,
+					     const double Size, std::mt19937 &Rng)
+{
+  std::uniform_real_distribution<double> u(0,1);
+  simAstrom::FatPointArrays points;
+  points.resize(N);
+  for (size_t k=0; k < N; ++k)
+    {
+      points.x[k] = X0+Size*u(Rng); points.y[k] = Y0+Size*u(Rng);
+      points.vx[k] = 1e-4*(1+u(Rng)); points.vy[k] = 1e-4*(1+u(Rng));
+      points.vxy[k] = 0.8e-4*(u(Rng)-0.5);
+    }
+  return points;
+}
+
+//! a polynomial with all coefficients set, close to the identity (on a domain of size ~1).
+static simAstrom::GtransfoPoly some_poly(const unsigned Degree, std::mt19937 &Rng)
+{
+  std::uniform_real_distribution<double> u(-1,1);
+  simAstrom::GtransfoPoly poly(Degree);
+  for (int k=0; k < poly.Npar(); ++k) poly.ParamRef(k) = 1e-2*u(Rng);
+  poly.ParamRef(1) += 1; // x' = x
+  poly.ParamRef(poly.Npar()/2+2) += 1; // y' = y
+  return poly;
+}
+
+static bool close_to(const double A, const double B, const double RelPrec)
+{
+  return fabs(A-B) <= RelPrec*std::max(1., std::max(fabs(A), fabs(B)));
+}
+
+/* The batch routines of T against the per-point ones on Points (and
+   ParamDerivativesBatch against ParamDerivatives if WithParams). */
+static void check_batches(const simAstrom::Gtransfo &T, const simAstrom::FatPointArrays &Points,
+			  const bool WithParams)
+{
+  const double eps = 1e-12;
+  size_t n = Points.size();
+  std::vector<double> xout(n), yout(n);
+  T.ApplyBatch(&Points.x[0], &Points.y[0], &xout[0], &yout[0], n);
+  // in place
+  std::vector<double> xin(Points.x), yin(Points.y);
+  T.ApplyBatch(&xin[0], &yin[0], &xin[0], &yin[0], n);
+  simAstrom::FatPointArrays out;
+  T.TransformPosAndErrorsBatch(Points, out);
+  BOOST_REQUIRE_EQUAL(out.size(), n);
+  std::vector<double> der;
+  unsigned npar = T.Npar();
+  if (WithParams)
+    {
+      der.resize(2*npar*n);
+      T.ParamDerivativesBatch(Points, &der[0]);
+    }
+  std::vector<double> dx(npar), dy(npar);
+  unsigned nBad = 0;
+  for (size_t k=0; k < n; ++k)
+    {
+      simAstrom::FatPoint in = Points.Get(k), ref;
+      double x, y;
+      T.apply(in.x, in.y, x, y);
+      T.TransformPosAndErrors(in, ref);
+      bool ok = close_to(xout[k], x, eps) && close_to(yout[k], y, eps)
+	&& xin[k] == xout[k] && yin[k] == yout[k]
+	&& close_to(out.x[k], ref.x, eps) && close_to(out.y[k], ref.y, eps)
+	&& close_to(out.vx[k], ref.vx, eps) && close_to(out.vy[k], ref.vy, eps)
+	&& close_to(out.vxy[k], ref.vxy, eps);
+      if (WithParams)
+	{
+	  T.ParamDerivatives(in, &dx[0], &dy[0]);
+	  for (unsigned i=0; i < npar; ++i)
+	    ok = ok && close_to(der[2*k*npar+i], dx[i], eps) && close_to(der[(2*k+1)*npar+i], dy[i], eps);
+	}
+      if (!ok) nBad++;
+    }
+  BOOST_CHECK_EQUAL(nBad, 0u);
+}
+
 /* Test simAstrom::TanSipPix2RaDec::apply against afwImg::Wcs::pixelToSky */
 
 BOOST_AUTO_TEST_SUITE(test_transfos)
@@ -159,5 +244,225 @@ BOOST_AUTO_TEST_CASE(test_wcs_convertions)
 
 }
 
+/* Gtransfo::ApplyBatch, TransformPosAndErrorsBatch and
+   ParamDerivativesBatch should give what apply, TransformPosAndErrors
+   and ParamDerivatives give, point by point, for the transfos that
+   override them (GtransfoPoly, GtransfoLin, TanRaDec2Pix,
+   compositions) and the ones that rely on the defaults. The number of
+   points is not a multiple of the blocks GtransfoPoly works with. */
+BOOST_AUTO_TEST_CASE(test_batches)
+{
+  std::mt19937 rng(1357);
+  simAstrom::FatPointArrays points = some_points(301, -0.5, -0.5, 1, rng);
+  for (unsigned deg=1; deg <= 5; ++deg)
+    {
+      BOOST_TEST_MESSAGE("GtransfoPoly of degree " << deg);
+      check_batches(some_poly(deg, rng), points, true);
+    }
+  simAstrom::GtransfoLin lin(0.1, -0.2, 1.01, 0.02, -0.03, 0.99);
+  check_batches(lin, points, true);
+  // the tangent point away from the equator
+  const simAstrom::Point tangentPoint(150., 40.);
+  simAstrom::GtransfoLin tan2Pix(1000, 2000, 3600/0.2, 0, 0, 3600/0.2);
+  simAstrom::TanRaDec2Pix raDec2Pix(tan2Pix, tangentPoint);
+  simAstrom::FatPointArrays sky = some_points(301, 149.9, 39.9, 0.2, rng);
+  check_batches(raDec2Pix, sky, false);
+  simAstrom::TanPix2RaDec pix2RaDec(tan2Pix.invert(), tangentPoint);
+  simAstrom::FatPointArrays pix = some_points(301, 0, 0, 2000, rng);
+  check_batches(pix2RaDec, pix, false);
+  // a composition that cannot be reduced
+  simAstrom::GtransfoPoly scaleUp = simAstrom::GtransfoLinScale(1000);
+  simAstrom::GtransfoPoly distortions = scaleUp*some_poly(3, rng)*simAstrom::GtransfoLinScale(1e-3);
+  std::unique_ptr<simAstrom::Gtransfo> compo(simAstrom::GtransfoCompose(&pix2RaDec, &distortions));
+  check_batches(*compo, pix, false);
+}
+
+/* GtransfoPoly::fit with correlated errors is a generalized least
+   squares fit. With errors on the second points only, the weights
+   do not depend on the fitted transfo, and the solution is the one
+   of the normal equations, set up here point by point. A fit that
+   ignores the correlations (the xy block of the normal matrix) finds
+   another solution. Without noise, the fit finds the transfo back. */
+BOOST_AUTO_TEST_CASE(test_polyfit_correlated_errors)
+{
+  std::mt19937 rng(97531);
+  std::normal_distribution<double> g(0,1);
+  const unsigned deg = 3;
+  simAstrom::GtransfoPoly truth = some_poly(deg, rng);
+  simAstrom::FatPointArrays points = some_points(500, -1, -1, 2, rng);
+
+  for (unsigned noise=0; noise < 2; ++noise)
+    {
+      simAstrom::StarMatchList sml;
+      for (size_t k=0; k < points.size(); ++k)
+	{
+	  simAstrom::FatPoint p1(points.x[k], points.y[k], 0, 0, 0);
+	  simAstrom::FatPoint p2 = truth.apply(p1);
+	  // strongly correlated errors, that vary from point to point
+	  p2.vx = points.vx[k]; p2.vy = points.vy[k];
+	  p2.vxy = 0.9*sqrt(p2.vx*p2.vy)*((k%2) ? 1 : -1);
+	  if (noise)
+	    {
+	      // drawn from the covariance
+	      double l11 = sqrt(p2.vx), l21 = p2.vxy/l11, l22 = sqrt(p2.vy-l21*l21);
+	      double g1 = g(rng), g2 = g(rng);
+	      p2.x += l11*g1;
+	      p2.y += l21*g1+l22*g2;
+	    }
+	  sml.push_back(simAstrom::StarMatch(p1, p2, NULL, NULL));
+	}
+      simAstrom::GtransfoPoly fitted(deg);
+      double chi2 = fitted.fit(sml);
+
+      // the normal equations, point by point
+      simAstrom::GtransfoPoly ref(deg);
+      unsigned npar = ref.Npar();
+      Eigen::MatrixXd a(npar, npar); a.setZero();
+      Eigen::VectorXd b(npar); b.setZero();
+      Eigen::MatrixXd aDiag(npar, npar); aDiag.setZero();
+      Eigen::VectorXd bDiag(npar); bDiag.setZero();
+      std::vector<double> dx(npar), dy(npar);
+      for (auto i = sml.cbegin(); i != sml.end(); ++i)
+	{
+	  ref.ParamDerivatives(i->point1, &dx[0], &dy[0]);
+	  Eigen::MatrixXd j(2, npar);
+	  for (unsigned l=0; l < npar; ++l) { j(0,l) = dx[l]; j(1,l) = dy[l];}
+	  Eigen::Matrix2d cov;
+	  cov << i->point2.vx, i->point2.vxy, i->point2.vxy, i->point2.vy;
+	  Eigen::Matrix2d w = cov.inverse();
+	  Eigen::Vector2d p2(i->point2.x, i->point2.y);
+	  a += j.transpose()*w*j;
+	  b += j.transpose()*w*p2;
+	  w(0,1) = w(1,0) = 0;
+	  aDiag += j.transpose()*w*j;
+	  bDiag += j.transpose()*w*p2;
+	}
+      Eigen::VectorXd sol = a.ldlt().solve(b);
+      Eigen::VectorXd solDiag = aDiag.ldlt().solve(bDiag);
+      Eigen::VectorXd params(npar);
+      for (unsigned l=0; l < npar; ++l) params(l) = fitted.ParamRef(l);
+      BOOST_TEST_MESSAGE("noise " << noise << " chi2 " << chi2 << " relative differences "
+			 << (params-sol).norm()/sol.norm() << ' ' << (params-solDiag).norm()/sol.norm());
+      BOOST_CHECK((params-sol).norm() <= 1e-8*sol.norm());
+      if (noise)
+	{
+	  BOOST_CHECK((sol-solDiag).norm() > 1e-4*sol.norm());
+	  // the chi2 is about the number of degrees of freedom
+	  unsigned ndof = 2*sml.size()-npar;
+	  BOOST_CHECK(fabs(chi2-ndof) < 5*sqrt(2.*ndof));
+	}
+      else
+	{
+	  for (unsigned l=0; l < npar; ++l)
+	    BOOST_CHECK_SMALL(fitted.ParamRef(l)-truth.ParamRef(l), 1e-9);
+	  BOOST_CHECK_SMALL(chi2, 1e-8);
+	}
+    }
+}
+
+//! a SIP WCS with distortions of a few tens of pixels over a 2000x4000 frame.
+static simAstrom::TanSipPix2RaDec distorted_wcs(const simAstrom::Point &TangentPoint, std::mt19937 &Rng)
+{
+  simAstrom::GtransfoPoly scaleUp = simAstrom::GtransfoLinScale(2000);
+  simAstrom::GtransfoPoly corrections = scaleUp*some_poly(3, Rng)*simAstrom::GtransfoLinScale(1./2000);
+  simAstrom::GtransfoLin pix2Tan(-1000*0.2/3600, -2000*0.2/3600, 0.2/3600, 0, 0, 0.2/3600);
+  return simAstrom::TanSipPix2RaDec(pix2Tan, TangentPoint, &corrections);
+}
+
+//! the largest distance between Inverse(Direct(p)) and p, over Points.
+static double max_round_trip(const simAstrom::Gtransfo &Direct, const simAstrom::Gtransfo &Inverse,
+			     const simAstrom::FatPointArrays &Points)
+{
+  double dist = 0;
+  for (size_t k=0; k < Points.size(); ++k)
+    {
+      simAstrom::Point p(Points.x[k], Points.y[k]);
+      dist = std::max(dist, p.Distance(Inverse.apply(Direct.apply(p))));
+    }
+  return dist;
+}
+
+static bool is_iterative_inverse(const simAstrom::Gtransfo &T)
+{
+  std::stringstream s;
+  T.dump(s);
+  return s.str().find("GtransfoInverse") != std::string::npos;
+}
+
+/* The inverse of a SIP WCS is a polynomial fitted over the region
+   (see fitted_wcs_inverse in Gtransfo.cc). It should reach the
+   requested precision at points it was not fitted on, and hand over
+   to the iterative inverse when a polynomial cannot reach it. */
+BOOST_AUTO_TEST_CASE(test_wcs_inverse)
+{
+  std::mt19937 rng(8642);
+  simAstrom::TanSipPix2RaDec wcs = distorted_wcs(simAstrom::Point(30., -60.), rng);
+  simAstrom::Frame region(0, 0, 2000, 4000);
+  simAstrom::FatPointArrays points = some_points(2000, 0, 0, 1, rng);
+  for (size_t k=0; k < points.size(); ++k) { points.x[k] *= 2000; points.y[k] *= 4000;}
+
+  const double precision = 1e-3;
+  std::unique_ptr<simAstrom::Gtransfo> inverse(wcs.InverseTransfo(precision, region));
+  BOOST_CHECK(!is_iterative_inverse(*inverse));
+  double error = max_round_trip(wcs, *inverse, points);
+  BOOST_TEST_MESSAGE("fitted inverse : largest error " << error);
+  BOOST_CHECK(error < precision);
+
+  // out of reach of a polynomial
+  const double highPrecision = 1e-8;
+  std::unique_ptr<simAstrom::Gtransfo> iterative(wcs.InverseTransfo(highPrecision, region));
+  BOOST_CHECK(is_iterative_inverse(*iterative));
+  error = max_round_trip(wcs, *iterative, points);
+  BOOST_TEST_MESSAGE("iterative inverse : largest error " << error);
+  BOOST_CHECK(error < 10*highPrecision);
+}
+
+/* GtransfoCompose reduces a projection applied after a WCS with the
+   same tangent point (TanRaDec2Pix::ReduceCompo) to a polynomial, and
+   reduces with the adjacent stage of nested compositions. The
+   reduced transfos should transform as the chains they replace. */
+BOOST_AUTO_TEST_CASE(test_flattened_compositions)
+{
+  std::mt19937 rng(7531);
+  const simAstrom::Point tangentPoint(30., -60.);
+  simAstrom::TanSipPix2RaDec wcs = distorted_wcs(tangentPoint, rng);
+  simAstrom::TanRaDec2Pix raDec2TP(simAstrom::GtransfoLin(), tangentPoint);
+  simAstrom::GtransfoPoly scaleUp = simAstrom::GtransfoLinScale(1000);
+  simAstrom::GtransfoPoly a = some_poly(2, rng)*simAstrom::GtransfoLinScale(1e3);
+  simAstrom::GtransfoPoly b = scaleUp*some_poly(2, rng)*simAstrom::GtransfoLinScale(1e-3);
+  simAstrom::FatPointArrays points = some_points(500, 0, 0, 2000, rng);
+
+  // pix -> TP, as in CcdImage
+  std::unique_ptr<simAstrom::Gtransfo> pix2TP(simAstrom::GtransfoCompose(&raDec2TP, &wcs));
+  BOOST_CHECK(dynamic_cast<simAstrom::GtransfoPoly *>(pix2TP.get()) != NULL);
+  // (a o raDec2TP) o wcs : the first stage of the left one reduces with wcs
+  std::unique_ptr<simAstrom::Gtransfo> left(simAstrom::GtransfoCompose(&a, &raDec2TP));
+  std::unique_ptr<simAstrom::Gtransfo> leftNested(simAstrom::GtransfoCompose(left.get(), &wcs));
+  BOOST_CHECK(dynamic_cast<simAstrom::GtransfoPoly *>(leftNested.get()) != NULL);
+  // raDec2TP o (wcs o b) : raDec2TP reduces with the second stage of the right one
+  std::unique_ptr<simAstrom::Gtransfo> wcsB(simAstrom::GtransfoCompose(&wcs, &b));
+  BOOST_CHECK(dynamic_cast<simAstrom::GtransfoPoly *>(wcsB.get()) == NULL);
+  std::unique_ptr<simAstrom::Gtransfo> rightNested(simAstrom::GtransfoCompose(&raDec2TP, wcsB.get()));
+  BOOST_CHECK(dynamic_cast<simAstrom::GtransfoPoly *>(rightNested.get()) != NULL);
+
+  unsigned nBad = 0;
+  for (size_t k=0; k < points.size(); ++k)
+    {
+      simAstrom::Point p(points.x[k], points.y[k]);
+      simAstrom::Point tp = raDec2TP.apply(wcs.apply(p));
+      simAstrom::Point chainLeft = a.apply(tp);
+      simAstrom::Point chainRight = raDec2TP.apply(wcs.apply(b.apply(p)));
+      simAstrom::Point flatTP = pix2TP->apply(p);
+      simAstrom::Point flatLeft = leftNested->apply(p);
+      simAstrom::Point flatRight = rightNested->apply(p);
+      // the tangent plane is in degrees
+      if (!close_to(flatTP.x, tp.x, 1e-12) || !close_to(flatTP.y, tp.y, 1e-12)
+	  || !close_to(flatLeft.x, chainLeft.x, 1e-10) || !close_to(flatLeft.y, chainLeft.y, 1e-10)
+	  || !close_to(flatRight.x, chainRight.x, 1e-12) || !close_to(flatRight.y, chainRight.y, 1e-12))
+	nBad++;
+    }
+  BOOST_CHECK_EQUAL(nBad, 0u);
+}
+
 
 BOOST_AUTO_TEST_SUITE_END()